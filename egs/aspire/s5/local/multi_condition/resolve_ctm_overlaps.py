@@ -3,7 +3,12 @@
 
 # Script to combine ctms for uniformly segmented, with overlaps
 
-import sys, math, numpy as np, argparse
+# The ctm file is read one line at a time, and the windows of one recording
+# are merged and written before the next recording is read; so the lines of
+# each recording must be together in the input (as they are in the output of
+# lattice-to-ctm-conf, as the utterance-ids start with the recording-id).
+
+import sys, math, numpy as np, argparse, itertools
 break_threshold = 0.01
 def get_breaks(ctm, prev_end):
   breaks = []
@@ -13,51 +18,55 @@ def get_breaks(ctm, prev_end):
     prev_end = ctm[i][2] + ctm[i][3]
   return np.array(breaks)
 
+# Returns the index of the first True in the boolean array 'mask', or
+# 'default' if there is none.
+def first_true(mask, default):
+  if mask.any():
+    return int(np.argmax(mask))
+  return default
+
+# Each ctm (the ctm of one window) is a tuple (lines, midpoints) where lines is
+# the list of the ctm lines, split into fields, and midpoints is a numpy array
+# with the midpoints of the words (start + duration/2) relative to the window.
+# Returns the list of the lines of the merged ctm.
 def resolve_overlaps(ctms, window_length, overlap):
   total_ctm = []
   if len(ctms) == 0:
     raise Exception('Something wrong with the input ctms')
+  begin = 0
   for ctm_index in range(len(ctms) - 1):
-    cur_ctm = ctms[ctm_index]
-    next_ctm = ctms[ctm_index + 1]
+    (cur_lines, cur_midpoints) = ctms[ctm_index]
+    (next_lines, next_midpoints) = ctms[ctm_index + 1]
     # find the breaks after overlap starts
-    index = len(cur_ctm)
-    for i in xrange(len(cur_ctm)):
-      if cur_ctm[i][2] + cur_ctm[i][3]/2.0 > (window_length - overlap/2.0):
-        index = i
-        break
-    total_ctm += cur_ctm[:index]
-    
-    index = 0
-    for i in xrange(len(next_ctm)):
-      if next_ctm[i][2] + next_ctm[i][3]/2.0 > (overlap/2.0):
-        index = i
-        break
-    ctms[ctm_index + 1] = next_ctm[index:]
+    end = begin + first_true(cur_midpoints[begin:] > (window_length - overlap/2.0),
+                             len(cur_lines) - begin)
+    total_ctm += cur_lines[begin:end]
+
+    begin = first_true(next_midpoints > (overlap/2.0), 0)
   # merge the last ctm entirely
-  total_ctm +=ctms[-1]
+  total_ctm += ctms[-1][0][begin:]
   return total_ctm
-def read_ctm(ctm_file_lines, utt2spk):
-  ctms = {}
-  for key in utt2spk.values():
-    ctms[key] = []
 
-  ctm = []
-  prev_utt = ctm_file_lines[0].split()[0]
-  for line in ctm_file_lines:
-    parts = line.split()
-    if prev_utt == parts[0]:
-      ctm.append([parts[0], parts[1], float(parts[2]),
-        float(parts[3]), parts[4], parts[5]])
-    else:
-      ctms[utt2spk[ctm[0][0]]].append(ctm)
-      prev_utt = parts[0]
-      ctm = []
-      ctm.append([parts[0], parts[1], float(parts[2]),
-        float(parts[3]), parts[4], parts[5]])
-  # append the last ctm
-  ctms[utt2spk[ctm[0][0]]].append(ctm) 
-  return ctms
+# Reads the ctm lines, and yields (recording, ctms) for each recording, where
+# ctms is the list of the ctms of its windows (see resolve_overlaps()), in the
+# order of the input.
+def read_ctm(ctm_file_lines, utt2spk):
+  done = set()
+  windows = itertools.groupby((line.split() for line in ctm_file_lines),
+                              lambda parts: parts[0])
+  for (reco, reco_windows) in itertools.groupby(windows,
+                                                lambda window: utt2spk[window[0]]):
+    if reco in done:
+      raise Exception('The ctm lines of recording {0} are not together in '
+                      'the input'.format(reco))
+    done.add(reco)
+    ctms = []
+    for (utt, utt_lines) in reco_windows:
+      lines = [ [parts[0], parts[1], float(parts[2]), float(parts[3]),
+                 parts[4], parts[5]] for parts in utt_lines ]
+      times = np.array([ [line[2], line[3]] for line in lines ]).reshape(-1, 2)
+      ctms.append((lines, times[:, 0] + times[:, 1]/2.0))
+    yield (reco, ctms)
 
 def write_ctm(ctm_lines):
   ctm_file_lines = []
@@ -90,11 +99,7 @@ if __name__ == "__main__":
     parts = line.split()
     utt2spk[parts[0]] = parts[1]
 
-  ctms = read_ctm(params.ctm_in.readlines(), utt2spk)
-  speakers = ctms.keys()
-  speakers.sort()
-  for key in speakers:
-    ctm = ctms[key]
+  for (key, ctm) in read_ctm(params.ctm_in, utt2spk):
     ctm = resolve_overlaps(ctm, params.window_length, params.overlap)
     params.ctm_out.write("\n".join(write_ctm(ctm))+"\n")
   params.ctm_out.close()
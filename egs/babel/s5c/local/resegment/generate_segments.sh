@@ -7,6 +7,8 @@ set -o pipefail
 set -e
 
 nj=8
+num_threads=1  # Number of processes used by segmentation.py to resegment
+               # the recordings in parallel (it is run on the local machine).
 cmd=run.pl
 stage=0
 segmentation_opts="--isolated-resegmentation --min-inter-utt-silence-length 1.0 --silence-proportion 0.05"
@@ -34,6 +36,7 @@ if [ $# -ne 5 ]; then
   echo "    --nj <numjobs>          # Number of parallel jobs. "
   echo "                              For the standard data directories of dev10h, dev2h and eval"
   echo "                              this is taken from the lang.conf file"
+  echo "    --num-threads <n>       # Number of processes for segmentation.py (default: $num_threads)"
   echo "    --segmentation-opts '--opt1 opt1val --opt2 opt2val' # options for segmentation.py"
   echo "    --reference-rttm        # Reference RTTM file that will be used for analysis of the segmentation"
   echo "    --get-text (true|false) # Convert text from base data directory to correspond to the new segments"
@@ -121,7 +124,7 @@ cat $lang/phones/nonsilence.txt | awk '{print $1, 2;}' | sed 's/\(<.*>.*\)2/\11/
 mkdir -p $output_dir
 mkdir -p $temp_dir/log
 
-local/resegment/segmentation.py --verbose 2 $segmentation_opts \
+local/resegment/segmentation.py --verbose 2 --num-jobs $num_threads $segmentation_opts \
   $temp_dir/pred $temp_dir/phone_map.txt 2>$temp_dir/log/resegment.log | \
   sort > $output_dir/segments || exit 1
 
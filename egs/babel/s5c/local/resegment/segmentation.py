@@ -4,7 +4,12 @@
 # Apache 2.0
 
 import os, glob, argparse, sys, re, time
+import multiprocessing
 from argparse import ArgumentParser
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
 
 use_numpy = True
 try:
@@ -12,7 +17,8 @@ try:
 except ImportError:
   use_numpy = False
 
-# Global stats for analysis taking RTTM file as reference
+# Stats for analysis taking RTTM file as reference, accumulated over the
+# recordings of a job; see resegment_recordings()
 global_analysis_get_initial_segments = None
 global_analysis_set_nonspeech_proportion = None
 global_analysis_final = None
@@ -53,8 +59,10 @@ class Analysis:
   # The interpretation of 'speech', 'noise' and 'silence' are bound to change
   # through the different post-processing stages. e.g at the end, speech and silence
   # correspond respectively to 'in segment' and 'out of segment'
-  def write_confusion_matrix(self, write_hours = False, file_handle = sys.stderr):
-    sys.stderr.write("Total counts: \n")
+  def write_confusion_matrix(self, write_hours = False, file_handle = None):
+    if file_handle is None:
+      file_handle = sys.stderr
+    file_handle.write("Total counts: \n")
 
     name = ['Silence as silence', \
         'Silence as noise', \
@@ -74,24 +82,26 @@ class Analysis:
         # functions like merge_segments
         if write_hours:
           # Write stats in hours instead of seconds
-          sys.stderr.write("File %s: %s : %s : %8.3f hrs\n" %
+          file_handle.write("File %s: %s : %s : %8.3f hrs\n" %
               (self.file_id, self.prefix, name[j],
                 self.confusion_matrix[j] * self.frame_shift / 3600.0))
         else:
-          sys.stderr.write("File %s: %s : %s : %8.3f seconds\n" %
+          file_handle.write("File %s: %s : %s : %8.3f seconds\n" %
               (self.file_id, self.prefix, name[j],
                 self.confusion_matrix[j] * self.frame_shift))
         # End if write_hours
       else:
-        sys.stderr.write("File %s: %s : Confusion: Type %d : %8.3f counts\n" %
+        file_handle.write("File %s: %s : Confusion: Type %d : %8.3f counts\n" %
             (self.file_id, self.prefix, j, self.confusion_matrix[j]))
       # End if
     # End for loop over 9 cells of confusion matrix
 
   # Print the total stats that are just row and column sums of
   # 3x3 confusion matrix
-  def write_total_stats(self, write_hours = True, file_handle = sys.stderr):
-    sys.stderr.write("Total Stats: \n")
+  def write_total_stats(self, write_hours = True, file_handle = None):
+    if file_handle is None:
+      file_handle = sys.stderr
+    file_handle.write("Total Stats: \n")
 
     name = ['Actual Silence', \
         'Actual Noise', \
@@ -105,16 +115,16 @@ class Analysis:
         # functions like merge_segments
         if write_hours:
           # Write stats in hours instead of seconds
-          sys.stderr.write("File %s: %s : %s : %8.3f hrs\n" %
+          file_handle.write("File %s: %s : %s : %8.3f hrs\n" %
               (self.file_id, self.prefix, name[j],
                 sum(self.confusion_matrix[3*j:3*j+3]) * self.frame_shift / 3600.0))
         else:
-          sys.stderr.write("File %s: %s : %s : %8.3f seconds\n" %
+          file_handle.write("File %s: %s : %s : %8.3f seconds\n" %
               (self.file_id, self.prefix, name[j],
                 sum(self.confusion_matrix[3*j:3*j+3]) * self.frame_shift))
         # End if write_hours
       else:
-        sys.stderr.write("File %s: %s : %s : %8.3f counts\n" %
+        file_handle.write("File %s: %s : %s : %8.3f counts\n" %
             (self.file_id, self.prefix, name[j],
               sum(self.confusion_matrix[3*j:3*j+3])))
       # End if
@@ -132,16 +142,16 @@ class Analysis:
         # functions like merge_segments
         if write_hours:
           # Write stats in hours instead of seconds
-          sys.stderr.write("File %s: %s : %s : %8.3f hrs\n" %
+          file_handle.write("File %s: %s : %s : %8.3f hrs\n" %
               (self.file_id, self.prefix, name[j],
                 sum(self.confusion_matrix[j:7+j:3]) * self.frame_shift / 3600.0))
         else:
-          sys.stderr.write("File %s: %s : %s : %8.3f seconds\n" %
+          file_handle.write("File %s: %s : %s : %8.3f seconds\n" %
               (self.file_id, self.prefix, name[j],
                 sum(self.confusion_matrix[j:7+j:3]) * self.frame_shift))
         # End if write_hours
       else:
-        sys.stderr.write("File %s: %s : %s : %8.3f counts\n" %
+        file_handle.write("File %s: %s : %s : %8.3f counts\n" %
             (self.file_id, self.prefix, name[j],
               sum(self.confusion_matrix[j:7+j:3])))
       # End if
@@ -149,7 +159,9 @@ class Analysis:
 
   # Print detailed stats of lengths of each of the 3 types of frames
   # in 8 kinds of segments
-  def write_type_stats(self, file_handle = sys.stderr):
+  def write_type_stats(self, file_handle = None):
+    if file_handle is None:
+      file_handle = sys.stderr
     for j in range(0,3):
       # 3 types of frames. Silence, noise, speech.
       # Typically, we store the number of frames of each type here.
@@ -164,15 +176,15 @@ class Analysis:
         if use_numpy:
           try:
             percentile25  = np.percentile(self.type_counts[j][i], 25)
-          except ValueError:
+          except (ValueError, IndexError):
             percentile25 = 0
           try:
             percentile50  = np.percentile(self.type_counts[j][i], 50)
-          except ValueError:
+          except (ValueError, IndexError):
             percentile50 = 0
           try:
             percentile75  = np.percentile(self.type_counts[j][i], 75)
-          except ValueError:
+          except (ValueError, IndexError):
             percentile75 = 0
 
         file_handle.write("File %s: %s : TypeStats: Type %d %d: Min: %4d Max: %4d Mean: %4d percentile25: %4d percentile50: %4d percentile75: %4d\n" % (self.file_id, self.prefix, j, i,  min_length, max_length, mean_length, percentile25, percentile50, percentile75))
@@ -183,7 +195,9 @@ class Analysis:
   # The stats include different statistical measures like mean, max, min
   # and median of the length of continuous regions of frames in
   # each of the 9 cells of the confusion matrix
-  def write_length_stats(self, file_handle = sys.stderr):
+  def write_length_stats(self, file_handle = None):
+    if file_handle is None:
+      file_handle = sys.stderr
     for i in range(0,9):
       self.max_length[i]    = max([0]+self.state_count[i])
       self.min_length[i]    = min([10000]+self.state_count[i])
@@ -191,15 +205,15 @@ class Analysis:
       if use_numpy:
         try:
           self.percentile25[i]  = np.percentile(self.state_count[i], 25)
-        except ValueError:
+        except (ValueError, IndexError):
           self.percentile25[i] = 0
         try:
           self.percentile50[i]  = np.percentile(self.state_count[i], 50)
-        except ValueError:
+        except (ValueError, IndexError):
           self.percentile50[i] = 0
         try:
           self.percentile75[i]  = np.percentile(self.state_count[i], 75)
-        except ValueError:
+        except (ValueError, IndexError):
           self.percentile75[i] = 0
 
       file_handle.write("File %s: %s : Length: Type %d: Min: %4d Max: %4d Mean: %4d percentile25: %4d percentile50: %4d percentile75: %4d\n" % (self.file_id, self.prefix, i,  self.min_length[i], self.max_length[i], self.mean_length[i], self.percentile25[i], self.percentile50[i], self.percentile75[i]))
@@ -211,7 +225,9 @@ class Analysis:
   # Markers: Type <type>: <start_frame> (<num_of_frames>) (<hypothesized_phones>)
   # The hypothesized_phones can be looked at to see what phones are
   # present in the hypothesis from start_frame for num_of_frames frames.
-  def write_markers(self, file_handle = sys.stderr):
+  def write_markers(self, file_handle = None):
+    if file_handle is None:
+      file_handle = sys.stderr
     file_handle.write("Start frames of different segments:\n")
     for j in range(0,9):
       if self.phones[j] == []:
@@ -222,54 +238,23 @@ class Analysis:
 
 # Function to read a standard IARPA Babel RTTM file
 # as structure in Jan 16, 2014
-def read_rttm_file(rttm_file, temp_dir, frame_shift):
-  file_id = None
-  this_file = []
-  ref_file_handle = None
+# Returns a dictionary from file_id to the list of reference classes
+# of the frames of the file (0 for silence, 1 for noise and 2 for speech).
+# The lines of a file_id need not be contiguous in the RTTM file.
+def read_rttm_file(rttm_file, frame_shift):
   reference = {}
-  for line in open(rttm_file).readlines():
+  try:
+    lines = open(rttm_file).readlines()
+  except IOError:
+    sys.stderr.write("Unable to open " + rttm_file + " for reading\n")
+    sys.exit(1)
+  for line in lines:
     splits = line.strip().split()
     type1 = splits[0]
     if type1 == "SPEAKER":
       continue
-    if splits[1] != file_id:
-      # A different file_id. Need to open a different file to write
-      if this_file != []:
-        # If this_file is empty, no reference RTTM corresponding to the file_id
-        # is read. This will happen at the start of the file_id. Otherwise it means a
-        # contiguous segment of previous file_id is processed. So write it to the file.
-        # corresponding to the previous file_id
-        try:
-          ref_file_handle.write(' '.join(this_file))
-          # Close the previous file if any
-          ref_file_handle.close()
-          this_file = []
-        except AttributeError:
-          # Ignore AttributeError. It is expected.
-          1==1
-      # End if
-
-      file_id = splits[1]
-      if (file_id not in reference):
-        # First time seeing this file_id. Open a new file for writing.
-        reference[file_id] = 1
-        try:
-          ref_file_handle = open(temp_dir+"/"+file_id+".ref", 'w')
-        except IOError:
-          sys.stderr.write("Unable to open " + temp_dir+"/"+file_id+".ref for writing\n")
-          sys.exit(1)
-        ref_file_handle.write(file_id + "\t")
-      else:
-        # This file has been seen before but not in the previous iteration.
-        # The file has already been closed. So open it for append.
-        try:
-          this_file = open(temp_dir+"/"+file_id+".ref").readline().strip().split()[1:]
-          ref_file_handle = open(temp_dir+"/"+file_id+".ref", 'a')
-        except IOError:
-          sys.stderr.write("Unable to open " + temp_dir+"/"+file_id+".ref for appending\n")
-          sys.exit(1)
-      # End if
-    # End if
+    file_id = splits[1]
+    this_file = reference.setdefault(file_id, [])
 
     i = len(this_file)
     category = splits[6]
@@ -277,20 +262,18 @@ def read_rttm_file(rttm_file, temp_dir, frame_shift):
     start_time = int(float(splits[3])/frame_shift + 0.5)
     duration = int(float(splits[4])/frame_shift + 0.5)
     if i < start_time:
-      this_file.extend(["0"]*(start_time - i))
+      this_file.extend([0]*(start_time - i))
     if type1 == "NON-LEX":
       if category == "other":
         # <no-speech> is taken as Silence
-        this_file.extend(["0"]*duration)
+        this_file.extend([0]*duration)
       else:
-        this_file.extend(["1"]*duration)
+        this_file.extend([1]*duration)
     if type1 == "LEXEME":
-      this_file.extend(["2"]*duration)
+      this_file.extend([2]*duration)
     if type1 == "NON-SPEECH":
-      this_file.extend(["1"]*duration)
-
-  ref_file_handle.write(' '.join(this_file))
-  ref_file_handle.close()
+      this_file.extend([1]*duration)
+  return reference
 
 # Stats class to store some basic stats about the number of
 # times the post-processor goes through particular loops or blocks
@@ -312,6 +295,15 @@ class Stats:
     sys.stderr.write("Noise only: %d\n" % self.noise_only)
     sys.stderr.write("Silence only: %d\n" % self.silence_only)
 
+  # Add the stats of another Stats object s to this object
+  def add(self, s):
+    self.inter_utt_nonspeech += s.inter_utt_nonspeech
+    self.merge_nonspeech_segment += s.merge_nonspeech_segment
+    self.merge_segments += s.merge_segments
+    self.split_segments += s.split_segments
+    self.silence_only += s.silence_only
+    self.noise_only += s.noise_only
+
   def reset(self):
     self.inter_utt_nonspeech = 0
     self.merge_nonspeech_segment = 0
@@ -323,26 +315,88 @@ class Stats:
 # Timer class to time functions
 class Timer:
   def __enter__(self):
-    self.start = time.clock()
+    self.start = time.time()
     return self
   def __exit__(self, *args):
-    self.end = time.clock()
+    self.end = time.time()
     self.interval = self.end - self.start
 
+# Frame class constants.  The predicted class of each frame is an integer in
+# 0 ... 14.  Classes 0 ... 8 are 3 * (class of this channel) + (class of the
+# other channel), where the classes of the channels are 0 for silence, 1 for
+# noise and 2 for speech; in isolated resegmentation, the other channel is
+# taken to have the same class.  Classes 9 ... 14 are the non-speech classes
+# 0 ... 5 converted to be included in the segments by set_nonspeech_proportion().
+THIS_SILENCE = (0, 1, 2)
+THIS_NOISE = (3, 4, 5)
+THIS_SPEECH = (6, 7, 8)
+THIS_SPEECH_THAT_SIL = (6,)
+THIS_SPEECH_THAT_NOISE = (7,)
+THIS_SIL_CONVERT_THAT_SIL = (9,)
+THIS_SIL_CONVERT_THAT_NOISE = (10,)
+THIS_SIL_CONVERT = (9, 10, 11)
+THIS_SILENCE_CONVERT = (9, 10, 11)
+THIS_NOISE_CONVERT_THAT_SIL = (12,)
+THIS_NOISE_CONVERT_THAT_NOISE = (13,)
+THIS_NOISE_CONVERT = (12, 13, 14)
+THIS_NOISE_OR_SILENCE = THIS_NOISE + THIS_SILENCE
+THIS_SILENCE_OR_NOISE = THIS_NOISE + THIS_SILENCE
+THIS_CONVERT = THIS_SILENCE_CONVERT + THIS_NOISE_CONVERT
+THIS_SILENCE_PLUS = THIS_SILENCE + THIS_SILENCE_CONVERT
+THIS_NOISE_PLUS = THIS_NOISE + THIS_NOISE_CONVERT
+THIS_SPEECH_PLUS = THIS_SPEECH + THIS_CONVERT
+NUM_CLASSES = 15
+
+# Return the type of the transition from a frame of class x to a frame of
+# class y, which is used to prioritize the merging of segments.  Returns -1
+# if the transition is not expected at a segment boundary.
+def get_transition_type(x, y):
+  if x in (THIS_SPEECH_THAT_NOISE + THIS_SPEECH_THAT_SIL) and y in (THIS_SPEECH_THAT_NOISE + THIS_SPEECH_THAT_SIL):
+    return 0
+  if x in THIS_SPEECH and y in THIS_SPEECH:
+    return 1
+  if x in (THIS_SPEECH + THIS_NOISE_CONVERT_THAT_SIL + THIS_NOISE_CONVERT_THAT_NOISE) and y in (THIS_SPEECH + THIS_NOISE_CONVERT_THAT_SIL + THIS_NOISE_CONVERT_THAT_NOISE):
+    return 2
+  if x in (THIS_SPEECH + THIS_NOISE_CONVERT) and y in (THIS_SPEECH + THIS_NOISE_CONVERT):
+    return 3
+  if x in (THIS_SPEECH + THIS_NOISE_CONVERT + THIS_SIL_CONVERT_THAT_SIL + THIS_SIL_CONVERT_THAT_NOISE) and y in (THIS_SPEECH + THIS_NOISE_CONVERT + THIS_SIL_CONVERT_THAT_SIL + THIS_SIL_CONVERT_THAT_NOISE):
+    return 4
+  if x in (THIS_SPEECH + THIS_CONVERT) and y in (THIS_SPEECH + THIS_CONVERT):
+    return 5
+  if x in THIS_SPEECH_PLUS and y in (THIS_SPEECH_PLUS + THIS_NOISE):
+    return 6
+  if x in THIS_SPEECH_PLUS and y in (THIS_SPEECH_PLUS + THIS_SILENCE):
+    return 7
+  if x in (THIS_SPEECH_PLUS + THIS_NOISE) and y in THIS_SPEECH_PLUS:
+    return 8
+  if x in (THIS_SPEECH_PLUS + THIS_SILENCE) and y in THIS_SPEECH_PLUS:
+    return 9
+  return -1
+
+# Returns a boolean array that is True where the frame classes in the
+# array A are in the tuple 'classes'
+def in_classes(A, classes):
+  table = np.zeros(NUM_CLASSES, dtype=bool)
+  table[list(classes)] = True
+  return table[A]
+
 # The main class for post-processing a file.
 # This does the segmentation either looking at the file isolated
-# or by looking at both classes simultaneously
+# or by looking at both classes simultaneously.
+# The predicted classes (see the constants above) and the segment start and
+# end markers are stored in numpy arrays, so that most of the processing is
+# done on whole arrays or on runs of frames rather than frame by frame.
 class JointResegmenter:
   def __init__(self, P, A, f, options, phone_map, stats = None, reference = None):
 
     # Pointers to prediction arrays and Initialization
     self.P = P                    # Predicted phones
-    self.B = [ i for i in A ]     # Original predicted classes
-    self.A = A                    # Predicted classes
+    self.A = np.array(A, dtype=np.int64)  # Predicted classes
+    self.B = self.A.copy()        # Original predicted classes
     self.file_id = f              # File name
-    self.N = len(A)               # Length of the prediction (= Num of frames in the audio file)
-    self.S = [False] * self.N     # Array of Start boundary markers
-    self.E = [False] * (self.N+1) # Array of End boundary markers
+    self.N = len(self.A)          # Length of the prediction (= Num of frames in the audio file)
+    self.S = np.zeros(self.N, dtype=bool)     # Array of Start boundary markers
+    self.E = np.zeros(self.N+1, dtype=bool)   # Array of End boundary markers
 
     self.phone_map = phone_map
     self.options = options
@@ -361,36 +415,24 @@ class JointResegmenter:
 
     # End of Configuration
 
-    # Define Frame Type Constants
-    self.THIS_SILENCE = ("0","1","2")
-    self.THIS_NOISE = ("3","4","5")
-    self.THIS_SPEECH = ("6", "7", "8")
-    self.THIS_SPEECH_THAT_SIL = ("6",)
-    self.THIS_SPEECH_THAT_NOISE = ("7",)
-    self.THIS_SIL_CONVERT_THAT_SIL = ("9",)
-    self.THIS_SIL_CONVERT_THAT_NOISE = ("10",)
-    self.THIS_SIL_CONVERT = ("9","10","11")
-    self.THIS_SILENCE_CONVERT = ("9","10","11")
-    self.THIS_NOISE_CONVERT_THAT_SIL = ("12",)
-    self.THIS_NOISE_CONVERT_THAT_NOISE = ("13",)
-    self.THIS_NOISE_CONVERT = ("12","13","14")
-    self.THIS_NOISE_OR_SILENCE = self.THIS_NOISE + self.THIS_SILENCE
-    self.THIS_SILENCE_OR_NOISE = self.THIS_NOISE + self.THIS_SILENCE
-    self.THIS_CONVERT = self.THIS_SILENCE_CONVERT + self.THIS_NOISE_CONVERT
-    self.THIS_SILENCE_PLUS = self.THIS_SILENCE + self.THIS_SILENCE_CONVERT
-    self.THIS_NOISE_PLUS = self.THIS_NOISE + self.THIS_NOISE_CONVERT
-    self.THIS_SPEECH_PLUS = self.THIS_SPEECH + self.THIS_CONVERT
+    # Table of the transition types between frame classes;
+    # see transition_type()
+    self.transition_types = np.array(
+        [ [ get_transition_type(x, y) for y in range(NUM_CLASSES) ]
+          for x in range(NUM_CLASSES) ])
 
     if stats != None:
       self.stats = stats
 
+    # The reference classes of the frames (0 for silence, 1 for noise
+    # and 2 for speech), as an integer array.
     self.reference = None
     if reference != None:
-      if len(reference) < self.N:
-        self.reference = reference + ["0"] * (self.N - len(reference))
+      self.reference = np.array([ int(x) for x in reference ], dtype=np.int64)
+      if len(self.reference) < self.N:
+        self.reference = np.concatenate((self.reference,
+          np.zeros(self.N - len(self.reference), dtype=np.int64)))
         assert (len(self.reference) == self.N)
-      else:
-        self.reference = reference
 
   # This function restricts the output to length N
   def restrict(self, N):
@@ -398,7 +440,7 @@ class JointResegmenter:
     self.A = self.A[0:N]
     self.S = self.S[0:N]
     self.E = self.E[0:N+1]
-    if sum(self.S) == sum(self.E) + 1:
+    if np.count_nonzero(self.S) == np.count_nonzero(self.E) + 1:
       self.E[N] = True
     self.N = N
 
@@ -433,110 +475,82 @@ class JointResegmenter:
       sys.stderr.write("For file %s\n" % self.file_id)
       self.stats.print_stats()
       sys.stderr.write("\n")
-      self.stats.reset()
+
+  # Returns the first frame p > n that is a segment end, i.e. the end of
+  # the segment starting at n; or self.N + 1 if there is no such frame.
+  def next_segment_end(self, n):
+    if n + 1 > self.N:
+      return n + 1
+    p = n + 1 + int(np.argmax(self.E[n+1:]))
+    if self.E[p]:
+      return p
+    return self.N + 1
+
+  # Fill the Analysis object a with the statistics of the confusion
+  # classes C (an integer array in 0 ... 8 with one element per frame):
+  # the confusion matrix and the lengths, start frames and predicted phones of
+  # the runs of frames with the same class.  Note: the last run of the file
+  # is not included in the run statistics.
+  def accumulate_run_stats(self, a, C):
+    change_points = np.flatnonzero(C[1:] != C[:-1]) + 1
+    run_start = 0
+    for i in change_points.tolist():
+      c = int(C[i-1])
+      a.state_count[c].append(i - run_start)
+      a.markers[c].append(run_start)
+      a.phones[c].append(' '.join(set(self.P[run_start:i])))
+      run_start = i
+    a.confusion_matrix = [ int(x) for x in np.bincount(C, minlength=9) ]
 
   def get_initial_segments(self):
-    for i in range(0, self.N):
-      if (i > 0) and self.A[i-1] != self.A[i]:
-        # This frame is different from the previous frame.
-        if self.A[i] in self.THIS_SPEECH:
-          # This frame is speech.
-          if self.A[i-1] in self.THIS_SPEECH:
-            # Both this and the previous frames are speech
-            # But they are different. e.g. "8 7"
-            # So this is the end of the previous region and
-            # the beginning of the next region
-            self.S[i] = True
-            self.E[i] = True
-          else:
-            # The previous frame is non-speech, but not this one.
-            # So this frame is the beginning of a new segment
-            self.S[i] = True
-        else:
-          # This frame is non-speech
-          if self.A[i-1] in self.THIS_SPEECH:
-            # Previous frame is speech, but this one is not.
-            # So this frame is the end of the previous segment
-            self.E[i] = True
-      elif i == 0 and self.A[i] in self.THIS_SPEECH:
-        # The frame is speech. So this is the start of a new segment.
-        self.S[i] = True
-    if self.A[self.N-1] in self.THIS_SPEECH:
+    # At this point the classes are all in 0 ... 8
+    speech = in_classes(self.A, THIS_SPEECH)
+    if self.N > 0:
+      # A frame starts a segment if it is speech and either the first frame or
+      # different from the previous frame, and it ends a segment (i.e.
+      # the segment ends before it) if the previous frame is speech and
+      # different from it.
+      changed = self.A[1:] != self.A[:-1]
+      self.S[0] = speech[0]
+      self.S[1:] = changed & speech[1:]
+      self.E[1:self.N] = changed & speech[:-1]
       # Handle the special case where the last frame of file is not nonspeech
-      self.E[self.N] = True
-    assert(sum(self.S) == sum(self.E))
+      self.E[self.N] = speech[-1]
+    assert(np.count_nonzero(self.S) == np.count_nonzero(self.E))
 
     ###########################################################################
     # Analysis section
-    self.C = ["0"] * self.N
-    C = self.C
     a = Analysis(self.file_id, self.frame_shift,"Analysis after get_initial_segments")
 
-    if self.reference != None:
-      count = 0
-      for i in range(0,self.N):
-        if   self.reference[i] == "0" and self.A[i] in self.THIS_SILENCE:
-          C[i] = "0"
-        elif self.reference[i] == "0" and self.A[i] in self.THIS_NOISE:
-          C[i] = "1"
-        elif self.reference[i] == "0" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "2"
-        elif self.reference[i] == "1" and self.A[i] in self.THIS_SILENCE:
-          C[i] = "3"
-        elif self.reference[i] == "1" and self.A[i] in self.THIS_NOISE:
-          C[i] = "4"
-        elif self.reference[i] == "1" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "5"
-        elif self.reference[i] == "2" and self.A[i] in self.THIS_SILENCE:
-          C[i] = "6"
-        elif self.reference[i] == "2" and self.A[i] in self.THIS_NOISE:
-          C[i] = "7"
-        elif self.reference[i] == "2" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "8"
-        if i > 0 and C[i-1] != C[i]:
-          a.state_count[int(C[i-1])].append(count)
-          a.markers[int(C[i-1])].append(i - count)
-          a.phones[int(C[i-1])].append(' '.join(set(self.P[i-count:i])))
-          count = 1
-        else:
-          count += 1
-
-      for j in range(0,9):
-        a.confusion_matrix[j] = sum([C[i] == str(j) for i in range(0,self.N)])
+    if self.reference is not None:
+      # 3 * reference-class + predicted-class, where the predicted class is
+      # 0 for silence, 1 for noise and 2 for speech.
+      self.C = self.reference[0:self.N] * 3 + self.A // 3
+      self.accumulate_run_stats(a, self.C)
 
       global_analysis_get_initial_segments.add(a)
 
-      if self.reference != None and self.options.verbose > 0:
+      if self.reference is not None and self.options.verbose > 0:
         a.write_confusion_matrix()
         a.write_length_stats()
-        if self.reference != None and self.options.verbose > 1:
+        if self.reference is not None and self.options.verbose > 1:
           a.write_markers()
     ###########################################################################
 
   def set_nonspeech_proportion(self):
-    num_speech_frames = 0
-    in_segment = False
-
-    # Active frames are the frames that are either segment starts
-    # or segment ends
-    active_frames = []
-    for n in range(0, self.N + 1):
-      if self.E[n]:
-        assert(in_segment)
-        in_segment = False
-        active_frames.append(n)
-      if n < self.N and self.S[n]:
-        assert(not in_segment)
-        in_segment = True
-        active_frames.append(n)
-      if n < self.N:
-        if in_segment:
-          # Count the number of speech frames
-          num_speech_frames += 1
-    assert (not in_segment)
+    # The depth is 1 for frames inside segments and 0 outside.
+    depth = np.cumsum(self.S.astype(np.int64) - self.E[0:self.N])
+    assert (self.N == 0 or (depth.min() >= 0 and depth.max() <= 1 and depth[-1] == self.E[self.N]))
+    num_speech_frames = int(np.count_nonzero(depth))
     if num_speech_frames == 0:
       sys.stderr.write("%s: Warning: no speech found for recording %s\n" % (sys.argv[0], self.file_id))
 
+    # Active frames are the frames that are either segment starts
+    # or segment ends, in order, with the segment end first if a frame is both.
+    active_frames = np.sort(np.concatenate((np.flatnonzero(self.E) * 2,
+                                            np.flatnonzero(self.S) * 2 + 1))) // 2
+    active_frames = active_frames.tolist()
+
     # Set the number of non-speech frames to be added depending on the
     # silence proportion. The target number of frames in the segments
     # is computed as below:
@@ -545,6 +559,15 @@ class JointResegmenter:
     # The number of frames currently in the segments
     num_segment_frames = num_speech_frames
 
+    # This loop adds one frame at each active frame per iteration, so it is
+    # done on lists, which are faster than numpy arrays for accessing single
+    # elements.
+    A = self.A.tolist()
+    B = self.B.tolist()
+    S = self.S.tolist()
+    E = self.E.tolist()
+    N = self.N
+
     count = 0
     while num_segment_frames < target_segment_frames:
       count += 1
@@ -556,42 +579,42 @@ class JointResegmenter:
         # labelled 9...14 depending on whether they were originally
         # 0...5 respectively
         n = active_frames[i]
-        if self.E[n] and n < self.N and not self.S[n]:
+        if E[n] and n < N and not S[n]:
           # This must be the beginning of a non-speech region.
           # Include some of this non-speech in the segments
-          assert (self.A[n] not in self.THIS_SPEECH)
+          assert (A[n] not in THIS_SPEECH)
 
           # Convert the non-speech frame to be included in segment
-          self.A[n] = str(int(self.B[n]) + 9)
-          if self.B[n-1] != self.B[n]:
+          A[n] = B[n] + 9
+          if B[n-1] != B[n]:
             # In this frame there is a transition from
             # one type of non-speech (0, 1 ... 5) to another
             # So its the start of a segment. Also add it to the
             # end of the active frames list
-            self.S[n] = True
+            S[n] = True
             active_frames.append(n+1)
           else:
             # We need to extend the segment end since we have
             # included a non-speeech frame. Remove the current segment end mark
             # and one to the next frame
-            self.E[n] = False
+            E[n] = False
             active_frames[i] = n + 1
-          self.E[n+1] = True
+          E[n+1] = True
           # Increment the number of frames in the segments
           num_segment_frames += 1
           changed = True
-        if n < self.N and self.S[n] and n > 0 and not self.E[n]:
+        if n < N and S[n] and n > 0 and not E[n]:
           # This must be the beginning of a speech region.
           # Include some non-speech before it into the segments
-          assert (self.A[n-1] not in self.THIS_SPEECH)
-          self.A[n-1] = str(int(self.B[n-1]) + 9)
-          if self.B[n-1] != self.B[n]:
-            self.E[n] = True
+          assert (A[n-1] not in THIS_SPEECH)
+          A[n-1] = B[n-1] + 9
+          if B[n-1] != B[n]:
+            E[n] = True
             active_frames.append(n-1)
           else:
-            self.S[n] = False
+            S[n] = False
             active_frames[i] = n - 1
-          self.S[n-1] = True
+          S[n-1] = True
           num_segment_frames += 1
           changed = True
         if num_segment_frames >= target_segment_frames:
@@ -602,76 +625,53 @@ class JointResegmenter:
       proportion = float(num_segment_frames - num_speech_frames) / num_segment_frames
       sys.stderr.write("%s: Warning: for recording %s, only got a proportion %f of non-speech frames, versus target %f\n" % (sys.argv[0], self.file_id, proportion, self.options.silence_proportion))
 
+    self.A = np.array(A, dtype=np.int64)
+    self.S = np.array(S, dtype=bool)
+    self.E = np.array(E, dtype=bool)
+
     ###########################################################################
     # Analysis section
-    self.C = ["0"] * self.N
-    C = self.C
     a = Analysis(self.file_id, self.frame_shift,"Analysis after set_nonspeech_proportion")
 
-    if self.reference != None:
-      count = 0
-      for i in range(0,self.N):
-        if   self.reference[i] == "0" and self.A[i] in (self.THIS_SILENCE + self.THIS_NOISE):
-          C[i] = "0"
-        elif self.reference[i] == "0" and self.A[i] in self.THIS_CONVERT:
-          C[i] = "1"
-        elif self.reference[i] == "0" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "2"
-        elif self.reference[i] == "1" and self.A[i] in (self.THIS_SILENCE + self.THIS_NOISE):
-          C[i] = "3"
-        elif self.reference[i] == "1" and self.A[i] in self.THIS_CONVERT:
-          C[i] = "4"
-        elif self.reference[i] == "1" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "5"
-        elif self.reference[i] == "2" and self.A[i] in (self.THIS_SILENCE + self.THIS_NOISE):
-          C[i] = "6"
-        elif self.reference[i] == "2" and self.A[i] in self.THIS_CONVERT:
-          C[i] = "7"
-        elif self.reference[i] == "2" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "8"
-        if i > 0 and C[i-1] != C[i]:
-          a.state_count[int(C[i-1])].append(count)
-          a.markers[int(C[i-1])].append(i - count)
-          a.phones[int(C[i-1])].append(' '.join(set(self.P[i-count:i])))
-          count = 1
-        else:
-          count += 1
-
-      for j in range(0,9):
-        a.confusion_matrix[j] = sum([C[i] == str(j) for i in range(0,self.N)])
+    if self.reference is not None:
+      # The predicted class is 0 for silence and noise, 1 for converted
+      # non-speech and 2 for speech.
+      predicted = np.zeros(NUM_CLASSES, dtype=np.int64)
+      predicted[list(THIS_CONVERT)] = 1
+      predicted[list(THIS_SPEECH)] = 2
+      self.C = self.reference[0:self.N] * 3 + predicted[self.A]
+      self.accumulate_run_stats(a, self.C)
 
       global_analysis_set_nonspeech_proportion.add(a)
 
-      if self.reference != None and self.options.verbose > 0:
+      if self.reference is not None and self.options.verbose > 0:
         a.write_confusion_matrix()
         a.write_length_stats()
-        if self.reference != None and self.options.verbose > 1:
+        if self.reference is not None and self.options.verbose > 1:
           a.write_markers()
     ###########################################################################
 
   def merge_segments(self):
     # Get list of frames which have segment start and segment end
     # markers into separate lists
-    segment_starts = [i for i, val in enumerate(self.S) if val]
-    segment_ends = [i for i, val in enumerate(self.E) if val]
-    assert (sum(self.S) == sum(self.E))
+    segment_starts = np.flatnonzero(self.S)
+    segment_ends = np.flatnonzero(self.E)
+    assert (len(segment_starts) == len(segment_ends))
 
     if self.options.verbose > 3:
       sys.stderr.write("Length of segment starts before non-speech adding: %d\n" % len(segment_starts))
 
     if self.min_inter_utt_nonspeech_length > 0.0:
-      segment_starts = list(set([0] + segment_starts + segment_ends + [self.N]))
-      segment_starts.sort()
-      segment_starts.pop()
-      segment_ends= list(set([0] + segment_starts + segment_ends + [self.N]))
-      segment_ends.sort()
-      segment_ends.pop(0)
+      # Make every frame that is a segment start or end both a segment
+      # start and a segment end, so the non-speech between segments forms
+      # segments too.
+      points = np.union1d(np.union1d(segment_starts, segment_ends), [0, self.N])
+      segment_starts = points[:-1]
+      segment_ends = points[1:]
       if self.options.verbose > 3:
         sys.stderr.write("Length of segment starts after non-speech adding: %d\n" % len(segment_starts))
-      for i in segment_starts:
-        self.S[i] = True
-      for i in segment_ends:
-        self.E[i] = True
+      self.S[segment_starts] = True
+      self.E[segment_ends] = True
 
     # Just a check. There must always be equal number of segment starts
     # and segment ends
@@ -681,54 +681,38 @@ class JointResegmenter:
     # The list of boundaries is obtained in the following step along with
     # a few statistics like the type of segment on either side of the boundary
     # and the length of the segment on either side of it
-    boundaries = []
-    i = 0
-    j = 0
-    while i < len(segment_starts) and j < len(segment_ends):
-      if segment_ends[j] < segment_starts[i]:
-        # The segment end marker is before the segment start marker.
-        # This means that this segment end marker corresponds to a segment
-        # that is before the one indicated by the segment start marker.
-        # So advance the segment end pointer to the next segment end to
-        # check if that is a 'boundary'
-        j += 1
-      elif segment_ends[j] > segment_starts[i]:
-        # The segment end marker is after the segment start marker.
-        # This means that this segment end marker would corresponds
-        # to segment indicated by the segment start marker.
-        # So advance the segment start pointer to the next segment start to
-        # check if that is a 'boundary'
-        i += 1
-      else:
-        assert(i < len(segment_starts) and j < len(segment_ends))
-        # A boundary:
-        # Find the segment score as the min of lengths of the segments
-        # to the left and to the right.
-        # This segment score will be used to prioritize merging of
-        # the segment with its neighbor
-        assert ((j + 1) < len(segment_ends))
-        segment_score = min(segment_starts[i] - segment_starts[i-1], \
-            segment_ends[j+1] - segment_ends[j])
-        # Also find the type of tranisition of the segments at the boundary.
-        # This is also used to prioritize the merging of the segment
-        boundaries.append((segment_ends[j], segment_score, \
-            self.transition_type(segment_ends[j])))
-
-        # Sort the boundaries based on segment score
-        boundaries.sort(key = lambda x: x[1])
-        # Then sort based on the type of transition by keeping it still
-        # sorted within each transition type  based on segment score
-        boundaries.sort(key = lambda x: x[2])
-        i += 1
-        j += 1
-      # End if
-    # End while loop
+    boundary_frames = np.intersect1d(segment_starts, segment_ends)
+    i = np.searchsorted(segment_starts, boundary_frames)
+    j = np.searchsorted(segment_ends, boundary_frames)
+    assert (np.all((j + 1) < len(segment_ends)))
+    # Find the segment score as the min of lengths of the segments
+    # to the left and to the right.
+    # This segment score will be used to prioritize merging of
+    # the segment with its neighbor
+    segment_scores = np.minimum(segment_starts[i] - segment_starts[i-1],
+                                segment_ends[j+1] - segment_ends[j])
+    # Also find the type of tranisition of the segments at the boundary.
+    # This is also used to prioritize the merging of the segment
+    prev_classes = self.A[boundary_frames - 1]
+    classes = self.A[boundary_frames]
+    assert (np.all((prev_classes != classes) | in_classes(classes, THIS_CONVERT)))
+    transition_types = self.transition_types[prev_classes, classes]
+    assert (np.all(transition_types >= 0))
+    # Sort the boundaries based on the type of transition, and within each
+    # transition type based on segment score, and then on the frame.
+    order = np.lexsort((boundary_frames, segment_scores, transition_types))
+    boundaries = list(zip(boundary_frames[order].tolist(),
+                          segment_scores[order].tolist(),
+                          transition_types[order].tolist()))
+
+    # The segment starts, in order, for finding the start of the segment to
+    # the left of a boundary.  Segment starts are only removed from here on,
+    # so any segment start is in this list.
+    all_segment_starts = np.flatnonzero(self.S)
 
     # Begin merging of segments by removing the start and end mark
     # at the boundary to be merged
-    count = 0
     for b in boundaries:
-      count += 1
       segment_length = 0
 
       if self.min_inter_utt_nonspeech_length > 0.0 and not self.E[b[0]]:
@@ -739,26 +723,18 @@ class JointResegmenter:
 
       # Count the number of frames in the segment to the
       # left of the boundary
-      p = b[0] - 1
-      while p >= 0:
-        if self.S[p]:
-          break
-        p -= 1
-        # End if
-      # End while loop
-      p_left = p
-      segment_length += b[0] - p
+      k = int(np.searchsorted(all_segment_starts, b[0])) - 1
+      while k >= 0 and not self.S[all_segment_starts[k]]:
+        k -= 1
+      p_left = int(all_segment_starts[k]) if k >= 0 else -1
+      segment_length += b[0] - p_left
 
       # Count the number of frames in the segment to the
       # right of the boundary
-      p = b[0] + 1
-      while p <= self.N:
-        if self.E[p]:
-          break
-        p += 1
-      assert (self.min_inter_utt_nonspeech_length == 0 or p == self.N or self.S[p] or self.A[p] in self.THIS_SILENCE_OR_NOISE)
+      p = self.next_segment_end(b[0])
+      assert (self.min_inter_utt_nonspeech_length == 0 or p == self.N or self.S[p] or self.A[p] in THIS_SILENCE_OR_NOISE)
 
-      if self.min_inter_utt_nonspeech_length > 0 and self.A[b[0]] in self.THIS_SILENCE_OR_NOISE:
+      if self.min_inter_utt_nonspeech_length > 0 and self.A[b[0]] in THIS_SILENCE_OR_NOISE:
         assert(b[2] == 6 or b[2] == 7)
         if (p - b[0]) > self.min_inter_utt_nonspeech_length:
           # This is a non-speech segment that is longer than the minimum
@@ -784,12 +760,7 @@ class JointResegmenter:
         # with the adjacent ones as long as the length of the
         # segment after merging to see if its within limits.
         p_temp = p
-        p += 1
-        while p <= self.N:
-          if self.E[p]:
-            break
-          p += 1
-        # End while loop
+        p = self.next_segment_end(p)
         segment_length += p - b[0]
         if segment_length < self.max_frames:
           # Merge the non-speech segment with the segments
@@ -829,20 +800,20 @@ class JointResegmenter:
       # End if
     # End for loop over boundaries
 
-    assert (sum(self.S) == sum(self.E))
+    assert (np.count_nonzero(self.S) == np.count_nonzero(self.E))
 
     ###########################################################################
     # Analysis section
 
-    if self.reference != None and self.options.verbose > 3:
+    if self.reference is not None and self.options.verbose > 3:
       a = self.segmentation_analysis("Analysis after merge_segments")
       a.write_confusion_matrix()
 
-      if self.reference != None and self.options.verbose > 4:
+      if self.reference is not None and self.options.verbose > 4:
         a.write_type_stats()
       # End if
 
-      if self.reference != None and self.options.verbose > 4:
+      if self.reference is not None and self.options.verbose > 4:
         a.write_markers()
       # End if
     # End if
@@ -850,114 +821,90 @@ class JointResegmenter:
   # End function merge_segments
 
   def split_long_segments(self):
-    assert (sum(self.S) == sum(self.E))
-    for n in range(0, self.N):
-      if self.S[n]:
-        p = n + 1
-        while p <= self.N:
-          if self.E[p]:
-            break
-          p += 1
-        segment_length = p - n
-        if segment_length > self.hard_max_frames:
-          # Count the number of times long segments are split
-          self.stats.split_segments += 1
-
-          num_pieces = int((float(segment_length) / self.hard_max_frames) + 0.99999)
-          sys.stderr.write("%s: Warning: for recording %s, " \
-              % (sys.argv[0], self.file_id) \
-              + "splitting segment of length %f seconds into %d pieces " \
-              % (segment_length * self.frame_shift, num_pieces) \
-              + "(--hard-max-segment-length %f)\n" \
-              % self.options.hard_max_segment_length)
-          frames_per_piece = int(segment_length / num_pieces)
-          for i in range(1,num_pieces):
-            q = n + i * frames_per_piece
-            self.S[q] = True
-            self.E[q] = True
-        if p - 1 > n:
-          n = p - 1
-    assert (sum(self.S) == sum(self.E))
+    assert (np.count_nonzero(self.S) == np.count_nonzero(self.E))
+    # The segment starts still to be processed, in order.  Splitting a
+    # segment adds the starts of the new pieces, which are then processed
+    # too (the last piece may still be too long).
+    segment_starts = np.flatnonzero(self.S).tolist()
+    k = 0
+    while k < len(segment_starts):
+      n = segment_starts[k]
+      k += 1
+      p = self.next_segment_end(n)
+      segment_length = p - n
+      if segment_length > self.hard_max_frames:
+        # Count the number of times long segments are split
+        self.stats.split_segments += 1
+
+        num_pieces = int((float(segment_length) / self.hard_max_frames) + 0.99999)
+        sys.stderr.write("%s: Warning: for recording %s, " \
+            % (sys.argv[0], self.file_id) \
+            + "splitting segment of length %f seconds into %d pieces " \
+            % (segment_length * self.frame_shift, num_pieces) \
+            + "(--hard-max-segment-length %f)\n" \
+            % self.options.hard_max_segment_length)
+        frames_per_piece = int(segment_length / num_pieces)
+        new_starts = [ n + i * frames_per_piece for i in range(1, num_pieces) ]
+        self.S[new_starts] = True
+        self.E[new_starts] = True
+        segment_starts = segment_starts[0:k] + \
+            sorted(set(new_starts + segment_starts[k:]))
+    assert (np.count_nonzero(self.S) == np.count_nonzero(self.E))
   # End function split_long_segments
 
   def remove_silence_only_segments(self):
-    for n in range(0, self.N):
-      # Run through to find a segment start
-      if self.S[n]:
-        p = n
-        saw_nonsilence = False
-        # From the segment start, go till the segment end to see
-        # if there is speech in it
-        while p <= self.N:
-          if self.E[p] and p != n:
-            break
-          if p < self.N and self.A[p] not in self.THIS_SILENCE:
-            saw_nonsilence = True
-          p += 1
-        # End of while loop through the segment
-        assert (p > self.N or self.E[p])
-        if not saw_nonsilence:
-          # Count the number of silence only segments
-          self.stats.silence_only += 1
-
-          self.S[n] = False
-          self.E[p] = False
-        # End if
-        if p - 1 > n:
-          # Go to the end of the segment since that segment is
-          # already processed
-          n = p - 1
-        # End if
-    if self.reference != None and self.options.verbose > 3:
+    nonsilence = ~in_classes(self.A, THIS_SILENCE)
+    for n in np.flatnonzero(self.S).tolist():
+      # From the segment start, go till the segment end to see
+      # if there is speech in it
+      p = self.next_segment_end(n)
+      assert (p > self.N or self.E[p])
+      if not nonsilence[n:p].any():
+        # Count the number of silence only segments
+        self.stats.silence_only += 1
+
+        self.S[n] = False
+        self.E[p] = False
+      # End if
+    if self.reference is not None and self.options.verbose > 3:
       a = self.segmentation_analysis("Analysis after remove_silence_only_segments")
       a.write_confusion_matrix()
 
-      if self.reference != None and self.options.verbose > 4:
+      if self.reference is not None and self.options.verbose > 4:
         a.write_type_stats()
       # End if
 
-      if self.reference != None and self.options.verbose > 4:
+      if self.reference is not None and self.options.verbose > 4:
         a.write_markers()
       # End if
     # End if
   # End function remove_silence_only_segments
 
   def remove_noise_only_segments(self):
-    for n in range(0, self.N):
-      if self.S[n]:
-        p = n
-        saw_speech = False
-        while p <= self.N:
-          if self.E[p] and p != n:
-            break
-          if self.A[p] in self.THIS_SPEECH:
-            saw_speech = True
-          p += 1
-        assert (self.E[p])
-        if not saw_speech:
-          # Count the number of segments with no speech
-          self.stats.noise_only += 1
-          self.S[n] = False
-          self.E[p] = False
-        # End if
-        if p - 1 > n:
-          n = p - 1
-        # End if
+    speech = in_classes(self.A, THIS_SPEECH)
+    for n in np.flatnonzero(self.S).tolist():
+      p = self.next_segment_end(n)
+      assert (self.E[p])
+      if not speech[n:p].any():
+        # Count the number of segments with no speech
+        self.stats.noise_only += 1
+        self.S[n] = False
+        self.E[p] = False
       # End if
-    # End for loop over frames
+    # End for loop over segments
 
     ###########################################################################
     # Analysis section
 
-    if self.reference != None and self.options.verbose > 3:
+    if self.reference is not None and self.options.verbose > 3:
       a = self.segmentation_analysis("Analysis after remove_noise_only_segments")
       a.write_confusion_matrix()
 
-      if self.reference != None and self.options.verbose > 4:
+      if self.reference is not None and self.options.verbose > 4:
         a.write_type_stats()
       # End if
 
-      if self.reference != None and self.options.verbose > 4:
+      if self.reference is not None and self.options.verbose > 4:
         a.write_markers()
       # End if
     # End if
@@ -967,55 +914,29 @@ class JointResegmenter:
   # Return the transition type from frame j-1 to frame j
   def transition_type(self, j):
     assert (j > 0)
-    assert (self.A[j-1] != self.A[j] or self.A[j] in self.THIS_CONVERT)
-    if self.A[j-1] in (self.THIS_SPEECH_THAT_NOISE + self.THIS_SPEECH_THAT_SIL) and self.A[j] in (self.THIS_SPEECH_THAT_NOISE + self.THIS_SPEECH_THAT_SIL):
-      return 0
-    if self.A[j-1] in self.THIS_SPEECH and self.A[j] in self.THIS_SPEECH:
-      return 1
-    if self.A[j-1] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT_THAT_SIL + self.THIS_NOISE_CONVERT_THAT_NOISE) and self.A[j] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT_THAT_SIL + self.THIS_NOISE_CONVERT_THAT_NOISE):
-      return 2
-    if self.A[j-1] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT) and self.A[j] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT):
-      return 3
-    if self.A[j-1] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT + self.THIS_SIL_CONVERT_THAT_SIL + self.THIS_SIL_CONVERT_THAT_NOISE) and self.A[j] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT + self.THIS_SIL_CONVERT_THAT_SIL + self.THIS_SIL_CONVERT_THAT_NOISE):
-      return 4
-    if self.A[j-1] in (self.THIS_SPEECH + self.THIS_CONVERT) and self.A[j] in (self.THIS_SPEECH + self.THIS_CONVERT):
-      return 5
-    if self.A[j-1] in self.THIS_SPEECH_PLUS and self.A[j] in (self.THIS_SPEECH_PLUS + self.THIS_NOISE):
-      return 6
-    if self.A[j-1] in self.THIS_SPEECH_PLUS and self.A[j] in (self.THIS_SPEECH_PLUS + self.THIS_SILENCE):
-      return 7
-    if self.A[j-1] in (self.THIS_SPEECH_PLUS + self.THIS_NOISE) and self.A[j] in self.THIS_SPEECH_PLUS:
-      return 8
-    if self.A[j-1] in (self.THIS_SPEECH_PLUS + self.THIS_SILENCE) and self.A[j] in self.THIS_SPEECH_PLUS:
-      return 9
-    assert (False)
+    assert (self.A[j-1] != self.A[j] or self.A[j] in THIS_CONVERT)
+    t = int(self.transition_types[self.A[j-1], self.A[j]])
+    assert (t >= 0)
+    return t
 
   # Output the final segments
   def print_segments(self, out_file_handle = sys.stdout):
     # We also do some sanity checking here.
-    segments = []
-
     assert (self.N == len(self.S))
     assert (self.N + 1 == len(self.E))
 
-    max_end_time = 0
-    n = 0
-    while n < self.N:
-      if self.E[n] and not self.S[n]:
-        sys.stderr.write("%s: Error: Ending segment before starting it: n=%d\n" % (sys.argv[0], n))
-      if self.S[n]:
-        p = n + 1
-        while p < self.N and not self.E[p]:
-          assert (not self.S[p])
-          p += 1
-        assert (p == self.N or self.E[p])
-        segments.append((n,p))
-        max_end_time = p
-        if p < self.N and self.S[p]:
-          n = p - 1
-        else:
-          n = p
-      n += 1
+    # Each segment goes from a segment start to the next segment end,
+    # or the end of the file.
+    segment_starts = np.flatnonzero(self.S)
+    segment_ends = np.flatnonzero(self.E[0:self.N])
+    k = np.searchsorted(segment_ends, segment_starts, side='right')
+    next_ends = np.append(segment_ends, self.N)[k]
+    for n in np.setdiff1d(segment_ends, np.union1d(next_ends, segment_starts)).tolist():
+      sys.stderr.write("%s: Error: Ending segment before starting it: n=%d\n" % (sys.argv[0], n))
+    # No segment may start inside another one
+    assert (np.all(segment_starts[1:] >= next_ends[:-1]))
+    segments = list(zip(segment_starts.tolist(), next_ends.tolist()))
+    max_end_time = segments[-1][1] if len(segments) > 0 else 0
 
     if len(segments) == 0:
       sys.stderr.write("%s: Warning: no segments for recording %s\n" % (sys.argv[0], self.file_id))
@@ -1024,42 +945,17 @@ class JointResegmenter:
     ############################################################################
     # Analysis section
 
-    self.C = ["0"] * self.N
-    C = self.C
     a = Analysis(self.file_id, self.frame_shift,"Analysis final")
 
-    if self.reference != None:
-      count = 0
-      in_seg = False
-      for i in range(0,self.N):
-        if in_seg and self.E[i]:
-          in_seg = False
-        if i == 0 and self.S[i]:
-          in_seg = True
-        if not in_seg and self.S[i]:
-          in_seg = True
-        if   self.reference[i] == "0" and not in_seg:
-          C[i] = "0"
-        elif self.reference[i] == "0" and in_seg:
-          C[i] = "2"
-        elif self.reference[i] == "1" and not in_seg:
-          C[i] = "3"
-        elif self.reference[i] == "1" and in_seg:
-          C[i] = "5"
-        elif self.reference[i] == "2" and not in_seg:
-          C[i] = "6"
-        elif self.reference[i] == "2" and in_seg:
-          C[i] = "8"
-        if i > 0 and C[i-1] != C[i]:
-          a.state_count[int(C[i-1])].append(count)
-          a.markers[int(C[i-1])].append(i - count)
-          a.phones[int(C[i-1])].append(' '.join(set(self.P[i-count:i])))
-          count = 1
-        else:
-          count += 1
-
-      for j in range(0,9):
-        a.confusion_matrix[j] = sum([C[i] == str(j) for i in range(0,self.N)])
+    if self.reference is not None:
+      # A frame is in a segment if the last segment start up to it is not
+      # before the last segment end up to it.
+      frames = np.arange(self.N)
+      last_start = np.maximum.accumulate(np.where(self.S, frames, -1))
+      last_end = np.maximum.accumulate(np.where(self.E[0:self.N], frames, -1))
+      in_seg = (last_start >= 0) & (last_start >= last_end)
+      self.C = self.reference[0:self.N] * 3 + in_seg * 2
+      self.accumulate_run_stats(a, self.C)
 
       if self.options.verbose > 0:
         a.write_confusion_matrix()
@@ -1099,21 +995,18 @@ class JointResegmenter:
 
     # First get the segment start and segment ends
     # Note that they are in sync by construction
-    segment_starts = [i for i in range(0,self.N) if self.S[i]]
-    segment_ends = [i for i in range(0,self.N+1) if self.E[i]]
+    segment_starts = np.flatnonzero(self.S).tolist()
+    segment_ends = np.flatnonzero(self.E).tolist()
 
     D = {}
     for i,st in enumerate(segment_starts):
       en = segment_ends[i]
-      types = {}
-      for val in self.reference[st:en]:
-        # The segment is defined by the indices st:en
-        # Count the number of frames in the segment that
-        # are silence, speech and noise in the reference.
-        types[val] = types.get(val,0) + 1
-      # End for loop over a particular segment
+      # The segment is defined by the indices st:en
+      # Count the number of frames in the segment that
+      # are silence, speech and noise in the reference.
+      types = np.bincount(self.reference[st:en], minlength=3).tolist()
       # Make a tuple out of the counts of the types of frames
-      D[st] = (en, types.get("0",0), types.get("1", 0), types.get("2", 0))
+      D[st] = (en, types[0], types[1], types[2])
     # End for loop over all segments
 
     a = Analysis(self.file_id, None, title)
@@ -1184,93 +1077,149 @@ class JointResegmenter:
     return a
   # End function segmentation_analysis
 
+# Returns an integer array with the classes (0 for silence, 1 for noise,
+# 2 for speech) of the phones in the list A, according to phone_map.
+def get_phone_classes(A, phone_map):
+  phones, phone_indexes = np.unique(np.array(A), return_inverse=True)
+  return np.array([ int(phone_map[x]) for x in phones ], dtype=np.int64)[phone_indexes]
+
+# Maps the predicted phones A1 (and A2, in joint segmentation) to the
+# integer frame classes used by JointResegmenter.
 def map_prediction(A1, A2, phone_map, speech_cap = None, f = None):
-  if A2 == None:
-    B = []
+  if A2 is None:
     # Isolated segmentation
-    prev_x = None
-    len_x = 0
-    i = 0
-    for x in A1:
-      if prev_x == None or x == prev_x:
-        len_x += 1
-      else:
-        assert (len_x > 0)
-        #sys.stderr.write("PHONE_LENGTH %s %d %s %d\n" % (prev_x, len_x, f, i - len_x))
-        if phone_map[prev_x] == "0":
-          B.extend(["0"] * len_x)
-        elif (speech_cap != None and len_x > speech_cap) or phone_map[prev_x] == "1":
-          B.extend(["4"] * len_x)
-        elif phone_map[prev_x] == "2":
-          B.extend(["8"] * len_x)
-        # End if
-        len_x = 1
-      # End if
-      prev_x = x
-      i += 1
-    # End for
-    try:
-      assert (len_x > 0)
-    except AssertionError as e:
-      repr(e)
+    if len(A1) == 0:
       sys.stderr.write("In file %s\n" % f)
       sys.exit(1)
-
-    if phone_map[prev_x] == "0":
-      B.extend(["0"] * len_x)
-    elif (speech_cap != None and len_x > speech_cap) or phone_map[prev_x] == "1":
-      B.extend(["4"] * len_x)
-    elif phone_map[prev_x] == "2":
-      B.extend(["8"] * len_x)
-    # End if
-    return B
+    # Find the runs of identical phones (not of identical classes, as the
+    # speech cap is applied to the length of a phone).
+    phones, phone_indexes = np.unique(np.array(A1), return_inverse=True)
+    run_starts = np.concatenate(([0], np.flatnonzero(phone_indexes[1:] != phone_indexes[:-1]) + 1))
+    run_lengths = np.diff(np.append(run_starts, len(A1)))
+    phone_classes = np.array([ int(phone_map[x]) for x in phones ], dtype=np.int64)
+    run_classes = phone_classes[phone_indexes[run_starts]]
+    # silence -> 0, noise -> 4, speech -> 8, and speech phones longer than
+    # the speech cap are taken to be noise.
+    run_values = run_classes * 4
+    if speech_cap != None:
+      run_values[(run_classes != 0) & (run_lengths > speech_cap)] = 4
+    return np.repeat(run_values, run_lengths)
   # End if (isolated segmentation)
 
   # Assuming len(A1) > len(A2)
   # Otherwise A1 and A2 must be interchanged before
   # passing to this function
-  B1 = []
-  B2 = []
-  for i in range(0, len(A2)):
-    if phone_map[A1[i]] == "0" and phone_map[A2[i]] == "0":
-      B1.append("0")
-      B2.append("0")
-    if phone_map[A1[i]] == "0" and phone_map[A2[i]] == "1":
-      B1.append("1")
-      B2.append("3")
-    if phone_map[A1[i]] == "0" and phone_map[A2[i]] == "2":
-      B1.append("2")
-      B2.append("6")
-    if phone_map[A1[i]] == "1" and phone_map[A2[i]] == "0":
-      B1.append("3")
-      B2.append("1")
-    if phone_map[A1[i]] == "1" and phone_map[A2[i]] == "1":
-      B1.append("4")
-      B2.append("4")
-    if phone_map[A1[i]] == "1" and phone_map[A2[i]] == "2":
-      B1.append("5")
-      B2.append("7")
-    if phone_map[A1[i]] == "2" and phone_map[A2[i]] == "0":
-      B1.append("6")
-      B2.append("2")
-    if phone_map[A1[i]] == "2" and phone_map[A2[i]] == "1":
-      B1.append("7")
-      B2.append("5")
-    if phone_map[A1[i]] == "2" and phone_map[A2[i]] == "2":
-      B1.append("8")
-      B2.append("8")
-  for i in range(len(A2), len(A1)):
-    if phone_map[A1[i]] == "0":
-      B1.append("0")
-      B2.append("0")
-    if phone_map[A1[i]] == "1":
-      B1.append("3")
-      B2.append("1")
-    if phone_map[A1[i]] == "2":
-      B1.append("6")
-      B2.append("2")
+  C1 = get_phone_classes(A1, phone_map)
+  C2 = get_phone_classes(A2, phone_map)
+  n = len(A2)
+  # The classes of the frames are 3 * (class of this channel) + (class of
+  # the other channel); after the end of A2 the other channel is taken to be
+  # silence for A1, and A2 is given the class of A1 as its own class.
+  B1 = np.concatenate((C1[0:n] * 3 + C2, C1[n:] * 3))
+  B2 = np.concatenate((C2 * 3 + C1[0:n], C1[n:]))
   return (B1, B2)
 
+# Reads the predicted phones of the recording f from the prediction directory
+def read_prediction(prediction_dir, f):
+  try:
+    return open(os.path.join(prediction_dir, f+".pred")).readline().strip().split()[1:]
+  except IndexError:
+    sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f))
+    sys.exit(1)
+
+# Resegments the recordings in the list 'files', which is either a single
+# recording for isolated resegmentation, or the two channels [f1, f2] of a
+# conversation for joint resegmentation. 'references' is a dictionary from
+# file_id to the reference classes read by read_rttm_file() (it need only
+# contain the recordings in 'files').
+# This is what each job does. The segments and the log are returned as
+# strings rather than written out, so that the jobs can be run in parallel,
+# together with the Stats and the Analysis objects of the job (after
+# get_initial_segments, after set_nonspeech_proportion and final), which are
+# accumulated over all the jobs in main().
+def resegment_recordings(files, options, phone_map, speech_cap, references):
+  global global_analysis_get_initial_segments
+  global global_analysis_set_nonspeech_proportion
+  global global_analysis_final
+  global_analysis_get_initial_segments = Analysis(None, options.frame_shift, None)
+  global_analysis_set_nonspeech_proportion = Analysis(None, options.frame_shift, None)
+  global_analysis_final = Analysis(None, options.frame_shift, None)
+
+  prediction_dir = options.prediction_dir
+  total_stats = Stats()
+  segments = StringIO()
+
+  if len(files) == 1:
+    f = files[0]
+    A = read_prediction(prediction_dir, f)
+    B = map_prediction(A, None, phone_map, speech_cap, f)
+
+    stats = Stats()
+    r = JointResegmenter(A, B, f, options, phone_map, stats, references.get(f))
+    r.resegment()
+    r.print_segments(segments)
+    total_stats.add(stats)
+  else:
+    f1, f2 = files
+    A1 = read_prediction(prediction_dir, f1)
+    A2 = read_prediction(prediction_dir, f2)
+
+    if len(A1) < len(A2):
+      A3 = A1
+      A1 = A2
+      A2 = A3
+
+      f3 = f1
+      f1 = f2
+      f2 = f3
+    # End if
+
+    if (len(A1) - len(A2)) > options.max_length_diff / options.frame_shift:
+      sys.stderr.write( \
+          "%s: Warning: Lengths of %s and %s differ by more than %f. " \
+          % (sys.argv[0], f1,f2, options.max_length_diff) \
+          + "So using isolated resegmentation\n")
+      B1 = map_prediction(A1, None, phone_map, speech_cap)
+      B2 = map_prediction(A2, None, phone_map, speech_cap)
+    else:
+      B1,B2 = map_prediction(A1, A2, phone_map, speech_cap)
+    # End if
+
+    stats = Stats()
+    r1 = JointResegmenter(A1, B1, f1, options, phone_map, stats, references.get(f1))
+    r1.resegment()
+    r1.print_segments(segments)
+    total_stats.add(stats)
+
+    stats = Stats()
+    r2 = JointResegmenter(A1, B2, f2, options, phone_map, stats, references.get(f2))
+    r2.resegment()
+    r2.restrict(len(A2))
+    r2.print_segments(segments)
+    total_stats.add(stats)
+  # End if
+
+  return (segments.getvalue(), total_stats, \
+      (global_analysis_get_initial_segments, \
+        global_analysis_set_nonspeech_proportion, \
+        global_analysis_final))
+
+# Runs resegment_recordings() with the log (standard error) captured into a
+# string, and returns a tuple (log, result), where result is None if the job
+# failed (the jobs exit with sys.exit(1) on errors, which must not be raised
+# in the worker processes of a multiprocessing.Pool).
+def resegment_recordings_star(args):
+  log = StringIO()
+  stderr = sys.stderr
+  sys.stderr = log
+  try:
+    result = resegment_recordings(*args)
+  except SystemExit:
+    result = None
+  finally:
+    sys.stderr = stderr
+  return (log.getvalue(), result)
+
 def main():
   parser = ArgumentParser(description='Get segmentation arguments')
   parser.add_argument('--verbose', type=int, \
@@ -1317,6 +1266,10 @@ def main():
       + "segmentation to be done (default: %(default)s)")
   parser.add_argument('--reference-rttm', dest='reference_rttm', \
       help="RTTM file to compare and get statistics (default: %(default)s)")
+  parser.add_argument('--num-jobs', type=int, \
+      dest='num_jobs', default=1, \
+      help="Number of processes to resegment the recordings in parallel " \
+      + "(default: %(default)s)")
   parser.add_argument('--speech-cap-length', type=float, default=None, \
       help="Maximum length in seconds of a particular speech phone prediction." \
       + "\nAny length above this will be considered as noise")
@@ -1331,6 +1284,10 @@ def main():
   options = parser.parse_args()
 
   sys.stderr.write(' '.join(sys.argv) + "\n")
+  if not use_numpy:
+    sys.stderr.write("%s: Error: numpy is required for the resegmentation\n" % sys.argv[0])
+    sys.exit(1)
+
   if not ( options.silence_proportion \
       > 0.01 and options.silence_proportion < 0.99 ):
     sys.stderr.write("%s: Error: Invalid silence-proportion value %f\n" \
@@ -1342,6 +1299,11 @@ def main():
         % options.remove_noise_only_segments)
     sys.exit(1)
 
+  if options.num_jobs < 1:
+    sys.stderr.write("%s: Error: Invalid num-jobs value %d\n" \
+        % (sys.argv[0], options.num_jobs))
+    sys.exit(1)
+
   if options.output_segments == '-':
     out_file = sys.stdout
   else:
@@ -1365,32 +1327,28 @@ def main():
   channel1_file = options.channel1_file
   channel2_file = options.channel2_file
 
-  temp_dir = prediction_dir + "/../rttm_classes"
-  os.system("mkdir -p %s" % temp_dir)
   if options.reference_rttm != None:
-    read_rttm_file(options.reference_rttm, temp_dir, options.frame_shift)
+    references = read_rttm_file(options.reference_rttm, options.frame_shift)
   else:
-    temp_dir = None
-
-  stats = Stats()
+    references = {}
 
   pred_files = dict([ (f.split('/')[-1][0:-5], False) \
     for f in glob.glob(os.path.join(prediction_dir, "*.pred")) ])
 
-  global global_analysis_get_initial_segments
-  global_analysis_get_initial_segments = Analysis("TOTAL_Get_Initial_Segments", options.frame_shift, "Global Analysis after get_initial_segments")
-
-  global global_analysis_set_nonspeech_proportion
-  global_analysis_set_nonspeech_proportion = Analysis("TOTAL_set_nonspeech_proportion", options.frame_shift, "Global Analysis after set_nonspeech_proportion")
-
-  global global_analysis_final
-  global_analysis_final= Analysis("TOTAL_Final", options.frame_shift, "Global Analysis Final")
+  total_analysis_get_initial_segments = Analysis("TOTAL_Get_Initial_Segments", options.frame_shift, "Global Analysis after get_initial_segments")
+  total_analysis_set_nonspeech_proportion = Analysis("TOTAL_set_nonspeech_proportion", options.frame_shift, "Global Analysis after set_nonspeech_proportion")
+  total_analysis_final= Analysis("TOTAL_Final", options.frame_shift, "Global Analysis Final")
+  stats = Stats()
 
   speech_cap = None
   if options.speech_cap_length != None:
     speech_cap = int( options.speech_cap_length / options.frame_shift )
   # End if
 
+  # Make the list of jobs, each of which is either a single recording
+  # (isolated resegmentation) or the two channels of a conversation
+  # (joint resegmentation)
+  jobs = []
   for f in pred_files:
     if pred_files[f]:
       continue
@@ -1410,96 +1368,59 @@ def main():
 
     if options.isolated_resegmentation or f2 not in pred_files or f1 not in pred_files:
       pred_files[f] = True
-      try:
-        A = open(os.path.join(prediction_dir, f+".pred")).readline().strip().split()[1:]
-      except IndexError:
-        sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f))
-        sys.exit(1)
-
-      B = map_prediction(A, None, phone_map, speech_cap, f)
-
-      if temp_dir != None:
-        try:
-          reference = open(os.path.join(temp_dir, f+".ref")).readline().strip().split()[1:]
-        except IOError:
-          reference = None
-      else:
-        reference = None
-      r = JointResegmenter(A, B, f, options, phone_map, stats, reference)
-      r.resegment()
-      r.print_segments(out_file)
+      files = [f]
     else:
       if pred_files[f1] and pred_files[f2]:
         continue
       pred_files[f1] = True
       pred_files[f2] = True
-      try:
-        A1 = open(os.path.join(prediction_dir, f1+".pred")).readline().strip().split()[1:]
-      except IndexError:
-        sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f1))
-        sys.exit(1)
-      try:
-        A2 = open(os.path.join(prediction_dir, f2+".pred")).readline().strip().split()[1:]
-      except IndexError:
-        sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f2))
-        sys.exit(1)
-
-      if len(A1) < len(A2):
-        A3 = A1
-        A1 = A2
-        A2 = A3
-
-        f3 = f1
-        f1 = f2
-        f2 = f3
-      # End if
-
-      if (len(A1) - len(A2)) > options.max_length_diff / options.frame_shift:
-        sys.stderr.write( \
-            "%s: Warning: Lengths of %s and %s differ by more than %f. " \
-            % (sys.argv[0], f1,f2, options.max_length_diff) \
-            + "So using isolated resegmentation\n")
-        B1 = map_prediction(A1, None, phone_map, speech_cap)
-        B2 = map_prediction(A2, None, phone_map, speech_cap)
-      else:
-        B1,B2 = map_prediction(A1, A2, phone_map, speech_cap)
-      # End if
-
-      if temp_dir != None:
-        try:
-          reference1 = open(os.path.join(temp_dir, f1+".ref")).readline().strip().split()[1:]
-        except IOError:
-          reference1 = None
-      else:
-        reference1 = None
-      r1 = JointResegmenter(A1, B1, f1, options, phone_map, stats, reference1)
-      r1.resegment()
-      r1.print_segments(out_file)
-
-      if temp_dir != None:
-        try:
-          reference2 = open(os.path.join(temp_dir, f2+".ref")).readline().strip().split()[1:]
-        except IOError:
-          reference2= None
-      else:
-        reference2 = None
-      r2 = JointResegmenter(A1, B2, f2, options, phone_map, stats, reference2)
-      r2.resegment()
-      r2.restrict(len(A2))
-      r2.print_segments(out_file)
+      files = [f1, f2]
     # End if
+    jobs.append((files, options, phone_map, speech_cap, \
+        dict([ (x, references[x]) for x in files if x in references ])))
   # End for loop over files
 
+  if options.num_jobs > 1:
+    pool = multiprocessing.Pool(options.num_jobs)
+    results = pool.imap(resegment_recordings_star, jobs)
+  else:
+    pool = None
+    results = map(resegment_recordings_star, jobs)
+
+  # The results are written in the order of the jobs
+  for log, result in results:
+    sys.stderr.write(log)
+    if result is None:
+      if pool is not None:
+        pool.terminate()
+      sys.exit(1)
+    segments, job_stats, job_analyses = result
+    out_file.write(segments)
+    stats.add(job_stats)
+    total_analysis_get_initial_segments.add(job_analyses[0])
+    total_analysis_set_nonspeech_proportion.add(job_analyses[1])
+    total_analysis_final.add(job_analyses[2])
+  # End for loop over jobs
+
+  if pool is not None:
+    pool.close()
+    pool.join()
+
+  if options.verbose > 1:
+    sys.stderr.write("Total over all files\n")
+    stats.print_stats()
+    sys.stderr.write("\n")
+
   if options.reference_rttm != None:
-    global_analysis_get_initial_segments.write_confusion_matrix(True)
-    global_analysis_get_initial_segments.write_total_stats(True)
-    global_analysis_get_initial_segments.write_length_stats()
-    global_analysis_set_nonspeech_proportion.write_confusion_matrix(True)
-    global_analysis_set_nonspeech_proportion.write_total_stats(True)
-    global_analysis_set_nonspeech_proportion.write_length_stats()
-    global_analysis_final.write_confusion_matrix(True)
-    global_analysis_final.write_total_stats(True)
-    global_analysis_final.write_length_stats()
+    total_analysis_get_initial_segments.write_confusion_matrix(True)
+    total_analysis_get_initial_segments.write_total_stats(True)
+    total_analysis_get_initial_segments.write_length_stats()
+    total_analysis_set_nonspeech_proportion.write_confusion_matrix(True)
+    total_analysis_set_nonspeech_proportion.write_total_stats(True)
+    total_analysis_set_nonspeech_proportion.write_length_stats()
+    total_analysis_final.write_confusion_matrix(True)
+    total_analysis_final.write_total_stats(True)
+    total_analysis_final.write_length_stats()
 
 if __name__ == '__main__':
   with Timer() as t:
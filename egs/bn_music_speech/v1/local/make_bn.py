@@ -7,42 +7,54 @@
 #
 # This file is meant to be invoked by make_bn.sh.
 
-import os, sys
-wav_dir = sys.argv[1]
-out_dir = sys.argv[2]
+import os, sys, argparse
+from multiprocessing.pool import ThreadPool
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--num-threads", type=int, default=8,
+                    help="Number of threads used to read the annotation files.")
+parser.add_argument("wav_dir", help="Directory containing the .sph files.")
+parser.add_argument("out_dir", help="Directory containing the refined "
+                    "annotations, to which the data files are written.")
+args = parser.parse_args()
+wav_dir = args.wav_dir
+out_dir = args.out_dir
+num_threads = args.num_threads
+
+def read_annotations(utt):
+  music_filename = utt + "_music.key.refined"
+  speech_filename = utt + "_speech.key.refined"
+  music_fi = open(os.path.join(out_dir, music_filename), 'r').readlines()
+  speech_fi = open(os.path.join(out_dir, speech_filename), 'r').readlines()
+  return utt, music_fi, speech_fi
 
 utts = open(os.path.join(out_dir, "utt_list"), 'r').readlines()
 utts = set(x.rstrip() for x in utts)
-wav = ""
-segments = ""
-utt2spk = ""
+wav_fi = open(os.path.join(out_dir, "wav.scp"), 'w')
 for subdir, dirs, files in os.walk(wav_dir):
   for file in files:
     utt = str(file).replace(".sph", "")
     if file.endswith(".sph") and utt in utts:
-      wav = wav + utt + " sox " + subdir + "/" + utt + ".sph"  + " -c 1 -r 16000 -t wav - |\n"
-wav_fi = open(os.path.join(out_dir, "wav.scp"), 'w')
-wav_fi.write(wav)
+      wav_fi.write(utt + " sox " + subdir + "/" + utt + ".sph"  + " -c 1 -r 16000 -t wav - |\n")
+wav_fi.close()
 
-for utt in utts:
-  music_filename = utt + "_music.key.refined"
-  speech_filename = utt + "_speech.key.refined"
-  music_fi = open(os.path.join(out_dir, music_filename), 'r').readlines()
-  speech_fi = open(os.path.join(out_dir, speech_filename), 'r').readlines()
+utt2spk_fi = open(os.path.join(out_dir, "utt2spk"), 'w')
+segments_fi = open(os.path.join(out_dir, "segments"), 'w')
+pool = ThreadPool(num_threads)
+for utt, music_fi, speech_fi in pool.imap(read_annotations, utts):
   count = 1
   for line in music_fi:
     left, right = line.rstrip().split(" ")
-    segments = segments + utt + "-music-" + str(count) + " " + utt + " " + left + " " + right + "\n"
-    utt2spk = utt2spk + utt + "-music-" + str(count) + " " + utt + "-music-" + str(count) + "\n"
+    segments_fi.write(utt + "-music-" + str(count) + " " + utt + " " + left + " " + right + "\n")
+    utt2spk_fi.write(utt + "-music-" + str(count) + " " + utt + "-music-" + str(count) + "\n")
     count += 1
   count = 1
   for line in speech_fi:
     left, right = line.rstrip().split(" ")
-    segments = segments + utt + "-speech-" + str(count) + " " + utt + " " + left + " " + right + "\n"
-    utt2spk = utt2spk + utt + "-speech-" + str(count) + " " + utt + "-speech-" + str(count) + "\n"
+    segments_fi.write(utt + "-speech-" + str(count) + " " + utt + " " + left + " " + right + "\n")
+    utt2spk_fi.write(utt + "-speech-" + str(count) + " " + utt + "-speech-" + str(count) + "\n")
     count += 1
-utt2spk_fi = open(os.path.join(out_dir, "utt2spk"), 'w')
-utt2spk_fi.write(utt2spk)
-segments_fi = open(os.path.join(out_dir, "segments"), 'w')
-segments_fi.write(segments)
-
+pool.close()
+pool.join()
+utt2spk_fi.close()
+segments_fi.close()
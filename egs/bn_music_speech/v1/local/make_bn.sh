@@ -21,6 +21,8 @@ tmp_dir=local/bn.tmp
 # longer than this.
 frames_per_sec=100
 min_seg=0.5
+# The number of threads make_bn.py uses to read the annotation files.
+num_threads=8
 
 rm -rf local/bn.tmp
 mkdir local/bn.tmp
@@ -30,7 +32,7 @@ local/make_annotations_bn.py ${transcript_dir} ${tmp_dir}
 echo "$0: Removing overlapping annotations..."
 local/refine_annotations_bn.py ${tmp_dir} ${frames_per_sec} ${min_seg}
 echo "$0: Preparing broadcast news data directories ${data_dir}/bn..."
-local/make_bn.py ${sph_dir} ${tmp_dir}
+local/make_bn.py --num-threads ${num_threads} ${sph_dir} ${tmp_dir}
 
 mkdir -p ${data_dir}/bn
 cp ${tmp_dir}/wav.scp ${data_dir}/bn/
@@ -7,7 +7,16 @@
 
 import os
 import sys
-import subprocess
+import imp
+import argparse
+
+plf_lib = imp.load_source('plf_lib', 'local/lattice_plf_lib.py')
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help = "Number of processes used to convert the lines of the "
+                    "translation file to PLF.")
+args = parser.parse_args()
 
 latticeLocation = 'latjosh-2-callhome/lattices-pushed/'
 
@@ -28,19 +37,6 @@ if not os.path.exists(invalidplfdir):
 else:
     os.system("rm " + invalidplfdir + "/*")
 
-def latticeConcatenate(lat1, lat2):
-    '''
-    Concatenates lattices, writes temporary results to tmpdir
-    '''
-    if lat1 == "":
-        os.system('rm ' + tmpdir + '/tmp.lat')
-        return lat2
-    else:
-        proc = subprocess.Popen(['fstconcat', lat1, lat2, (tmpdir + '/tmp.lat')])
-        proc.wait()
-        return tmpdir + '/tmp.lat'
-
-
 def findLattice(timeDetail):
     '''
     Finds the lattice corresponding to a time segment
@@ -61,52 +57,23 @@ for line in conversationList:
 # IN what order were the conversations added to the spanish files?
 # Now get timing information to concatenate the ASR outputs
 
-lineNo = 1
-for item in fileList:
-    timingFile = open('/export/a04/gkumar/corpora/fishcall/callhome/tim/' + item + '.es')
-    for line in timingFile:
-        timeInfo = line.split()
-
-        # For utterances that are concatenated in the translation file, 
-        # the corresponding FSTs have to be translated as well
-        mergedTranslation = ""
-        for timeDetail in timeInfo:
-            tmp = findLattice(timeDetail)
-            if tmp != -1:
-                # Concatenate lattices
-                mergedTranslation = latticeConcatenate(mergedTranslation, tmp)
-
-        print mergedTranslation
-        if mergedTranslation != "":
-            
-            # Sanjeev's Recipe : Remove epsilons and topo sort
-            finalFST = tmpdir + "/final.fst"
-            os.system("fstrmepsilon " + mergedTranslation + " | fsttopsort - " + finalFST)
-        
-            # Now convert to PLF
-            proc = subprocess.Popen('/export/a04/gkumar/corpora/fishcall/bin/fsm2plf.sh ' + symtable +  ' ' + finalFST, stdout=subprocess.PIPE, shell=True)
-            PLFline = proc.stdout.readline()
-            finalPLFFile = tmpdir + "/final.plf"
-            finalPLF = open(finalPLFFile, "w+")
-            finalPLF.write(PLFline)
-            finalPLF.close()
-
-            # now check if this is a valid PLF, if not write it's ID in a 
-            # file so it can be checked later
-            proc = subprocess.Popen("/export/a04/gkumar/moses/mosesdecoder/checkplf < " + finalPLFFile + " 2>&1 | awk 'FNR == 2 {print}'", stdout=subprocess.PIPE, shell=True)
-            line = proc.stdout.readline()
-            print line + " " + str(lineNo)
-            if line.strip() != "PLF format appears to be correct.":
-                os.system("cp " + finalFST + " " + invalidplfdir + "/" + timeInfo[0])
-                invalidPLF.write(invalidplfdir + "/" + timeInfo[0] + "\n")
-                rmLines.write(str(lineNo) + "\n")
-            else:
-                provFile.write(PLFline)
-        else:
-            blankPLF.write(timeInfo[0] + "\n")
+# The lines are processed in parallel, and the results are written in order
+# as they come in
+jobs = plf_lib.readTranslationLines(fileList, '/export/a04/gkumar/corpora/fishcall/callhome/tim')
+for lineNo, timeInfo, mergedTranslation, PLFline, checkLine in plf_lib.convertLinesToPLF(
+        jobs, findLattice, tmpdir, invalidplfdir, symtable, args.num_jobs):
+    print mergedTranslation
+    if mergedTranslation != "":
+        print checkLine + " " + str(lineNo)
+        if checkLine.strip() != "PLF format appears to be correct.":
+            # the FST was kept by plf_lib.processLine
+            invalidPLF.write(invalidplfdir + "/" + timeInfo[0] + "\n")
             rmLines.write(str(lineNo) + "\n")
-        # Now convert to PLF
-        lineNo += 1
+        else:
+            provFile.write(PLFline)
+    else:
+        blankPLF.write(timeInfo[0] + "\n")
+        rmLines.write(str(lineNo) + "\n")
 
 provFile.close()
 invalidPLF.close()
@@ -0,0 +1,119 @@
+# Copyright 2014  Gaurav Kumar.   Apache 2.0
+
+# Functions shared by get_lattices.py, callhome_get_lattices.py and
+# train_get_lattices.py, which convert the lattices of the segments of each
+# line of a translation file to PLF. The scripts are run from the s5 directory
+# and load this with
+#   plf_lib = imp.load_source('plf_lib', 'local/lattice_plf_lib.py')
+
+import os
+import subprocess
+import itertools
+import multiprocessing
+
+# The settings of convertLinesToPLF(), which the worker processes inherit
+config = {}
+
+
+def latticeConcatenate(lattices, workdir):
+    '''
+    Concatenates lattices, writes temporary results to workdir.
+    The lattices are concatenated pairwise in a balanced tree, so each
+    lattice is copied O(log n) times rather than once per later segment;
+    since fstconcat appends the states of the second FST after those of the
+    first, the result is the same as concatenating them one at a time
+    '''
+    level = 0
+    while len(lattices) > 1:
+        merged = []
+        for i in range(0, len(lattices) - 1, 2):
+            mergedLattice = workdir + '/tmp.' + str(level) + '.' + str(i / 2) + '.lat'
+            proc = subprocess.Popen(['fstconcat', lattices[i], lattices[i + 1], mergedLattice])
+            proc.wait()
+            merged.append(mergedLattice)
+        if len(lattices) % 2 == 1:
+            merged.append(lattices[-1])
+        lattices = merged
+        level += 1
+    return lattices[0]
+
+
+def processLine(job):
+    '''
+    Converts the concatenated lattices of the segments of one line of the
+    translation file to PLF; this is run in the worker processes, each with
+    its own directory in tmpdir. Returns (lineNo, timeInfo, mergedTranslation,
+    PLFline, checkLine), where mergedTranslation is "" if there is no lattice
+    '''
+    lineNo, timeInfo = job
+    workdir = config['tmpdir'] + '/' + str(os.getpid())
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+
+    # For utterances that are concatenated in the translation file,
+    # the corresponding FSTs have to be translated as well
+    lattices = []
+    for timeDetail in timeInfo:
+        tmp = config['findLattice'](timeDetail)
+        if tmp != -1:
+            lattices.append(tmp)
+    if len(lattices) == 0:
+        return (lineNo, timeInfo, "", None, None)
+    # Concatenate lattices
+    mergedTranslation = latticeConcatenate(lattices, workdir)
+
+    # Sanjeev's Recipe : Remove epsilons and topo sort
+    finalFST = workdir + "/final.fst"
+    os.system("fstrmepsilon " + mergedTranslation + " | fsttopsort - " + finalFST)
+
+    # Now convert to PLF
+    proc = subprocess.Popen('/export/a04/gkumar/corpora/fishcall/bin/fsm2plf.sh ' + config['symtable'] +  ' ' + finalFST, stdout=subprocess.PIPE, shell=True)
+    PLFline = proc.stdout.readline()
+    finalPLFFile = workdir + "/final.plf"
+    finalPLF = open(finalPLFFile, "w+")
+    finalPLF.write(PLFline)
+    finalPLF.close()
+
+    # now check if this is a valid PLF, if not keep the FST so it can be
+    # checked later
+    proc = subprocess.Popen("/export/a04/gkumar/moses/mosesdecoder/checkplf < " + finalPLFFile + " 2>&1 | awk 'FNR == 2 {print}'", stdout=subprocess.PIPE, shell=True)
+    checkLine = proc.stdout.readline()
+    if checkLine.strip() != "PLF format appears to be correct.":
+        os.system("cp " + finalFST + " " + config['invalidplfdir'] + "/" + timeInfo[0])
+    return (lineNo, timeInfo, mergedTranslation, PLFline, checkLine)
+
+
+def readTranslationLines(fileList, timingDir):
+    '''
+    Yields (lineNo, timeInfo) for the lines of the translation file, i.e.
+    the lines of the timing files in timingDir of the conversations in fileList
+    '''
+    lineNo = 1
+    for item in fileList:
+        timingFile = open(timingDir + '/' + item + '.es')
+        for line in timingFile:
+            yield (lineNo, line.split())
+            lineNo += 1
+        timingFile.close()
+
+
+def convertLinesToPLF(jobs, findLattice, tmpdir, invalidplfdir, symtable, numJobs):
+    '''
+    Runs processLine() on the (lineNo, timeInfo) pairs in jobs, with numJobs
+    processes, and yields the results in order as they come in. findLattice
+    maps a time segment to its lattice file, or -1 if there is none
+    '''
+    config['findLattice'] = findLattice
+    config['tmpdir'] = tmpdir
+    config['invalidplfdir'] = invalidplfdir
+    config['symtable'] = symtable
+    if numJobs > 1:
+        # the pool is created after setting config, so the workers have it
+        pool = multiprocessing.Pool(numJobs)
+        for result in pool.imap(processLine, jobs):
+            yield result
+        pool.close()
+        pool.join()
+    else:
+        for result in itertools.imap(processLine, jobs):
+            yield result
@@ -3,7 +3,16 @@
 
 import os
 import sys
-import subprocess
+import imp
+import argparse
+
+plf_lib = imp.load_source('plf_lib', 'local/lattice_plf_lib.py')
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help = "Number of processes used to convert the lines of the "
+                    "translation file to PLF.")
+args = parser.parse_args()
 
 latticeLocation = {1:"/export/a04/gkumar/kaldi-trunk/egs/fishcall_es/j-1/latjosh-2/lattices-pushed/",
 2:"/export/a04/gkumar/kaldi-trunk/egs/fishcall_es/j-2/latjosh-2/lattices-pushed/",
@@ -24,6 +33,7 @@ for key,location in latticeLocation.iteritems():
             latticeDict[f] = str(key)
 
 tmpdir = 'data/local/data/tmp/lattmp'
+symtable = '/export/a04/gkumar/kaldi-trunk/egs/fishcall_es/j-matt/data/lang/words.clean.txt'
 if not os.path.exists(tmpdir):
     os.makedirs(tmpdir)
 invalidplfdir = 'data/local/data/tmp/invalidplf'
@@ -32,20 +42,6 @@ if not os.path.exists(invalidplfdir):
 else:
     os.system("rm " + invalidplfdir + "/*")
 
-def latticeConcatenate(lat1, lat2):
-    '''
-    Concatenates lattices, writes temporary results to tmpdir
-    '''
-    if lat1 == "":
-        if os.path.exists('rm ' + tmpdir + '/tmp.lat'):
-            os.system('rm ' + tmpdir + '/tmp.lat')
-        return lat2
-    else:
-        proc = subprocess.Popen(['fstconcat', lat1, lat2, (tmpdir + '/tmp.lat')])
-        proc.wait()
-        return tmpdir + '/tmp.lat'
-
-
 def findLattice(timeDetail):
     '''
     Finds the lattice corresponding to a time segment
@@ -69,54 +65,26 @@ for line in conversationList:
 # Now get timing information to concatenate the ASR outputs
 
 provFile = open('/export/a04/gkumar/corpora/fishcall/jack-splits/split-matt/asr.train.plf', 'w+')
-lineNo = 1
 invalidPLF = open('/export/a04/gkumar/corpora/fishcall/jack-splits/split-matt/invalidPLF', 'w+')
 blankPLF = open('/export/a04/gkumar/corpora/fishcall/jack-splits/split-matt/blankPLF', 'w+')
 rmLines = open('/export/a04/gkumar/corpora/fishcall/jack-splits/split-matt/removeLines', 'w+')
-for item in fileList:
-    timingFile = open('/export/a04/gkumar/corpora/fishcall/fisher/tim/' + item + '.es')
-    for line in timingFile:
-        timeInfo = line.split()
-
-        # For utterances that are concatenated in the translation file, 
-        # the corresponding FSTs have to be translated as well
-        mergedTranslation = ""
-        for timeDetail in timeInfo:
-            tmp = findLattice(timeDetail)
-            if tmp != -1:
-                # Concatenate lattices
-                mergedTranslation = latticeConcatenate(mergedTranslation, tmp)
-
-        if mergedTranslation != "":
-            
-            # Sanjeev's Recipe : Remove epsilons and topo sort
-            finalFST = tmpdir + "/final.fst"
-            os.system("fstrmepsilon " + mergedTranslation + " | fsttopsort - " + finalFST)
-        
-            # Now convert to PLF
-            proc = subprocess.Popen('/export/a04/gkumar/corpora/fishcall/bin/fsm2plf.sh /export/a04/gkumar/kaldi-trunk/egs/fishcall_es/j-matt/data/lang/words.clean.txt ' + finalFST, stdout=subprocess.PIPE, shell=True)
-            PLFline = proc.stdout.readline()
-            finalPLFFile = tmpdir + "/final.plf"
-            finalPLF = open(finalPLFFile, "w+")
-            finalPLF.write(PLFline)
-            finalPLF.close()
 
-            # now check if this is a valid PLF, if not write it's ID in a 
-            # file so it can be checked later
-            proc = subprocess.Popen("/export/a04/gkumar/moses/mosesdecoder/checkplf < " + finalPLFFile + " 2>&1 | awk 'FNR == 2 {print}'", stdout=subprocess.PIPE, shell=True)
-            line = proc.stdout.readline()
-            print line + " " + str(lineNo)
-            if line.strip() != "PLF format appears to be correct.":
-                os.system("cp " + finalFST + " " + invalidplfdir + "/" + timeInfo[0])
-                invalidPLF.write(invalidplfdir + "/" + timeInfo[0] + "\n")
-                rmLines.write(str(lineNo) + "\n")
-            else:
-                provFile.write(PLFline)
-        else:
-            blankPLF.write(timeInfo[0] + "\n")
+# The lines are processed in parallel, and the results are written in order
+# as they come in
+jobs = plf_lib.readTranslationLines(fileList, '/export/a04/gkumar/corpora/fishcall/fisher/tim')
+for lineNo, timeInfo, mergedTranslation, PLFline, checkLine in plf_lib.convertLinesToPLF(
+        jobs, findLattice, tmpdir, invalidplfdir, symtable, args.num_jobs):
+    if mergedTranslation != "":
+        print checkLine + " " + str(lineNo)
+        if checkLine.strip() != "PLF format appears to be correct.":
+            # the FST was kept by plf_lib.processLine
+            invalidPLF.write(invalidplfdir + "/" + timeInfo[0] + "\n")
             rmLines.write(str(lineNo) + "\n")
-        # Now convert to PLF
-        lineNo += 1
+        else:
+            provFile.write(PLFline)
+    else:
+        blankPLF.write(timeInfo[0] + "\n")
+        rmLines.write(str(lineNo) + "\n")
 
 provFile.close()
 invalidPLF.close()
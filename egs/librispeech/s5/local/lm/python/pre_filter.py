@@ -10,19 +10,31 @@ import argparse
 import re
 import sys
 
-roman_number = [re.compile('^\s*[_LXVI]+(\.)?\s*$'), ]
-
-sq_brackets = [re.compile('(.*)(\[.+\])(.*)', re.IGNORECASE)]
-
-pipes = [re.compile('^\s*\|.*\|\s*$')]
-
-non_word = [re.compile('^\W+$')]
-
-chapter = [re.compile('^\s*((Chapter)|(Volume)|(Canto)).*[LXIV0-9]+.*$', re.IGNORECASE),]
-
-contents = [re.compile('CONTENTS'),
-            re.compile('^.*((\s{2,50})|([\t]+))[0-9]+\s*$'),
-            re.compile('^\s*((I+[:.]+)|(I?[LXV]+I*([\.:])?))\s+.*')]
+def nocase(word):
+    """
+    Returns a pattern that matches 'word' ignoring the case (re.IGNORECASE
+    can't be used for a part of a pattern)
+    """
+    return ''.join('[%s%s]' % (c.upper(), c.lower()) for c in word)
+
+# The patterns that the lines are matched against. They are combined into a
+# single regex 'line_classes', in which each pattern is in a lookahead with a
+# named group, so that one match tells which of the patterns the line matches.
+line_patterns = [
+    ('roman_number', '^\s*[_LXVI]+(\.)?\s*$'),
+    ('sq_brackets', '(.*)(\[.+\])(.*)'),
+    ('pipes', '^\s*\|.*\|\s*$'),
+    ('non_word', '^\W+$'),
+    ('chapter', '^\s*((%s)|(%s)|(%s)).*[LXIVlxiv0-9]+.*$' %
+                (nocase('Chapter'), nocase('Volume'), nocase('Canto'))),
+    ('contents', '(CONTENTS)|(^.*((\s{2,50})|([\t]+))[0-9]+\s*$)|'
+                 '(^\s*((I+[:.]+)|(I?[LXV]+I*([\.:])?))\s+.*)'),
+    ]
+
+line_classes = re.compile(''.join('(?:(?=(?P<%s>%s))|)' % (name, pattern)
+                                  for name, pattern in line_patterns))
+
+sq_brackets = re.compile('(.*)(\[.+\])(.*)')
 
 debug = None
 
@@ -46,11 +58,12 @@ def debug_log(lines, idx, context=2):
         end = min(len(lines), idx + context + 1)
         sys.stderr.write('\n'.join('> %s' % l for l in lines[start:end]) + '\n\n')
 
-def match(regexes, line):
-    for r in regexes:
-        if r.match(line) is not None:
-            return True
-    return False
+def match(classes, name):
+    """
+    Tells if the line matched the pattern 'name', where 'classes' is the
+    match of 'line_classes' for the line
+    """
+    return classes.group(name) is not None
 
 def empty_lines(lines, index, extent):
     """
@@ -71,43 +84,44 @@ if __name__ == '__main__':
     opts = parse_opts()
 
     with open(opts.in_text) as in_text:
-        in_lines = [l.strip() for l in in_text.readlines()]
-
-    out_lines = list()
-    for i, l in enumerate(in_lines):
-        if len(l) == 0:
-            continue
-
-        # Roman numeral alone in a line, surrounded by empty lines
-        if match(roman_number, l) and empty_lines(in_lines, i, -1) and empty_lines(in_lines, i, 1):
-            #print 'matched roman'
-            debug_log(in_lines, i)
-            continue
-
-        if match(chapter, l) and (empty_lines(in_lines, i, -1) or empty_lines(in_lines, i, 1)):
-            #print 'matched chapter'
-            debug_log(in_lines, i)
-            continue
-
-        if match(non_word, l):
-            debug_log(in_lines, i)
-            continue
-
-        if match(contents, l):
-            #print 'matched contents'
-            debug_log(in_lines, i)
-            continue
-
-        if match(pipes, l):
-            debug_log(in_lines, i)
-            continue
-
-        if match(sq_brackets, l):
-            debug_log(in_lines, i)
-            l = sq_brackets[0].sub(r'\1\3', l)
-
-        out_lines.append(l)
+        in_lines = [l.strip() for l in in_text]
 
     with open(opts.out_text, 'w') as out_text:
-        out_text.write('\n'.join(out_lines) + '\n')
-        
\ No newline at end of file
+        n_out = 0
+        for i, l in enumerate(in_lines):
+            if len(l) == 0:
+                continue
+            classes = line_classes.match(l)
+
+            # Roman numeral alone in a line, surrounded by empty lines
+            if match(classes, 'roman_number') and empty_lines(in_lines, i, -1) and empty_lines(in_lines, i, 1):
+                #print 'matched roman'
+                debug_log(in_lines, i)
+                continue
+
+            if match(classes, 'chapter') and (empty_lines(in_lines, i, -1) or empty_lines(in_lines, i, 1)):
+                #print 'matched chapter'
+                debug_log(in_lines, i)
+                continue
+
+            if match(classes, 'non_word'):
+                debug_log(in_lines, i)
+                continue
+
+            if match(classes, 'contents'):
+                #print 'matched contents'
+                debug_log(in_lines, i)
+                continue
+
+            if match(classes, 'pipes'):
+                debug_log(in_lines, i)
+                continue
+
+            if match(classes, 'sq_brackets'):
+                debug_log(in_lines, i)
+                l = sq_brackets.sub(r'\1\3', l)
+
+            out_text.write(l + '\n')
+            n_out += 1
+        if n_out == 0:
+            out_text.write('\n')
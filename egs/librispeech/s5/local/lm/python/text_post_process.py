@@ -13,6 +13,9 @@
 import sys, argparse
 import re
 
+# The tokens that are kept
+word_re = re.compile("^[A-Z]+\'?[A-Z\']*$")
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="Post-process an .opl file into plain text")
@@ -36,7 +39,7 @@ if __name__ == '__main__':
          open(opts.out_text, 'w') as dst, \
          open(opts.sent_bounds, 'w') as bounds:
         corrections = 0
-        lines = list()
+        n_lines = 0
         current_line = list()
         sent_bounds = list()
         n_tokens = 0
@@ -54,11 +57,13 @@ if __name__ == '__main__':
                         sys.stderr.write('WARNING: Too long sentence - splitting ...\n')
                         sent_start = 0
                         while sent_start < len(current_line):
-                            lines.append(' '.join(current_line[sent_start:\
-                                                  sent_start + opts.max_sent_len]))
+                            dst.write(' '.join(current_line[sent_start:\
+                                               sent_start + opts.max_sent_len]) + '\n')
+                            n_lines += 1
                             sent_start += opts.max_sent_len
                 else:
-                    lines.append(' '.join(current_line))
+                    dst.write(' '.join(current_line) + '\n')
+                    n_lines += 1
                 current_line = list()
                 continue
             if len(opl_tokens) >= 4 and opl_tokens[3] == 'SUNDAY' and opl_tokens[1] == 'EXPN':
@@ -67,12 +72,13 @@ if __name__ == '__main__':
                 start_scan = 4
                 current_line.append('SUN')
             for i in xrange(start_scan, len(opl_tokens)):
-                m = re.match("^[A-Z]+\'?[A-Z\']*$", opl_tokens[i])
+                m = word_re.match(opl_tokens[i])
                 if m is not None:
                     n_tokens += 1
                     current_line.append(opl_tokens[i])
                 #else:
                 #    sys.stderr.write('rejected: %s\n' % opl_tokens[i])
         sys.stderr.write('Corrected tokens: %d\n' % corrections)
-        dst.write('\n'.join(lines) + '\n')
+        if n_lines == 0:
+            dst.write('\n')
         bounds.write(','.join([str(t) for t in sent_bounds]))
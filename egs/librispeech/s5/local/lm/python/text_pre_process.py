@@ -38,6 +38,9 @@ def decode(roman):
         result += -rd if rd < rd1 else rd
     return result + _rdecode[roman[-1]]
 
+chapter_re = re.compile('^(\s*C((hapter)|(HAPTER))\s+)(([IVX]+)|([ivx]+))(.*)')
+roman_re = re.compile('^(\s*)(([IVX]+)|([ivx]+))([\s\.]+[A-Z].*)')
+
 def convert_roman(text):
     """
     Uses heuristics to decide whether to convert a string that looks like a
@@ -46,12 +49,12 @@ def convert_roman(text):
     lines = re.split('\r?\n', text)
     new_lines = list()
     for i, l in enumerate(lines):
-        m = re.match('^(\s*C((hapter)|(HAPTER))\s+)(([IVX]+)|([ivx]+))(.*)', l)
+        m = chapter_re.match(l)
         if m is not None:
             new_line = "%s%s%s" % (m.group(1), decode(m.group(5).upper()), m.group(8))
             new_lines.append(new_line)
             continue
-        m = re.match('^(\s*)(([IVX]+)|([ivx]+))([\s\.]+[A-Z].*)', l)
+        m = roman_re.match(l)
         if m is not None:
             new_line = "%s%s%s" % (m.group(1), decode(m.group(2).upper()), m.group(5))
             new_lines.append(new_line)
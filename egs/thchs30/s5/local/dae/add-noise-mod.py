@@ -13,30 +13,69 @@ import math
 import struct
 import sys
 import os
+import multiprocessing
 
 try:
-  import pyximport; pyximport.install()
-  from thchs30_util import *
-except:
-  print("Cython possibly not installed, using standard python code. The process might be slow", file=sys.stderr)
-
+  import numpy as np
+  have_numpy = True
+except ImportError:
+  have_numpy = False
+
+if have_numpy:
+  # The samples are kept in int16 numpy arrays, and the noise is mixed in with
+  # array operations.  This gives the same results as the python code below.
   def energy(mat):
-    return float(sum([x * x for x in mat])) / len(mat)
+    mat = mat.astype(np.int64)
+    return float(np.dot(mat, mat)) / len(mat)
 
   def mix(mat, noise, pos, scale):
-    ret = []
     l = len(noise)
-    for i in xrange(len(mat)):
-        x = mat[i]
-        d = int(x + scale * noise[pos])
-        #if d > 32767 or d < -32768:
-        #    logging.debug('overflow occurred!')
-        d = max(min(d, 32767), -32768)
-        ret.append(d)
-        pos += 1
-        if pos == l:
-            pos = 0
-    return (pos, ret)
+    d = np.trunc(mat + scale * noise[(pos + np.arange(len(mat))) % l])
+    ret = np.clip(d, -32768, 32767).astype(np.int16)
+    return ((pos + len(mat)) % l, ret)
+
+  def concat(a, b):
+    return np.concatenate((a, b))
+
+  def samples_to_bytes(mat):
+    return mat.astype(np.int16).tobytes()
+
+  def bytes_to_samples(data):
+    return np.frombuffer(data, dtype=np.int16)
+
+else:
+  try:
+    import pyximport; pyximport.install()
+    from thchs30_util import *
+  except:
+    print("Cython possibly not installed, using standard python code. The process might be slow", file=sys.stderr)
+
+    def energy(mat):
+      return float(sum([x * x for x in mat])) / len(mat)
+
+    def mix(mat, noise, pos, scale):
+      ret = []
+      l = len(noise)
+      for i in xrange(len(mat)):
+          x = mat[i]
+          d = int(x + scale * noise[pos])
+          #if d > 32767 or d < -32768:
+          #    logging.debug('overflow occurred!')
+          d = max(min(d, 32767), -32768)
+          ret.append(d)
+          pos += 1
+          if pos == l:
+              pos = 0
+      return (pos, ret)
+
+  def concat(a, b):
+    return a + b
+
+  def samples_to_bytes(mat):
+    return struct.pack('%dh' % len(mat), *mat)
+
+  def bytes_to_samples(data):
+    return list(struct.unpack('%dh' % (len(data) // 2), data))
 
 
 def dirichlet(params):
@@ -51,7 +90,13 @@ def wave_mat(wav_filename):
     n = f.getnframes()
     ret = f.readframes(n)
     f.close()
-    return list(struct.unpack('%dh' % n, ret))
+    return bytes_to_samples(ret)
+
+def wave_num_frames(wav_filename):
+    f = wave.open(wav_filename, 'r')
+    n = f.getnframes()
+    f.close()
+    return n
 
 def num_samples(mat):
     return len(mat)
@@ -80,15 +125,49 @@ def wave_header(sample_array, sample_rate):
   return hdr
 
 
-def output(tag, mat):
-    sys.stdout.write(tag + ' ')
-    sys.stdout.write(wave_header(mat, 16000))
-    sys.stdout.write(struct.pack('%dh' % len(mat), *mat))
-
 def output_wave_file(dir, tag, mat):
     with open('%s/%s.wav' % (dir,tag), 'w') as f:
         f.write(wave_header(mat, 16000))
-        f.write(struct.pack('%dh' % len(mat), *mat))
+        f.write(samples_to_bytes(mat))
+
+# The noises, as a list of (position, samples) indexed by noise type (type 0
+# is no noise).  In each process this is set by set_noises().
+noises = None
+
+def set_noises(noise_list):
+    global noises
+    noises = noise_list
+
+# Adds the noise to one utterance.  The random choices (noise level and noise
+# type) and the position in the noise are made beforehand and in order by
+# main(), so the output does not depend on the number of jobs.  If wavdir is
+# 'NULL', returns the utterance as it is written to the standard output,
+# otherwise writes it to wavdir and returns None.
+def add_noise(fname, wav, noise_level, type, p, wavdir):
+    mat = wave_mat(wav)
+    signal = energy(mat)
+    logging.debug('signal energy: %f', signal)
+    noise = signal / (10 ** (noise_level / 10.))
+    logging.debug('noise energy: %f', noise)
+    if type == 0:
+        result = mat
+    else:
+        n = noises[type][1]
+        if p+len(mat) > len(n):
+            noise_energy = energy(concat(n[p::], n[0:len(n)-p:]))
+        else:
+            noise_energy = energy(n[p:p+len(mat):])
+        scale = math.sqrt(noise / noise_energy)
+        logging.debug('noise scale: %f', scale)
+        pos, result = mix(mat, n, p, scale)
+    if wavdir != 'NULL':
+        output_wave_file(wavdir, fname, result)
+        return None
+    else:
+        return fname + ' ' + wave_header(result, 16000) + samples_to_bytes(result)
+
+def add_noise_star(args):
+    return add_noise(*args)
 
 def main():
     parser = optparse.OptionParser()
@@ -100,57 +179,52 @@ def main():
     parser.add_option('--wav-src', type=str, help='')
     parser.add_option('--verbose', type=int, help='')
     parser.add_option('--wavdir', type=str, help='')
+    parser.add_option('--num-jobs', type=int, default=1,
+                      help='Number of processes used to add the noise')
     (args, dummy) = parser.parse_args()
     random.seed(args.seed)
     params = [float(x) for x in args.noise_prior.split(',')]
     
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
-    global noises
-    noise_energies = [0.]
-    noises = [(0, [])]
+    noise_list = [(0, [])]
     for tag, wav in scp(args.noise_src):
         logging.debug('noise wav: %s', wav)
         mat = wave_mat(wav)
         e = energy(mat)
         logging.debug('noise energy: %f', e)
-        noise_energies.append(e)
-        noises.append((0, mat))
-        
+        noise_list.append((0, mat))
+    set_noises(noise_list)
+
+    # The random choices are made here, in the order of the utterances, and
+    # the position in each noise is moved on by the length of the utterances
+    # it is added to; the noise is then added by add_noise().
+    positions = [p for (p, n) in noises]
+    jobs = []
     for tag, wav in scp(args.wav_src):
         logging.debug('wav: %s', wav)
         fname = wav.split("/")[-1].split(".")[0]
         noise_level = random.gauss(args.noise_level, args.sigma0)
         logging.debug('noise level: %f', noise_level)
-        mat = wave_mat(wav)
-        signal = energy(mat)
-        logging.debug('signal energy: %f', signal)
-        noise = signal / (10 ** (noise_level / 10.))
-        logging.debug('noise energy: %f', noise)
         type = dirichlet(params)
         logging.debug('selected type: %d', type)
-        if type == 0:
-            if args.wavdir != 'NULL':
-               output_wave_file(args.wavdir, fname, mat)
-            else:
-               output(fname, mat)
-        else:
-            p,n = noises[type]
-            if p+len(mat) > len(n):
-                noise_energies[type] = energy(n[p::]+n[0:len(n)-p:])
-            else:
-                noise_energies[type] = energy(n[p:p+len(mat):])
-            scale = math.sqrt(noise / noise_energies[type])
-            logging.debug('noise scale: %f', scale)
-            pos, result = mix(mat, n, p, scale)
-            noises[type] = (pos, n)
-            if args.wavdir != 'NULL':
-                output_wave_file(args.wavdir, fname, result)
-            else:
-                output(fname, result)
+        p = positions[type]
+        if type != 0:
+            positions[type] = (p + wave_num_frames(wav)) % len(noises[type][1])
+        jobs.append((fname, wav, noise_level, type, p, args.wavdir))
+
+    if args.num_jobs > 1:
+        pool = multiprocessing.Pool(args.num_jobs, set_noises, (noise_list,))
+        results = pool.imap(add_noise_star, jobs)
+    else:
+        pool = None
+        results = (add_noise_star(job) for job in jobs)
+    for result in results:
+        if result is not None:
+            sys.stdout.write(result)
+    if pool is not None:
+        pool.close()
+        pool.join()
 
 if __name__ == '__main__':
     main()
-
-
-
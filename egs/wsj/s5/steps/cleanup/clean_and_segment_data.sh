@@ -17,6 +17,7 @@ stage=0
 cmd=run.pl
 cleanup=true
 nj=4
+num_threads=1  # number of processes used to modify and segment the ctm-edits.
 graph_opts=
 segmentation_opts=
 
@@ -40,10 +41,14 @@ if [ $# -ne 5 ]; then
   echo "e.g. $0 data/train data/lang exp/tri3 exp/tri3_cleanup data/train_cleaned"
   echo "Options:"
   echo "  --stage <n>             # stage to run from, to enable resuming from partially"
-  echo "                          # completed run (default: 0)"
+  echo "                          # completed run (default: 0).  Note: stages 5, 6 and 7"
+  echo "                          # (modifying, tainting and segmenting the ctm-edits) are now"
+  echo "                          # done as one stage, so --stage 6 or 7 redoes all of them."
   echo "  --cmd '$cmd'            # command to submit jobs with (e.g. run.pl, queue.pl)"
   echo "  --nj <n>                # number of parallel jobs to use in graph creation and"
   echo "                          # decoding"
+  echo "  --num-threads <n>       # number of processes used to modify, taint and segment"
+  echo "                          # the ctm-edits (default: 1)"
   echo "  --segmentation-opts 'opts'  # Additional options to segment_ctm_edits.py."
   echo "                              # Please run steps/cleanup/internal/segment_ctm_edits.py"
   echo "                              # without arguments to see allowed options."
@@ -126,41 +131,29 @@ if [ $stage -le 4 ]; then
   steps/cleanup/internal/get_non_scored_words.py $lang > $dir/non_scored_words.txt
 fi
 
-if [ $stage -le 5 ]; then
-  echo "$0: modifying ctm-edits file to allow repetitions [for dysfluencies] and "
-  echo "   ... to fix reference mismatches involving non-scored words. "
-
-  $cmd $dir/log/modify_ctm_edits.log \
-    steps/cleanup/internal/modify_ctm_edits.py --verbose=3 $dir/non_scored_words.txt \
-    $dir/lattice_oracle/ctm_edits $dir/ctm_edits.modified
-
-  echo "   ... See $dir/log/modify_ctm_edits.log for details and stats, including"
-  echo " a list of commonly-repeated words."
-fi
-
-if [ $stage -le 6 ]; then
-  echo "$0: applying 'taint' markers to ctm-edits file to mark silences and"
-  echo "  ... non-scored words that are next to errors."
-  $cmd $dir/log/taint_ctm_edits.log \
-       steps/cleanup/internal/taint_ctm_edits.py $dir/ctm_edits.modified $dir/ctm_edits.tainted
-  echo "... Stats, including global cor/ins/del/sub stats, are in $dir/log/taint_ctm_edits.log."
-fi
-
-
+# Stages 5, 6 and 7 are done together by process_ctm_edits.py, which does the
+# same as running modify_ctm_edits.py, taint_ctm_edits.py and
+# segment_ctm_edits.py one after the other.
 if [ $stage -le 7 ]; then
-  echo "$0: creating segmentation from ctm-edits file."
-
-  $cmd $dir/log/segment_ctm_edits.log \
-    steps/cleanup/internal/segment_ctm_edits.py \
-       $segmentation_opts \
-       --oov-symbol-file=$lang/oov.txt \
-      --ctm-edits-out=$dir/ctm_edits.segmented \
-      --word-stats-out=$dir/word_stats.txt \
-      $dir/non_scored_words.txt \
-      $dir/ctm_edits.tainted $dir/text $dir/segments
-
-  echo "$0: contents of $dir/log/segment_ctm_edits.log are:"
-  cat $dir/log/segment_ctm_edits.log
+  if [ $stage -ge 6 ]; then
+    echo "$0: note: stages 5, 6 and 7 are now done as one stage, so the ctm-edits"
+    echo "   ... file will be modified and tainted again, as with --stage 5."
+  fi
+  echo "$0: modifying ctm-edits file to allow repetitions [for dysfluencies] and "
+  echo "   ... to fix reference mismatches involving non-scored words, "
+  echo "   ... applying 'taint' markers to mark silences and non-scored words "
+  echo "   ... that are next to errors, and creating segmentation from the ctm-edits file."
+
+  $cmd --num-threads $num_threads $dir/log/process_ctm_edits.log \
+    steps/cleanup/internal/process_ctm_edits.py --num-jobs=$num_threads \
+      --modify-opts="--verbose=3" \
+      --segmentation-opts="$segmentation_opts --oov-symbol-file=$lang/oov.txt --ctm-edits-out=$dir/ctm_edits.segmented --word-stats-out=$dir/word_stats.txt" \
+      --ctm-edits-modified-out=$dir/ctm_edits.modified \
+      --ctm-edits-tainted-out=$dir/ctm_edits.tainted \
+      $dir/non_scored_words.txt $dir/lattice_oracle/ctm_edits $dir/text $dir/segments
+
+  echo "$0: contents of $dir/log/process_ctm_edits.log are:"
+  cat $dir/log/process_ctm_edits.log
   echo "For word-level statistics on p(not-being-in-a-segment), with 'worst' words at the top,"
   echo "see $dir/word_stats.txt"
   echo "For detailed utterance-level debugging information, see $dir/ctm_edits.segmented"
@@ -7,7 +7,19 @@ from __future__ import print_function
 import sys
 import argparse
 import math
+import itertools
+import multiprocessing
 from collections import defaultdict
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import numpy as np
+    have_numpy = True
+except ImportError:
+    have_numpy = False
 
 parser = argparse.ArgumentParser(description="""
 This script creates a biased language model suitable for alignment and
@@ -36,6 +48,16 @@ parser.add_argument("--discounting-constant", type = float, default = 0.3,
                     help = "Discounting constant D for standard (unmodified) Kneser-Ney; "
                     "must be strictly between 0 and 1.  A value closer to 0 will give "
                     "you a more-strongly-biased LM.")
+parser.add_argument("--batch", type = str, default = "false",
+                    choices = ["true", "false"],
+                    help = "If true, each input line is preceded by an utterance-group "
+                    "id, and we make a separate LM from each run of lines with the same "
+                    "id; the LMs are written to the standard output as a Kaldi text-form "
+                    "archive of FSTs, indexed by the group ids.  Each FST is the same "
+                    "as running this program without --batch on that group's lines.")
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help = "Number of processes used to make the LMs in parallel "
+                    "(only relevant if --batch=true).")
 parser.add_argument("--verbose", type = int, default = 0,
                     choices=[0,1,2,3,4,5], help = "Verbose level")
 
@@ -105,12 +127,10 @@ class NgramCounts:
             history = tuple(words[history_start:n])
             self.AddCount(history, predicted_word, 1.0)
 
-    def AddRawCountsFromStandardInput(self):
+    # 'lines' is an iterable of lines of integerized text, e.g. sys.stdin.
+    def AddRawCountsFromLines(self, lines):
         lines_processed = 0
-        while True:
-            line = sys.stdin.readline()
-            if line == '':
-                break
+        for line in lines:
             self.AddRawCountsFromLine(line)
             lines_processed += 1
         if lines_processed == 0 or args.verbose > 0:
@@ -194,29 +214,14 @@ class NgramCounts:
         print('total count = {0}, excluding discount = {1}'.format(
                 total, total_excluding_backoff), file = sys.stderr)
 
-    def AddTopWords(self, top_words_file):
+    # 'top_words' is a list of (word, prob) pairs, as returned by
+    # ReadTopWords().
+    def AddTopWords(self, top_words):
         empty_history = ()
         word_to_count = self.counts[0][empty_history]
         total = sum(word_to_count.values())
-        try:
-            f = open(top_words_file)
-        except:
-            sys.exit("make_one_biased_lm.py: error opening top-words file: "
-                     "--top-words=" + top_words_file)
-        while True:
-            line = f.readline()
-            if line == '':
-                break
-            try:
-                [ word_index, prob ] = line.split()
-                word_index = int(word_index)
-                prob = float(prob)
-                assert word_index > 0 and prob > 0.0
-                word_to_count[word_index] += prob * total
-            except Exception as e:
-                sys.exit("make_one_biased_lm.py: could not make sense of the "
-                         "line '{0}' in op-words file: {1} ".format(line, str(e)))
-        f.close()
+        for word_index, prob in top_words:
+            word_to_count[word_index] += prob * total
 
 
     def GetTotalCountMap(self):
@@ -250,7 +255,7 @@ class NgramCounts:
         return prob
 
     # This function prints the estimated language model as an FST.
-    def PrintAsFst(self, word_disambig_symbol):
+    def PrintAsFst(self, word_disambig_symbol, out = sys.stdout):
         # n is the history-length (== order + 1).  We iterate over the
         # history-length in the order 1, 0, 2, 3, and then iterate over the
         # histories of each order in sorted order.  Putting order 1 first
@@ -280,34 +285,451 @@ class NgramCounts:
                             next_hist = next_hist[1:]
                         next_fst_state = hist_to_state[next_hist]
                         print(this_fst_state, next_fst_state, word, word,
-                              this_cost)
+                              this_cost, file = out)
                     elif word == self.eos_symbol:
                         # print final-prob for this state.
-                        print(this_fst_state, this_cost)
+                        print(this_fst_state, this_cost, file = out)
                     else:
                         assert word == self.backoff_symbol
                         backoff_fst_state = hist_to_state[hist[1:len(hist)]]
                         print(this_fst_state, backoff_fst_state,
-                              word_disambig_symbol, 0, this_cost)
-
-
-ngram_counts = NgramCounts(args.ngram_order)
-ngram_counts.AddRawCountsFromStandardInput()
-
-if args.verbose >= 3:
-    ngram_counts.Print("Raw counts:")
-ngram_counts.CompletelyDiscountLowCountStates(args.min_lm_state_count)
-if args.verbose >= 3:
-    ngram_counts.Print("Counts after discounting low-count states:")
-ngram_counts.ApplyBackoff(args.discounting_constant)
-if args.verbose >= 3:
-    ngram_counts.Print("Counts after applying Kneser-Ney discounting:")
-if args.top_words != None:
-    ngram_counts.AddTopWords(args.top_words)
+                              word_disambig_symbol, 0, this_cost, file = out)
+
+
+
+class ArrayNgramCounts:
+    ## This class does the same job as class NgramCounts, but it stores the
+    ## counts in sorted numpy arrays instead of dicts, and does the backoff,
+    ## the probability computation and the FST printing with vectorized numpy
+    ## operations, which uses much less memory and is a lot faster.  It's used
+    ## if numpy is available.  The FST it prints is equivalent to the one
+    ## printed by class NgramCounts, but the states are numbered in the
+    ## sorted order of their histories rather than in dict order, so the
+    ## state numbers and the order of the lines differ.
+    ##
+    ## A note on data-structure.  Symbols are converted to non-negative ids
+    ## by subtracting self.bos_symbol, so <s>, </s> and the backoff symbol are
+    ## 0, 1 and 2 respectively, and word w is w + 3.  For each history-length
+    ## n we store all histories of that length that occur in the data (whether
+    ## or not they are history-states of the LM) as a sorted array of keys
+    ## self.hist_keys[n], where the key of a history is
+    ## prefix_id * self.vocab_size + last_id; prefix_id is the index in
+    ## self.hist_keys[n-1] of the history minus its last word.  So the history
+    ## (5, 6, 7) is identified by its index in self.hist_keys[3].
+    ## self.hist_backoff[n] gives, for each history of length n, the index in
+    ## self.hist_keys[n-1] of the history it backs off to (e.g. (6, 7)).
+    ## The n-gram counts for history-length n are stored as a sorted array of
+    ## keys self.ngram_keys[n], where the key of the n-gram hist -> word is
+    ## hist_id * self.vocab_size + word_id, and an array of float counts
+    ## self.ngram_counts[n].  A history is a history-state of the LM if it has
+    ## any counts.
+    def __init__(self, ngram_order):
+        self.ngram_order = ngram_order
+        # see the comments in class NgramCounts.
+        self.bos_symbol = -3
+        self.eos_symbol = -2
+        self.backoff_symbol = -1
+        self.backoff_id = self.backoff_symbol - self.bos_symbol
+        self.vocab_size = 0
+        self.hist_keys = []
+        self.hist_backoff = []
+        self.ngram_keys = []
+        self.ngram_counts = []
+
+    # This function reads 'lines' of integerized text (e.g. sys.stdin) and
+    # sets up the history tables and the raw n-gram counts.
+    def AddRawCountsFromLines(self, lines):
+        lines_processed = 0
+        # 'ids' is the concatenated sequences of symbol-ids, with <s> and </s>
+        # added, and 'positions' is the position of each one in its sequence.
+        ids = []
+        positions = []
+        for line in lines:
+            try:
+                words = [self.bos_symbol] + [ int(x) for x in line.split() ] + [self.eos_symbol]
+            except:
+                sys.exit("make_one_biased_lm.py: bad input line {0} (expected a sequence "
+                         "of integers)".format(line))
+            ids.extend([ word - self.bos_symbol for word in words ])
+            positions.extend(range(len(words)))
+            lines_processed += 1
+        if lines_processed == 0 or args.verbose > 0:
+            print("make_one_biased_lm.py: processed {0} lines of input".format(
+                    lines_processed), file = sys.stderr)
+
+        ids = np.array(ids, dtype = np.int64)
+        positions = np.array(positions, dtype = np.int64)
+        self.vocab_size = int(ids.max()) + 1 if len(ids) > 0 else self.backoff_id + 1
+        V = self.vocab_size
+
+        # hist_index[i] is the index in self.hist_keys[n] of the history of
+        # length n that precedes position i, or -1 if position i is less than
+        # n words into its sequence.
+        hist_index = np.zeros(len(ids), dtype = np.int64)
+        for n in range(self.ngram_order):
+            if n == 0:
+                self.hist_keys.append(np.zeros(1, dtype = np.int64))
+                self.hist_backoff.append(np.zeros(0, dtype = np.int64))
+            else:
+                valid = positions >= n
+                keys = np.full(len(ids), -1, dtype = np.int64)
+                keys[1:] = hist_index[:-1] * V + ids[:-1]
+                hist_keys, inverse = np.unique(keys[valid], return_inverse = True)
+                hist_index = np.full(len(ids), -1, dtype = np.int64)
+                hist_index[valid] = inverse
+                self.hist_keys.append(hist_keys)
+                if n == 1:
+                    self.hist_backoff.append(np.zeros(len(hist_keys), dtype = np.int64))
+                else:
+                    # the history (5, 6, 7) backs off to (6, 7), which is the
+                    # history that (5, 6) backs off to, plus 7.
+                    self.hist_backoff.append(self.FindKeys(
+                            self.hist_keys[n-1], self.GetBackoffKeys(n-1, hist_keys)))
+
+            # raw counts are only added for the longest history available.
+            this_order = (positions >= 1) & (np.minimum(positions, self.ngram_order - 1) == n)
+            keys, counts = np.unique(hist_index[this_order] * V + ids[this_order],
+                                     return_counts = True)
+            self.ngram_keys.append(keys)
+            self.ngram_counts.append(counts.astype(np.float64))
+
+    # Returns the indexes of 'keys' in the sorted array 'sorted_keys'; all of
+    # them must be present.
+    def FindKeys(self, sorted_keys, keys):
+        indexes = np.searchsorted(sorted_keys, keys)
+        assert np.all(sorted_keys[np.minimum(indexes, len(sorted_keys) - 1)] == keys)
+        return indexes
+
+    # Adds the counts 'counts' for the n-grams 'keys' to history-length n,
+    # merging them with any existing counts for the same n-grams.
+    def AddCounts(self, n, keys, counts):
+        keys, inverse = np.unique(np.concatenate((self.ngram_keys[n], keys)),
+                                  return_inverse = True)
+        # (note: np.bincount() returns integers if there are no counts).
+        self.ngram_counts[n] = np.bincount(
+            inverse, weights = np.concatenate((self.ngram_counts[n], counts)),
+            minlength = len(keys)).astype(np.float64)
+        self.ngram_keys[n] = keys
+
+    # Returns the total count of each history of length n (zero for
+    # histories that are not history-states).
+    def GetTotalCounts(self, n):
+        return np.bincount(self.ngram_keys[n] // self.vocab_size,
+                           weights = self.ngram_counts[n],
+                           minlength = len(self.hist_keys[n]))
+
+    # Converts the keys of n-grams (or histories) of history-length n into
+    # the keys of the n-grams they back off to, of history-length n-1.
+    def GetBackoffKeys(self, n, keys):
+        V = self.vocab_size
+        return self.hist_backoff[n][keys // V] * V + keys % V
+
+    # Returns the history with index 'hist_id' in self.hist_keys[n], as a
+    # tuple of integers; used in debugging output.
+    def GetHistTuple(self, n, hist_id):
+        ans = ()
+        while n > 0:
+            key = int(self.hist_keys[n][hist_id])
+            ans = (key % self.vocab_size + self.bos_symbol,) + ans
+            hist_id = key // self.vocab_size
+            n -= 1
+        return ans
+
+    # See the same-named function in class NgramCounts.
+    def CompletelyDiscountLowCountStates(self, min_count):
+        # hist_to_total_count[n] is the total count of each history of length
+        # n, plus all the history-states of length >= 2 which back off to it.
+        hist_to_total_count = [ None ] * self.ngram_order
+        for n in reversed(range(2, self.ngram_order)):
+            hist_to_total_count[n] = self.GetTotalCounts(n)
+            if n + 1 < self.ngram_order:
+                hist_to_total_count[n] += np.bincount(
+                    self.hist_backoff[n+1], weights = hist_to_total_count[n+1],
+                    minlength = len(self.hist_keys[n]))
+        for n in reversed(range(2, self.ngram_order)):
+            keys = self.ngram_keys[n]
+            discount = hist_to_total_count[n][keys // self.vocab_size] < min_count
+            # we need to completely back off these counts.
+            self.AddCounts(n - 1, self.GetBackoffKeys(n, keys[discount]),
+                           self.ngram_counts[n][discount])
+            self.ngram_keys[n] = keys[~discount]
+            self.ngram_counts[n] = self.ngram_counts[n][~discount]
+
+    # See the same-named function in class NgramCounts.
+    def ApplyBackoff(self, D):
+        assert D > 0.0 and D < 1.0
+        V = self.vocab_size
+        for n in reversed(range(1, self.ngram_order)):
+            keys = self.ngram_keys[n]
+            assert np.all(self.ngram_counts[n] >= 1.0)
+            self.ngram_counts[n] -= D
+            hist_ids, num_words = np.unique(keys // V, return_counts = True)
+            self.AddCounts(n, hist_ids * V + self.backoff_id, num_words * D)
+            # Interpret the following line as incrementing the count-of-counts
+            # for the next-lower order.
+            self.AddCounts(n - 1, self.GetBackoffKeys(n, keys),
+                           np.ones(len(keys)))
+
+    # See the same-named function in class NgramCounts.
+    def Print(self, info_string):
+        print(info_string, file=sys.stderr)
+        total = 0.0
+        total_excluding_backoff = 0.0
+        for n in range(self.ngram_order):
+            keys = self.ngram_keys[n].tolist()
+            counts = self.ngram_counts[n].tolist()
+            # the keys are sorted, so the n-grams of each history are together.
+            for hist_id, group in itertools.groupby(zip(keys, counts),
+                                                    lambda x: x[0] // self.vocab_size):
+                word_to_count = dict([ (key % self.vocab_size + self.bos_symbol, count)
+                                       for key, count in group ])
+                this_total_count = sum(word_to_count.values())
+                print(str(self.GetHistTuple(n, hist_id)) +
+                      ': total={0} '.format(this_total_count), end='', file=sys.stderr)
+                print(' '.join(['{0} -> {1} '.format(word, count)
+                                for word, count in word_to_count.items() ]),
+                      file = sys.stderr)
+                total += this_total_count
+                total_excluding_backoff += this_total_count
+                if self.backoff_symbol in word_to_count:
+                    total_excluding_backoff -= word_to_count[self.backoff_symbol]
+        print('total count = {0}, excluding discount = {1}'.format(
+                total, total_excluding_backoff), file = sys.stderr)
+
+    # See the same-named function in class NgramCounts.
+    def AddTopWords(self, top_words):
+        if len(top_words) == 0:
+            return
+        total = self.ngram_counts[0].sum()
+        # the history-id of the empty history is 0, so the key of the unigram
+        # is just the word-id.
+        word_ids = np.array([ word_index - self.bos_symbol for word_index, prob in top_words ],
+                            dtype = np.int64)
+        probs = np.array([ prob for word_index, prob in top_words ])
+        if word_ids.max() >= self.vocab_size:
+            self.SetVocabSize(int(word_ids.max()) + 1)
+        self.AddCounts(0, word_ids, probs * total)
+
+    # Changes self.vocab_size, re-encoding the keys; this doesn't change their
+    # order.
+    def SetVocabSize(self, vocab_size):
+        for keys in self.hist_keys[1:] + self.ngram_keys:
+            keys[:] = (keys // self.vocab_size) * vocab_size + keys % self.vocab_size
+        self.vocab_size = vocab_size
+
+    # Returns a list, indexed by history-length, of the probability of each
+    # n-gram in self.ngram_keys (for the backoff symbol, the backoff prob).
+    def GetProbs(self):
+        V = self.vocab_size
+        probs = []
+        for n in range(self.ngram_order):
+            keys = self.ngram_keys[n]
+            hist_ids = keys // V
+            total_counts = self.GetTotalCounts(n)
+            prob = self.ngram_counts[n] / total_counts[hist_ids]
+            if n > 0:
+                backoff_counts = np.zeros(len(self.hist_keys[n]))
+                is_backoff = (keys % V == self.backoff_id)
+                backoff_counts[hist_ids[is_backoff]] = self.ngram_counts[n][is_backoff]
+                backoff_prob = backoff_counts[hist_ids] / total_counts[hist_ids]
+                prob_in_backoff = probs[n-1][self.FindKeys(
+                        self.ngram_keys[n-1], self.GetBackoffKeys(n, keys[~is_backoff]))]
+                prob[~is_backoff] += backoff_prob[~is_backoff] * prob_in_backoff
+            probs.append(prob)
+        return probs
+
+    # This function prints the estimated language model as an FST; see the
+    # same-named function in class NgramCounts.
+    def PrintAsFst(self, word_disambig_symbol, out = sys.stdout):
+        V = self.vocab_size
+        # hist_to_state[n] maps from the index of a history of length n to its
+        # FST-state, or -1 if it is not a history-state.
+        hist_to_state = []
+        fst_state_counter = 0
+        for n in range(self.ngram_order):
+            states = np.unique(self.ngram_keys[n] // V)
+            hist_to_state.append(np.full(len(self.hist_keys[n]), -1, dtype = np.int64))
+            hist_to_state[n][states] = np.arange(fst_state_counter,
+                                                 fst_state_counter + len(states))
+            fst_state_counter += len(states)
+
+        probs = self.GetProbs()
+
+        # Printing states in the order of their histories' keys ensures
+        # that the bigram state with <s> as the left context comes first.
+        # (note: the state numbering is not the same as in class NgramCounts,
+        # which numbers states in dict order, but the FST is equivalent).
+        for n in [ 1, 0 ] + range(2, self.ngram_order):
+            keys = self.ngram_keys[n]
+            hist_ids = keys // V
+            word_ids = keys % V
+            # work out the costs.  Costs in OpenFst are negative logs.
+            costs = -np.log(probs[n])
+
+            # work out the destination state of the arc for each word, by
+            # finding the longest history-state that is a suffix of the
+            # history plus the word.
+            next_states = np.full(len(keys), -1, dtype = np.int64)
+            this_hist_ids = hist_ids
+            for m in reversed(range(n + 1)):
+                if m + 1 < self.ngram_order:
+                    # look for the history of length m + 1.
+                    next_keys = this_hist_ids * V + word_ids
+                    next_hist_keys = self.hist_keys[m+1]
+                    indexes = np.minimum(np.searchsorted(next_hist_keys, next_keys),
+                                         len(next_hist_keys) - 1)
+                    found = ((next_states == -1) & (next_hist_keys[indexes] == next_keys))
+                    next_states[found] = hist_to_state[m+1][indexes[found]]
+                if m > 0:
+                    this_hist_ids = self.hist_backoff[m][this_hist_ids]
+            next_states[next_states == -1] = hist_to_state[0][0]
+
+            this_states = hist_to_state[n][hist_ids]
+            backoff_states = (hist_to_state[n-1][self.hist_backoff[n][hist_ids]]
+                              if n > 0 else this_states)
+            # we build the lines as strings and print them all at once, as
+            # calling print() for each arc is slow.
+            lines = []
+            for this_fst_state, next_fst_state, backoff_fst_state, word_id, this_cost in zip(
+                this_states.tolist(), next_states.tolist(), backoff_states.tolist(),
+                word_ids.tolist(), costs.tolist()):
+                word = word_id + self.bos_symbol
+                if word > 0: # a real word.
+                    lines.append('{0} {1} {2} {2} {3}'.format(
+                            this_fst_state, next_fst_state, word, this_cost))
+                elif word == self.eos_symbol:
+                    # final-prob for this state.
+                    lines.append('{0} {1}'.format(this_fst_state, this_cost))
+                else:
+                    assert word == self.backoff_symbol
+                    lines.append('{0} {1} {2} 0 {3}'.format(
+                            this_fst_state, backoff_fst_state, word_disambig_symbol,
+                            this_cost))
+            if len(lines) > 0:
+                print('\n'.join(lines), file = out)
+
+
+# Reads the --top-words file and returns a list of (word, prob) pairs.
+def ReadTopWords(top_words_file):
+    ans = []
+    try:
+        f = open(top_words_file)
+    except:
+        sys.exit("make_one_biased_lm.py: error opening top-words file: "
+                 "--top-words=" + top_words_file)
+    while True:
+        line = f.readline()
+        if line == '':
+            break
+        try:
+            [ word_index, prob ] = line.split()
+            word_index = int(word_index)
+            prob = float(prob)
+            assert word_index > 0 and prob > 0.0
+            ans.append((word_index, prob))
+        except Exception as e:
+            sys.exit("make_one_biased_lm.py: could not make sense of the "
+                     "line '{0}' in op-words file: {1} ".format(line, str(e)))
+    f.close()
+    return ans
+
+
+# Makes the biased LM from 'lines' of integerized text and prints it as an FST
+# to 'out'.  'top_words' is as returned by ReadTopWords(), or None.
+def MakeBiasedLm(lines, top_words, out = sys.stdout):
+    if have_numpy:
+        ngram_counts = ArrayNgramCounts(args.ngram_order)
+    else:
+        ngram_counts = NgramCounts(args.ngram_order)
+    ngram_counts.AddRawCountsFromLines(lines)
+
+    if args.verbose >= 3:
+        ngram_counts.Print("Raw counts:")
+    ngram_counts.CompletelyDiscountLowCountStates(args.min_lm_state_count)
     if args.verbose >= 3:
-        ngram_counts.Print("Counts after applying top-n-words")
-ngram_counts.PrintAsFst(args.word_disambig_symbol)
+        ngram_counts.Print("Counts after discounting low-count states:")
+    ngram_counts.ApplyBackoff(args.discounting_constant)
+    if args.verbose >= 3:
+        ngram_counts.Print("Counts after applying Kneser-Ney discounting:")
+    if top_words != None:
+        ngram_counts.AddTopWords(top_words)
+        if args.verbose >= 3:
+            ngram_counts.Print("Counts after applying top-n-words")
+    ngram_counts.PrintAsFst(args.word_disambig_symbol, out)
+
+
+# This function is used in batch mode.  It reads lines of the form
+# '<group-id> <integerized text>' from the standard input, and yields
+# (group-id, list-of-lines) pairs for each run of lines with the same group-id.
+def ReadGroupsFromStandardInput():
+    group_id = None
+    group_lines = []
+    for line in sys.stdin:
+        a = line.split(None, 1)
+        if len(a) == 0:
+            sys.exit("make_one_biased_lm.py: empty input line in batch mode")
+        if a[0] != group_id:
+            if group_id != None:
+                yield (group_id, group_lines)
+            group_id = a[0]
+            group_lines = []
+        group_lines.append(a[1] if len(a) > 1 else '')
+    if group_id != None:
+        yield (group_id, group_lines)
+
+
+# Makes the biased LM for one group, as returned by
+# ReadGroupsFromStandardInput(), and returns (group-id, FST-as-text).  This
+# is called in the worker processes in batch mode.
+def MakeBiasedLmForGroup(group):
+    (group_id, lines) = group
+    out = StringIO()
+    try:
+        MakeBiasedLm(lines, top_words, out)
+    except SystemExit as e:
+        # sys.exit() would kill the worker process without telling the
+        # parent, so turn it into an exception.
+        raise Exception("error making LM for {0}: {1}".format(group_id, str(e)))
+    return (group_id, out.getvalue())
+
+
+# the top words are only read once, even in batch mode; the worker processes
+# inherit them.
+top_words = (ReadTopWords(args.top_words) if args.top_words != None else None)
+
+if args.batch == "true":
+    if args.num_jobs > 1:
+        pool = multiprocessing.Pool(args.num_jobs)
+        map_function = pool.imap
+    else:
+        map_function = itertools.imap if hasattr(itertools, 'imap') else map
+    groups = ReadGroupsFromStandardInput()
+    num_groups = 0
+    while True:
+        # we process the groups in chunks so that we don't read the whole
+        # input into memory.
+        chunk = list(itertools.islice(groups, max(args.num_jobs, 1) * 20))
+        if len(chunk) == 0:
+            break
+        try:
+            for group_id, fst in map_function(MakeBiasedLmForGroup, chunk):
+                # write the FST in the Kaldi text-form archive format; the blank
+                # line terminates the FST.
+                sys.stdout.write(group_id + '\n' + fst + '\n')
+                num_groups += 1
+        except Exception as e:
+            sys.exit("make_one_biased_lm.py: " + str(e))
+        sys.stdout.flush()
+    if args.num_jobs > 1:
+        pool.close()
+        pool.join()
+    if args.verbose >= 1:
+        print("make_one_biased_lm.py: made LMs for {0} utterance groups".format(
+                num_groups), file = sys.stderr)
+else:
+    MakeBiasedLm(sys.stdin, top_words)
 
 
 # test comand:
 # (echo 6 7 8 4; echo 7 8 9; echo 7 8) | ./make_one_biased_lm.py --word-disambig-symbol=1000 --min-lm-state-count=2 --verbose=3 --top-words=<(echo 1 0.5; echo 2 0.25)
+# (echo g1 6 7 8 4; echo g1 7 8 9; echo g2 7 8) | ./make_one_biased_lm.py --word-disambig-symbol=1000 --batch=true --num-jobs=2
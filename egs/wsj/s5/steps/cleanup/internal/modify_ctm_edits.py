@@ -85,7 +85,10 @@ parser.add_argument("ctm_edits_out", metavar = "<ctm-edits-out>",
                     help = "Filename of output ctm-edits file. "
                     "Use /dev/stdout for standard output.")
 
-args = parser.parse_args()
+# 'args' is set by the code at the bottom of this script; when this script is
+# loaded as a module by steps/cleanup/internal/process_ctm_edits.py, that
+# script sets it instead.
+args = None
 
 
 
@@ -409,7 +412,6 @@ def PrintRepetitionStats():
 
 
 non_scored_words = set()
-ReadNonScoredWords(args.non_scored_words_in)
 
 num_lines = 0
 num_correct_lines = 0
@@ -423,6 +425,9 @@ ref_change_stats = defaultdict(int)
 # in allowing repetitions.
 repetition_stats = defaultdict(int)
 
-ProcessData()
-PrintNonScoredStats()
-PrintRepetitionStats()
+if __name__ == "__main__":
+    args = parser.parse_args()
+    ReadNonScoredWords(args.non_scored_words_in)
+    ProcessData()
+    PrintNonScoredStats()
+    PrintRepetitionStats()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+# Apache 2.0
+
+from __future__ import print_function
+import sys, argparse, imp, shlex, multiprocessing
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+# This script does the same as running, one after the other,
+# steps/cleanup/internal/modify_ctm_edits.py,
+# steps/cleanup/internal/taint_ctm_edits.py and
+# steps/cleanup/internal/segment_ctm_edits.py, but in a single pass over the
+# ctm-edits: each utterance is parsed once, and goes through the three
+# stages in memory (the functions ProcessUtterance() of modify_ctm_edits.py
+# and taint_ctm_edits.py, and GetSegmentsForUtterance() of
+# segment_ctm_edits.py, are used for this).  The utterances are independent,
+# so they are processed by a pool of --num-jobs processes; the statistics that
+# the three scripts print at the end are accumulated over the processes.
+#
+# The intermediate ctm-edits files that would be produced by
+# modify_ctm_edits.py and taint_ctm_edits.py can optionally be written with
+# --ctm-edits-modified-out and --ctm-edits-tainted-out.
+#
+# This script must be run from the egs directory (e.g. egs/wsj/s5), as it
+# loads the scripts above from steps/cleanup/internal.
+
+modify_lib = imp.load_source('modify_ctm_edits', 'steps/cleanup/internal/modify_ctm_edits.py')
+taint_lib = imp.load_source('taint_ctm_edits', 'steps/cleanup/internal/taint_ctm_edits.py')
+segment_lib = imp.load_source('segment_ctm_edits', 'steps/cleanup/internal/segment_ctm_edits.py')
+
+
+parser = argparse.ArgumentParser(
+    description = "This program does the same as modify_ctm_edits.py, taint_ctm_edits.py "
+    "and segment_ctm_edits.py (in steps/cleanup/internal) run one after the other, "
+    "but parses the ctm-edits input only once and processes the utterances with "
+    "multiple processes.  It must be run from the egs directory.")
+
+parser.add_argument("--modify-opts", type = str, default = "",
+                    help = "Options to modify_ctm_edits.py, e.g. '--verbose=3 "
+                    "--allow-repetitions=false'")
+parser.add_argument("--taint-opts", type = str, default = "",
+                    help = "Options to taint_ctm_edits.py, e.g. '--verbose=0'")
+parser.add_argument("--segmentation-opts", type = str, default = "",
+                    help = "Options to segment_ctm_edits.py, e.g. '--oov-symbol-file=data/lang/oov.txt "
+                    "--ctm-edits-out=exp/cleanup/ctm_edits.segmented'")
+parser.add_argument("--ctm-edits-modified-out", type = str, default = None,
+                    help = "If specified, the ctm-edits as modified by modify_ctm_edits.py "
+                    "are written to this file.")
+parser.add_argument("--ctm-edits-tainted-out", type = str, default = None,
+                    help = "If specified, the ctm-edits as modified by taint_ctm_edits.py "
+                    "are written to this file.")
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help = "Number of processes used to process the utterances.")
+parser.add_argument("--utterances-per-chunk", type = int, default = 200,
+                    help = "Number of utterances given to a process at a time.")
+parser.add_argument("non_scored_words_in", metavar = "<non-scored-words-file>",
+                    help="Filename of file containing a list of non-scored words, "
+                    "one per line. See steps/cleanup/internal/get_non_scored_words.py.")
+parser.add_argument("ctm_edits_in", metavar = "<ctm-edits-in>",
+                    help = "Filename of input ctm-edits file, as produced by "
+                    "steps/cleanup/internal/get_ctm_edits.py. "
+                    "Use /dev/stdin for standard input.")
+parser.add_argument("text_out", metavar = "<text-out>",
+                    help = "Filename of output text file; see segment_ctm_edits.py.")
+parser.add_argument("segments_out", metavar = "<segments-out>",
+                    help = "Filename of output segments; see segment_ctm_edits.py.")
+
+args = parser.parse_args()
+
+if args.num_jobs < 1 or args.utterances_per_chunk < 1:
+    sys.exit("process_ctm_edits.py: --num-jobs and --utterances-per-chunk must be positive.")
+
+
+# The options of the three scripts are parsed with their own parsers; the
+# filenames of their outputs that are not used are given as /dev/null.
+def ParseOptionsForLib(lib, opts, positional_args):
+    try:
+        return lib.parser.parse_args(shlex.split(opts) + positional_args)
+    except SystemExit:
+        sys.exit("process_ctm_edits.py: bad options '{0}' for {1}".format(
+                opts, lib.__file__))
+
+modify_lib.args = ParseOptionsForLib(modify_lib, args.modify_opts,
+                                     [ args.non_scored_words_in, args.ctm_edits_in, '/dev/null' ])
+taint_lib.args = ParseOptionsForLib(taint_lib, args.taint_opts,
+                                    [ args.ctm_edits_in, '/dev/null' ])
+segment_lib.args = ParseOptionsForLib(segment_lib, args.segmentation_opts,
+                                      [ args.non_scored_words_in, args.ctm_edits_in,
+                                        args.text_out, args.segments_out ])
+modify_lib.ReadNonScoredWords(args.non_scored_words_in)
+segment_lib.ReadNonScoredWords(args.non_scored_words_in)
+segment_lib.ReadOovSymbol()
+
+
+# These are the names of the global variables in which each of the scripts
+# accumulates statistics.  They are ints or floats, or dicts whose values are
+# ints or floats or lists of ints.
+stats_names = [ (modify_lib, [ 'num_lines', 'num_correct_lines',
+                               'ref_change_stats', 'repetition_stats' ]),
+                (taint_lib, [ 'num_lines_of_type', 'num_tainted_lines',
+                              'num_del_lines_giving_taint', 'num_sub_lines_giving_taint',
+                              'num_ins_lines_giving_taint' ]),
+                (segment_lib, [ 'segment_total_length', 'num_segments', 'word_count_pair',
+                                'num_utterances', 'num_utterances_without_segments',
+                                'total_length_of_utterances' ]) ]
+
+# This function returns the statistics accumulated by the scripts since the
+# last call, as a list of lists of values (with dicts converted to plain dicts
+# so that they can be passed between processes), and resets them.
+def GetAndResetStats():
+    ans = []
+    for (lib, names) in stats_names:
+        values = []
+        for name in names:
+            value = getattr(lib, name)
+            if isinstance(value, dict):
+                values.append(dict(value))
+                value.clear()
+            else:
+                values.append(value)
+                setattr(lib, name, 0)
+        ans.append(values)
+    return ans
+
+# This function adds the statistics 'stats' (as returned by GetAndResetStats())
+# to 'total_stats', which has the same format.
+def AddStats(stats, total_stats):
+    for (values, total_values) in zip(stats, total_stats):
+        for i in range(len(values)):
+            if isinstance(values[i], dict):
+                for key, value in values[i].items():
+                    if key not in total_values[i]:
+                        total_values[i][key] = value
+                    elif isinstance(value, list):
+                        total_values[i][key] = [ x + y for x, y in zip(total_values[i][key], value) ]
+                    else:
+                        total_values[i][key] += value
+            else:
+                total_values[i] += values[i]
+
+# This function sets the statistics of the scripts to 'total_stats', so that
+# their functions that print the statistics can be used.
+def SetStats(total_stats):
+    for ((lib, names), values) in zip(stats_names, total_stats):
+        for (name, value) in zip(names, values):
+            if isinstance(value, dict):
+                getattr(lib, name).update(value)
+            else:
+                setattr(lib, name, value)
+
+
+# This function processes a chunk of utterances, given as a list of lists of
+# the lines of each utterance.  It returns a tuple
+# (text, segments, ctm_edits_modified, ctm_edits_tainted, ctm_edits_segmented, stats)
+# where the first five elements are the text to be written to the corresponding
+# outputs (or None for the outputs that are not required) and 'stats' are the
+# statistics accumulated for the chunk, as returned by GetAndResetStats().
+def ProcessChunk(chunk):
+    text_handle = StringIO()
+    segments_handle = StringIO()
+    modified_handle = StringIO() if args.ctm_edits_modified_out is not None else None
+    tainted_handle = StringIO() if args.ctm_edits_tainted_out is not None else None
+    segmented_handle = StringIO() if segment_lib.args.ctm_edits_out is not None else None
+
+    try:
+        for lines_of_utt in chunk:
+            split_lines_of_utt = [ line.split() for line in lines_of_utt ]
+            utterance = split_lines_of_utt[0][0]
+            split_lines_of_utt = modify_lib.ProcessUtterance(split_lines_of_utt)
+            if modified_handle is not None:
+                modified_handle.write(''.join([ ' '.join(split_line) + '\n'
+                                               for split_line in split_lines_of_utt ]))
+            # if all lines of the utterance were removed, it will not be seen by
+            # the later stages, just as if they were reading the output of the
+            # previous stage from a file.
+            if len(split_lines_of_utt) == 0:
+                continue
+            split_lines_of_utt = taint_lib.ProcessUtterance(split_lines_of_utt)
+            if tainted_handle is not None:
+                tainted_handle.write(''.join([ ' '.join(split_line) + '\n'
+                                              for split_line in split_lines_of_utt ]))
+            if len(split_lines_of_utt) == 0:
+                continue
+            utterance_obj = segment_lib.CtmEditsUtterance(split_lines_of_utt)
+            (segments_for_utterance,
+             deleted_segments_for_utterance) = segment_lib.GetSegmentsForUtterance(utterance_obj)
+            segment_lib.AccWordStatsForUtterance(utterance_obj, segments_for_utterance)
+            segment_lib.WriteSegmentsForUtterance(text_handle, segments_handle,
+                                                  utterance, segments_for_utterance)
+            if segmented_handle is not None:
+                segment_lib.PrintDebugInfoForUtterance(segmented_handle,
+                                                       utterance_obj,
+                                                       segments_for_utterance,
+                                                       deleted_segments_for_utterance)
+    except SystemExit as e:
+        # sys.exit() in a worker process would not be seen by the parent
+        # process as an error.
+        raise Exception(str(e.code))
+
+    return tuple([ None if handle is None else handle.getvalue()
+                   for handle in [ text_handle, segments_handle, modified_handle,
+                                   tainted_handle, segmented_handle ] ]
+                 + [ GetAndResetStats() ])
+
+
+# This generator reads the ctm-edits input and yields lists of at most
+# 'utterances_per_chunk' utterances, each a list of the lines of that
+# utterance.
+def ReadChunks(f_in, utterances_per_chunk):
+    chunk = []
+    lines_of_cur_utterance = []
+    cur_utterance = None
+    for line in f_in:
+        fields = line.split(None, 1)
+        if len(fields) == 0:
+            sys.exit("process_ctm_edits.py: got an empty or whitespace input line")
+        if fields[0] != cur_utterance:
+            if len(lines_of_cur_utterance) > 0:
+                chunk.append(lines_of_cur_utterance)
+                if len(chunk) == utterances_per_chunk:
+                    yield chunk
+                    chunk = []
+            lines_of_cur_utterance = []
+            cur_utterance = fields[0]
+        lines_of_cur_utterance.append(line)
+    if len(lines_of_cur_utterance) > 0:
+        chunk.append(lines_of_cur_utterance)
+    if len(chunk) > 0:
+        yield chunk
+
+
+def OpenOutput(filename):
+    if filename is None:
+        return None
+    try:
+        return open(filename, 'w')
+    except:
+        sys.exit("process_ctm_edits.py: error opening output file {0}".format(filename))
+
+def ProcessData():
+    try:
+        f_in = open(args.ctm_edits_in)
+    except:
+        sys.exit("process_ctm_edits.py: error opening ctm-edits input "
+                 "file {0}".format(args.ctm_edits_in))
+    output_handles = [ OpenOutput(filename) for filename in
+                       [ args.text_out, args.segments_out, args.ctm_edits_modified_out,
+                         args.ctm_edits_tainted_out, segment_lib.args.ctm_edits_out ] ]
+
+    total_stats = GetAndResetStats()
+    chunks = ReadChunks(f_in, args.utterances_per_chunk)
+    if args.num_jobs > 1:
+        pool = multiprocessing.Pool(args.num_jobs)
+    num_chunks = 0
+    while True:
+        # we read only a limited number of chunks at a time, so that the input
+        # is not all read into memory if the processing is slower than reading.
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == args.num_jobs * 4:
+                break
+        if len(batch) == 0:
+            break
+        num_chunks += len(batch)
+        try:
+            if args.num_jobs > 1:
+                results = pool.map(ProcessChunk, batch, chunksize = 1)
+            else:
+                results = [ ProcessChunk(chunk) for chunk in batch ]
+        except Exception as e:
+            sys.exit("process_ctm_edits.py: error processing the ctm-edits: " + str(e))
+        for result in results:
+            for (handle, output) in zip(output_handles, result[:5]):
+                if handle is not None:
+                    handle.write(output)
+            AddStats(result[5], total_stats)
+    if args.num_jobs > 1:
+        pool.close()
+        pool.join()
+    if num_chunks == 0:
+        sys.exit("process_ctm_edits.py: empty input")
+
+    try:
+        for handle in output_handles:
+            if handle is not None:
+                handle.close()
+    except:
+        sys.exit("process_ctm_edits.py: error closing one or more outputs "
+                 "(broken pipe or full disk?)")
+    SetStats(total_stats)
+
+
+ProcessData()
+
+modify_lib.PrintNonScoredStats()
+modify_lib.PrintRepetitionStats()
+taint_lib.PrintStats()
+segment_lib.PrintSegmentStats()
+if segment_lib.args.word_stats_out != None:
+    segment_lib.PrintWordStats(segment_lib.args.word_stats_out)
+if segment_lib.args.ctm_edits_out != None:
+    print("process_ctm_edits.py: detailed utterance-level debug information "
+          "is in " + segment_lib.args.ctm_edits_out, file = sys.stderr)
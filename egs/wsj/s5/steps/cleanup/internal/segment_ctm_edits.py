@@ -6,6 +6,7 @@
 
 from __future__ import print_function
 import sys, operator, argparse, os
+from array import array
 from collections import defaultdict
 
 # This script reads 'ctm-edits' file format that is produced by get_ctm_edits.py
@@ -13,7 +14,7 @@ from collections import defaultdict
 # produce a segmentation and text from the ctm-edits input.
 
 # The ctm-edits file format that this script expects is as follows
-# <file-id> <channel> <start-time> <duration> <conf> <hyp-word> <ref-word> <edit> ['tainted']
+# <file-id> <channel> <start-time> <duration> <hyp-word> <conf> <ref-word> <edit> ['tainted']
 # [note: file-id is really utterance-id at this point].
 
 parser = argparse.ArgumentParser(
@@ -105,13 +106,91 @@ parser.add_argument("segments_out", metavar = "<segments-out>",
                     "but instead of <recording-id>, the second field is the old utterance-id, i.e "
                     "<new-utterance-id> <old-utterance-id> <start-time> <end-time>")
 
-args = parser.parse_args()
+# 'args' is set by the code at the bottom of this script; when this script is
+# loaded as a module by steps/cleanup/internal/process_ctm_edits.py, that
+# script sets it instead.
+args = None
+
+
+# The edit-types of the ctm-edits lines are stored in CtmEditsUtterance as
+# the following small integer codes.
+EDIT_COR, EDIT_SUB, EDIT_INS, EDIT_DEL, EDIT_SIL, EDIT_FIX = range(6)
+edit_type_codes = { 'cor': EDIT_COR, 'sub': EDIT_SUB, 'ins': EDIT_INS,
+                    'del': EDIT_DEL, 'sil': EDIT_SIL, 'fix': EDIT_FIX }
+
+# The hyp and ref words are stored in CtmEditsUtterance as integer ids;
+# word_to_id maps from words to ids and word_list from ids to words.  Ids are
+# assigned by WordToId() as words are seen.
+word_to_id = {}
+word_list = []
+
+def WordToId(word):
+    word_id = word_to_id.get(word)
+    if word_id is None:
+        word_id = len(word_list)
+        word_to_id[word] = word_id
+        word_list.append(word)
+    return word_id
+
+eps_id = WordToId('<eps>')
+
+
+# This class holds the lines of the ctm-edits file for one utterance, in
+# columns: the start-times, durations and confidences are arrays of floats, the
+# words are arrays of word-ids and the edit-types arrays of codes (see
+# above).  This avoids converting the same fields from strings again and again
+# while processing the segments, and takes several times less memory than
+# keeping the lines as lists of strings.  The constructor takes the lines as
+# lists of fields, i.e. the lines split on whitespace.  It must be called
+# after the non-scored words have been read.
+class CtmEditsUtterance:
+    def __init__(self, split_lines_of_utt):
+        global non_scored_words
+        self.utterance_id = split_lines_of_utt[0][0]
+        for split_line in split_lines_of_utt:
+            if len(split_line) < 8 or not split_line[7] in edit_type_codes:
+                sys.exit("segment_ctm_edits.py: bad line in ctm-edits input: " +
+                         ' '.join(split_line))
+        # 'columns' is the first 8 fields of the lines, transposed.
+        columns = list(zip(*split_lines_of_utt))
+        for word in set(columns[4] + columns[6]):
+            WordToId(word)
+        self.start_times = array('d', map(float, columns[2]))
+        self.durations = array('d', map(float, columns[3]))
+        self.confidences = array('d', map(float, columns[5]))
+        self.hyp_words = array('i', [ word_to_id[word] for word in columns[4] ])
+        self.ref_words = array('i', [ word_to_id[word] for word in columns[6] ])
+        self.edit_types = array('b', [ edit_type_codes[edit_type]
+                                       for edit_type in columns[7] ])
+        # 1 if the line has the 'tainted' marker, else 0.
+        self.tainted = array('b', [ len(split_line) > 8 and split_line[8] == 'tainted'
+                                    for split_line in split_lines_of_utt ])
+        # 1 if the ref-word is in the set of non-scored words, else 0.
+        self.ref_is_non_scored = array('b', [ word in non_scored_words
+                                              for word in columns[6] ])
+        # the number of times the marker 'do-not-include-in-text' has been
+        # added to the line (see Segment.MergeWithSegment()).
+        self.num_do_not_include = array('b', [0]) * len(split_lines_of_utt)
+        # the lines without the utterance-id, as strings; these are only needed
+        # for the --ctm-edits-out output, so we don't keep them otherwise.
+        if args.ctm_edits_out != None:
+            self.line_strings = [ ' '.join(split_line[1:])
+                                  for split_line in split_lines_of_utt ]
+        else:
+            self.line_strings = None
+        # the end-time of the last line, which is taken to be the end-time of
+        # the utterance.
+        self.end_time = self.start_times[-1] + self.durations[-1]
 
+    def NumLines(self):
+        return len(self.edit_types)
 
+    def EndTimeOfLine(self, i):
+        return self.start_times[i] + self.durations[i]
 
+    def RefWord(self, i):
+        return word_list[self.ref_words[i]]
 
-def IsTainted(split_line_of_utt):
-    return len(split_line_of_utt) > 8 and split_line_of_utt[8] == 'tainted'
 
 # This function returns a list of pairs (start-index, end-index) representing
 # the cores of segments (so if a pair is (s, e), then the core of a segment
@@ -127,28 +206,29 @@ def IsTainted(split_line_of_utt):
 # or 'cor' that is not tainted.  Contiguous regions of 'true' in the resulting
 # boolean array will then become the cores of prototype segments, and we'll add
 # any adjacent tainted words (or parts of them).
-def ComputeSegmentCores(split_lines_of_utt):
-    num_lines = len(split_lines_of_utt)
-    line_is_in_segment_core = [ False] * num_lines
-    for i in range(num_lines):
-        if split_lines_of_utt[i][7] == 'cor' and \
-            split_lines_of_utt[i][4] == split_lines_of_utt[i][6]:
-            line_is_in_segment_core[i] = True
+def ComputeSegmentCores(utterance):
+    num_lines = utterance.NumLines()
+    edit_types = utterance.edit_types
+    hyp_words = utterance.hyp_words
+    ref_words = utterance.ref_words
+    tainted = utterance.tainted
+    line_is_in_segment_core = [ edit_types[i] == EDIT_COR and hyp_words[i] == ref_words[i]
+                                for i in range(num_lines) ]
 
     # extend each proto-segment forwards as far as we can:
     for i in range(1, num_lines):
         if line_is_in_segment_core[i-1] and not line_is_in_segment_core[i]:
-            edit_type = split_lines_of_utt[i][7]
-            if not IsTainted(split_lines_of_utt[i]) and \
-                (edit_type == 'cor' or edit_type == 'sil' or edit_type == 'fix'):
+            edit_type = edit_types[i]
+            if not tainted[i] and \
+                (edit_type == EDIT_COR or edit_type == EDIT_SIL or edit_type == EDIT_FIX):
                 line_is_in_segment_core[i] = True
 
     # extend each proto-segment backwards as far as we can:
     for i in reversed(range(0, num_lines - 1)):
         if line_is_in_segment_core[i+1] and not line_is_in_segment_core[i]:
-            edit_type = split_lines_of_utt[i][7]
-            if not IsTainted(split_lines_of_utt[i]) and \
-               (edit_type == 'cor' or edit_type == 'sil' or edit_type == 'fix'):
+            edit_type = edit_types[i]
+            if not tainted[i] and \
+               (edit_type == EDIT_COR or edit_type == EDIT_SIL or edit_type == EDIT_FIX):
                 line_is_in_segment_core[i] = True
 
 
@@ -167,9 +247,12 @@ def ComputeSegmentCores(split_lines_of_utt):
 
     return segment_ranges
 
+# A segment is a range of lines of an utterance, i.e. of a CtmEditsUtterance
+# object, plus information about how much of the boundary lines it keeps and
+# how much unk-padding it adds.
 class Segment:
-    def __init__(self, split_lines_of_utt, start_index, end_index, debug_str = None):
-        self.split_lines_of_utt = split_lines_of_utt
+    def __init__(self, utterance, start_index, end_index, debug_str = None):
+        self.utterance = utterance
         # start_index is the index of the first line that appears in this
         # segment, and end_index is one past the last line.  This does not
         # include unk-padding.
@@ -205,8 +288,7 @@ class Segment:
     # probably don't want to start or end the segment right at the boundary of a
     # real word, we want to add some kind of padding.
     def PossiblyAddTaintedLines(self):
-        global non_scored_words
-        split_lines_of_utt = self.split_lines_of_utt
+        utterance = self.utterance
         # we're iterating over the segment (start, end)
         for b in [False, True]:
             if b:
@@ -215,22 +297,21 @@ class Segment:
             else:
                 boundary_index = self.start_index
                 adjacent_index = self.start_index - 1
-            if adjacent_index >= 0 and adjacent_index < len(split_lines_of_utt):
+            if adjacent_index >= 0 and adjacent_index < utterance.NumLines():
                 # only consider merging the adjacent word into the segment if we're not
                 # at a segment boundary.
-                adjacent_line_is_tainted = IsTainted(split_lines_of_utt[adjacent_index])
+                adjacent_line_is_tainted = utterance.tainted[adjacent_index]
                 # if the adjacent line wasn't tainted, then there must have been
                 # another stronger reason why we didn't include it in the core
                 # of the segment (probably that it was an ins, del or sub), so
                 # there is no point considering it.
                 if adjacent_line_is_tainted:
-                    boundary_edit_type = split_lines_of_utt[boundary_index][7]
-                    boundary_hyp_word = split_lines_of_utt[boundary_index][7]
                     # we only add the tainted line to the segment if the word at
-                    # the boundary was a non-silence word that was correctly
-                    # decoded and not fixed [see modify_ctm_edits.py.]
-                    if boundary_edit_type == 'cor' and \
-                       not boundary_hyp_word in non_scored_words:
+                    # the boundary was correctly decoded and not fixed [see
+                    # modify_ctm_edits.py.]  Note: the word at the boundary may
+                    # be a non-scored word; this used to be checked against the
+                    # edit-type field instead of the word, so it never matched.
+                    if utterance.edit_types[boundary_index] == EDIT_COR:
                         # Add the adjacent tainted line to the segment.
                         if b:
                             self.end_index += 1
@@ -245,28 +326,28 @@ class Segment:
     # list of segments.  In the normal case (where there is no splitting)
     # it just returns an array with a single element 'self'.
     def PossiblySplitSegment(self):
-        global non_scored_words, args
+        global args
         # make sure the segment hasn't been processed more than we expect.
         assert self.start_unk_padding == 0.0 and self.end_unk_padding == 0.0 and \
               self.start_keep_proportion == 1.0 and self.end_keep_proportion == 1.0
+        utterance = self.utterance
         segments = []  # the answer
         cur_start_index = self.start_index
         cur_start_is_split = False
         # only consider splitting at non-boundary lines.  [we'd just truncate
         # the boundary lines.]
         for index_to_split_at in range(cur_start_index + 1, self.end_index - 1):
-            this_split_line = self.split_lines_of_utt[index_to_split_at]
-            this_duration = float(this_split_line[3])
-            this_edit_type = this_split_line[7]
-            this_ref_word = this_split_line[6]
-            if (this_edit_type == 'sil' and this_duration > args.max_internal_silence_length) or \
-               (this_ref_word in non_scored_words and this_duration > args.max_internal_non_scored_length):
+            this_duration = utterance.durations[index_to_split_at]
+            if (utterance.edit_types[index_to_split_at] == EDIT_SIL and
+                this_duration > args.max_internal_silence_length) or \
+               (utterance.ref_is_non_scored[index_to_split_at] and
+                this_duration > args.max_internal_non_scored_length):
                 # We split this segment at this index, dividing the word in two
                 # [later on, in PossiblyTruncateBoundaries, it may be further
                 # truncated.]
                 # Note: we use 'index_to_split_at + 1' because the Segment constructor
                 # takes an 'end-index' which is interpreted as one past the end.
-                new_segment = Segment(self.split_lines_of_utt, cur_start_index,
+                new_segment = Segment(utterance, cur_start_index,
                                       index_to_split_at + 1, self.debug_str)
                 if cur_start_is_split:
                     new_segment.start_keep_proportion = 0.5
@@ -278,7 +359,7 @@ class Segment:
             segments.append(self)
         else:
             # We did split.  Add the very last segment.
-            new_segment = Segment(self.split_lines_of_utt, cur_start_index,
+            new_segment = Segment(utterance, cur_start_index,
                                   self.end_index, self.debug_str)
             assert cur_start_is_split
             new_segment.start_keep_proportion = 0.5
@@ -292,20 +373,18 @@ class Segment:
     # (and to the extent that this wouldn't take us below the
     # --min-segment-length or --min-new-segment-length).
     def PossiblyTruncateBoundaries(self):
+        utterance = self.utterance
         for b in [True, False]:
             if b:
                 this_index = self.start_index
             else:
                 this_index = self.end_index - 1
-            this_split_line = self.split_lines_of_utt[this_index]
             truncated_duration = None
-            this_duration = float(this_split_line[3])
-            this_edit = this_split_line[7]
-            this_ref_word = this_split_line[6]
-            if this_edit == 'sil' and \
+            this_duration = utterance.durations[this_index]
+            if utterance.edit_types[this_index] == EDIT_SIL and \
                this_duration > args.max_edge_silence_length:
                 truncated_duration = args.max_edge_silence_length
-            elif this_ref_word in non_scored_words and \
+            elif utterance.ref_is_non_scored[this_index] and \
                  this_duration > args.max_edge_non_scored_length:
                 truncated_duration = args.max_edge_non_scored_length
             if truncated_duration != None:
@@ -332,9 +411,9 @@ class Segment:
             return  # Nothing to do.
         orig_start_keep_proportion = self.start_keep_proportion
         orig_end_keep_proportion = self.end_keep_proportion
-        if not IsTainted(self.split_lines_of_utt[self.start_index]):
+        if not self.utterance.tainted[self.start_index]:
             self.start_keep_proportion = 1.0
-        if not IsTainted(self.split_lines_of_utt[self.end_index - 1]):
+        if not self.utterance.tainted[self.end_index - 1]:
             self.end_keep_proportion = 1.0
         length_with_relaxed_boundaries = self.Length()
         if length_with_relaxed_boundaries <= length_cutoff:
@@ -373,18 +452,17 @@ class Segment:
     # values.  This is done if the current boundary words are real, scored
     # words and we're not next to the beginning or end of the utterance.
     def PossiblyAddUnkPadding(self):
+        utterance = self.utterance
         for b in [True, False]:
             if b:
                 this_index = self.start_index
             else:
                 this_index = self.end_index - 1
-            this_split_line = self.split_lines_of_utt[this_index]
-            this_start_time = float(this_split_line[2])
-            this_ref_word = this_split_line[6]
-            this_edit = this_split_line[7]
-            if this_edit == 'cor' and not this_ref_word in non_scored_words:
+            if utterance.edit_types[this_index] == EDIT_COR and \
+               not utterance.ref_is_non_scored[this_index]:
                 # we can consider adding unk-padding.
                 if b: # start of utterance.
+                    this_start_time = utterance.start_times[this_index]
                     unk_padding = args.unk_padding
                     if unk_padding > this_start_time:  # close to beginning of file
                         unk_padding = this_start_time
@@ -397,10 +475,8 @@ class Segment:
                         unk_padding = 0.0
                     self.start_unk_padding = unk_padding
                 else: # end of utterance.
-                    this_end_time = this_start_time + float(this_split_line[3])
-                    last_line = self.split_lines_of_utt[-1]
-                    utterance_end_time = float(last_line[2]) + float(last_line[3])
-                    max_allowable_padding = utterance_end_time - this_end_time
+                    this_end_time = utterance.EndTimeOfLine(this_index)
+                    max_allowable_padding = utterance.end_time - this_end_time
                     assert max_allowable_padding > -0.01
                     unk_padding = args.unk_padding
                     if unk_padding > max_allowable_padding:
@@ -426,7 +502,7 @@ class Segment:
     def MergeWithSegment(self, other):
         assert self.EndTime() >= other.StartTime() and \
                self.StartTime() < other.EndTime() and \
-               self.split_lines_of_utt is other.split_lines_of_utt
+               self.utterance is other.utterance
         orig_self_end_index = self.end_index
         self.debug_str = "({0}/merged-with/{1})".format(self.debug_str, other.debug_str)
         # everything that relates to the end of this segment gets copied
@@ -444,23 +520,21 @@ class Segment:
         # as 'discard-this-word'.
         first_index_of_overlap = min(orig_self_end_index - 1, other.start_index)
         last_index_of_overlap = max(orig_self_end_index - 1, other.start_index)
+        edit_types = self.utterance.edit_types
         num_deleted_words = 0
         for i in range(first_index_of_overlap, last_index_of_overlap + 1):
-            edit_type = self.split_lines_of_utt[i][7]
-            if edit_type == 'del':
+            if edit_types[i] == EDIT_DEL:
                 num_deleted_words += 1
         if num_deleted_words > args.max_deleted_words_kept_when_merging:
             for i in range(first_index_of_overlap, last_index_of_overlap + 1):
-                if self.split_lines_of_utt[i][7] == 'del':
-                    self.split_lines_of_utt[i].append('do-not-include-in-text')
+                if edit_types[i] == EDIT_DEL:
+                    self.utterance.num_do_not_include[i] += 1
 
     # Returns the start time of the utterance (within the enclosing utterance)
     # This is before any rounding.
     def StartTime(self):
-        first_line = self.split_lines_of_utt[self.start_index]
-        first_line_start = float(first_line[2])
-        first_line_duration = float(first_line[3])
-        first_line_end = first_line_start + first_line_duration
+        first_line_duration = self.utterance.durations[self.start_index]
+        first_line_end = self.utterance.start_times[self.start_index] + first_line_duration
         return first_line_end - self.start_unk_padding \
               - (first_line_duration * self.start_keep_proportion)
 
@@ -473,10 +547,9 @@ class Segment:
 
     # Returns the start time of the utterance (within the enclosing utterance)
     def EndTime(self):
-        last_line = self.split_lines_of_utt[self.end_index - 1]
-        last_line_start = float(last_line[2])
-        last_line_duration = float(last_line[3])
-        return last_line_start + (last_line_duration * self.end_keep_proportion) \
+        last_index = self.end_index - 1
+        return self.utterance.start_times[last_index] + \
+            (self.utterance.durations[last_index] * self.end_keep_proportion) \
              + self.end_unk_padding
 
     # Returns the segment length in seconds.
@@ -487,10 +560,26 @@ class Segment:
         # returns true if this segment corresponds to the whole utterance that
         # it's a part of (i.e. its start/end time are zero and the end-time of
         # the last segment.
-        last_line_of_utt = self.split_lines_of_utt[-1]
-        last_line_end_time = float(last_line_of_utt[2]) + float(last_line_of_utt[3])
         return abs(self.StartTime() - 0.0) < 0.001 and \
-               abs(self.EndTime() - last_line_end_time) < 0.001
+               abs(self.EndTime() - self.utterance.end_time) < 0.001
+
+    # Returns the duration of junk (unk-padding and tainted lines) at the start
+    # of the segment.
+    def StartJunkDuration(self):
+        junk_duration = self.start_unk_padding
+        if self.utterance.tainted[self.start_index]:
+            junk_duration += self.utterance.durations[self.start_index] * \
+                             self.start_keep_proportion
+        return junk_duration
+
+    # Returns the duration of junk (unk-padding and tainted lines) at the end
+    # of the segment.
+    def EndJunkDuration(self):
+        junk_duration = self.end_unk_padding
+        if self.utterance.tainted[self.end_index - 1]:
+            junk_duration += self.utterance.durations[self.end_index - 1] * \
+                             self.end_keep_proportion
+        return junk_duration
 
     # Returns the proportion of the duration of this segment that consists of
     # unk-padding and tainted lines of input (will be between 0.0 and 1.0).
@@ -500,14 +589,12 @@ class Segment:
         # the utterance must contain other lines, so double-counting is not a
         # problem.
         junk_duration = self.start_unk_padding + self.end_unk_padding
-        first_split_line = self.split_lines_of_utt[self.start_index]
-        if IsTainted(first_split_line):
-            first_duration = float(first_split_line[3])
-            junk_duration += first_duration * self.start_keep_proportion
-        last_split_line = self.split_lines_of_utt[self.end_index - 1]
-        if IsTainted(last_split_line):
-            last_duration = float(last_split_line[3])
-            junk_duration += last_duration * self.end_keep_proportion
+        if self.utterance.tainted[self.start_index]:
+            junk_duration += self.utterance.durations[self.start_index] * \
+                             self.start_keep_proportion
+        if self.utterance.tainted[self.end_index - 1]:
+            junk_duration += self.utterance.durations[self.end_index - 1] * \
+                             self.end_keep_proportion
         return junk_duration / self.Length()
 
     # This function will remove something from the beginning of the
@@ -518,28 +605,23 @@ class Segment:
     # segment or non-tainted non-scored-word segment in the
     # utterance.  See also TruncateEndForJunkProportion
     def PossiblyTruncateStartForJunkProportion(self):
-        begin_junk_duration = self.start_unk_padding
-        first_split_line = self.split_lines_of_utt[self.start_index]
-        if IsTainted(first_split_line):
-            first_duration = float(first_split_line[3])
-            begin_junk_duration += first_duration * self.start_keep_proportion
+        begin_junk_duration = self.StartJunkDuration()
         if begin_junk_duration == 0.0:
             # nothing to do.
             return
 
+        utterance = self.utterance
         candidate_start_index = None
         # the following iterates over all lines internal to the utterance.
         for i in range(self.start_index + 1, self.end_index - 1):
-            this_split_line = self.split_lines_of_utt[i]
-            this_edit_type = this_split_line[7]
-            this_ref_word = this_split_line[6]
+            this_edit_type = utterance.edit_types[i]
             # We'll consider splitting on silence and on non-scored words.
             # (i.e. making the silence or non-scored word the left boundary of
             # the new utterance and discarding the piece to the left of that).
-            if this_edit_type == 'sil' or \
-               (this_edit_type == 'cor' and this_ref_word in non_scored_words):
+            if this_edit_type == EDIT_SIL or \
+               (this_edit_type == EDIT_COR and utterance.ref_is_non_scored[i]):
                 candidate_start_index = i
-                candidate_start_time = float(this_split_line[2])
+                candidate_start_time = utterance.start_times[i]
                 break  # Consider only the first potential truncation.
         if candidate_start_index == None:
             return  # Nothing to do as there is no place to split.
@@ -556,29 +638,24 @@ class Segment:
     # This is like PossiblyTruncateStartForJunkProportion(), but
     # acts on the end of the segment; see comments there.
     def PossiblyTruncateEndForJunkProportion(self):
-        end_junk_duration = self.end_unk_padding
-        last_split_line = self.split_lines_of_utt[self.end_index - 1]
-        if IsTainted(last_split_line):
-            last_duration = float(last_split_line[3])
-            end_junk_duration += last_duration * self.end_keep_proportion
+        end_junk_duration = self.EndJunkDuration()
         if end_junk_duration == 0.0:
             # nothing to do.
             return
 
+        utterance = self.utterance
         candidate_end_index = None
         # the following iterates over all lines internal to the utterance
         # (starting from the end).
         for i in reversed(range(self.start_index + 1, self.end_index - 1)):
-            this_split_line = self.split_lines_of_utt[i]
-            this_edit_type = this_split_line[7]
-            this_ref_word = this_split_line[6]
+            this_edit_type = utterance.edit_types[i]
             # We'll consider splitting on silence and on non-scored words.
             # (i.e. making the silence or non-scored word the right boundary of
             # the new utterance and discarding the piece to the right of that).
-            if this_edit_type == 'sil' or \
-               (this_edit_type == 'cor' and this_ref_word in non_scored_words):
+            if this_edit_type == EDIT_SIL or \
+               (this_edit_type == EDIT_COR and utterance.ref_is_non_scored[i]):
                 candidate_end_index = i + 1  # note: end-indexes are one past the last.
-                candidate_end_time = float(this_split_line[2]) + float(this_split_line[3])
+                candidate_end_time = utterance.EndTimeOfLine(i)
                 break  # Consider only the latest potential truncation.
         if candidate_end_index == None:
             return  # Nothing to do as there is no place to split.
@@ -597,29 +674,23 @@ class Segment:
     # that's a scored word (not a non-scored word) and not an OOV word that's
     # realized as unk.  This becomes a filter on keeping segments.
     def ContainsAtLeastOneScoredNonOovWord(self):
-        global non_scored_words
+        utterance = self.utterance
         for i in range(self.start_index, self.end_index):
-            this_split_line = self.split_lines_of_utt[i]
-            this_hyp_word = this_split_line[4]
-            this_ref_word = this_split_line[6]
-            this_edit = this_split_line[7]
-            if this_edit == 'cor' and not this_ref_word in non_scored_words \
-               and this_ref_word == this_hyp_word:
+            if utterance.edit_types[i] == EDIT_COR and not utterance.ref_is_non_scored[i] \
+               and utterance.ref_words[i] == utterance.hyp_words[i]:
                 return True
         return False
 
     # Returns the text corresponding to this utterance, as a string.
     def Text(self):
         global oov_symbol
+        utterance = self.utterance
         text_array = []
         if self.start_unk_padding != 0.0:
             text_array.append(oov_symbol)
         for i in range(self.start_index, self.end_index):
-            this_split_line = self.split_lines_of_utt[i]
-            this_edit = this_split_line[7]
-            this_ref_word = this_split_line[6]
-            if this_ref_word != '<eps>' and this_split_line[-1] != 'do-not-include-in-text':
-                text_array.append(this_ref_word)
+            if utterance.ref_words[i] != eps_id and utterance.num_do_not_include[i] == 0:
+                text_array.append(utterance.RefWord(i))
         if self.end_unk_padding != 0.0:
             text_array.append(oov_symbol)
         return ' '.join(text_array)
@@ -663,19 +734,17 @@ def PrintSegmentStats():
 # of class Segment.
 # It returns a 2-tuple (list-of-segments, list-of-deleted-segments)
 # where the deleted segments are only useful for diagnostic printing.
-# Note: split_lines_of_utt is a list of lists, one per line, each containing the
-# sequence of fields.
-def GetSegmentsForUtterance(split_lines_of_utt):
+# Note: 'utterance' is an object of class CtmEditsUtterance.
+def GetSegmentsForUtterance(utterance):
     global num_utterances, num_utterances_without_segments, total_length_of_utterances
 
     num_utterances += 1
 
-    segment_ranges = ComputeSegmentCores(split_lines_of_utt)
+    segment_ranges = ComputeSegmentCores(utterance)
 
-    utterance_end_time = float(split_lines_of_utt[-1][2]) + float(split_lines_of_utt[-1][3])
-    total_length_of_utterances += utterance_end_time
+    total_length_of_utterances += utterance.end_time
 
-    segments = [ Segment(split_lines_of_utt, x[0], x[1])
+    segments = [ Segment(utterance, x[0], x[1])
                  for x in segment_ranges ]
 
     AccumulateSegmentStats(segments, 'stage  0 [segment cores]')
@@ -817,9 +886,8 @@ def WriteSegmentsForUtterance(text_output_handle, segments_output_handle,
 
 
 
-# Note, this is destrutive of 'segments_for_utterance', but it won't matter.
 def PrintDebugInfoForUtterance(ctm_edits_out_handle,
-                               split_lines_of_cur_utterance,
+                               utterance,
                                segments_for_utterance,
                                deleted_segments_for_utterance):
     # info_to_print will be list of 2-tuples (time, 'start-segment-n'|'end-segment-n')
@@ -841,39 +909,37 @@ def PrintDebugInfoForUtterance(ctm_edits_out_handle,
         info_to_print.append( (segment.EndTime(), end_string) )
 
     info_to_print = sorted(info_to_print)
-
-    for i in range(len(split_lines_of_cur_utterance)):
-        split_line=split_lines_of_cur_utterance[i]
-        split_line[0] += '[' + str(i) + ']'  # add an index like [0], [1], to
-                                             # the utterance-id so we can easily
-                                             # look up segment indexes.
-        start_time = float(split_line[2])
-        end_time = start_time + float(split_line[3])
-        split_line_copy = list(split_line)
-        while len(info_to_print) > 0 and info_to_print[0][0] <= end_time:
-            (segment_start, string) = info_to_print[0]
-            # shift the first element off of info_to_print.
-            info_to_print = info_to_print[1:]
+    info_index = 0
+
+    for i in range(utterance.NumLines()):
+        # add an index like [0], [1], to the utterance-id so we can easily look
+        # up segment indexes.
+        fields = [ utterance.utterance_id + '[' + str(i) + ']', utterance.line_strings[i] ]
+        fields += [ 'do-not-include-in-text' ] * utterance.num_do_not_include[i]
+        end_time = utterance.EndTimeOfLine(i)
+        while info_index < len(info_to_print) and info_to_print[info_index][0] <= end_time:
+            (segment_start, string) = info_to_print[info_index]
+            info_index += 1
             # add a field like 'start-segment1[...]=3.21' to what we're about to print.
-            split_line_copy.append(string + "=" + TimeToString(segment_start, args.frame_length))
-        print(' '.join(split_line_copy), file = ctm_edits_out_handle)
+            fields.append(string + "=" + TimeToString(segment_start, args.frame_length))
+        print(' '.join(fields), file = ctm_edits_out_handle)
 
 # This accumulates word-level stats about, for each reference word, with what
 # probability it will end up in the core of a segment.  Words with low
 # probabilities of being in segments will generally be associated with some kind
 # of error (there is a higher probability of having a wrong lexicon entry).
-def AccWordStatsForUtterance(split_lines_of_utt,
+def AccWordStatsForUtterance(utterance,
                              segments_for_utterance):
     # word_count_pair is a map from a string (the word) to
     # a list [total-count, count-not-within-segments]
     global word_count_pair
-    line_is_in_segment = [ False ] * len(split_lines_of_utt)
+    line_is_in_segment = [ False ] * utterance.NumLines()
     for segment in segments_for_utterance:
         for i in range(segment.start_index, segment.end_index):
             line_is_in_segment[i] = True
-    for i in range(len(split_lines_of_utt)):
-        this_ref_word = split_lines_of_utt[i][6]
-        if this_ref_word != '<eps>':
+    for i in range(utterance.NumLines()):
+        if utterance.ref_words[i] != eps_id:
+            this_ref_word = utterance.RefWord(i)
             word_count_pair[this_ref_word][0] += 1
             if not line_is_in_segment[i]:
                 word_count_pair[this_ref_word][1] += 1
@@ -932,8 +998,8 @@ def ProcessData():
                      "file {0}".format(args.ctm_edits_out))
 
     # Most of what we're doing in the lines below is splitting the input lines
-    # and grouping them per utterance, before giving them to ProcessUtterance()
-    # and then printing the modified lines.
+    # and grouping them per utterance, before converting them to
+    # CtmEditsUtterance objects and processing them.
     first_line = f_in.readline()
     if first_line == '':
         sys.exit("segment_ctm_edits.py: empty input")
@@ -945,14 +1011,15 @@ def ProcessData():
 
     while True:
         if len(split_pending_line) == 0 or split_pending_line[0] != cur_utterance:
+            utterance = CtmEditsUtterance(split_lines_of_cur_utterance)
             (segments_for_utterance,
-             deleted_segments_for_utterance) = GetSegmentsForUtterance(split_lines_of_cur_utterance)
-            AccWordStatsForUtterance(split_lines_of_cur_utterance, segments_for_utterance)
+             deleted_segments_for_utterance) = GetSegmentsForUtterance(utterance)
+            AccWordStatsForUtterance(utterance, segments_for_utterance)
             WriteSegmentsForUtterance(text_output_handle, segments_output_handle,
                                       cur_utterance, segments_for_utterance)
             if args.ctm_edits_out != None:
                 PrintDebugInfoForUtterance(ctm_edits_output_handle,
-                                           split_lines_of_cur_utterance,
+                                           utterance,
                                            segments_for_utterance,
                                            deleted_segments_for_utterance)
             split_lines_of_cur_utterance = []
@@ -995,23 +1062,25 @@ def ReadNonScoredWords(non_scored_words_file):
 
 
 
-non_scored_words = set()
-ReadNonScoredWords(args.non_scored_words_in)
+def ReadOovSymbol():
+    global oov_symbol
+    if args.oov_symbol_file != None:
+        try:
+            with open(args.oov_symbol_file) as f:
+                line = f.readline()
+                assert len(line.split()) == 1
+                oov_symbol = line.split()[0]
+                assert f.readline() == ''
+        except Exception as e:
+            sys.exit("segment_ctm_edits.py: error reading file --oov-symbol-file=" +
+                     args.oov_symbol_file + ", error is: " + str(e))
+    elif args.unk_padding != 0.0:
+        sys.exit("segment_ctm_edits.py: if the --unk-padding option is nonzero (which "
+                 "it is by default, the --oov-symbol-file option must be supplied.")
+
 
+non_scored_words = set()
 oov_symbol = None
-if args.oov_symbol_file != None:
-    try:
-        with open(args.oov_symbol_file) as f:
-            line = f.readline()
-            assert len(line.split()) == 1
-            oov_symbol = line.split()[0]
-            assert f.readline() == ''
-    except Exception as e:
-        sys.exit("segment_ctm_edits.py: error reading file --oov-symbol-file=" +
-                 args.oov_symbol_file + ", error is: " + str(e))
-elif args.unk_padding != 0.0:
-    sys.exit("segment_ctm_edits.py: if the --unk-padding option is nonzero (which "
-             "it is by default, the --oov-symbol-file option must be supplied.")
 
 # segment_total_length and num_segments are maps from
 # 'stage' strings; see AccumulateSegmentStats for details.
@@ -1025,11 +1094,15 @@ num_utterances_without_segments = 0
 total_length_of_utterances = 0
 
 
-ProcessData()
-PrintSegmentStats()
-if args.word_stats_out != None:
-    PrintWordStats(args.word_stats_out)
-if args.ctm_edits_out != None:
-    print("segment_ctm_edits.py: detailed utterance-level debug information "
-          "is in " + args.ctm_edits_out, file = sys.stderr)
+if __name__ == "__main__":
+    args = parser.parse_args()
+    ReadNonScoredWords(args.non_scored_words_in)
+    ReadOovSymbol()
+    ProcessData()
+    PrintSegmentStats()
+    if args.word_stats_out != None:
+        PrintWordStats(args.word_stats_out)
+    if args.ctm_edits_out != None:
+        print("segment_ctm_edits.py: detailed utterance-level debug information "
+              "is in " + args.ctm_edits_out, file = sys.stderr)
 
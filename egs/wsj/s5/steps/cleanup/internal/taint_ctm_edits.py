@@ -60,7 +60,10 @@ parser.add_argument("ctm_edits_out", metavar = "<ctm-edits-out>",
                     help = "Filename of output ctm-edits file. "
                     "Use /dev/stdout for standard output.")
 
-args = parser.parse_args()
+# 'args' is set by the code at the bottom of this script; when this script is
+# loaded as a module by steps/cleanup/internal/process_ctm_edits.py, that
+# script sets it instead.
+args = None
 
 
 
@@ -237,6 +240,8 @@ num_del_lines_giving_taint = 0
 num_sub_lines_giving_taint = 0
 num_ins_lines_giving_taint = 0
 
-ProcessData()
-PrintStats()
+if __name__ == "__main__":
+    args = parser.parse_args()
+    ProcessData()
+    PrintStats()
 
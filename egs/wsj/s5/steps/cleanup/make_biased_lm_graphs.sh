@@ -17,6 +17,7 @@ set -e
 # Begin configuration section.
 nj=10
 cmd=run.pl
+num_threads=1  # Number of processes used to make the biased LMs in each job.
 scale_opts="--transition-scale=1.0 --self-loop-scale=0.1"
 top_n_words=100 # Number of common words that we compile into each graph (most frequent
                 # in $data/text.orig.
@@ -68,6 +69,8 @@ if [ $# != 3 ]; then
    echo "                                            # and 1.  Default 0.3.  Smaller -> more strongly biased LM."
    echo "  --config <config-file>                    # config containing options"
    echo "  --nj <nj>                                 # number of parallel jobs"
+   echo "  --num-threads <n>                         # number of processes used to make the"
+   echo "                                            # LMs in each job (default: 1)"
    echo "  --cmd (utils/run.pl|utils/queue.pl <queue opts>) # how to run jobs."
    exit 1;
 fi
@@ -120,10 +123,10 @@ if [ $stage -le 1 ]; then
   # These options are passed through directly to make_one_biased_lm.py.
   lm_opts="--word-disambig-symbol=$word_disambig_symbol --ngram-order=$ngram_order --min-lm-state-count=$min_lm_state_count --discounting-constant=$discounting_constant"
 
-  $cmd JOB=1:$nj $dir/log/compile_decoding_graphs.JOB.log \
+  $cmd --num-threads $num_threads JOB=1:$nj $dir/log/compile_decoding_graphs.JOB.log \
     utils/sym2int.pl --map-oov $oov -f 2- $lang/words.txt $sdata/JOB/text \| \
     steps/cleanup/make_biased_lms.py --min-words-per-graph=$min_words_per_graph \
-      --lm-opts="$lm_opts" $dir/fsts/utt2group.JOB \| \
+      --num-jobs=$num_threads --lm-opts="$lm_opts" $dir/fsts/utt2group.JOB \| \
     compile-train-graphs-fsts $scale_opts --read-disambig-syms=$lang/phones/disambig.int \
       $dir/tree $dir/final.mdl $lang/L_disambig.fst ark:- \
     ark,scp:$dir/fsts/HCLG.fsts.JOB.ark,$dir/fsts/HCLG.fsts.JOB.scp || exit 1
@@ -13,11 +13,15 @@ of (integerized) text data from the standard input and writes a Kaldi archive of
 backoff-language-model FSTs to the standard-output.  It takes care of
 grouping utterances to respect the --min-words-per-graph option.  It writes
 the graphs to the standard output and also outputs a map from input utterance-ids
-to the per-group utterance-ids that index the output graphs.""")
+to the per-group utterance-ids that index the output graphs.  All the groups
+are processed by a single invocation of make_one_biased_lm.py in batch mode.""")
 
 parser.add_argument("--lm-opts", type = str, default = "",
                     help = "Options to pass in to make_one_biased_lm.py (which "
                     "creates the individual LM graphs), e.g. '--word-disambig-symbol=8721'.")
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help = "Number of processes that make_one_biased_lm.py uses to "
+                    "make the LMs in parallel.")
 parser.add_argument("--min-words-per-graph", type = int, default = 100,
                     help = "Minimum number of words per utterance group; this program "
                     "will try to arrange the input utterances into groups such that each "
@@ -36,9 +40,20 @@ except:
     sys.exit("make_biased_lms.py: error opening {0} to write utterance map".format(
             args.utterance_map))
 
+command = "steps/cleanup/internal/make_one_biased_lm.py --batch=true --num-jobs={0} {1}".format(
+    args.num_jobs, args.lm_opts)
+try:
+    p = subprocess.Popen(command, shell = True, stdin = subprocess.PIPE,
+                         stdout = sys.stdout, stderr = sys.stderr)
+except Exception as e:
+    sys.exit("make_biased_lms.py: error calling subprocess, command was: " +
+             command + ", error was : " + str(e))
+
 # This processes one group of input lines; 'group_of_lines' is
 # an array of lines of input integerized text, e.g.
 # [ 'utt1 67 89 432', 'utt2 89 48 62' ]
+# It writes the lines to make_one_biased_lm.py, preceded by the group
+# utterance-id, which will index the graph in its output.
 def ProcessGroupOfLines(group_of_lines):
     num_lines = len(group_of_lines)
     try:
@@ -47,15 +62,8 @@ def ProcessGroupOfLines(group_of_lines):
         sys.exit("make_biased_lms.py: empty input line")
 
     group_utterance_id = '{0}-group-of-{1}'.format(first_utterance_id, num_lines)
-    # print the group utterance-id to the stdout; it forms the name in
-    # the text-form archive.
-    print(group_utterance_id)
-    sys.stdout.flush()
 
     try:
-        command = "steps/cleanup/internal/make_one_biased_lm.py " + args.lm_opts
-        p = subprocess.Popen(command, shell = True, stdin = subprocess.PIPE,
-                            stdout = sys.stdout, stderr = sys.stderr)
         for line in group_of_lines:
             a = line.split()
             if len(a) == 0:
@@ -64,16 +72,10 @@ def ProcessGroupOfLines(group_of_lines):
             # print <utt> <utt-group> to utterance-map file
             print(utterance_id, group_utterance_id, file = utterance_map_file)
             rest_of_line = ' '.join(a[1:])  # get rid of utterance id.
-            print(rest_of_line, file=p.stdin)
-        p.stdin.close()
-        assert p.wait() == 0
+            print(group_utterance_id, rest_of_line, file=p.stdin)
     except Exception as e:
-        sys.exit("make_biased_lms.py: error calling subprocess, command was: " +
+        sys.exit("make_biased_lms.py: error writing to subprocess, command was: " +
                  command + ", error was : " + str(e))
-    # Print a blank line; this terminates the FST in the Kaldi fst-archive
-    # format.
-    print("")
-    sys.stdout.flush()
 
 
 
@@ -93,6 +95,11 @@ while True:
     if line == '':
         break
 
+p.stdin.close()
+if p.wait() != 0:
+    sys.exit("make_biased_lms.py: error in subprocess, command was: " + command)
+utterance_map_file.close()
+
 
 # test comand [to be run from ../..]
 #
@@ -3,7 +3,9 @@
 # Copyright 2015  Brno University of Technology (author: Karel Vesely)
 # Apache 2.0
 
-import sys, gzip, re
+import sys, imp
+
+arpa_lib = imp.load_source('arpa_lib', 'utils/lang/arpa_lib.py')
 
 # Parse options,
 if len(sys.argv) != 4:
@@ -18,15 +20,11 @@ if unigrams_out == '-': unigrams_out = '/dev/stdout'
 words = [ l.split() for l in open(words_txt) ]
 
 # Load the unigram probabilities in 10log from ARPA,
-wrd_log10 = dict()
-with gzip.open(arpa_gz,'r') as f:
-  read = False
-  for l in f:
-    if l.strip() == '\\1-grams:': read = True
-    if l.strip() == '\\2-grams:': break
-    if read and len(l.split())>=2:
-      log10_p_unigram, wrd = re.split('[\t ]+',l.strip(),2)[:2]
-      wrd_log10[wrd] = float(log10_p_unigram)
+try:
+  lm = arpa_lib.ReadArpa(arpa_gz, max_order=1)
+except arpa_lib.ArpaError as e:
+  sys.exit("%s: %s" % (__file__, str(e)))
+wrd_log10 = dict(zip(lm.words, lm.logprobs[0].tolist()))
 
 # Create list, 'wrd id log_p_unigram',
 words_unigram = [[wrd, id, (wrd_log10[wrd] if wrd in wrd_log10 else -99)] for wrd,id in words ]
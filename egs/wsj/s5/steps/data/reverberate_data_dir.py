@@ -5,9 +5,11 @@
 
 # we're using python 3.x style print but want it to work in python 2.x,
 from __future__ import print_function
-import argparse, shlex, glob, math, os, random, sys, warnings, copy, imp, ast
+import argparse, shlex, glob, math, os, random, sys, warnings, copy, imp, ast, bisect
+import hashlib, multiprocessing, shutil
 
 data_lib = imp.load_source('dml', 'steps/data/data_dir_manipulation_lib.py')
+rvb_lib = imp.load_source('rvb_lib', 'steps/data/reverberation_lib.py')
 
 def GetArgs():
     # we add required arguments as named arguments for readability
@@ -71,6 +73,19 @@ def GetArgs():
                         "the RIRs/noises will be resampled to the rate of the source data.")
     parser.add_argument("--include-original-data", type=str, help="If true, the output data includes one copy of the original data",
                          choices=['true', 'false'], default = "false")
+    parser.add_argument("--output-audio-dir", type=str, default = None,
+                        help="If specified, the reverberated recordings are computed by this script (in python, which "
+                        "requires numpy) and written into wav archives in this directory, and wav.scp refers to these "
+                        "archives instead of containing wav-reverberate commands.")
+    parser.add_argument("--num-jobs", type=int, default = 1,
+                        help="Number of processes used to compute the reverberated recordings with --output-audio-dir, "
+                        "or to process the shards with --num-shards.")
+    parser.add_argument("--num-shards", type=int, default = 0,
+                        help="If positive, the data is processed in this many shards, without loading the data directory "
+                        "into memory (wav.scp and reco2dur must be sorted in the same order).  The random seed is then set "
+                        "for each recording from --random-seed, so the output does not depend on the number of shards, "
+                        "but differs from the output without --num-shards.  If the script is interrupted, rerunning it "
+                        "with the same options resumes from the shards that were finished.")
     parser.add_argument("input_dir",
                         help="Input data directory")
     parser.add_argument("output_dir",
@@ -117,6 +132,15 @@ def CheckArgs(args):
     if args.source_sampling_rate is not None and args.source_sampling_rate <= 0:
         raise Exception("--source-sampling-rate cannot be non-positive")
 
+    if args.num_jobs <= 0:
+        raise Exception("--num-jobs cannot be non-positive")
+
+    if args.num_shards < 0:
+        raise Exception("--num-shards cannot be negative")
+
+    if args.output_audio_dir is not None:
+        rvb_lib.CheckNumpyIsAvailable()
+
     return args
 
 
@@ -132,22 +156,45 @@ class list_cyclic_iterator:
     return item
 
 
-# This functions picks an item from the collection according to the associated probability distribution.
+# This class stores the cumulative probabilities of the items in a collection, so that
+# items can be picked according to their probabilities by a binary search,
+# rather than by summing the probabilities each time an item is picked.
 # The probability estimate of each item in the collection is stored in the "probability" field of 
 # the particular item. x : a collection (list or dictionary) where the values contain a field called probability
-def PickItemWithProbability(x):
-   if isinstance(x, dict):
-     plist = list(set(x.values()))
-   else:
-     plist = x
-   total_p = sum(item.probability for item in plist)
-   p = random.uniform(0, total_p)
-   accumulate_p = 0
-   for item in plist:
-      if accumulate_p + item.probability >= p:
-         return item
+class item_sampler:
+  def __init__(self, x):
+    if isinstance(x, dict):
+      # the values are sorted by key so that the items picked for a given random seed
+      # don't depend on where the values are in memory
+      self.items = [ x[key] for key in sorted(x.keys()) ]
+    else:
+      self.items = list(x)
+    self.cumulative_p = []
+    accumulate_p = 0
+    for item in self.items:
       accumulate_p += item.probability
-   assert False, "Shouldn't get here as the accumulated probability should always equal to 1"
+      self.cumulative_p.append(accumulate_p)
+    self.total_p = accumulate_p
+
+  def __len__(self):
+    return len(self.items)
+
+  # The item picked is the first one whose cumulative probability is >= p, so for
+  # a given random state this picks the same item as summing the probabilities would.
+  def Pick(self):
+    p = random.uniform(0, self.total_p)
+    index = bisect.bisect_left(self.cumulative_p, p)
+    assert index < len(self.items), "Shouldn't get here as the accumulated probability should always equal to 1"
+    return self.items[index]
+
+
+# This functions picks an item from the collection according to the associated probability distribution.
+# x : an item_sampler, or a collection (list or dictionary) where the values contain a field called probability.
+# If items are picked from the same collection repeatedly, x should be an item_sampler.
+def PickItemWithProbability(x):
+   if not isinstance(x, item_sampler):
+     x = item_sampler(x)
+   return x.Pick()
 
 
 # This function parses a file and pack the data into a dictionary
@@ -182,7 +229,19 @@ def WriteDictToFile(dict, file_name):
 
 
 # This function creates the utt2uniq file from the utterance id in utt2spk file
-def CreateCorruptedUtt2uniq(input_dir, output_dir, num_replicas, include_original, prefix):
+# If streaming is True, utt2spk is assumed to be sorted and is read line by line
+# rather than being loaded into memory.
+def CreateCorruptedUtt2uniq(input_dir, output_dir, num_replicas, include_original, prefix, streaming = False):
+    if streaming:
+        f = open(output_dir + "/utt2uniq", "w")
+        for i in GetSortedCopyIndexes(num_replicas, include_original, prefix):
+            for line in open(input_dir + "/utt2spk"):
+                parts = line.split()
+                if len(parts) > 0:
+                    f.write("{0} {1}\n".format(GetNewId(parts[0], prefix, i), parts[0]))
+        f.close()
+        return
+
     corrupted_utt2uniq = {}
     # Parse the utt2spk to get the utterance id
     utt2spk = ParseFileToDict(input_dir + "/utt2spk", value_processor = lambda x: " ".join(x))
@@ -203,28 +262,35 @@ def CreateCorruptedUtt2uniq(input_dir, output_dir, num_replicas, include_origina
 
 def AddPointSourceNoise(noise_addition_descriptor,  # descriptor to store the information of the noise added
                         room,  # the room selected
-                        pointsource_noise_list, # the point source noise list
+                        pointsource_noise_sampler, # the item_sampler of the point source noise list
                         pointsource_noise_addition_probability, # Probability of adding point-source noises
                         foreground_snrs, # the SNR for adding the foreground noises
                         background_snrs, # the SNR for adding the background noises
                         speech_dur,  # duration of the recording
                         max_noises_recording  # Maximum number of point-source noises that can be added
                         ):
-    if len(pointsource_noise_list) > 0 and random.random() < pointsource_noise_addition_probability and max_noises_recording >= 1:
+    if len(pointsource_noise_sampler) > 0 and random.random() < pointsource_noise_addition_probability and max_noises_recording >= 1:
         for k in range(random.randint(1, max_noises_recording)):
             # pick the RIR to reverberate the point-source noise
-            noise = PickItemWithProbability(pointsource_noise_list)
-            noise_rir = PickItemWithProbability(room.rir_list)
+            noise = PickItemWithProbability(pointsource_noise_sampler)
+            noise_rir = PickItemWithProbability(room.rir_sampler)
             # If it is a background noise, the noise will be extended and be added to the whole speech
             # if it is a foreground noise, the noise will not extended and be added at a random time of the speech
             if noise.bg_fg_type == "background":
                 noise_rvb_command = """wav-reverberate --impulse-response="{0}" --duration={1}""".format(noise_rir.rir_rspecifier, speech_dur)
+                noise_duration = speech_dur
                 noise_addition_descriptor['start_times'].append(0)
                 noise_addition_descriptor['snrs'].append(background_snrs.next())
             else:
                 noise_rvb_command = """wav-reverberate --impulse-response="{0}" """.format(noise_rir.rir_rspecifier)
+                noise_duration = None
                 noise_addition_descriptor['start_times'].append(round(random.random() * speech_dur, 2))
                 noise_addition_descriptor['snrs'].append(foreground_snrs.next())
+            noise_addition_descriptor['noises'].append({'wav': noise.noise_rspecifier,
+                                                        'rir': noise_rir.rir_rspecifier,
+                                                        'duration': noise_duration,
+                                                        'start_time': noise_addition_descriptor['start_times'][-1],
+                                                        'snr': noise_addition_descriptor['snrs'][-1]})
 
             # check if the rspecifier is a pipe or not
             if len(noise.noise_rspecifier.split()) == 1:
@@ -237,10 +303,13 @@ def AddPointSourceNoise(noise_addition_descriptor,  # descriptor to store the in
 
 # This function randomly decides whether to reverberate, and sample a RIR if it does
 # It also decides whether to add the appropriate noises 
-# This function return the string of options to the binary wav-reverberate
-def GenerateReverberationOpts(room_dict,  # the room dictionary, please refer to MakeRoomDict() for the format
-                              pointsource_noise_list, # the point source noise list
-                              iso_noise_dict, # the isotropic noise dictionary
+# This function returns a tuple (reverberate_opts, rvb_descriptor), where reverberate_opts
+# is the string of options to the binary wav-reverberate and rvb_descriptor describes the
+# same reverberation and noises in the format used by steps/data/reverberation_lib.py
+# (i.e. it's a recording dict as described there, without the 'id', 'wav' and 'shift_output' keys)
+def GenerateReverberationOpts(room_sampler,  # the item_sampler of the room dictionary, please refer to MakeRoomDict() for the format
+                              pointsource_noise_sampler, # the item_sampler of the point source noise list
+                              iso_noise_sampler_dict, # the isotropic noise dictionary, with the lists replaced by item_samplers
                               foreground_snrs, # the SNR for adding the foreground noises
                               background_snrs, # the SNR for adding the background noises
                               speech_rvb_probability, # Probability of reverberating a speech signal
@@ -250,24 +319,27 @@ def GenerateReverberationOpts(room_dict,  # the room dictionary, please refer to
                               max_noises_recording  # Maximum number of point-source noises that can be added
                               ):
     reverberate_opts = ""
+    rvb_descriptor = {'rir': None}
     noise_addition_descriptor = {'noise_io': [],
                                  'start_times': [],
-                                 'snrs': []}
+                                 'snrs': [],
+                                 'noises': []}
     # Randomly select the room
     # Here the room probability is a sum of the probabilities of the RIRs recorded in the room.
-    room = PickItemWithProbability(room_dict)
+    room = PickItemWithProbability(room_sampler)
     # Randomly select the RIR in the room
-    speech_rir = PickItemWithProbability(room.rir_list)
+    speech_rir = PickItemWithProbability(room.rir_sampler)
     if random.random() < speech_rvb_probability:
         # pick the RIR to reverberate the speech
         reverberate_opts += """--impulse-response="{0}" """.format(speech_rir.rir_rspecifier)
+        rvb_descriptor['rir'] = speech_rir.rir_rspecifier
 
-    rir_iso_noise_list = []
-    if speech_rir.room_id in iso_noise_dict:
-        rir_iso_noise_list = iso_noise_dict[speech_rir.room_id]
+    rir_iso_noise_sampler = []
+    if speech_rir.room_id in iso_noise_sampler_dict:
+        rir_iso_noise_sampler = iso_noise_sampler_dict[speech_rir.room_id]
     # Add the corresponding isotropic noise associated with the selected RIR
-    if len(rir_iso_noise_list) > 0 and random.random() < isotropic_noise_addition_probability:
-        isotropic_noise = PickItemWithProbability(rir_iso_noise_list)
+    if len(rir_iso_noise_sampler) > 0 and random.random() < isotropic_noise_addition_probability:
+        isotropic_noise = PickItemWithProbability(rir_iso_noise_sampler)
         # extend the isotropic noise to the length of the speech waveform
         # check if the rspecifier is a pipe or not
         if len(isotropic_noise.noise_rspecifier.split()) == 1:
@@ -276,10 +348,15 @@ def GenerateReverberationOpts(room_dict,  # the room dictionary, please refer to
             noise_addition_descriptor['noise_io'].append("{0} wav-reverberate --duration={1} - - |".format(isotropic_noise.noise_rspecifier, speech_dur))
         noise_addition_descriptor['start_times'].append(0)
         noise_addition_descriptor['snrs'].append(background_snrs.next())
+        noise_addition_descriptor['noises'].append({'wav': isotropic_noise.noise_rspecifier,
+                                                    'rir': None,
+                                                    'duration': speech_dur,
+                                                    'start_time': 0,
+                                                    'snr': noise_addition_descriptor['snrs'][-1]})
 
     noise_addition_descriptor = AddPointSourceNoise(noise_addition_descriptor,  # descriptor to store the information of the noise added
                                                     room,  # the room selected
-                                                    pointsource_noise_list, # the point source noise list
+                                                    pointsource_noise_sampler, # the item_sampler of the point source noise list
                                                     pointsource_noise_addition_probability, # Probability of adding point-source noises
                                                     foreground_snrs, # the SNR for adding the foreground noises
                                                     background_snrs, # the SNR for adding the background noises
@@ -293,8 +370,9 @@ def GenerateReverberationOpts(room_dict,  # the room dictionary, please refer to
         reverberate_opts += "--additive-signals='{0}' ".format(','.join(noise_addition_descriptor['noise_io']))
         reverberate_opts += "--start-times='{0}' ".format(','.join(map(lambda x:str(x), noise_addition_descriptor['start_times'])))
         reverberate_opts += "--snrs='{0}' ".format(','.join(map(lambda x:str(x), noise_addition_descriptor['snrs'])))
+    rvb_descriptor['noises'] = noise_addition_descriptor['noises']
 
-    return reverberate_opts
+    return (reverberate_opts, rvb_descriptor)
 
 # This function generates a new id from the input id
 # This is needed when we have to create multiple copies of the original data
@@ -327,11 +405,20 @@ def GenerateReverberatedWavScp(wav_scp,  # a dictionary whose values are the Kal
                                shift_output, # option whether to shift the output waveform
                                isotropic_noise_addition_probability, # Probability of adding isotropic noises
                                pointsource_noise_addition_probability, # Probability of adding point-source noises
-                               max_noises_per_minute # maximum number of point-source noises that can be added to a recording according to its duration
+                               max_noises_per_minute, # maximum number of point-source noises that can be added to a recording according to its duration
+                               output_audio_dir = None, # if not None, the reverberated recordings are written to wav archives in this directory
+                               num_jobs = 1 # number of processes used to write the reverberated recordings
                                ):
     foreground_snrs = list_cyclic_iterator(foreground_snr_array)
     background_snrs = list_cyclic_iterator(background_snr_array)
+    # the cumulative probabilities are computed once here, rather than for each recording
+    room_sampler = item_sampler(room_dict)
+    pointsource_noise_sampler = item_sampler(pointsource_noise_list)
+    iso_noise_sampler_dict = dict((key, item_sampler(iso_noise_dict[key])) for key in iso_noise_dict.keys())
     corrupted_wav_scp = {}
+    # the recordings to be reverberated by steps/data/reverberation_lib.py,
+    # if output_audio_dir is specified
+    recordings_to_write = []
     keys = wav_scp.keys()
     keys.sort()
     if include_original:
@@ -348,9 +435,9 @@ def GenerateReverberatedWavScp(wav_scp,  # a dictionary whose values are the Kal
             speech_dur = durations[recording_id]
             max_noises_recording = math.floor(max_noises_per_minute * speech_dur / 60)
 
-            reverberate_opts = GenerateReverberationOpts(room_dict,  # the room dictionary, please refer to MakeRoomDict() for the format
-                                                         pointsource_noise_list, # the point source noise list
-                                                         iso_noise_dict, # the isotropic noise dictionary
+            (reverberate_opts, rvb_descriptor) = GenerateReverberationOpts(room_sampler,  # the item_sampler of the room dictionary
+                                                         pointsource_noise_sampler, # the item_sampler of the point source noise list
+                                                         iso_noise_sampler_dict, # the isotropic noise dictionary, with the lists replaced by item_samplers
                                                          foreground_snrs, # the SNR for adding the foreground noises
                                                          background_snrs, # the SNR for adding the background noises
                                                          speech_rvb_probability, # Probability of reverberating a speech signal
@@ -361,20 +448,252 @@ def GenerateReverberatedWavScp(wav_scp,  # a dictionary whose values are the Kal
                                                          )       
 
             # prefix using index 0 is reserved for original data e.g. rvb0_swb0035 corresponds to the swb0035 recording in original data
+            new_recording_id = GetNewId(recording_id, prefix, i)
             if reverberate_opts == "" or i == 0:
                 wav_corrupted_pipe = "{0}".format(wav_original_pipe) 
+            elif output_audio_dir is not None:
+                rvb_descriptor['id'] = new_recording_id
+                rvb_descriptor['wav'] = wav_scp[recording_id]
+                rvb_descriptor['shift_output'] = (shift_output == "true")
+                recordings_to_write.append(rvb_descriptor)
+                continue
             else:
                 wav_corrupted_pipe = "{0} wav-reverberate --shift-output={1} {2} - - |".format(wav_original_pipe, shift_output, reverberate_opts)
 
-            new_recording_id = GetNewId(recording_id, prefix, i)
             corrupted_wav_scp[new_recording_id] = wav_corrupted_pipe
 
+    if len(recordings_to_write) > 0:
+        print("Writing {0} reverberated recordings to {1}...".format(len(recordings_to_write), output_audio_dir))
+        corrupted_wav_scp.update(rvb_lib.WriteReverberatedArchives(recordings_to_write, output_audio_dir, num_jobs))
+
     WriteDictToFile(corrupted_wav_scp, output_dir + "/wav.scp")
 
 
+# This function returns the indexes of the copies of the data (0 being the original data)
+# in the order in which their recording ids are sorted, e.g. [0, 1, 10, 2, 3, ...]
+# for the prefix "rvb"; if the input is sorted, writing the copies one after another
+# in this order gives a sorted output.
+def GetSortedCopyIndexes(num_replicas, include_original, prefix):
+    if include_original:
+        start_index = 0
+    else:
+        start_index = 1
+    return sorted(range(start_index, num_replicas+1), key = lambda i: GetNewId("", prefix, i))
+
+
+# This function seeds the random number generator for the copy 'copy' of the recording
+# 'recording_id', so that the corruption of each recording does not depend on the
+# other recordings, and hence on how the data is split into shards.
+def SeedForRecording(random_seed, copy, recording_id):
+    seed_string = "{0} {1} {2}".format(random_seed, copy, recording_id)
+    random.seed(int(hashlib.md5(seed_string.encode('utf-8')).hexdigest()[:16], 16))
+
+
+# This function splits the wav.scp and reco2dur of the input data directory into
+# 'num_shards' shards of consecutive recordings, in the directories <shards_dir>/<n>
+# (n = 1..num_shards).  The files are read line by line, so they are never loaded
+# into memory.  If the shards already exist (i.e. the script is being rerun) they are reused.
+def SplitDataForShards(input_dir, shards_dir, num_shards):
+    if os.path.isfile(shards_dir + "/.split_done"):
+        return
+    num_recordings = sum(1 for line in open(input_dir + "/wav.scp") if len(line.split()) > 0)
+    wav_scp = open(input_dir + "/wav.scp")
+    reco2dur = open(input_dir + "/reco2dur")
+    for shard in range(num_shards):
+        shard_dir = "{0}/{1}".format(shards_dir, shard + 1)
+        if not os.path.exists(shard_dir):
+            os.makedirs(shard_dir)
+        shard_wav_scp = open(shard_dir + "/wav.scp", "w")
+        shard_reco2dur = open(shard_dir + "/reco2dur", "w")
+        num_shard_recordings = ((shard + 1) * num_recordings) // num_shards - (shard * num_recordings) // num_shards
+        while num_shard_recordings > 0:
+            wav_line = wav_scp.readline()
+            if len(wav_line.split()) == 0:
+                continue
+            dur_line = reco2dur.readline()
+            if dur_line.split()[:1] != wav_line.split()[:1]:
+                raise Exception("{0}/wav.scp and {0}/reco2dur must contain the same recordings in the same order "
+                                "to use --num-shards".format(input_dir))
+            shard_wav_scp.write(wav_line)
+            shard_reco2dur.write(dur_line)
+            num_shard_recordings -= 1
+        shard_wav_scp.close()
+        shard_reco2dur.close()
+    open(shards_dir + "/.split_done", "w").close()
+
+
+# This function does the same as GenerateReverberatedWavScp() for a shard of the data, i.e. for
+# the recordings in <shard_dir>/wav.scp, writing the corrupted wav.scp of each copy of the data
+# to <shard_dir>/wav.<copy>.scp.  If output_audio_dir is not None, the corrupted recordings of the
+# shard are written to the wav archive <output_audio_dir>/wav.<shard>.ark.  Finally it writes the
+# file <shard_dir>/.done, so that the shard is not processed again if the script is rerun.
+# It is called in a separate process for each shard, so the arguments are passed as a tuple.
+def GenerateReverberatedWavScpForShard(args):
+    (shard_dir, # directory of the shard, created by SplitDataForShards()
+     audio_archive, # the wav archive to write the corrupted recordings to, or None
+     rir_list, # the RIR list; the room dictionary is created from it by MakeRoomDict()
+     pointsource_noise_list, # the point source noise list
+     iso_noise_dict, # the isotropic noise dictionary
+     foreground_snr_array, # the SNR for adding the foreground noises
+     background_snr_array, # the SNR for adding the background noises
+     num_replicas, # Number of replicate to generated for the data
+     include_original, # include a copy of the original data
+     prefix, # prefix for the id of the corrupted utterances
+     speech_rvb_probability, # Probability of reverberating a speech signal
+     shift_output, # option whether to shift the output waveform
+     isotropic_noise_addition_probability, # Probability of adding isotropic noises
+     pointsource_noise_addition_probability, # Probability of adding point-source noises
+     max_noises_per_minute, # maximum number of point-source noises that can be added to a recording according to its duration
+     random_seed # the seed from which the seed of each recording is derived
+     ) = args
+    if os.path.isfile(shard_dir + "/.done"):
+        return
+    room_sampler = item_sampler(MakeRoomDict(rir_list))
+    pointsource_noise_sampler = item_sampler(pointsource_noise_list)
+    iso_noise_sampler_dict = dict((key, item_sampler(iso_noise_dict[key])) for key in iso_noise_dict.keys())
+    durations = ParseFileToDict(shard_dir + "/reco2dur", value_processor = lambda x: float(x[0]))
+
+    recordings_to_write = []
+    # a list of (copy, recording-id, rxfilename) tuples; the rxfilename is None for
+    # the recordings in recordings_to_write, until they are written
+    corrupted_wav_scp = []
+    copy_indexes = GetSortedCopyIndexes(num_replicas, include_original, prefix)
+    for i in copy_indexes:
+        for line in open(shard_dir + "/wav.scp"):
+            parts = line.split()
+            if len(parts) == 0:
+                continue
+            recording_id = parts[0]
+            wav_original_pipe = " ".join(parts[1:])
+            # check if it is really a pipe
+            if len(parts) == 2:
+                wav_original_pipe = "cat {0} |".format(wav_original_pipe)
+            new_recording_id = GetNewId(recording_id, prefix, i)
+            if i == 0:
+                corrupted_wav_scp.append((i, new_recording_id, wav_original_pipe))
+                continue
+
+            SeedForRecording(random_seed, i, recording_id)
+            speech_dur = durations[recording_id]
+            max_noises_recording = math.floor(max_noises_per_minute * speech_dur / 60)
+            (reverberate_opts, rvb_descriptor) = GenerateReverberationOpts(room_sampler,
+                                                         pointsource_noise_sampler,
+                                                         iso_noise_sampler_dict,
+                                                         list_cyclic_iterator(list(foreground_snr_array)),
+                                                         list_cyclic_iterator(list(background_snr_array)),
+                                                         speech_rvb_probability,
+                                                         isotropic_noise_addition_probability,
+                                                         pointsource_noise_addition_probability,
+                                                         speech_dur,
+                                                         max_noises_recording
+                                                         )
+            if reverberate_opts == "":
+                wav_corrupted_pipe = wav_original_pipe
+            elif audio_archive is not None:
+                rvb_descriptor['id'] = new_recording_id
+                rvb_descriptor['wav'] = " ".join(parts[1:])
+                rvb_descriptor['shift_output'] = (shift_output == "true")
+                recordings_to_write.append(rvb_descriptor)
+                wav_corrupted_pipe = None
+            else:
+                wav_corrupted_pipe = "{0} wav-reverberate --shift-output={1} {2} - - |".format(wav_original_pipe, shift_output, reverberate_opts)
+            corrupted_wav_scp.append((i, new_recording_id, wav_corrupted_pipe))
+
+    archive_entries = {}
+    if len(recordings_to_write) > 0:
+        archive_entries = dict(rvb_lib.WriteReverberatedArchive(audio_archive, recordings_to_write))
+
+    files = dict((i, open("{0}/wav.{1}.scp.tmp".format(shard_dir, i), "w")) for i in copy_indexes)
+    for (i, recording_id, wav_corrupted_pipe) in corrupted_wav_scp:
+        if wav_corrupted_pipe is None:
+            wav_corrupted_pipe = archive_entries[recording_id]
+        files[i].write("{0} {1}\n".format(recording_id, wav_corrupted_pipe))
+    for i in copy_indexes:
+        files[i].close()
+        os.rename("{0}/wav.{1}.scp.tmp".format(shard_dir, i), "{0}/wav.{1}.scp".format(shard_dir, i))
+    open(shard_dir + "/.done", "w").close()
+
+
+# This function does the same as GenerateReverberatedWavScp(), but the data is split into
+# 'num_shards' shards, which are processed by 'num_jobs' processes, and no file is loaded into
+# memory as a whole (it requires wav.scp and reco2dur to be sorted in the same order, as they
+# are in a valid data directory).  The random number generator is seeded for each recording, so
+# the output does not depend on the number of shards (but it is not the same as the output of
+# GenerateReverberatedWavScp() with the same seed).
+# The shards are kept in <output_dir>/shards until the output is complete: if the script is
+# interrupted, rerunning it with the same options reuses the shards that were finished.
+def GenerateReverberatedWavScpSharded(input_dir, # input data directory
+                                      output_dir, # output directory to write the corrupted wav.scp
+                                      room_dict,  # the room dictionary, please refer to MakeRoomDict() for the format
+                                      pointsource_noise_list, # the point source noise list
+                                      iso_noise_dict, # the isotropic noise dictionary
+                                      foreground_snr_array, # the SNR for adding the foreground noises
+                                      background_snr_array, # the SNR for adding the background noises
+                                      num_replicas, # Number of replicate to generated for the data
+                                      include_original, # include a copy of the original data
+                                      prefix, # prefix for the id of the corrupted utterances
+                                      speech_rvb_probability, # Probability of reverberating a speech signal
+                                      shift_output, # option whether to shift the output waveform
+                                      isotropic_noise_addition_probability, # Probability of adding isotropic noises
+                                      pointsource_noise_addition_probability, # Probability of adding point-source noises
+                                      max_noises_per_minute, # maximum number of point-source noises that can be added to a recording according to its duration
+                                      output_audio_dir, # if not None, the reverberated recordings are written to wav archives in this directory
+                                      num_jobs, # number of processes used to process the shards
+                                      num_shards, # number of shards
+                                      random_seed # the seed from which the seed of each recording is derived
+                                      ):
+    shards_dir = output_dir + "/shards"
+    if not os.path.exists(shards_dir):
+        os.makedirs(shards_dir)
+    # the options are recorded so that shards done with different options are not reused
+    options = repr([input_dir, sorted(room_dict.keys()), len(pointsource_noise_list), sorted(iso_noise_dict.keys()),
+                    foreground_snr_array, background_snr_array, num_replicas, include_original, prefix,
+                    speech_rvb_probability, shift_output, isotropic_noise_addition_probability,
+                    pointsource_noise_addition_probability, max_noises_per_minute, output_audio_dir,
+                    num_shards, random_seed])
+    if os.path.isfile(shards_dir + "/options"):
+        if open(shards_dir + "/options").read().strip() != options:
+            raise Exception("{0} contains shards created with different options; "
+                            "please delete it and rerun.".format(shards_dir))
+    else:
+        f = open(shards_dir + "/options", "w")
+        f.write(options + "\n")
+        f.close()
+
+    SplitDataForShards(input_dir, shards_dir, num_shards)
+
+    if output_audio_dir is not None:
+        if not os.path.exists(output_audio_dir):
+            os.makedirs(output_audio_dir)
+        output_audio_dir = os.path.abspath(output_audio_dir)
+    rir_list = [ rir for key in sorted(room_dict.keys()) for rir in room_dict[key].rir_list ]
+    shard_args = [ ("{0}/{1}".format(shards_dir, shard),
+                    None if output_audio_dir is None else "{0}/wav.{1}.ark".format(output_audio_dir, shard),
+                    rir_list, pointsource_noise_list, iso_noise_dict,
+                    foreground_snr_array, background_snr_array, num_replicas, include_original, prefix,
+                    speech_rvb_probability, shift_output, isotropic_noise_addition_probability,
+                    pointsource_noise_addition_probability, max_noises_per_minute, random_seed)
+                   for shard in range(1, num_shards + 1) ]
+    if num_jobs > 1:
+        pool = multiprocessing.Pool(num_jobs)
+        pool.map(GenerateReverberatedWavScpForShard, shard_args, chunksize = 1)
+        pool.close()
+        pool.join()
+    else:
+        for args in shard_args:
+            GenerateReverberatedWavScpForShard(args)
+
+    f = open(output_dir + "/wav.scp", "w")
+    for i in GetSortedCopyIndexes(num_replicas, include_original, prefix):
+        for shard in range(1, num_shards + 1):
+            shutil.copyfileobj(open("{0}/{1}/wav.{2}.scp".format(shards_dir, shard, i)), f)
+    f.close()
+    shutil.rmtree(shards_dir)
+
+
 # This function replicate the entries in files like segments, utt2spk, text
+# The input file is read once for each copy, rather than being kept in memory
 def AddPrefixToFields(input_file, output_file, num_replicas, include_original, prefix, field = [0]):
-    list = map(lambda x: x.strip(), open(input_file))
     f = open(output_file, "w")
     if include_original:
         start_index = 0
@@ -382,7 +701,8 @@ def AddPrefixToFields(input_file, output_file, num_replicas, include_original, p
         start_index = 1
     
     for i in range(start_index, num_replicas+1):
-        for line in list:
+        for line in open(input_file):
+            line = line.strip()
             if len(line) > 0 and line[0] != ';':
                 split1 = line.split()
                 for j in field:
@@ -408,27 +728,40 @@ def CreateReverberatedCopy(input_dir,
                            shift_output, # option whether to shift the output waveform
                            isotropic_noise_addition_probability, # Probability of adding isotropic noises
                            pointsource_noise_addition_probability, # Probability of adding point-source noises
-                           max_noises_per_minute  # maximum number of point-source noises that can be added to a recording according to its duration
+                           max_noises_per_minute,  # maximum number of point-source noises that can be added to a recording according to its duration
+                           output_audio_dir = None, # if not None, the reverberated recordings are written to wav archives in this directory
+                           num_jobs = 1, # number of processes used to write the reverberated recordings
+                           num_shards = 0, # if > 0, the data is processed in this many shards by GenerateReverberatedWavScpSharded()
+                           random_seed = 0 # the seed from which the seed of each recording is derived, if num_shards > 0
                            ):
     
-    wav_scp = ParseFileToDict(input_dir + "/wav.scp", value_processor = lambda x: " ".join(x))
     if not os.path.isfile(input_dir + "/reco2dur"):
         print("Getting the duration of the recordings...");
         read_entire_file="false"
-        for value in wav_scp.values():
+        for line in open(input_dir + "/wav.scp"):
+            value = " ".join(line.split()[1:])
             # we will add more checks for sox commands which modify the header as we come across these cases in our data
             if "sox" in value and "speed" in value:
                 read_entire_file="true"
                 break
         data_lib.RunKaldiCommand("wav-to-duration --read-entire-file={1} scp:{0}/wav.scp ark,t:{0}/reco2dur".format(input_dir, read_entire_file))
-    durations = ParseFileToDict(input_dir + "/reco2dur", value_processor = lambda x: float(x[0]))
     foreground_snr_array = map(lambda x: float(x), foreground_snr_string.split(':'))
     background_snr_array = map(lambda x: float(x), background_snr_string.split(':'))
 
-    GenerateReverberatedWavScp(wav_scp, durations, output_dir, room_dict, pointsource_noise_list, iso_noise_dict,
-               foreground_snr_array, background_snr_array, num_replicas, include_original, prefix, 
-               speech_rvb_probability, shift_output, isotropic_noise_addition_probability, 
-               pointsource_noise_addition_probability, max_noises_per_minute)
+    if num_shards > 0:
+        GenerateReverberatedWavScpSharded(input_dir, output_dir, room_dict, pointsource_noise_list, iso_noise_dict,
+                   foreground_snr_array, background_snr_array, num_replicas, include_original, prefix,
+                   speech_rvb_probability, shift_output, isotropic_noise_addition_probability,
+                   pointsource_noise_addition_probability, max_noises_per_minute,
+                   output_audio_dir, num_jobs, num_shards, random_seed)
+    else:
+        wav_scp = ParseFileToDict(input_dir + "/wav.scp", value_processor = lambda x: " ".join(x))
+        durations = ParseFileToDict(input_dir + "/reco2dur", value_processor = lambda x: float(x[0]))
+        GenerateReverberatedWavScp(wav_scp, durations, output_dir, room_dict, pointsource_noise_list, iso_noise_dict,
+                   foreground_snr_array, background_snr_array, num_replicas, include_original, prefix, 
+                   speech_rvb_probability, shift_output, isotropic_noise_addition_probability, 
+                   pointsource_noise_addition_probability, max_noises_per_minute,
+                   output_audio_dir, num_jobs)
 
     AddPrefixToFields(input_dir + "/utt2spk", output_dir + "/utt2spk", num_replicas, include_original, prefix, field = [0,1])
     data_lib.RunKaldiCommand("utils/utt2spk_to_spk2utt.pl <{output_dir}/utt2spk >{output_dir}/spk2utt"
@@ -438,7 +771,8 @@ def CreateReverberatedCopy(input_dir,
         AddPrefixToFields(input_dir + "/utt2uniq", output_dir + "/utt2uniq", num_replicas, include_original, prefix, field =[0])
     else:
         # Create the utt2uniq file
-        CreateCorruptedUtt2uniq(input_dir, output_dir, num_replicas, include_original, prefix)
+        CreateCorruptedUtt2uniq(input_dir, output_dir, num_replicas, include_original, prefix,
+                                streaming = (num_shards > 0))
 
     if os.path.isfile(input_dir + "/text"):
         AddPrefixToFields(input_dir + "/text", output_dir + "/text", num_replicas, include_original, prefix, field =[0])
@@ -563,6 +897,7 @@ def MakeRoomDict(rir_list):
     # the probability of the room is the sum of probabilities of its RIR
     for key in room_dict.keys():
         room_dict[key].probability = sum(rir.probability for rir in room_dict[key].rir_list)
+        setattr(room_dict[key], "rir_sampler", item_sampler(room_dict[key].rir_list))
 
     assert almost_equal(sum(room_dict[key].probability for key in room_dict.keys()), 1.0)
 
@@ -660,7 +995,11 @@ def Main():
                            shift_output = args.shift_output,
                            isotropic_noise_addition_probability = args.isotropic_noise_addition_probability,
                            pointsource_noise_addition_probability = args.pointsource_noise_addition_probability,
-                           max_noises_per_minute = args.max_noises_per_minute)
+                           max_noises_per_minute = args.max_noises_per_minute,
+                           output_audio_dir = args.output_audio_dir,
+                           num_jobs = args.num_jobs,
+                           num_shards = args.num_shards,
+                           random_seed = args.random_seed)
 
 if __name__ == "__main__":
     Main()
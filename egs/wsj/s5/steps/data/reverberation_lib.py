@@ -0,0 +1,281 @@
+# Apache 2.0.
+
+# This library reverberates recordings and adds noises to them in python, with
+# numpy, doing the same computation as the binary wav-reverberate.  It is used
+# by reverberate_data_dir.py when the --output-audio-dir option is given: the
+# reverberated audio is then computed once, by a pool of processes, and written
+# into Kaldi wav archives, instead of wav.scp containing wav-reverberate
+# commands that are rerun each time the data is read.
+#
+# Each process reads every RIR and noise only once, and keeps the FFTs of
+# the RIRs so they are not recomputed for each recording they are used with.
+#
+# Scripts are expected to be run from the egs directory (e.g. egs/wsj/s5), and
+# load this library with
+#   rvb_lib = imp.load_source('rvb_lib', 'steps/data/reverberation_lib.py')
+
+import io
+import math
+import os
+import subprocess
+import wave
+import multiprocessing
+
+try:
+    import numpy as np
+    have_numpy = True
+except ImportError:
+    have_numpy = False
+
+
+def CheckNumpyIsAvailable():
+    if not have_numpy:
+        raise Exception("numpy is required to compute the reverberated audio in python; "
+                        "please install it, or do not use --output-audio-dir.")
+
+
+# The recordings are described to this library by dicts of the following
+# form, which can be passed to the worker processes:
+#  { 'id': the id of the reverberated recording, e.g. 'rvb1_swb0035',
+#    'wav': the rspecifier of the original recording (a filename or a command
+#           ending in '|'),
+#    'rir': the rspecifier of the RIR, or None if the speech is not reverberated,
+#    'shift_output': True if the output is shifted by the position of the peak
+#                    of the RIR,
+#    'noises': a list of dicts, one for each additive noise, of the form
+#         { 'wav': the rspecifier of the noise,
+#           'rir': the rspecifier of the RIR to reverberate the noise with, or None,
+#           'duration': the duration (in seconds) to which the noise is extended
+#                       by repeating it, or None to keep its own duration,
+#           'start_time': the time (in seconds) at which the noise is added,
+#           'snr': the SNR (in dB) of the speech relative to the noise } }
+# The noises in 'noises' correspond to the options --additive-signals,
+# --start-times and --snrs of wav-reverberate, and the noise dicts to the
+# wav-reverberate commands in --additive-signals.
+
+
+# Per-process caches of the waveforms of RIRs and noises, indexed by
+# rspecifier, and of the FFTs of the RIRs, indexed by (rspecifier, fft_length).
+wave_cache = {}
+rir_fft_cache = {}
+
+
+# Reads a wav file, or the output of a command if the rspecifier ends in '|',
+# and returns a pair (sampling-rate, samples).  Only single-channel files are
+# supported; we don't silently pick or mix down channels.  Like in Kaldi, the
+# samples are not scaled, i.e. they have the range of 16-bit integers.
+def ReadWave(rspecifier):
+    rspecifier = rspecifier.strip()
+    if rspecifier.endswith('|'):
+        data = subprocess.check_output(rspecifier[:-1], shell = True)
+    else:
+        with open(rspecifier, 'rb') as f:
+            data = f.read()
+    reader = wave.open(io.BytesIO(data), 'rb')
+    if reader.getsampwidth() != 2:
+        raise Exception("only 16-bit wav files are supported: {0}".format(rspecifier))
+    if reader.getnchannels() != 1:
+        raise Exception("only single-channel wav files are supported, but {0} has {1} "
+                        "channels; select a channel (e.g. with 'sox <wav> -t wav - remix 1 |'), "
+                        "or do not use --output-audio-dir.".format(
+                            rspecifier, reader.getnchannels()))
+    samples = np.frombuffer(reader.readframes(reader.getnframes()), dtype = '<i2')
+    samp_freq = reader.getframerate()
+    reader.close()
+    return (samp_freq, samples.astype(np.float64))
+
+
+# Returns the contents of a 16-bit mono wav file with the samples 'samples',
+# which are truncated and clipped to 16-bit integers like in Kaldi.
+def WaveToBytes(samp_freq, samples):
+    samples = np.clip(np.trunc(samples), -32768, 32767).astype('<i2')
+    output = io.BytesIO()
+    writer = wave.open(output, 'wb')
+    writer.setnchannels(1)
+    writer.setsampwidth(2)
+    writer.setframerate(samp_freq)
+    writer.writeframes(samples.tobytes())
+    writer.close()
+    return output.getvalue()
+
+
+# Like ReadWave(), but each RIR or noise is only read once per process.
+def GetWave(rspecifier):
+    if rspecifier not in wave_cache:
+        wave_cache[rspecifier] = ReadWave(rspecifier)
+    return wave_cache[rspecifier]
+
+
+# Returns the FFT length used when convolving with a filter of length
+# 'filter_length'; this is the same as in FFTbasedBlockConvolveSignals().
+def GetFftLength(filter_length):
+    return 1 << int(math.ceil(math.log(4 * filter_length, 2)))
+
+
+# Convolves 'signal' with 'filter', returning a signal of length
+# len(signal) + len(filter) - 1, like FFTbasedBlockConvolveSignals() in Kaldi.
+# The signal is split into blocks that are transformed together, and the
+# blocks of the output are overlapped and added.  If given, 'filter_fft' is the
+# rfft of 'filter' with the FFT length given by GetFftLength().
+def FftConvolve(signal, filter, filter_fft = None):
+    filter_length = len(filter)
+    output_length = len(signal) + filter_length - 1
+    fft_length = GetFftLength(filter_length)
+    block_length = fft_length - filter_length + 1
+    if filter_fft is None:
+        filter_fft = np.fft.rfft(filter, fft_length)
+    num_blocks = (output_length + block_length - 1) // block_length
+    blocks = np.zeros((num_blocks, block_length))
+    blocks.flat[:len(signal)] = signal
+    output_blocks = np.fft.irfft(np.fft.rfft(blocks, fft_length, axis = 1) * filter_fft,
+                                 fft_length, axis = 1)
+    # overlap and add: the first block_length samples of each block go into
+    # its own position and the rest is added to the start of the next block.
+    output = np.zeros((num_blocks + 1) * block_length)
+    output[:num_blocks * block_length] = output_blocks[:, :block_length].ravel()
+    tails = np.zeros((num_blocks, block_length))
+    tails[:, :filter_length - 1] = output_blocks[:, block_length:]
+    output[block_length:] += tails.ravel()
+    return output[:output_length]
+
+
+# Convolves 'signal' with the RIR 'rir_rspecifier', using the cached FFT of
+# the RIR.
+def ConvolveWithRir(signal, rir_rspecifier, rir):
+    key = (rir_rspecifier, GetFftLength(len(rir)))
+    if key not in rir_fft_cache:
+        rir_fft_cache[key] = np.fft.rfft(rir, key[1])
+    return FftConvolve(signal, rir, rir_fft_cache[key])
+
+
+# Returns the power of 'signal' after convolving it with the early part of
+# 'rir' (from 1ms before its peak to 50ms after it); this is the signal power
+# relative to which the SNRs of the noises are computed.  It's the same as
+# ComputeEarlyReverbEnergy() in wav-reverberate.
+def ComputeEarlyReverbEnergy(rir, signal, samp_freq):
+    peak_index = int(np.argmax(rir))
+    early_rir_start_index = max(peak_index - int(0.001 * samp_freq), 0)
+    early_rir_end_index = min(peak_index + int(0.05 * samp_freq), len(rir))
+    early_reverb = FftConvolve(signal, rir[early_rir_start_index:early_rir_end_index])
+    return np.dot(early_reverb, early_reverb) / len(early_reverb)
+
+
+# Repeats 'signal' to fill 'length' samples (or truncates it), like
+# AddVectorsOfUnequalLength() in Kaldi.
+def ExtendSignal(signal, length):
+    if len(signal) == 0:
+        return np.zeros(length)
+    return np.tile(signal, (length + len(signal) - 1) // len(signal))[:length]
+
+
+# This does the same as the binary wav-reverberate (with its default
+# --normalize-output=true), for a single channel.  'noises' is a list of
+# (noise-samples, start-time, snr) tuples.  'duration' is the duration of the
+# output in seconds, or None for the duration of the input.
+def Reverberate(samples, samp_freq, rir_rspecifier = None, shift_output = True,
+                noises = [], duration = None):
+    num_samp_input = len(samples)
+    num_samp_output = (int(samp_freq * duration) if duration is not None and duration > 0
+                       else num_samp_input)
+    power_before_reverb = np.dot(samples, samples) / num_samp_input
+    shift_index = 0
+    if rir_rspecifier is not None:
+        (rir_samp_freq, rir) = GetWave(rir_rspecifier)
+        if rir_samp_freq != samp_freq:
+            raise Exception("sampling rate of RIR {0} is {1}, expected {2}".format(
+                    rir_rspecifier, rir_samp_freq, samp_freq))
+        rir = rir / (1 << 15)
+        early_energy = ComputeEarlyReverbEnergy(rir, samples, rir_samp_freq)
+        samples = ConvolveWithRir(samples, rir_rspecifier, rir)
+        if shift_output:
+            shift_index = int(np.argmax(rir))
+    else:
+        early_energy = power_before_reverb
+        samples = samples.copy()
+
+    for (noise, start_time, snr) in noises:
+        noise_power = np.dot(noise, noise) / len(noise)
+        if noise_power == 0:
+            continue
+        scale_factor = math.sqrt(math.pow(10, -snr / 10.0) * early_energy / noise_power)
+        offset = int(start_time * samp_freq)
+        add_length = min(len(samples) - offset, len(noise))
+        if add_length > 0:
+            samples[offset:offset + add_length] += scale_factor * noise[:add_length]
+
+    power_after_reverb = np.dot(samples, samples) / len(samples)
+    if power_after_reverb > 0:
+        samples *= math.sqrt(power_before_reverb / power_after_reverb)
+
+    if num_samp_output <= num_samp_input:
+        return samples[shift_index:shift_index + num_samp_output]
+    else:
+        return ExtendSignal(samples[shift_index:shift_index + num_samp_input],
+                            num_samp_output)
+
+
+# Returns the samples of the reverberated recording described by 'recording'
+# (see the description of the recording dicts at the top of this file), as a
+# pair (sampling-rate, samples).
+def ReverberateRecording(recording):
+    (samp_freq, samples) = ReadWave(recording['wav'])
+    noises = []
+    for noise in recording['noises']:
+        # each noise is itself reverberated and extended, like in the
+        # wav-reverberate commands in --additive-signals.
+        (noise_samp_freq, noise_samples) = GetWave(noise['wav'])
+        if noise_samp_freq != samp_freq:
+            raise Exception("sampling rate of noise {0} is {1}, expected {2}".format(
+                    noise['wav'], noise_samp_freq, samp_freq))
+        noise_samples = Reverberate(noise_samples, samp_freq, noise['rir'],
+                                    duration = noise['duration'])
+        noises.append((noise_samples, noise['start_time'], noise['snr']))
+    samples = Reverberate(samples, samp_freq, recording['rir'], recording['shift_output'],
+                          noises)
+    return (samp_freq, samples)
+
+
+# Writes the reverberated recordings in the list 'recordings' to the wav
+# archive 'ark_file', and returns a list of (recording-id, rxfilename) pairs
+# where the rxfilenames are of the form <ark_file>:<offset>, as in scp files.
+# This is what each worker process does.
+def WriteReverberatedArchive(ark_file, recordings):
+    ans = []
+    f = open(ark_file, 'wb')
+    for recording in recordings:
+        (samp_freq, samples) = ReverberateRecording(recording)
+        f.write((recording['id'] + ' ').encode())
+        ans.append((recording['id'], '{0}:{1}'.format(ark_file, f.tell())))
+        f.write(WaveToBytes(samp_freq, samples))
+    f.close()
+    return ans
+
+
+def WriteReverberatedArchiveStar(args):
+    return WriteReverberatedArchive(*args)
+
+
+# Computes the reverberated recordings in the list 'recordings' with
+# 'num_jobs' processes, writing them into 'num_jobs' wav archives
+# <output_dir>/wav.<n>.ark.  Returns a dict from recording-id to the rxfilename
+# of the recording in the archives, for use in wav.scp.
+def WriteReverberatedArchives(recordings, output_dir, num_jobs):
+    CheckNumpyIsAvailable()
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    output_dir = os.path.abspath(output_dir)
+    # the recordings are split round-robin, so that the shards contain similar
+    # amounts of audio.
+    job_args = [ ('{0}/wav.{1}.ark'.format(output_dir, n + 1), recordings[n::num_jobs])
+                 for n in range(num_jobs) ]
+    if num_jobs > 1:
+        pool = multiprocessing.Pool(num_jobs)
+        results = pool.map(WriteReverberatedArchiveStar, job_args)
+        pool.close()
+        pool.join()
+    else:
+        results = map(WriteReverberatedArchiveStar, job_args)
+    ans = {}
+    for result in results:
+        ans.update(result)
+    return ans
@@ -38,24 +38,38 @@ num_jobs=$(cat $dir/num_jobs) || exit 1
 
 mkdir -p $dir/log
 
-rm $dir/phone_stats.*.gz 2>/dev/null || true
-
-$cmd JOB=1:$num_jobs $dir/log/get_phone_alignments.JOB.log \
-  set -o pipefail '&&' ali-to-phones --write-lengths=true "$model"  \
-      "ark:gunzip -c $dir/ali.JOB.gz|" ark,t:- \| \
-   sed -E 's/^[^ ]+ //' \| \
-   awk 'BEGIN{FS=" ; "; OFS="\n";} {print "begin " $1; print "end " $NF; for (n=1;n<=NF;n++) print "all " $n; }' \| \
-   sort \| uniq -c \| gzip -c '>' $dir/phone_stats.JOB.gz || exit 1
-
-if ! $cmd $dir/log/analyze_alignments.log \
-  gunzip -c "$dir/phone_stats.*.gz" \| \
-  steps/diagnostic/analyze_phone_length_stats.py $lang; then
-  echo "$0: analyze_phone_length_stats.py failed, but ignoring the error (it's just for diagnostics)"
+rm $dir/phone_stats.*.gz $dir/phone_lengths.*.ark 2>/dev/null || true
+
+if python -c 'import numpy' 2>/dev/null; then
+  # analyze_phone_length_stats.py can read the phone lengths directly from
+  # binary archives, which is much faster than sorting and counting them as text.
+  $cmd JOB=1:$num_jobs $dir/log/get_phone_alignments.JOB.log \
+    ali-to-phones --write-lengths=true "$model" \
+      "ark:gunzip -c $dir/ali.JOB.gz|" ark:$dir/phone_lengths.JOB.ark || exit 1
+
+  stats_opts=$(for n in $(seq $num_jobs); do echo -n " --phone-lengths-rspecifier=ark:$dir/phone_lengths.$n.ark"; done)
+  if ! $cmd $dir/log/analyze_alignments.log \
+    steps/diagnostic/analyze_phone_length_stats.py $stats_opts $lang; then
+    echo "$0: analyze_phone_length_stats.py failed, but ignoring the error (it's just for diagnostics)"
+  fi
+else
+  $cmd JOB=1:$num_jobs $dir/log/get_phone_alignments.JOB.log \
+    set -o pipefail '&&' ali-to-phones --write-lengths=true "$model"  \
+        "ark:gunzip -c $dir/ali.JOB.gz|" ark,t:- \| \
+     sed -E 's/^[^ ]+ //' \| \
+     awk 'BEGIN{FS=" ; "; OFS="\n";} {print "begin " $1; print "end " $NF; for (n=1;n<=NF;n++) print "all " $n; }' \| \
+     sort \| uniq -c \| gzip -c '>' $dir/phone_stats.JOB.gz || exit 1
+
+  if ! $cmd $dir/log/analyze_alignments.log \
+    gunzip -c "$dir/phone_stats.*.gz" \| \
+    steps/diagnostic/analyze_phone_length_stats.py $lang; then
+    echo "$0: analyze_phone_length_stats.py failed, but ignoring the error (it's just for diagnostics)"
+  fi
 fi
 
 grep WARNING $dir/log/analyze_alignments.log
 echo "$0: see stats in $dir/log/analyze_alignments.log"
 
-rm $dir/phone_stats.*.gz
+rm $dir/phone_stats.*.gz $dir/phone_lengths.*.ark 2>/dev/null
 
 exit 0
@@ -43,51 +43,81 @@ mkdir -p $dir/log
 
 rm $dir/phone_stats.*.gz 2>/dev/null || true
 
+# If numpy is available, the python scripts read the phone lengths, per-frame
+# phones and lattice depths directly from binary archives, which is much
+# faster than sorting and counting them as text.
+if python -c 'import numpy' 2>/dev/null; then
+  read_tables=true
+  depth_wspecifier="ark:$dir/depth_tmp.JOB.ark"
+else
+  read_tables=false
+  depth_wspecifier="ark,t:|gzip -c > $dir/depth_tmp.JOB.gz"
+fi
+
 # this writes two archives of depth_tmp and ali_tmp of (depth per frame, alignment per frame).
 $cmd JOB=1:$num_jobs $dir/log/lattice_best_path.JOB.log \
-  lattice-depth-per-frame "ark:gunzip -c $dir/lat.JOB.gz|" "ark,t:|gzip -c > $dir/depth_tmp.JOB.gz" ark:- \| \
+  lattice-depth-per-frame "ark:gunzip -c $dir/lat.JOB.gz|" "$depth_wspecifier" ark:- \| \
   lattice-best-path --acoustic-scale=$acwt ark:- ark:/dev/null "ark,t:|gzip -c >$dir/ali_tmp.JOB.gz" || exit 1
 
-$cmd JOB=1:$num_jobs $dir/log/get_lattice_stats.JOB.log \
-  ali-to-phones --write-lengths=true "$model" "ark:gunzip -c $dir/ali_tmp.JOB.gz|" ark,t:- \| \
-  sed -E 's/^[^ ]+ //' \| \
-  awk 'BEGIN{FS=" ; "; OFS="\n";} {print "begin " $1; print "end " $NF; for (n=1;n<=NF;n++) print "all " $n; }' \| \
-  sort \| uniq -c \| gzip -c '>' $dir/phone_stats.JOB.gz || exit 1
-
-
-$cmd $dir/log/analyze_alignments.log \
-  gunzip -c "$dir/phone_stats.*.gz" \| \
-  steps/diagnostic/analyze_phone_length_stats.py $lang || exit 1
+if $read_tables; then
+  $cmd JOB=1:$num_jobs $dir/log/get_lattice_stats.JOB.log \
+    ali-to-phones --write-lengths=true "$model" "ark:gunzip -c $dir/ali_tmp.JOB.gz|" \
+      ark:$dir/phone_lengths_tmp.JOB.ark || exit 1
+
+  stats_opts=$(for n in $(seq $num_jobs); do echo -n " --phone-lengths-rspecifier=ark:$dir/phone_lengths_tmp.$n.ark"; done)
+  $cmd $dir/log/analyze_alignments.log \
+    steps/diagnostic/analyze_phone_length_stats.py $stats_opts $lang || exit 1
+else
+  $cmd JOB=1:$num_jobs $dir/log/get_lattice_stats.JOB.log \
+    ali-to-phones --write-lengths=true "$model" "ark:gunzip -c $dir/ali_tmp.JOB.gz|" ark,t:- \| \
+    sed -E 's/^[^ ]+ //' \| \
+    awk 'BEGIN{FS=" ; "; OFS="\n";} {print "begin " $1; print "end " $NF; for (n=1;n<=NF;n++) print "all " $n; }' \| \
+    sort \| uniq -c \| gzip -c '>' $dir/phone_stats.JOB.gz || exit 1
+
+
+  $cmd $dir/log/analyze_alignments.log \
+    gunzip -c "$dir/phone_stats.*.gz" \| \
+    steps/diagnostic/analyze_phone_length_stats.py $lang || exit 1
+fi
 
 grep WARNING $dir/log/analyze_alignments.log
 echo "$0: see stats in $dir/log/analyze_alignments.log"
 
 
-# note: below, some things that would be interpreted by the shell have to be
-# escaped since it needs to be passed to $cmd.
-# the 'paste' command will paste together the phone-indexes and the depths
-# so that one line will be like utt-id1 phone1 phone2 phone3 .. utt-id1 depth1 depth2 depth3 ...
-# the awk command computes counts of pairs (phone, lattice-depth) and outputs lines
-# containing 3 integers representing:
-#   phone lattice_depth, count[phone,lattice_depth]
-$cmd JOB=1:$num_jobs $dir/log/lattice_best_path.JOB.log \
-  ali-to-phones --per-frame=true "$model" "ark:gunzip -c $dir/ali_tmp.JOB.gz|" ark,t:- \| \
-  paste /dev/stdin '<(' gunzip -c $dir/depth_tmp.JOB.gz  ')'  \| \
-  awk '{ half=NF/2; for (n=2; n<=half; n++) { m=n+half; count[$n " " $m]++;}} END{for(k in count) print k, count[k]; }' \| \
-  gzip -c '>' $dir/depth_stats_tmp.JOB.gz
-
-
-$cmd $dir/log/analyze_lattice_depth_stats.log \
-  gunzip -c "$dir/depth_stats_tmp.*.gz" \| \
-  steps/diagnostic/analyze_lattice_depth_stats.py $lang || exit 1
+if $read_tables; then
+  $cmd JOB=1:$num_jobs $dir/log/lattice_best_path.JOB.log \
+    ali-to-phones --per-frame=true "$model" "ark:gunzip -c $dir/ali_tmp.JOB.gz|" \
+      ark:$dir/phones_tmp.JOB.ark || exit 1
+
+  stats_opts=$(for n in $(seq $num_jobs); do echo -n " --phones-rspecifier=ark:$dir/phones_tmp.$n.ark --depth-rspecifier=ark:$dir/depth_tmp.$n.ark"; done)
+  $cmd $dir/log/analyze_lattice_depth_stats.log \
+    steps/diagnostic/analyze_lattice_depth_stats.py $stats_opts $lang || exit 1
+else
+  # note: below, some things that would be interpreted by the shell have to be
+  # escaped since it needs to be passed to $cmd.
+  # the 'paste' command will paste together the phone-indexes and the depths
+  # so that one line will be like utt-id1 phone1 phone2 phone3 .. utt-id1 depth1 depth2 depth3 ...
+  # the awk command computes counts of pairs (phone, lattice-depth) and outputs lines
+  # containing 3 integers representing:
+  #   phone lattice_depth, count[phone,lattice_depth]
+  $cmd JOB=1:$num_jobs $dir/log/lattice_best_path.JOB.log \
+    ali-to-phones --per-frame=true "$model" "ark:gunzip -c $dir/ali_tmp.JOB.gz|" ark,t:- \| \
+    paste /dev/stdin '<(' gunzip -c $dir/depth_tmp.JOB.gz  ')'  \| \
+    awk '{ half=NF/2; for (n=2; n<=half; n++) { m=n+half; count[$n " " $m]++;}} END{for(k in count) print k, count[k]; }' \| \
+    gzip -c '>' $dir/depth_stats_tmp.JOB.gz
+
+
+  $cmd $dir/log/analyze_lattice_depth_stats.log \
+    gunzip -c "$dir/depth_stats_tmp.*.gz" \| \
+    steps/diagnostic/analyze_lattice_depth_stats.py $lang || exit 1
+fi
 
 grep Overall $dir/log/analyze_lattice_depth_stats.log
 echo "$0: see stats in $dir/log/analyze_lattice_depth_stats.log"
 
 
-rm $dir/phone_stats.*.gz
-rm $dir/depth_tmp.*.gz
-rm $dir/depth_stats_tmp.*.gz
+rm $dir/phone_stats.*.gz $dir/depth_tmp.*.gz $dir/depth_stats_tmp.*.gz 2>/dev/null
+rm $dir/phone_lengths_tmp.*.ark $dir/phones_tmp.*.ark $dir/depth_tmp.*.ark 2>/dev/null
 rm $dir/ali_tmp.*.gz
 
 exit 0
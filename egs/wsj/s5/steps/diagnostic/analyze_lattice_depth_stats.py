@@ -7,8 +7,11 @@
 from __future__ import print_function
 import argparse
 import sys, os
+import imp
 from collections import defaultdict
 
+kaldi_table = imp.load_source('ktl', 'steps/kaldi_table_lib.py')
+
 
 parser = argparse.ArgumentParser(description="This script reads stats created in analyze_lats.sh "
                                  "to print information about lattice depths broken down per phone. "
@@ -20,6 +23,16 @@ parser.add_argument("--frequency-cutoff-percentage", type = float,
                     "(between 0 and 100), of frequency at which we print stats "
                     "for a phone.")
 
+parser.add_argument("--phones-rspecifier", type = str, action = "append",
+                    default = [], help="Binary archive or scp of per-frame phones, as written "
+                    "by 'ali-to-phones --per-frame=true'; may be repeated, once per "
+                    "--depth-rspecifier option.  If specified, the stats are computed from "
+                    "these directly (this requires numpy), instead of being read from the "
+                    "standard input.")
+parser.add_argument("--depth-rspecifier", type = str, action = "append",
+                    default = [], help="Binary archive or scp of per-frame lattice depths, as "
+                    "written by lattice-depth-per-frame; see --phones-rspecifier.")
+
 parser.add_argument("lang",
                     help="Language directory, e.g. data/lang.")
 
@@ -73,16 +86,9 @@ for p in [ -1 ] + phone_int2text.keys():
 
 total_frames = 0
 
-while True:
-    line = sys.stdin.readline()
-    if line == '':
-        break
-    a = line.split()
-    if len(a) != 3:
-        sys.exit("analyze_lattice_depth_stats.py: reading stdin, could not interpret line: " + line)
+def AccumulateStats(phone, depth, count):
+    global total_frames
     try:
-        phone, depth, count = [ int(x) for x in a ]
-
         phone_depth_counts[phone][depth] += count
         total_frames += count
         if phone in nonsilence:
@@ -92,7 +98,56 @@ while True:
         phone_depth_counts[universal_phone][depth] += count
     except Exception as e:
         sys.exit("analyze_lattice_depth_stats.py: unexpected phone {0} "
-                 "seen (lang directory mismatch?): line is {1}, error is {2}".format(phone, line, str(e)))
+                 "seen (lang directory mismatch?): error is {1}".format(phone, str(e)))
+
+# This does the same as the 'paste ... | awk' pipeline in analyze_lats.sh,
+# i.e. it counts the (phone, lattice-depth) pairs over all frames, but reads
+# the per-frame phones and depths directly from the archives.
+def AccumulateStatsFromTables(phones_rspecifiers, depth_rspecifiers):
+    np = kaldi_table.np
+    counts = defaultdict(int)
+    try:
+        for phones_rspecifier, depth_rspecifier in zip(phones_rspecifiers, depth_rspecifiers):
+            depths = dict(kaldi_table.ReadTable(depth_rspecifier, 'int_vector'))
+            for utt, phones in kaldi_table.ReadTable(phones_rspecifier, 'int_vector'):
+                if not utt in depths:
+                    sys.exit("analyze_lattice_depth_stats.py: no lattice depth for "
+                             "utterance {0} in {1}".format(utt, depth_rspecifier))
+                if depths[utt].shape != phones.shape:
+                    sys.exit("analyze_lattice_depth_stats.py: length mismatch between phones "
+                             "and lattice depth for utterance {0}".format(utt))
+                # count the distinct (phone, depth) pairs, encoded as one int64.
+                keys = phones.astype(np.int64) * (1 << 32) + depths[utt]
+                unique_keys, unique_counts = np.unique(keys, return_counts = True)
+                for key, count in zip(unique_keys.tolist(), unique_counts.tolist()):
+                    counts[key] += count
+    except kaldi_table.KaldiTableException as e:
+        sys.exit("analyze_lattice_depth_stats.py: error reading archives: {0}".format(str(e)))
+    for key, count in counts.items():
+        AccumulateStats(key >> 32, key & 0xffffffff, count)
+
+if len(args.phones_rspecifier) > 0 or len(args.depth_rspecifier) > 0:
+    if len(args.phones_rspecifier) != len(args.depth_rspecifier):
+        sys.exit("analyze_lattice_depth_stats.py: --phones-rspecifier and --depth-rspecifier "
+                 "must be given the same number of times")
+    try:
+        kaldi_table.CheckNumpyIsAvailable()
+    except Exception as e:
+        sys.exit("analyze_lattice_depth_stats.py: " + str(e))
+    AccumulateStatsFromTables(args.phones_rspecifier, args.depth_rspecifier)
+else:
+    while True:
+        line = sys.stdin.readline()
+        if line == '':
+            break
+        a = line.split()
+        if len(a) != 3:
+            sys.exit("analyze_lattice_depth_stats.py: reading stdin, could not interpret line: " + line)
+        try:
+            phone, depth, count = [ int(x) for x in a ]
+        except ValueError:
+            sys.exit("analyze_lattice_depth_stats.py: reading stdin, could not interpret line: " + line)
+        AccumulateStats(phone, depth, count)
 
 if total_frames == 0:
     sys.exit("analyze_lattice_depth_stats.py: read no input")
@@ -7,8 +7,11 @@
 from __future__ import print_function
 import argparse
 import sys, os
+import imp
 from collections import defaultdict
 
+kaldi_table = imp.load_source('ktl', 'steps/kaldi_table_lib.py')
+
 
 parser = argparse.ArgumentParser(description="This script reads stats created in analyze_alignments.sh "
                                  "to print information about phone lengths in alignments.  It's principally "
@@ -22,6 +25,12 @@ parser.add_argument("--frequency-cutoff-percentage", type = float,
                     "(between 0 and 100), of frequency at which we print stats "
                     "for a phone.")
 
+parser.add_argument("--phone-lengths-rspecifier", type = str, action = "append",
+                    default = [], help="Binary archive or scp (e.g. ark:exp/tri4b/phone_lengths.1.ark) "
+                    "of the output of 'ali-to-phones --write-lengths=true'; may be repeated. "
+                    "If specified, the stats are computed from these directly (this "
+                    "requires numpy), instead of being read from the standard input.")
+
 parser.add_argument("lang",
                     help="Language directory, e.g. data/lang.")
 
@@ -84,25 +93,69 @@ total_frames = defaultdict(int)
 # total_frames is a dict from num-frames to count of num-utterances with that
 # num-frames.
 
-while True:
-    line = sys.stdin.readline()
-    if line == '':
-        break
-    a = line.split()
-    if len(a) != 4:
-        sys.exit("analyze_phone_length_stats.py: reading stdin, could not interpret line: " + line)
+def AccumulateStats(count, boundary_type, phone, length):
     try:
-        count, boundary_type, phone, length = a
-        total_phones[boundary_type] += int(count)
-        total_frames[boundary_type] += int(count) * int(length)
-        phone_lengths[boundary_type][int(phone)][int(length)] += int(count)
-        if int(phone) in nonsilence:
+        total_phones[boundary_type] += count
+        total_frames[boundary_type] += count * length
+        phone_lengths[boundary_type][phone][length] += count
+        if phone in nonsilence:
             nonsilence_phone = 0
-            phone_lengths[boundary_type][nonsilence_phone][int(length)] += int(count)
+            phone_lengths[boundary_type][nonsilence_phone][length] += count
     except Exception as e:
         sys.exit("analyze_phone_length_stats.py: unexpected phone {0} "
                  "seen (lang directory mismatch?): {1}".format(phone, str(e)))
 
+# This does the same as the pipeline in analyze_alignments.sh that
+# produces the lines 'count boundary-type phone length' on the standard input,
+# i.e. it counts the first ('begin'), last ('end') and all ('all') (phone,
+# length) pairs of each utterance, but reads the archives directly.
+def AccumulateStatsFromTables(rspecifiers):
+    np = kaldi_table.np
+    begin_pairs = []
+    end_pairs = []
+    all_pairs = []
+    try:
+        for rspecifier in rspecifiers:
+            for utt, pairs in kaldi_table.ReadTable(rspecifier, 'int_pair_vector'):
+                if pairs.shape[0] == 0:
+                    continue
+                begin_pairs.append(pairs[0])
+                end_pairs.append(pairs[-1])
+                all_pairs.append(pairs)
+    except Exception as e:
+        sys.exit("analyze_phone_length_stats.py: error reading phone lengths: {0}".format(str(e)))
+    if len(all_pairs) == 0:
+        return
+    for boundary_type, pairs in [ ('begin', np.array(begin_pairs)),
+                                  ('end', np.array(end_pairs)),
+                                  ('all', np.concatenate(all_pairs)) ]:
+        # count the distinct (phone, length) pairs, encoded as one int64.
+        keys = pairs[:, 0].astype(np.int64) * (1 << 32) + pairs[:, 1]
+        unique_keys, counts = np.unique(keys, return_counts = True)
+        for key, count in zip(unique_keys.tolist(), counts.tolist()):
+            AccumulateStats(count, boundary_type, key >> 32, key & 0xffffffff)
+
+if len(args.phone_lengths_rspecifier) > 0:
+    try:
+        kaldi_table.CheckNumpyIsAvailable()
+    except Exception as e:
+        sys.exit("analyze_phone_length_stats.py: " + str(e))
+    AccumulateStatsFromTables(args.phone_lengths_rspecifier)
+else:
+    while True:
+        line = sys.stdin.readline()
+        if line == '':
+            break
+        a = line.split()
+        if len(a) != 4:
+            sys.exit("analyze_phone_length_stats.py: reading stdin, could not interpret line: " + line)
+        try:
+            count, boundary_type, phone, length = a
+            count, phone, length = int(count), int(phone), int(length)
+        except ValueError:
+            sys.exit("analyze_phone_length_stats.py: reading stdin, could not interpret line: " + line)
+        AccumulateStats(count, boundary_type, phone, length)
+
 if len(phone_lengths) == 0:
     sys.exit("analyze_phone_length_stats.py: read no input")
 
@@ -0,0 +1,286 @@
+# Apache 2.0.
+
+# This library reads Kaldi tables (scp files and binary archives) directly from
+# python, without piping them through Kaldi binaries and parsing text.  The
+# archives are memory-mapped, so matrices, vectors and integer vectors are
+# returned as numpy arrays that are views into the mapped file (no copy is
+# made), except for compressed matrices which have to be decompressed.
+#
+# Scripts are expected to be run from the egs directory (e.g. egs/wsj/s5), and
+# load this library with
+#   kaldi_table = imp.load_source('ktl', 'steps/kaldi_table_lib.py')
+#
+# Only binary objects in real files can be read this way; rspecifiers
+# involving pipes, e.g. "ark:gunzip -c foo.gz|", and text-mode archives are
+# rejected with an exception.
+
+import re
+import struct
+import collections
+
+try:
+    import numpy as np
+    have_numpy = True
+except ImportError:
+    have_numpy = False
+
+
+class KaldiTableException(Exception):
+    pass
+
+
+def CheckNumpyIsAvailable():
+    if not have_numpy:
+        raise KaldiTableException("numpy is required to read Kaldi tables from python; "
+                                  "please install it.")
+
+
+# The holder types we know how to read.  They correspond to the
+# following writers in the C++ code:
+#  'matrix'          BaseFloatMatrixWriter, BaseFloatVectorWriter, and double
+#                    versions of these (FM, DM, FV, DV, CM and CM2 objects).
+#  'int_vector'      Int32VectorWriter, e.g. alignments, or the output of
+#                    ali-to-phones --per-frame or lattice-depth-per-frame.
+#  'int_pair_vector' Int32PairVectorWriter, e.g. the output of ali-to-phones
+#                    --write-lengths.
+holder_types = ['matrix', 'int_vector', 'int_pair_vector']
+
+# Binary Kaldi matrices and vectors are written as the binary marker "\0B"
+# followed by a token ("FM ", "DM ", "FV ", "DV ", or "CM "/"CM2 " for
+# compressed matrices), the dimensions as a size byte (4) plus an int32, and
+# the data in row-major order.  This is also used by the binary matrix
+# reader and writer in steps/nnet3/nnet3_train_lib.py.
+kaldi_binary_types = {'FM' : ['matrix', '<f4'], 'DM' : ['matrix', '<f8'],
+                      'FV' : ['vector', '<f4'], 'DV' : ['vector', '<f8']}
+
+if have_numpy:
+    # Int32VectorWriter writes every element as a size byte followed by the
+    # int32 value, so the values can be viewed as a field of a packed struct.
+    int_vector_dtype = np.dtype([('size', 'i1'), ('value', '<i4')])
+    int_pair_vector_dtype = np.dtype([('size1', 'i1'), ('first', '<i4'),
+                                      ('size2', 'i1'), ('second', '<i4')])
+
+
+class KaldiMmapCache:
+    """ A least-recently-used cache of memory-mapped files.  Reading many scp
+        entries that point into a few archives only maps each archive once;
+        when more than max_open_files archives are in use, the least recently
+        used one is dropped from the cache (its memory stays mapped as long
+        as arrays that were returned from it are alive). """
+    def __init__(self, max_open_files = 32):
+        self.max_open_files = max_open_files
+        self.mmaps = collections.OrderedDict()
+
+    def Get(self, file_name):
+        CheckNumpyIsAvailable()
+        try:
+            buf = self.mmaps.pop(file_name)
+        except KeyError:
+            try:
+                buf = np.memmap(file_name, dtype = np.uint8, mode = 'r')
+            except ValueError:
+                # numpy cannot map empty files.
+                buf = np.zeros(0, dtype = np.uint8)
+            while len(self.mmaps) >= self.max_open_files:
+                self.mmaps.popitem(last = False)
+        self.mmaps[file_name] = buf
+        return buf
+
+    def Clear(self):
+        self.mmaps.clear()
+
+mmap_cache = KaldiMmapCache()
+
+
+def ParseRange(range_string, rxfilename):
+    # Kaldi ranges are inclusive, e.g. "0:99" is the first 100 rows; an empty
+    # range (or ":") selects everything.
+    range_string = range_string.strip()
+    if range_string in ['', ':']:
+        return None
+    mat_obj = re.match("^([0-9]+):([0-9]+)$", range_string)
+    if mat_obj is None:
+        raise KaldiTableException("Invalid range specifier in {0}".format(rxfilename))
+    [first, last] = map(int, mat_obj.groups())
+    if last < first:
+        raise KaldiTableException("Invalid range specifier in {0}".format(rxfilename))
+    return [first, last + 1]
+
+def ParseRxfilename(rxfilename):
+    """ Parses an rxfilename as found in scp files, e.g.
+        exp/foo/feats.1.ark:1234[0:99,10:19], into [file_name, offset,
+        row_range, col_range].  The offset is 0 if absent, and the ranges
+        are None or [begin, end) lists. """
+    if rxfilename.endswith('|') or rxfilename.startswith('|') or rxfilename == '-':
+        raise KaldiTableException("Cannot memory-map the pipe or stream {0}".format(rxfilename))
+    row_range = None
+    col_range = None
+    mat_obj = re.match("^(.*)\[([^\[\]]*)\]$", rxfilename)
+    if mat_obj is not None:
+        [rxfilename, ranges] = mat_obj.groups()
+        ranges = ranges.split(',')
+        if len(ranges) > 2:
+            raise KaldiTableException("Invalid range specifier in {0}".format(rxfilename))
+        row_range = ParseRange(ranges[0], rxfilename)
+        if len(ranges) == 2:
+            col_range = ParseRange(ranges[1], rxfilename)
+    mat_obj = re.match("^(.+):([0-9]+)$", rxfilename)
+    if mat_obj is not None:
+        return [mat_obj.groups()[0], int(mat_obj.groups()[1]), row_range, col_range]
+    return [rxfilename, 0, row_range, col_range]
+
+def ParseRspecifier(rspecifier):
+    """ Splits an rspecifier like "ark:foo.ark" or "scp,s,cs:foo.scp" into
+        [type, file_name], where type is 'ark' or 'scp'. """
+    mat_obj = re.match("^(ark|scp)(,[a-z,]*)?:(.+)$", rspecifier)
+    if mat_obj is None:
+        raise KaldiTableException("Invalid rspecifier {0}".format(rspecifier))
+    [table_type, options, file_name] = mat_obj.groups()
+    if options is not None and 't' in options.split(','):
+        raise KaldiTableException("Text-mode archives cannot be memory-mapped: {0}".format(rspecifier))
+    if file_name.endswith('|') or file_name == '-':
+        raise KaldiTableException("Cannot memory-map the pipe or stream in {0}".format(rspecifier))
+    return [table_type, file_name]
+
+
+def ReadToken(buf, offset):
+    end = offset
+    size = buf.shape[0]
+    while end < size and buf[end] != 32:    # 32 is ' '
+        end += 1
+    if end == size:
+        raise KaldiTableException("Unexpected end of file while reading a token")
+    return [buf[offset:end].tostring(), end + 1]
+
+def ReadInt32(buf, offset):
+    if offset + 5 > buf.shape[0]:
+        raise KaldiTableException("Unexpected end of file while reading an int32")
+    if buf[offset] != 4:
+        raise KaldiTableException("Expected an int32 in the binary Kaldi object, "
+                                  "got size {0}".format(buf[offset]))
+    return [struct.unpack('<i', buf[offset + 1:offset + 5].tostring())[0], offset + 5]
+
+def GetView(buf, offset, dtype, count, what):
+    dtype = np.dtype(dtype)
+    end = offset + dtype.itemsize * count
+    if end > buf.shape[0]:
+        raise KaldiTableException("Unexpected end of file while reading a Kaldi {0}".format(what))
+    return [np.frombuffer(buf, dtype = dtype, count = count, offset = offset), end]
+
+def ReadMatrixObject(buf, offset):
+    [token, offset] = ReadToken(buf, offset)
+    if token in kaldi_binary_types:
+        [kind, dtype] = kaldi_binary_types[token]
+        if kind == 'matrix':
+            [num_rows, offset] = ReadInt32(buf, offset)
+            [num_cols, offset] = ReadInt32(buf, offset)
+            shape = (num_rows, num_cols)
+        else:
+            [dim, offset] = ReadInt32(buf, offset)
+            shape = (dim,)
+        [data, offset] = GetView(buf, offset, dtype, int(np.prod(shape)), kind)
+        return [data.reshape(shape), offset]
+    elif token in ['CM', 'CM2']:
+        if offset + 16 > buf.shape[0]:
+            raise KaldiTableException("Unexpected end of file while reading a compressed matrix")
+        [min_value, value_range, num_rows, num_cols] = struct.unpack('<ffii', buf[offset:offset + 16].tostring())
+        offset += 16
+        if token == 'CM':
+            # each column has 4 uint16 percentiles (0, 25, 75 and 100) and the
+            # data is one byte per element, stored column by column; see
+            # CompressedMatrix::CopyToMat().
+            [col_headers, offset] = GetView(buf, offset, '<u2', 4 * num_cols, 'compressed matrix')
+            [data, offset] = GetView(buf, offset, np.uint8, num_rows * num_cols, 'compressed matrix')
+            percentiles = min_value + value_range * (col_headers.reshape(num_cols, 4).astype(np.float32) *
+                                                     (1.0 / 65535.0))
+            [p0, p25, p75, p100] = map(lambda x: percentiles[:, x:x+1], [0, 1, 2, 3])
+            data = data.reshape(num_cols, num_rows).astype(np.float32)
+            matrix = np.where(data <= 64, p0 + (p25 - p0) * data * (1 / 64.0),
+                              np.where(data <= 192, p25 + (p75 - p25) * (data - 64) * (1 / 128.0),
+                                       p75 + (p100 - p75) * (data - 192) * (1 / 63.0)))
+            return [np.ascontiguousarray(matrix.T, dtype = np.float32), offset]
+        else:
+            [data, offset] = GetView(buf, offset, '<u2', num_rows * num_cols, 'compressed matrix')
+            data = data.reshape(num_rows, num_cols).astype(np.float32)
+            return [(min_value + value_range * (data * (1.0 / 65535.0))).astype(np.float32), offset]
+    raise KaldiTableException("Unknown token {0} while reading a binary Kaldi object".format(token))
+
+def ReadObject(buf, offset, holder_type = 'matrix'):
+    """ Reads the binary object that starts at 'offset' (at the binary marker
+        "\0B") in the uint8 array 'buf', and returns [array, end_offset].  For
+        the 'int_vector' and 'int_pair_vector' holder types the array is a
+        strided view of the int32 values (of shape (n,) and (n, 2) resp.)
+        """
+    if buf[offset:offset + 2].tostring() != '\0B':
+        raise KaldiTableException("Expected a binary Kaldi object at offset {0}; "
+                                  "text-mode objects are not supported".format(offset))
+    offset += 2
+    if holder_type == 'matrix':
+        return ReadMatrixObject(buf, offset)
+    elif holder_type in ['int_vector', 'int_pair_vector']:
+        [size, offset] = ReadInt32(buf, offset)
+        if holder_type == 'int_vector':
+            [data, offset] = GetView(buf, offset, int_vector_dtype, size, 'integer vector')
+            return [data['value'], offset]
+        [data, offset] = GetView(buf, offset, int_pair_vector_dtype, size, 'integer-pair vector')
+        # view the two int32 fields as the columns of an (n, 2) array,
+        # without copying.
+        pairs = np.ndarray(shape = (size, 2), dtype = '<i4', buffer = buf,
+                           offset = offset - data.nbytes + 1,
+                           strides = (int_pair_vector_dtype.itemsize, 5))
+        return [pairs, offset]
+    raise KaldiTableException("Unknown holder type {0}, expected one of {1}".format(
+        holder_type, " ".join(holder_types)))
+
+def ReadRxfilename(rxfilename, holder_type = 'matrix', cache = None):
+    """ Reads the object that an scp entry like exp/foo/feats.1.ark:1234 (or
+        with a range, e.g. exp/foo/feats.1.ark:1234[0:99]) points to. """
+    if cache is None:
+        cache = mmap_cache
+    [file_name, offset, row_range, col_range] = ParseRxfilename(rxfilename)
+    buf = cache.Get(file_name)
+    [array, end_offset] = ReadObject(buf, offset, holder_type)
+    if row_range is not None or col_range is not None:
+        if array.ndim != 2:
+            raise KaldiTableException("Range specifiers are only supported for matrices: {0}".format(rxfilename))
+        for this_range, dim in [[row_range, array.shape[0]], [col_range, array.shape[1]]]:
+            if this_range is not None and this_range[1] > dim:
+                raise KaldiTableException("Range exceeds the matrix dimension {0} in {1}".format(dim, rxfilename))
+        if row_range is not None:
+            array = array[row_range[0]:row_range[1]]
+        if col_range is not None:
+            array = array[:, col_range[0]:col_range[1]]
+    return array
+
+def ReadScp(scp_file, holder_type = 'matrix', cache = None):
+    """ A generator of (key, array) pairs for the entries of an scp file. """
+    for line in open(scp_file):
+        parts = line.split(None, 1)
+        if len(parts) == 0:
+            continue
+        if len(parts) != 2:
+            raise KaldiTableException("Bad line in scp file {0}: {1}".format(scp_file, line))
+        yield parts[0], ReadRxfilename(parts[1].strip(), holder_type, cache)
+
+def ReadArk(ark_file, holder_type = 'matrix', cache = None):
+    """ A generator of (key, array) pairs for the entries of a binary
+        archive, in the order they appear in the file. """
+    if cache is None:
+        cache = mmap_cache
+    buf = cache.Get(ark_file)
+    offset = 0
+    size = buf.shape[0]
+    while offset < size:
+        [key, offset] = ReadToken(buf, offset)
+        if key == '':
+            raise KaldiTableException("Empty key in archive {0}".format(ark_file))
+        [array, offset] = ReadObject(buf, offset, holder_type)
+        yield key, array
+
+def ReadTable(rspecifier, holder_type = 'matrix', cache = None):
+    """ A generator of (key, array) pairs for an rspecifier such as
+        "ark:exp/foo/ali.1.ark" or "scp:data/train/feats.scp". """
+    [table_type, file_name] = ParseRspecifier(rspecifier)
+    if table_type == 'ark':
+        return ReadArk(file_name, holder_type, cache)
+    return ReadScp(file_name, holder_type, cache)
@@ -208,7 +208,8 @@ def ComputeTrainCvProbabilities(dir, iter, egs_dir, l2_regularize, xent_regulari
 
     model = '{0}/{1}.mdl'.format(dir, iter)
 
-    train_lib.RunKaldiCommand("""
+    # the valid and train diagnostics are run in parallel, also with wait = True
+    train_lib.RunKaldiCommands(["""
 {command} {dir}/log/compute_prob_valid.{iter}.log \
   nnet3-chain-compute-prob --l2-regularize={l2} --leaky-hmm-coefficient={leaky} \
   --xent-regularize={xent_reg} \
@@ -218,9 +219,8 @@ def ComputeTrainCvProbabilities(dir, iter, egs_dir, l2_regularize, xent_regulari
                dir = dir, iter = iter, model = model,
                l2 = l2_regularize, leaky = leaky_hmm_coefficient,
                xent_reg = xent_regularize,
-               egs_dir = egs_dir), wait = wait)
-
-    train_lib.RunKaldiCommand("""
+               egs_dir = egs_dir),
+                                """
 {command} {dir}/log/compute_prob_train.{iter}.log \
   nnet3-chain-compute-prob --l2-regularize={l2} --leaky-hmm-coefficient={leaky} \
   --xent-regularize={xent_reg} \
@@ -232,7 +232,7 @@ def ComputeTrainCvProbabilities(dir, iter, egs_dir, l2_regularize, xent_regulari
                model = model,
                l2 = l2_regularize, leaky = leaky_hmm_coefficient,
                xent_reg = xent_regularize,
-               egs_dir = egs_dir), wait = wait)
+               egs_dir = egs_dir)], wait = wait)
 
 def ComputeProgress(dir, iter, run_opts, wait=False):
 
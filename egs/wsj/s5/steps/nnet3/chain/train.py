@@ -191,6 +191,26 @@ def GetArgs():
                         default = 8,
                         help="Number of neural net jobs to run in parallel at"
                         " the end of training")
+    parser.add_argument("--trainer.optimization.max-concurrent-jobs", type=int, dest='max_concurrent_jobs',
+                        default = None,
+                        help="""Maximum number of training jobs of an iteration
+                        that are run at the same time; further jobs are
+                        launched as soon as any running job finishes.
+                        If not specified all the jobs are run at once.""")
+    parser.add_argument("--trainer.optimization.straggler-factor", type=float, dest='straggler_factor',
+                        default = None,
+                        help="""If specified, a training job which has been
+                        running for more than this many times the median
+                        duration of the finished jobs of the iteration gets a
+                        backup job on a different archive, and the output of
+                        whichever finishes first is used. e.g. 1.5""")
+    parser.add_argument("--trainer.optimization.pipelined-iterations", type=str, dest='pipelined_iterations',
+                        default = False, action = train_lib.StrToBoolAction,
+                        choices = ["true", "false"],
+                        help="""If true, the diagnostics and clean-up of an
+                        iteration run in the background, concurrently with the
+                        training of the following iterations, instead of
+                        being interleaved with them.""")
     parser.add_argument("--trainer.optimization.max-models-combine", type=int, dest='max_models_combine',
                         default = 20,
                         help = "The is the maximum number of models we give to"
@@ -312,6 +332,8 @@ def ProcessArgs(args):
         run_opts.combine_queue_opt = ""
 
     run_opts.command = args.command
+    run_opts.max_concurrent_jobs = args.max_concurrent_jobs
+    run_opts.straggler_factor = args.straggler_factor
 
     return [args, run_opts]
 
@@ -322,6 +344,8 @@ class RunOpts:
         self.train_queue_opt = None
         self.combine_queue_opt = None
         self.parallel_train_opts = None
+        self.max_concurrent_jobs = None
+        self.straggler_factor = None
 
 
 def TrainNewModels(dir, iter, srand, num_jobs, num_archives_processed, num_archives,
@@ -345,20 +369,36 @@ def TrainNewModels(dir, iter, srand, num_jobs, num_archives_processed, num_archi
     if right_deriv_truncate is not None:
         deriv_time_opts += " --optimization.max-deriv-time={0}".format(int(chunk-width-right_deriv_truncate))
 
-    processes = []
+    jobs = []
     for job in range(1,num_jobs+1):
         k = num_archives_processed + job - 1 # k is a zero-based index that we will derive
                                                # the other indexes from.
         archive_index = (k % num_archives) + 1 # work out the 1-based archive index.
         frame_shift = (archive_index + k/num_archives) % frame_subsampling_factor
         # previous : frame_shift = (k/num_archives) % frame_subsampling_factor
-        if job == 1:
-            cur_cache_io_opts = cache_io_opts + " --write-cache={dir}/cache.{next_iter}".format(dir = dir, next_iter = iter + 1)
+        # a backup of a straggling job is run on a different archive, the one
+        # which would have been used by this job on the next iteration.
+        backup_archive_index = ((k + num_jobs) % num_archives) + 1
+
+        commands = []
+        # in straggler mode, the job and its backup write their outputs
+        # (including the cache written by the first job) under different
+        # names, and only those of the one which finishes first are moved into
+        # place.
+        if run_opts.straggler_factor is None:
+            # there is no backup, so the job writes its outputs under their
+            # final names, which can be watched while it runs.
+            variants = [["", archive_index]]
         else:
-            cur_cache_io_opts = cache_io_opts
+            variants = [[".main", archive_index], [".backup", backup_archive_index]]
+        for [suffix, cur_archive_index] in variants:
+            if job == 1:
+                cur_cache_io_opts = cache_io_opts + " --write-cache={dir}/cache.{next_iter}{suffix}".format(dir = dir, next_iter = iter + 1, suffix = suffix)
+            else:
+                cur_cache_io_opts = cache_io_opts
 
-        process_handle = train_lib.RunKaldiCommand("""
-{command} {train_queue_opt} {dir}/log/train.{iter}.{job}.log \
+            commands.append("""
+{command} {train_queue_opt} {dir}/log/train.{iter}.{job}{suffix}.log \
   nnet3-chain-train {parallel_train_opts} \
   --apply-deriv-weights={app_deriv_wts} \
   --l2-regularize={l2} --leaky-hmm-coefficient={leaky} \
@@ -367,10 +407,11 @@ def TrainNewModels(dir, iter, srand, num_jobs, num_archives_processed, num_archi
   --max-param-change={max_param_change} \
    "{raw_model}" {dir}/den.fst \
   "ark,bg:nnet3-chain-copy-egs --truncate-deriv-weights={trunc_deriv} --frame-shift={fr_shft} ark:{egs_dir}/cegs.{archive_index}.ark ark:- | nnet3-chain-shuffle-egs --buffer-size={shuffle_buffer_size} --srand={srand} ark:- ark:-| nnet3-chain-merge-egs --minibatch-size={num_chunk_per_minibatch} ark:- ark:- |" \
-  {dir}/{next_iter}.{job}.raw
+  {dir}/{next_iter}.{job}{suffix}.raw
           """.format(command = run_opts.command,
                      train_queue_opt = run_opts.train_queue_opt,
                      dir = dir, iter = iter, srand = iter + srand, next_iter = iter + 1, job = job,
+                     suffix = suffix,
                      deriv_time_opts = deriv_time_opts,
                      trunc_deriv = truncate_deriv_weights,
                      app_deriv_wts = apply_deriv_weights,
@@ -379,22 +420,20 @@ def TrainNewModels(dir, iter, srand, num_jobs, num_archives_processed, num_archi
                      parallel_train_opts = run_opts.parallel_train_opts,
                      momentum = momentum, max_param_change = max_param_change,
                      raw_model = raw_model_string,
-                     egs_dir = egs_dir, archive_index = archive_index,
+                     egs_dir = egs_dir, archive_index = cur_archive_index,
                      shuffle_buffer_size = shuffle_buffer_size,
                      cache_io_opts = cur_cache_io_opts,
-                     num_chunk_per_minibatch = num_chunk_per_minibatch),
-          wait = False)
+                     num_chunk_per_minibatch = num_chunk_per_minibatch))
 
-        processes.append(process_handle)
+        if run_opts.straggler_factor is None:
+            jobs.append(train_lib.KaldiJob(job, commands[0]))
+        else:
+            jobs.append(train_lib.KaldiJob(job, commands[0], commands[1],
+                                           train_lib.GetTrainingJobRenames(dir, iter, job, ".backup", job == 1),
+                                           train_lib.GetTrainingJobRenames(dir, iter, job, ".main", job == 1)))
 
-    all_success = True
-    for process in processes:
-        process.wait()
-        [stdout_value, stderr_value] = process.communicate()
-        if stderr_value.strip() != '':
-            print(stderr_value)
-        if process.returncode != 0:
-            all_success = False
+    all_success = train_lib.RunKaldiJobs(jobs, run_opts.max_concurrent_jobs,
+                                         run_opts.straggler_factor)
 
     if not all_success:
         open('{0}/.error'.format(dir), 'w').close()
@@ -408,7 +447,7 @@ def TrainOneIteration(dir, iter, srand, egs_dir,
                       l2_regularize, xent_regularize, leaky_hmm_coefficient,
                       momentum, max_param_change, shuffle_buffer_size,
                       frame_subsampling_factor, truncate_deriv_weights,
-                      run_opts):
+                      run_opts, task_graph = None):
 
     # Set off jobs doing some diagnostics, in the background.
     # Use the egs dir from the previous iteration for the diagnostics
@@ -427,11 +466,25 @@ def TrainOneIteration(dir, iter, srand, egs_dir,
         f.write(str(srand))
         f.close()
 
-    chain_lib.ComputeTrainCvProbabilities(dir, iter, egs_dir,
-            l2_regularize, xent_regularize, leaky_hmm_coefficient, run_opts)
+    if task_graph is None:
+        chain_lib.ComputeTrainCvProbabilities(dir, iter, egs_dir,
+                l2_regularize, xent_regularize, leaky_hmm_coefficient, run_opts)
 
-    if iter > 0:
-        chain_lib.ComputeProgress(dir, iter, run_opts)
+        if iter > 0:
+            chain_lib.ComputeProgress(dir, iter, run_opts)
+    else:
+        # in the pipelined mode the diagnostics are tracked, so that the models
+        # they read are not removed before they are done; like in the
+        # non-pipelined mode, a failed diagnostic does not stop the training.
+        task_graph.AddTask('compute_prob.{0}'.format(iter),
+                           lambda: chain_lib.ComputeTrainCvProbabilities(dir, iter, egs_dir,
+                                       l2_regularize, xent_regularize, leaky_hmm_coefficient,
+                                       run_opts, wait = True),
+                           fatal = False)
+        if iter > 0:
+            task_graph.AddTask('progress.{0}'.format(iter),
+                               lambda: chain_lib.ComputeProgress(dir, iter, run_opts, wait = True),
+                               fatal = False)
 
     if iter > 0 and (iter <= (num_hidden_layers-1) * add_layers_period) and (iter % add_layers_period == 0):
 
@@ -470,6 +523,13 @@ def TrainOneIteration(dir, iter, srand, egs_dir,
                    frame_subsampling_factor, truncate_deriv_weights,
                    cache_io_opts, run_opts)
 
+    if task_graph is not None and task_graph.HasTask('shrinkage.{0}'.format(iter)):
+        # the shrinkage probe ran alongside the training jobs, its result is
+        # only needed now for the averaging
+        if not task_graph.Wait('shrinkage.{0}'.format(iter)):
+            shrinkage_value = 1
+        logger.info("On iteration {0}, shrink value is {1}.".format(iter, shrinkage_value))
+
     [models_to_average, best_model] = train_lib.GetSuccessfulModels(num_jobs, '{0}/log/train.{1}.%.log'.format(dir,iter))
     nnets_list = []
     for n in models_to_average:
@@ -497,11 +557,11 @@ nnet3-am-copy --scale={shrink} --set-raw-nnet=- {dir}/{iter}.mdl {dir}/{new_iter
                    dir = dir, iter = iter, next_iter = iter + 1,
                    shrink = shrinkage_value, best_model_index =  best_model))
 
-    try:
-        for i in range(1, num_jobs + 1):
-            os.remove("{0}/{1}.{2}.raw".format(dir, iter + 1, i))
-    except OSError:
-        raise Exception("Error while trying to delete the raw models")
+    if task_graph is None:
+        train_lib.RemoveTrainingJobModels(dir, iter, num_jobs)
+    else:
+        task_graph.AddTask('remove_raw.{0}'.format(iter), train_lib.RemoveTrainingJobModels,
+                           (dir, iter, num_jobs))
 
     new_model = "{0}/{1}.mdl".format(dir, iter + 1)
 
@@ -520,6 +580,12 @@ def CheckForRequiredFiles(feat_dir, tree_dir, lat_dir):
         if not os.path.isfile(file):
             raise Exception('Expected {0} to exist.'.format(file))
 
+def SendProgressReport(dir, iter, email):
+    [report, times, data] = nnet3_log_parse.GenerateAccuracyReport(dir, key="log-probability")
+    message = report
+    subject = "Update : Expt {dir} : Iter {iter}".format(dir = dir, iter = iter)
+    train_lib.SendMail(message, subject, email)
+
 # args is a Namespace with the required parameters
 def Train(args, run_opts):
     arg_string = pprint.pformat(vars(args))
@@ -638,20 +704,33 @@ def Train(args, run_opts):
                                                                                            args.initial_effective_lrate,
                                                                                            args.final_effective_lrate)
 
+    task_graph = train_lib.KaldiTaskGraph() if args.pipelined_iterations else None
+
     logger.info("Training will run for {0} epochs = {1} iterations".format(args.num_epochs, num_iters))
     for iter in range(num_iters):
         if (args.exit_stage is not None) and (iter == args.exit_stage):
             logger.info("Exiting early due to --exit-stage {0}".format(iter))
+            if task_graph is not None:
+                task_graph.WaitAll()
             return
         current_num_jobs = int(0.5 + args.num_jobs_initial + (args.num_jobs_final - args.num_jobs_initial) * float(iter) / num_iters)
 
         if args.stage <= iter:
-            if args.shrink_value != 1.0:
+            if args.shrink_value != 1.0 and task_graph is not None:
+                # the shrinkage is only applied when averaging at the end of
+                # the iteration, so probe for it while the training jobs run
                 model_file = "{dir}/{iter}.mdl".format(dir = args.dir, iter = iter)
-                shrinkage_value = args.shrink_value if train_lib.DoShrinkage(iter, model_file, args.shrink_nonlinearity, args.shrink_threshold) else 1
-            else:
+                task_graph.AddTask('shrinkage.{0}'.format(iter), train_lib.DoShrinkage,
+                                   (iter, model_file, args.shrink_nonlinearity, args.shrink_threshold))
                 shrinkage_value = args.shrink_value
-            logger.info("On iteration {0}, learning rate is {1} and shrink value is {2}.".format(iter, learning_rate(iter, current_num_jobs, num_archives_processed), shrinkage_value))
+                logger.info("On iteration {0}, learning rate is {1}.".format(iter, learning_rate(iter, current_num_jobs, num_archives_processed)))
+            else:
+                if args.shrink_value != 1.0:
+                    model_file = "{dir}/{iter}.mdl".format(dir = args.dir, iter = iter)
+                    shrinkage_value = args.shrink_value if train_lib.DoShrinkage(iter, model_file, args.shrink_nonlinearity, args.shrink_threshold) else 1
+                else:
+                    shrinkage_value = args.shrink_value
+                logger.info("On iteration {0}, learning rate is {1} and shrink value is {2}.".format(iter, learning_rate(iter, current_num_jobs, num_archives_processed), shrinkage_value))
 
             TrainOneIteration(args.dir, iter, args.srand, egs_dir, current_num_jobs,
                               num_archives_processed, num_archives,
@@ -664,23 +743,38 @@ def Train(args, run_opts):
                               args.momentum, args.max_param_change,
                               args.shuffle_buffer_size,
                               args.frame_subsampling_factor,
-                              args.truncate_deriv_weights, run_opts)
+                              args.truncate_deriv_weights, run_opts, task_graph)
             if args.cleanup:
                 # do a clean up everythin but the last 2 models, under certain conditions
-                train_lib.RemoveModel(args.dir, iter-2, num_iters, num_iters_combine,
-                            args.preserve_model_interval)
+                if task_graph is None:
+                    train_lib.RemoveModel(args.dir, iter-2, num_iters, num_iters_combine,
+                                args.preserve_model_interval)
+                else:
+                    # model iter-2 is read by the diagnostics of iterations
+                    # iter-2 and iter-1
+                    task_graph.AddTask('remove_model.{0}'.format(iter - 2), train_lib.RemoveModel,
+                                       (args.dir, iter-2, num_iters, num_iters_combine,
+                                        args.preserve_model_interval),
+                                       ['compute_prob.{0}'.format(iter - 2),
+                                        'progress.{0}'.format(iter - 2),
+                                        'progress.{0}'.format(iter - 1)])
 
             if args.email is not None:
                 reporting_iter_interval = num_iters * args.reporting_interval
                 if iter % reporting_iter_interval == 0:
                 # lets do some reporting
-                    [report, times, data] = nnet3_log_parse.GenerateAccuracyReport(args.dir, key="log-probability")
-                    message = report
-                    subject = "Update : Expt {dir} : Iter {iter}".format(dir = args.dir, iter = iter)
-                    train_lib.SendMail(message, subject, args.email)
+                    if task_graph is None:
+                        SendProgressReport(args.dir, iter, args.email)
+                    else:
+                        task_graph.AddTask('report.{0}'.format(iter), SendProgressReport,
+                                           (args.dir, iter, args.email),
+                                           ['compute_prob.{0}'.format(iter)], fatal = False)
 
         num_archives_processed = num_archives_processed + current_num_jobs
 
+    if task_graph is not None:
+        task_graph.WaitAll()
+
     if args.stage <= num_iters:
         logger.info("Doing final combination to produce final.mdl")
         chain_lib.CombineModels(args.dir, num_iters, num_iters_combine,
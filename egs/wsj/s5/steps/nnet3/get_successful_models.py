@@ -8,6 +8,9 @@ import sys
 import warnings
 import copy
 import glob
+import imp
+
+train_lib = imp.load_source('ntl', 'steps/nnet3/nnet3_train_lib.py')
 
 
 if __name__ == "__main__":
@@ -35,21 +38,8 @@ if __name__ == "__main__":
 
     assert(args.num_models > 0)
 
-    parse_regex = re.compile("LOG .* Overall average objective function for 'output' is ([0-9e.\-+]+) over ([0-9e.\-+]+) frames")
-    loss = []
-    for i in range(args.num_models):
-        model_num = i + 1
-        logfile = re.sub('%', str(model_num), args.logfile_pattern)
-        lines = open(logfile, 'r').readlines()
-        this_loss = -100000
-        for line_num in range(1, len(lines) + 1):
-            # we search from the end as this would result in
-            # lesser number of regex searches. Python regex is slow !
-            mat_obj = parse_regex.search(lines[-1*line_num])
-            if mat_obj is not None:
-                this_loss = float(mat_obj.groups()[0])
-                break;
-        loss.append(this_loss);
+    logfiles = map(lambda x: re.sub('%', str(x + 1), args.logfile_pattern), range(args.num_models))
+    loss = train_lib.GetObjfsFromTrainLogs(logfiles)
     max_index = loss.index(max(loss))
     accepted_models = []
     for i in range(args.num_models):
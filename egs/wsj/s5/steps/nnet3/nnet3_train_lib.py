@@ -4,6 +4,20 @@ import math
 import re
 import time
 import argparse
+import signal
+import threading
+import traceback
+import struct
+import imp
+from multiprocessing.pool import ThreadPool
+
+try:
+    import numpy as np
+    have_numpy = True
+except ImportError:
+    have_numpy = False
+
+ktl = imp.load_source('ktl', 'steps/kaldi_table_lib.py')
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -76,24 +90,343 @@ def RunKaldiCommand(command, wait = True):
     else:
         return p
 
+def RunKaldiCommands(commands, wait = True):
+    """ Like RunKaldiCommand, but starts all the commands at once so that they
+        run in parallel. If wait is True, waits until all of them have
+        finished and raises a KaldiCommandException for the first one which
+        failed; otherwise returns the list of processes. """
+    processes = map(lambda x: RunKaldiCommand(x, wait = False), commands)
+    if not wait:
+        return processes
+    exception = None
+    for command, p in zip(commands, processes):
+        [stdout, stderr] = p.communicate()
+        if p.returncode is not 0 and exception is None:
+            exception = KaldiCommandException(command, stderr)
+    if exception is not None:
+        raise exception
+
+class KaldiJob:
+    """ A single command to be run by RunKaldiJobs.
+        'backup_command' is an optional speculative replacement which is
+        launched if this job turns out to be a straggler (e.g. the same
+        training job on a different archive). The command and its backup
+        write their outputs under different temporary names, and only the
+        files of the one which wins are moved into place: the (src, dst)
+        pairs in 'renames' for the command, and those in 'backup_renames'
+        for the backup. This way a losing process which could not be stopped
+        in time (e.g. a job already submitted to the grid) cannot overwrite
+        the outputs that the caller sees. """
+    def __init__(self, name, command, backup_command = None,
+                 backup_renames = None, renames = None):
+        self.name = name
+        self.command = command
+        self.backup_command = backup_command
+        self.renames = renames if renames is not None else []
+        self.backup_renames = backup_renames if backup_renames is not None else []
+        self.process = None
+        self.backup_process = None
+        self.start_time = None
+        self.end_time = None
+        self.returncode = None
+        self.used_backup = False
+
+    def WallTime(self):
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return end_time - self.start_time
+
+def _LaunchKaldiJobProcess(command, new_session = False):
+    # if new_session is True, the process is started in its own session so
+    # that the whole pipeline (e.g. run.pl and its children) can be killed if
+    # it loses a race against its backup. Otherwise it stays in our process
+    # group, so that e.g. a Ctrl-C on the terminal reaches it as before.
+    return subprocess.Popen(command, shell = True,
+                            stdout = subprocess.PIPE,
+                            stderr = subprocess.PIPE,
+                            preexec_fn = os.setsid if new_session else None)
+
+def _KillKaldiJobProcess(process):
+    if process.poll() is not None:
+        return
+    try:
+        if os.getpgid(process.pid) == process.pid:
+            # it was started in its own session; kill the whole pipeline.
+            os.killpg(process.pid, signal.SIGTERM)
+            process.communicate()
+            return
+        process.terminate()
+    except OSError:
+        pass
+    # the children of the shell may still hold its output pipes open, so we
+    # only wait for the shell itself.
+    process.wait()
+
+def _RenameKaldiJobOutputs(renames):
+    for src, dst in renames:
+        if os.path.exists(src):
+            os.rename(src, dst)
+
+def _RemoveKaldiJobOutputs(renames):
+    for src, dst in renames:
+        if os.path.exists(src):
+            os.remove(src)
+
+def _PrintKaldiJobStderr(process):
+    [stdout_value, stderr_value] = process.communicate()
+    if stderr_value is not None and stderr_value.strip() != '':
+        print(stderr_value)
+
+def RunKaldiJobs(jobs, max_concurrent_jobs = None, straggler_factor = None,
+                 poll_interval = 1.0):
+    """ Runs a list of KaldiJob objects with at most max_concurrent_jobs
+        processes alive at any time, refilling slots as soon as any job
+        finishes (rather than waiting for the jobs in launch order).
+
+        If straggler_factor is specified, once all the jobs have been
+        launched and there are idle slots, a job that has been running for
+        more than straggler_factor times the median wall-clock time of the
+        finished jobs has its backup_command launched; whichever of the two
+        finishes first successfully is kept and the other one is killed.
+        The outputs of the job that is kept are moved into place (see
+        KaldiJob) when it finishes, and those of the other one are removed.
+        Only in that mode are the processes started in sessions of their own
+        (so that a losing pipeline can be killed as a whole); otherwise they
+        get e.g. a Ctrl-C from the terminal like any other child process.
+        If an exception (e.g. a KeyboardInterrupt) is raised while waiting,
+        the processes which are still running are killed.
+
+        Returns True if all the jobs succeeded. The wall-clock time of each
+        job is available through KaldiJob.WallTime(). """
+    if max_concurrent_jobs is None or max_concurrent_jobs <= 0:
+        max_concurrent_jobs = len(jobs)
+    pending = list(jobs)
+    running = []
+    finished = []
+
+    def NumProcesses():
+        return sum(map(lambda x: 1 + (x.backup_process is not None), running))
+
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and NumProcesses() < max_concurrent_jobs:
+                job = pending.pop(0)
+                job.start_time = time.time()
+                job.process = _LaunchKaldiJobProcess(job.command,
+                                                     straggler_factor is not None)
+                running.append(job)
+
+            if (straggler_factor is not None and len(pending) == 0
+                and len(finished) > 0):
+                finished_times = sorted(map(lambda x: x.WallTime(), finished))
+                median_time = finished_times[len(finished_times) / 2]
+                candidates = filter(lambda x: (x.backup_command is not None
+                                               and x.backup_process is None
+                                               and x.process is not None
+                                               and x.WallTime() > straggler_factor * median_time),
+                                    running)
+                candidates.sort(key = lambda x: x.WallTime(), reverse = True)
+                for job in candidates:
+                    if NumProcesses() >= max_concurrent_jobs:
+                        break
+                    logger.info("Job {0} has been running for {1:.0f}s (median "
+                                "is {2:.0f}s), launching a backup".format(
+                                    job.name, job.WallTime(), median_time))
+                    job.backup_process = _LaunchKaldiJobProcess(job.backup_command, True)
+
+            time.sleep(poll_interval)
+
+            for job in list(running):
+                if job.process is not None and job.process.poll() is not None:
+                    _PrintKaldiJobStderr(job.process)
+                    job.returncode = job.process.returncode
+                    job.process = None
+                    if job.returncode == 0 and job.backup_process is not None:
+                        _KillKaldiJobProcess(job.backup_process)
+                        job.backup_process = None
+                if job.backup_process is not None and job.backup_process.poll() is not None:
+                    _PrintKaldiJobStderr(job.backup_process)
+                    if job.backup_process.returncode == 0:
+                        if job.process is not None:
+                            _KillKaldiJobProcess(job.process)
+                            job.process = None
+                        job.returncode = 0
+                        job.used_backup = True
+                    else:
+                        logger.warning("Backup of job {0} failed".format(job.name))
+                    job.backup_process = None
+                if job.process is None and job.backup_process is None:
+                    job.end_time = time.time()
+                    if job.used_backup:
+                        _RenameKaldiJobOutputs(job.backup_renames)
+                    else:
+                        _RenameKaldiJobOutputs(job.renames)
+                    running.remove(job)
+                    finished.append(job)
+    finally:
+        # if we get here through an exception (e.g. a KeyboardInterrupt),
+        # don't leave the processes which are still running behind; the ones
+        # in their own sessions would not get e.g. the terminal's SIGINT.
+        for job in running:
+            for process in [job.process, job.backup_process]:
+                if process is not None:
+                    _KillKaldiJobProcess(process)
+
+    # the outputs of the processes which lost are removed only now, as the
+    # ones which were killed may still have been writing them.
+    for job in jobs:
+        if job.used_backup:
+            _RemoveKaldiJobOutputs(job.renames)
+        else:
+            _RemoveKaldiJobOutputs(job.backup_renames)
+
+    if len(jobs) > 0:
+        wall_times = sorted(map(lambda x: x.WallTime(), jobs))
+        num_backups = len(filter(lambda x: x.used_backup, jobs))
+        logger.info("Wall-clock time of {0} jobs: min={1:.0f}s median={2:.0f}s "
+                    "max={3:.0f}s ({4} replaced by backups)".format(
+                        len(jobs), wall_times[0],
+                        wall_times[len(wall_times) / 2], wall_times[-1],
+                        num_backups))
+
+    return all(map(lambda x: x.returncode == 0, jobs))
+
+def GetTrainingJobRenames(dir, iter, job, suffix, write_cache = False):
+    """ Returns the (src, dst) pairs which move the outputs of training job
+        'job' of iteration 'iter' into place. The job (or its backup) writes
+        {dir}/{iter+1}.{job}{suffix}.raw, log/train.{iter}.{job}{suffix}.log
+        and, if write_cache is True, cache.{iter+1}{suffix}; see KaldiJob """
+    renames = [['{dir}/{next_iter}.{job}{suffix}.raw'.format(dir = dir, next_iter = iter + 1, job = job, suffix = suffix),
+                '{dir}/{next_iter}.{job}.raw'.format(dir = dir, next_iter = iter + 1, job = job)],
+               ['{dir}/log/train.{iter}.{job}{suffix}.log'.format(dir = dir, iter = iter, job = job, suffix = suffix),
+                '{dir}/log/train.{iter}.{job}.log'.format(dir = dir, iter = iter, job = job)]]
+    if write_cache:
+        renames.append(['{dir}/cache.{next_iter}{suffix}'.format(dir = dir, next_iter = iter + 1, suffix = suffix),
+                        '{dir}/cache.{next_iter}'.format(dir = dir, next_iter = iter + 1)])
+    return renames
+
+class KaldiTaskGraph:
+    """ Runs python callables (usually wrapping RunKaldiCommand with
+        wait = True) in background threads, each one as soon as the tasks it
+        depends on have finished. This is used to overlap the diagnostics and
+        clean-up work of one training iteration with the training of the
+        next ones, while keeping the order in which e.g. a model is removed
+        only after all the diagnostics which read it are done.
+        Dependencies on tasks which were never added are ignored.
+        A task added with fatal = False (e.g. a diagnostic) only logs a
+        warning if it fails, like the commands which are run in the
+        background without waiting for them; the failure is not seen by the
+        tasks which depend on it, nor by Wait() and WaitAll(). """
+    def __init__(self):
+        self.tasks = {}
+        self.lock = threading.Lock()
+
+    def AddTask(self, name, function, args = (), dependencies = [],
+                fatal = True):
+        with self.lock:
+            if name in self.tasks:
+                raise Exception("Task {0} was added twice".format(name))
+            dependencies = filter(lambda x: x in self.tasks, dependencies)
+            task = {'thread' : None, 'error' : None, 'result' : None}
+            task['thread'] = threading.Thread(target = self._RunTask,
+                                              args = (name, task, function,
+                                                      args, dependencies, fatal))
+            task['thread'].daemon = True
+            self.tasks[name] = task
+        task['thread'].start()
+
+    def _RunTask(self, name, task, function, args, dependencies, fatal):
+        try:
+            for dependency in dependencies:
+                self.Wait(dependency)
+            task['result'] = function(*args)
+        except Exception:
+            if fatal:
+                task['error'] = "Task {0} failed:\n{1}".format(name, traceback.format_exc())
+            else:
+                logger.warning("Task {0} failed, continuing:\n{1}".format(
+                    name, traceback.format_exc()))
+
+    def HasTask(self, name):
+        with self.lock:
+            return name in self.tasks
+
+    def Wait(self, name):
+        """ Blocks until the task has finished and returns the value returned
+            by its function; raises an exception if it failed. Waiting for a
+            task which was never added is a no-op which returns None. """
+        with self.lock:
+            task = self.tasks.get(name, None)
+        if task is None:
+            return
+        # a join with a timeout keeps the main thread responsive to Ctrl-C
+        while task['thread'].is_alive():
+            task['thread'].join(1.0)
+        if task['error'] is not None:
+            raise Exception(task['error'])
+        return task['result']
+
+    def WaitAll(self):
+        with self.lock:
+            names = sorted(self.tasks.keys())
+        for name in names:
+            self.Wait(name)
+
+def ReadLinesReversed(file_name, block_size = 65536):
+    """ Generator which yields the lines of a file (without the newline) from
+        the last to the first one. The file is read backwards in blocks, so
+        only the tail of the file is read when the caller stops early. """
+    file_handle = open(file_name, 'rb')
+    try:
+        file_handle.seek(0, os.SEEK_END)
+        position = file_handle.tell()
+        remainder = ''
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            file_handle.seek(position)
+            lines = (file_handle.read(read_size) + remainder).split('\n')
+            # the first line may continue in the previous block
+            remainder = lines[0]
+            for line in reversed(lines[1:]):
+                yield line
+        yield remainder
+    finally:
+        file_handle.close()
+
+objf_parse_regex = re.compile("LOG .* Overall average objective function for 'output' is ([0-9e.\-+]+) over ([0-9e.\-+]+) frames")
+
+def GetObjfFromTrainLog(logfile, default_objf = -100000):
+    """ Returns the last overall average objective function printed in the
+        log of a training job, or default_objf if there is none. """
+    for line in ReadLinesReversed(logfile):
+        # this check is much faster than the regex search, and the log is
+        # read from the end, as the objf line is near the end.
+        if not "Overall average objective function" in line:
+            continue
+        mat_obj = objf_parse_regex.search(line)
+        if mat_obj is not None:
+            return float(mat_obj.groups()[0])
+    return default_objf
+
+def GetObjfsFromTrainLogs(logfiles, num_threads = 8):
+    """ Batched version of GetObjfFromTrainLog, the logs of all the jobs of an
+        iteration are read in parallel as this is dominated by file-system
+        latency (e.g. on NFS). """
+    if num_threads <= 1 or len(logfiles) <= 1:
+        return map(GetObjfFromTrainLog, logfiles)
+    pool = ThreadPool(min(num_threads, len(logfiles)))
+    try:
+        return pool.map(GetObjfFromTrainLog, logfiles)
+    finally:
+        pool.close()
+
 def GetSuccessfulModels(num_models, log_file_pattern, difference_threshold=1.0):
     assert(num_models > 0)
 
-    parse_regex = re.compile("LOG .* Overall average objective function for 'output' is ([0-9e.\-+]+) over ([0-9e.\-+]+) frames")
-    objf = []
-    for i in range(num_models):
-        model_num = i + 1
-        logfile = re.sub('%', str(model_num), log_file_pattern)
-        lines = open(logfile, 'r').readlines()
-        this_objf = -100000
-        for line_num in range(1, len(lines) + 1):
-            # we search from the end as this would result in
-            # lesser number of regex searches. Python regex is slow !
-            mat_obj = parse_regex.search(lines[-1*line_num])
-            if mat_obj is not None:
-                this_objf = float(mat_obj.groups()[0])
-                break;
-        objf.append(this_objf);
+    logfiles = map(lambda x: re.sub('%', str(x + 1), log_file_pattern), range(num_models))
+    objf = GetObjfsFromTrainLogs(logfiles)
     max_index = objf.index(max(objf))
     accepted_models = []
     for i in range(num_models):
@@ -133,7 +466,14 @@ def GetFeatDim(feat_dir):
     return feat_dim
 
 def ReadKaldiMatrix(matrix_file):
+    """ Reads a Kaldi matrix or vector, in text or binary format, as a list of
+        lists of floats (a vector is read as a matrix with one row). """
     try:
+        if IsKaldiBinaryFile(matrix_file):
+            matrix = ReadKaldiArray(matrix_file)
+            if matrix.ndim == 1:
+                matrix = matrix.reshape(1, -1)
+            return matrix.tolist()
         lines = map(lambda x: x.split(), open(matrix_file).readlines())
         first_field = lines[0][0]
         last_field = lines[-1][-1]
@@ -142,11 +482,113 @@ def ReadKaldiMatrix(matrix_file):
         if not (first_field == "[" and last_field == "]"):
             raise Exception("Kaldi matrix file has incorrect format, only text format matrix files can be read by this script")
         for i in range(len(lines)):
-            lines[i] = map(lambda x: int(float(x)), lines[i])
+            lines[i] = map(lambda x: float(x), lines[i])
         return lines
     except IOError:
         raise Exception("Error while reading the kaldi matrix file {0}".format(matrix_file))
 
+# The binary Kaldi objects are read by the table reader in
+# steps/kaldi_table_lib.py (which also defines their tokens and data types,
+# kaldi_table_lib.kaldi_binary_types).
+
+def CheckNumpyIsAvailable():
+    if not have_numpy:
+        raise Exception("numpy is required to read and write binary Kaldi matrices."
+                        " Please install it, or use text format files.")
+
+def IsKaldiBinaryFile(rxfilename):
+    [file_name, offset, row_range, col_range] = ktl.ParseRxfilename(rxfilename)
+    file_handle = open(file_name, 'rb')
+    file_handle.seek(offset)
+    marker = file_handle.read(2)
+    file_handle.close()
+    return marker == '\0B'
+
+def ReadKaldiArray(rxfilename, memory_map = False):
+    """ Reads a Kaldi matrix or vector as a numpy array from a file name or
+        an 'ark:offset' specifier (e.g. an entry of an scp file). Binary
+        files (see kaldi_table_lib.ReadObject()) and text files are
+        supported; a text object in a single line, e.g. "[ 1 2 3 ]", is read
+        as a vector. If memory_map is True, uncompressed binary matrices and
+        vectors are returned as read-only views of the memory-mapped file
+        instead of being read into memory. """
+    CheckNumpyIsAvailable()
+    if IsKaldiBinaryFile(rxfilename):
+        if memory_map:
+            return ktl.ReadRxfilename(rxfilename)
+        cache = ktl.KaldiMmapCache(max_open_files = 1)
+        array = np.array(ktl.ReadRxfilename(rxfilename, cache = cache))
+        cache.Clear()
+        return array
+    [file_name, offset, row_range, col_range] = ktl.ParseRxfilename(rxfilename)
+    file_handle = open(file_name, 'rb')
+    try:
+        file_handle.seek(offset)
+        text = []
+        for line in file_handle:
+            text.append(line)
+            if ']' in line:
+                break
+        text = ''.join(text)
+        start = text.find('[')
+        end = text.find(']')
+        if start == -1 or end == -1:
+            raise Exception("Kaldi matrix file {0} has incorrect format".format(rxfilename))
+        body = text[start + 1:end]
+        if '\n' not in body.strip():
+            return np.array(map(float, body.split()))
+        return np.array(map(lambda x: map(float, x.split()),
+                            filter(lambda x: x.strip() != '', body.split('\n'))))
+    finally:
+        file_handle.close()
+
+def WriteKaldiBinaryObject(file_handle, array, double = False):
+    """ Writes a 1-d or 2-d numpy array as a binary Kaldi vector or matrix
+        (without the binary marker, which the caller writes, e.g. after the
+        key in an archive). """
+    CheckNumpyIsAvailable()
+    array = np.asarray(array)
+    if array.ndim == 1:
+        token = 'DV' if double else 'FV'
+        dims = [array.shape[0]]
+    elif array.ndim == 2:
+        token = 'DM' if double else 'FM'
+        dims = [array.shape[0], array.shape[1]]
+    else:
+        raise Exception("Only vectors and matrices can be written in Kaldi format")
+    file_handle.write(token + ' ')
+    for dim in dims:
+        file_handle.write(struct.pack('<bi', 4, dim))
+    file_handle.write(np.ascontiguousarray(array, dtype = ktl.kaldi_binary_types[token][1]).tostring())
+
+def WriteKaldiArray(output_file, array, double = False):
+    """ Writes a numpy array to a binary Kaldi vector or matrix file """
+    file_handle = open(output_file, 'wb')
+    file_handle.write('\0B')
+    WriteKaldiBinaryObject(file_handle, array, double)
+    file_handle.close()
+
+def SumKaldiVectors(input_files, output_file = None, double = False):
+    """ Python equivalent of vector-sum with file arguments, for when a few
+        vectors (e.g. per-job counts or posteriors) have to be summed and it
+        is not worth submitting a job for it. The sum is accumulated in
+        double precision, returned, and written in binary to output_file if
+        it is specified. """
+    if len(input_files) == 0:
+        raise Exception("No vectors to sum for {0}".format(output_file))
+    total = None
+    for input_file in input_files:
+        vector = ReadKaldiArray(input_file).astype(np.float64)
+        if total is None:
+            total = vector
+        elif total.shape != vector.shape:
+            raise Exception("Mismatch in the dimension of the vector {0}".format(input_file))
+        else:
+            total += vector
+    if output_file is not None:
+        WriteKaldiArray(output_file, total, double)
+    return total
+
 def WriteKaldiMatrix(output_file, matrix):
     # matrix is a list of lists
     file = open(output_file, 'w')
@@ -328,17 +770,22 @@ post-to-tacc --per-pdf=true  {alidir}/final.mdl ark:- {dir}/pdf_counts.JOB
                 dir = dir,
                 alidir = alidir))
 
-    RunKaldiCommand("""
+    import glob
+    if have_numpy:
+        # the per-job counts are summed here rather than in a vector-sum job
+        pdf_counts = SumKaldiVectors(glob.glob('{0}/pdf_counts.*'.format(dir))).tolist()
+        WriteKaldiMatrix('{0}/pdf_counts'.format(dir), [pdf_counts])
+    else:
+        RunKaldiCommand("""
 {command} {dir}/log/sum_pdf_counts.log \
 vector-sum --binary=false {dir}/pdf_counts.* {dir}/pdf_counts
        """.format(command = run_opts.command,  dir = dir))
+        pdf_counts = ReadKaldiMatrix('{0}/pdf_counts'.format(dir))[0]
 
-    import glob
     for file in glob.glob('{0}/pdf_counts.*'.format(dir)):
         os.remove(file)
 
     smooth=0.01
-    pdf_counts = ReadKaldiMatrix('{0}/pdf_counts'.format(dir))[0]
     total = sum(pdf_counts)
     average_count = total/len(pdf_counts)
     scales = []
@@ -510,7 +957,8 @@ def ComputeTrainCvProbabilities(dir, iter, egs_dir, run_opts, mb_size=256, wait
 
     model = '{0}/{1}.mdl'.format(dir, iter)
 
-    RunKaldiCommand("""
+    # the valid and train diagnostics are run in parallel, also with wait = True
+    RunKaldiCommands(["""
 {command} {dir}/log/compute_prob_valid.{iter}.log \
   nnet3-compute-prob "nnet3-am-copy --raw=true {model} - |" \
         "ark,bg:nnet3-merge-egs --minibatch-size={mb_size} ark:{egs_dir}/valid_diagnostic.egs ark:- |"
@@ -519,9 +967,8 @@ def ComputeTrainCvProbabilities(dir, iter, egs_dir, run_opts, mb_size=256, wait
                iter = iter,
                mb_size = mb_size,
                model = model,
-               egs_dir = egs_dir), wait = wait)
-
-    RunKaldiCommand("""
+               egs_dir = egs_dir),
+                      """
 {command} {dir}/log/compute_prob_train.{iter}.log \
   nnet3-compute-prob "nnet3-am-copy --raw=true {model} - |" \
        "ark,bg:nnet3-merge-egs --minibatch-size={mb_size} ark:{egs_dir}/train_diagnostic.egs ark:- |"
@@ -530,7 +977,7 @@ def ComputeTrainCvProbabilities(dir, iter, egs_dir, run_opts, mb_size=256, wait
                iter = iter,
                mb_size = mb_size,
                model = model,
-               egs_dir = egs_dir), wait = wait)
+               egs_dir = egs_dir)], wait = wait)
 
 
 def ComputeProgress(dir, iter, egs_dir, run_opts, mb_size=256, wait=False):
@@ -619,7 +1066,12 @@ matrix-sum-rows ark:- ark:- \| vector-sum ark:- {dir}/post.{iter}.JOB.vec
     # make sure there is time for $dir/post.{iter}.*.vec to appear.
     time.sleep(5)
     avg_post_vec_file = "{dir}/post.{iter}.vec".format(dir=dir, iter=iter)
-    RunKaldiCommand("""
+    if have_numpy:
+        # the per-job posteriors are summed here rather than in a vector-sum job
+        SumKaldiVectors(glob.glob('{0}/post.{1}.*.vec'.format(dir, iter)),
+                        avg_post_vec_file)
+    else:
+        RunKaldiCommand("""
 {command} {dir}/log/vector_sum.{iter}.log \
     vector-sum {dir}/post.{iter}.*.vec {output_file}
         """.format(command = run_opts.command,
@@ -665,6 +1117,15 @@ def RemoveModel(nnet_dir, iter, num_iters, num_iters_combine = None,
     if os.path.isfile(file_name):
         os.remove(file_name)
 
+def RemoveTrainingJobModels(dir, iter, num_jobs):
+    """ Removes the raw models {iter+1}.{1..num_jobs}.raw written by the
+        training jobs of iteration 'iter', once they have been averaged """
+    try:
+        for i in range(1, num_jobs + 1):
+            os.remove("{0}/{1}.{2}.raw".format(dir, iter + 1, i))
+    except OSError:
+        raise Exception("Error while trying to delete the raw models")
+
 def ComputeLifterCoeffs(lifter, dim):
     coeffs = [0] * dim
     for i in range(0, dim):
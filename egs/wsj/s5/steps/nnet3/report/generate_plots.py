@@ -12,6 +12,7 @@ import errno
 import logging
 import re
 import subprocess
+import time
 train_lib = imp.load_source('ntl', 'steps/nnet3/nnet3_train_lib.py')
 
 try:
@@ -48,6 +49,11 @@ example : steps/nnet3/report/generate_plots.py --comparison-dir exp/nnet3/tdnn1
     parser.add_argument("--comparison-dir", type=str, action='append', help="other experiment directories for comparison. These will only be used for plots, not tables")
     parser.add_argument("--start-iter", type=int, help="Iteration from which plotting will start", default = 1)
     parser.add_argument("--is-chain", type=str, default = False, action = train_lib.StrToBoolAction, help="Iteration from which plotting will start")
+    parser.add_argument("--follow", type=str, default = False, action = train_lib.StrToBoolAction,
+                        choices = ["true", "false"],
+                        help="If true, keep following the logs of a running experiment and re-render the plots whose logs changed, until final.mdl is produced")
+    parser.add_argument("--follow-interval", type=float, default = 60,
+                        help="Minimum number of seconds between two updates of the plots in --follow mode")
     parser.add_argument("exp_dir", help="experiment directory, e.g. exp/nnet3/tdnn")
     parser.add_argument("output_dir", help="experiment directory, e.g. exp/nnet3/tdnn/report")
 
@@ -257,7 +263,7 @@ def GenerateClippedProportionPlots(exp_dir, output_dir, plot, comparison_dir = N
             stats_per_dir[dir] = nlp.ParseProgressLogsForClippedProportion(dir)
         except nlp.MalformedClippedProportionLineException as e:
             raise e
-        except train_lib.KaldiCommandException as e:
+        except nlp.MissingLogLinesException as e:
             warnings.warn("Could not extract the clipped proportions for {0},"
                           " this might be because there are no "
                           "ClipGradientComponents.".format(dir))
@@ -422,7 +428,38 @@ def GenerateParameterDiffPlots(exp_dir, output_dir, plot, comparison_dir = None,
             if latex_report is not None:
                 latex_report.AddFigure(figfile_name, "Parameter differences at {0}".format(component_name))
 
-def GeneratePlots(exp_dir, output_dir, comparison_dir = None, start_iter = 1, is_chain = False):
+# the groups of plots, in the order they appear in the report, and the kinds
+# of log files (see nnet3_log_parse_lib.LogParseCache) they are computed from
+plot_groups = ['accuracy', 'nonlin_stats', 'clipped_proportion', 'param_diff']
+plot_group_log_kinds = {'accuracy' : set(['train', 'compute_prob_train', 'compute_prob_valid']),
+                        'nonlin_stats' : set(['progress']),
+                        'clipped_proportion' : set(['progress']),
+                        'param_diff' : set(['progress'])}
+
+def GeneratePlotGroup(group, exp_dir, output_dir, comparison_dir = None, start_iter = 1, is_chain = False, latex_report = None):
+    if group == 'accuracy':
+        if is_chain:
+            logger.info("Generating log-probability plots")
+            GenerateAccuracyPlots(exp_dir, output_dir, plot, key = 'log-probability', file_basename = 'log_probability', comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
+        else:
+            logger.info("Generating accuracy plots")
+            GenerateAccuracyPlots(exp_dir, output_dir, plot, key = 'accuracy', file_basename = 'accuracy', comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
+
+            logger.info("Generating log-likelihood plots")
+            GenerateAccuracyPlots(exp_dir, output_dir, plot, key = 'log-likelihood', file_basename = 'loglikelihood', comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
+    elif group == 'nonlin_stats':
+        logger.info("Generating non-linearity stats plots")
+        GenerateNonlinStatsPlots(exp_dir, output_dir, plot, comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
+    elif group == 'clipped_proportion':
+        logger.info("Generating clipped-proportion plots")
+        GenerateClippedProportionPlots(exp_dir, output_dir, plot, comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
+    elif group == 'param_diff':
+        logger.info("Generating parameter difference plots")
+        GenerateParameterDiffPlots(exp_dir, output_dir, plot, comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
+    else:
+        raise Exception("Unknown plot group {0}".format(group))
+
+def MakeOutputDir(output_dir):
     try:
         os.makedirs(output_dir)
     except OSError as e:
@@ -430,42 +467,82 @@ def GeneratePlots(exp_dir, output_dir, comparison_dir = None, start_iter = 1, is
             pass
         else:
             raise e
+
+def GeneratePlots(exp_dir, output_dir, comparison_dir = None, start_iter = 1, is_chain = False):
+    MakeOutputDir(output_dir)
     if plot:
         latex_report = LatexReport("{0}/report.pdf".format(output_dir))
     else:
         latex_report = None
 
-    if is_chain:
-        logger.info("Generating log-probability plots")
-        GenerateAccuracyPlots(exp_dir, output_dir, plot, key = 'log-probability', file_basename = 'log_probability', comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
-    else:
-        logger.info("Generating accuracy plots")
-        GenerateAccuracyPlots(exp_dir, output_dir, plot, key = 'accuracy', file_basename = 'accuracy', comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
-
-        logger.info("Generating log-likelihood plots")
-        GenerateAccuracyPlots(exp_dir, output_dir, plot, key = 'log-likelihood', file_basename = 'loglikelihood', comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
-
-    logger.info("Generating non-linearity stats plots")
-    GenerateNonlinStatsPlots(exp_dir, output_dir, plot, comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
-
-    logger.info("Generating clipped-proportion plots")
-    GenerateClippedProportionPlots(exp_dir, output_dir, plot, comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
-
-    logger.info("Generating parameter difference plots")
-    GenerateParameterDiffPlots(exp_dir, output_dir, plot, comparison_dir = comparison_dir, start_iter = start_iter, latex_report = latex_report)
-
+    for group in plot_groups:
+        GeneratePlotGroup(group, exp_dir, output_dir, comparison_dir = comparison_dir, start_iter = start_iter, is_chain = is_chain, latex_report = latex_report)
 
     if plot and latex_report is not None:
         has_compiled = latex_report.Close()
         if has_compiled:
             logger.info("Report has been generated. You can find it at the location {0}".format("{0}/report.pdf".format(output_dir)))
 
+def FollowPlots(exp_dir, output_dir, comparison_dir = None, start_iter = 1, is_chain = False, interval = 60):
+    """ Keeps the plots of a running experiment up to date. The logs are
+        tailed through the in-memory log-parse caches of nnet3_log_parse_lib,
+        so each log line is read only once, and at most every 'interval'
+        seconds the plots whose logs changed are re-rendered. The caches
+        are updated once per poll and frozen while rendering, so all the
+        plots of a poll are rendered from the same snapshot of the logs,
+        and every change is seen by the plots it affects. The latex
+        report is only compiled once, when {exp_dir}/final.mdl appears or
+        the user interrupts the script. """
+    MakeOutputDir(output_dir)
+    comparison_dir = [] if comparison_dir is None else comparison_dir
+    dirs = [exp_dir] + comparison_dir
+    groups_to_render = set(plot_groups)
+    try:
+        while True:
+            finished = os.path.exists("{0}/final.mdl".format(exp_dir))
+            updated_kinds = set([])
+            for dir in dirs:
+                updated_kinds = updated_kinds.union(nlp.UpdateLogParseCache(dir))
+            for group in plot_groups:
+                if len(plot_group_log_kinds[group].intersection(updated_kinds)) > 0:
+                    groups_to_render.add(group)
+            if finished:
+                break
+            nlp.FreezeLogParseCaches()
+            for group in plot_groups:
+                if group not in groups_to_render:
+                    continue
+                try:
+                    GeneratePlotGroup(group, exp_dir, output_dir, comparison_dir = comparison_dir, start_iter = start_iter, is_chain = is_chain)
+                except Exception as e:
+                    # e.g. there are no logs for these plots yet
+                    logger.warning("Could not generate the {0} plots, will retry later: {1}".format(group, str(e)))
+                    continue
+                groups_to_render.remove(group)
+            nlp.FreezeLogParseCaches(False)
+            if plot:
+                plt.close('all')
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logger.info("Stopped following the logs.")
+    finally:
+        nlp.FreezeLogParseCaches(False)
+
+    GeneratePlots(exp_dir, output_dir, comparison_dir = comparison_dir, start_iter = start_iter, is_chain = is_chain)
+
 def Main():
     args = GetArgs()
-    GeneratePlots(args.exp_dir, args.output_dir,
-                  comparison_dir = args.comparison_dir,
-                  start_iter = args.start_iter,
-                  is_chain = args.is_chain)
+    if args.follow:
+        FollowPlots(args.exp_dir, args.output_dir,
+                    comparison_dir = args.comparison_dir,
+                    start_iter = args.start_iter,
+                    is_chain = args.is_chain,
+                    interval = args.follow_interval)
+    else:
+        GeneratePlots(args.exp_dir, args.output_dir,
+                      comparison_dir = args.comparison_dir,
+                      start_iter = args.start_iter,
+                      is_chain = args.is_chain)
 
 if __name__ == "__main__":
     Main()
@@ -3,31 +3,249 @@
 
 from __future__ import division
 import sys, glob, re, math, datetime, argparse
+import os
+import cPickle
 import imp
 
 ntl = imp.load_source('ntl', 'steps/nnet3/nnet3_train_lib.py')
 
+# The parsers below do not grep the logs on every call. Instead each log file
+# is read once, line by line, and the few lines which are needed for the
+# reports are stored as records in a LogParseCache, along with the size/mtime
+# of the file and the offset up to which it was read. On later calls only
+# the new files, and the parts appended to the files which grew, are read.
+# A file which grew is only taken to have been appended to if its inode and
+# its first bytes (which include the "# Started at" date written by run.pl
+# or queue.pl) did not change; otherwise, e.g. when a stage is rerun and
+# its log is rewritten, it is read again from the start.
+# The cache is saved in {exp_dir}/.log_parse_cache so that this also holds
+# across invocations of e.g. generate_plots.py.
+
+class MissingLogLinesException(Exception):
+    def __init__(self, exp_dir, what):
+        Exception.__init__(self, "Could not find any {0} in the logs of {1}".format(what, exp_dir))
+
+log_parse_cache_version = 2
+
+# the number of bytes at the start of a log file which are compared to
+# detect that it was rewritten
+log_head_size = 4096
+
+log_file_regexes = [('progress', re.compile("^progress\.([0-9]+)\.log$")),
+                    ('train', re.compile("^train\.([0-9]+)\.([0-9]+)\.log$")),
+                    ('compute_prob_train', re.compile("^compute_prob_train\.([0-9]+)\.log$")),
+                    ('compute_prob_valid', re.compile("^compute_prob_valid\.([0-9]+)\.log$"))]
+
+nonlin_stats_regex = re.compile("component name=(.+) type=(.*)Component,.*value-avg=\[.*mean=([0-9\.\-e]+), stddev=([0-9\.e\-]+)\].*deriv-avg=\[.*mean=([0-9\.\-e]+), stddev=([0-9\.e\-]+)\]")
+clipped_proportion_regex = re.compile("component name=(.*) type=.* clipped-proportion=([0-9\.e\-]+)")
+param_diff_patterns = ["Relative parameter differences", "Parameter differences"]
+param_diff_regexes = dict(map(lambda x: (x, re.compile("LOG.*{0}.*\[(.*)\]".format(x))),
+                              param_diff_patterns))
+accounting_regex = re.compile("# Accounting: time=([0-9]+) thread")
+prob_regex = re.compile("LOG .nnet3.*compute-prob:PrintTotalStats..:nnet.*diagnostics.cc:[0-9]+. Overall ([a-zA-Z\-]+) for 'output'.*is ([0-9.\-e]+) .*per frame")
+
+def ParseProgressLogLine(line):
+    records = []
+    if "value-avg" in line and "deriv-avg" in line:
+        mat_obj = nonlin_stats_regex.match(line)
+        if mat_obj is not None:
+            groups = mat_obj.groups()
+            records.append(('nonlin', groups[0], groups[1]) + tuple(map(float, groups[2:])))
+    if "clipped-proportion" in line:
+        mat_obj = clipped_proportion_regex.match(line)
+        if mat_obj is None:
+            if line.strip() != "":
+                records.append(('clipped_malformed', line))
+        else:
+            records.append(('clipped', mat_obj.groups()[0], float(mat_obj.groups()[1]), line))
+    for pattern in param_diff_patterns:
+        if pattern in line:
+            mat_obj = param_diff_regexes[pattern].match(line)
+            if mat_obj is not None:
+                records.append(('param_diff', pattern,
+                                tuple(sorted(ParseDifferenceString(mat_obj.groups()[0]).items()))))
+    return records
+
+def ParseTrainLogLine(line):
+    if line.startswith("# Accounting"):
+        mat_obj = accounting_regex.match(line)
+        if mat_obj is not None:
+            return [('accounting', float(mat_obj.groups()[0]))]
+    return []
+
+def ParseProbLogLine(line):
+    if "Overall" in line:
+        mat_obj = prob_regex.match(line)
+        if mat_obj is not None:
+            return [('prob', mat_obj.groups()[0], mat_obj.groups()[1])]
+    return []
+
+log_line_parsers = {'progress' : ParseProgressLogLine,
+                    'train' : ParseTrainLogLine,
+                    'compute_prob_train' : ParseProbLogLine,
+                    'compute_prob_valid' : ParseProbLogLine}
+
+class LogParseCache:
+    """ Index of the records parsed from the logs in {exp_dir}/log.
+        Each entry of self.files is keyed by the log file name and holds
+        its kind, its numeric id (iteration, or (iteration, job) for
+        training logs), the size/mtime/inode at the last update, the first
+        bytes of the file, the offset up to which it was read, the records
+        parsed from complete lines and those parsed from a trailing partial
+        line (which is re-read next time). """
+    def __init__(self, exp_dir, cache_file = None):
+        self.exp_dir = exp_dir
+        self.cache_file = cache_file if cache_file is not None else "{0}/.log_parse_cache".format(exp_dir)
+        self.files = {}
+        self.modified = False
+        try:
+            [version, files] = cPickle.load(open(self.cache_file, 'rb'))
+            if version == log_parse_cache_version:
+                self.files = files
+        except (IOError, EOFError, ValueError, TypeError, cPickle.UnpicklingError):
+            pass
+
+    def Update(self):
+        """ Reads the new log files and the new parts of the changed ones.
+            Returns the set of kinds ('progress', 'train',
+            'compute_prob_train', 'compute_prob_valid') of the files which
+            had new content or were removed. """
+        log_dir = "{0}/log".format(self.exp_dir)
+        try:
+            file_names = os.listdir(log_dir)
+        except OSError:
+            file_names = []
+        updated_kinds = set([])
+        present = set([])
+        for file_name in file_names:
+            for kind, regex in log_file_regexes:
+                mat_obj = regex.match(file_name)
+                if mat_obj is None:
+                    continue
+                id = tuple(map(int, mat_obj.groups()))
+                present.add(file_name)
+                if self.UpdateFile(log_dir, file_name, kind, id):
+                    updated_kinds.add(kind)
+                break
+        for file_name in self.files.keys():
+            if file_name not in present:
+                updated_kinds.add(self.files[file_name]['kind'])
+                del self.files[file_name]
+                self.modified = True
+        return updated_kinds
+
+    def UpdateFile(self, log_dir, file_name, kind, id):
+        try:
+            stat = os.stat("{0}/{1}".format(log_dir, file_name))
+        except OSError:
+            return False
+        entry = self.files.get(file_name, None)
+        if (entry is not None and entry['size'] == stat.st_size
+            and entry['mtime'] == stat.st_mtime):
+            return False
+        file_handle = open("{0}/{1}".format(log_dir, file_name), 'r')
+        if (entry is not None and
+            (stat.st_size <= entry['offset'] or entry['inode'] != stat.st_ino
+             or file_handle.read(len(entry['head'])) != entry['head'])):
+            # rewritten log file (appending would have made it larger, and
+            # kept its start)
+            entry = None
+        if entry is None:
+            entry = {'kind' : kind, 'id' : id, 'offset' : 0, 'head' : '',
+                     'records' : [], 'tail_records' : []}
+            self.files[file_name] = entry
+        line_parser = log_line_parsers[kind]
+        file_handle.seek(entry['offset'])
+        offset = entry['offset']
+        entry['tail_records'] = []
+        for line in file_handle:
+            if line.endswith("\n"):
+                offset += len(line)
+                entry['records'].extend(line_parser(line.rstrip("\n")))
+            else:
+                # the log is still being written
+                entry['tail_records'] = line_parser(line)
+        if len(entry['head']) < log_head_size and offset > len(entry['head']):
+            file_handle.seek(0)
+            entry['head'] = file_handle.read(min(offset, log_head_size))
+        file_handle.close()
+        entry['offset'] = offset
+        entry['size'] = stat.st_size
+        entry['mtime'] = stat.st_mtime
+        entry['inode'] = stat.st_ino
+        self.modified = True
+        return True
+
+    def Save(self):
+        if not self.modified:
+            return
+        try:
+            temp_file = "{0}.{1}.tmp".format(self.cache_file, os.getpid())
+            cPickle.dump([log_parse_cache_version, self.files],
+                         open(temp_file, 'wb'), cPickle.HIGHEST_PROTOCOL)
+            os.rename(temp_file, self.cache_file)
+            self.modified = False
+        except (IOError, OSError):
+            # e.g. the experiment directory is not writable, the cache is
+            # just not persisted in this case.
+            pass
+
+    def GetRecords(self, kind, record_type):
+        """ Returns a list of (id, record) pairs, sorted by id """
+        records = []
+        for entry in self.files.values():
+            if entry['kind'] != kind:
+                continue
+            for record in entry['records'] + entry['tail_records']:
+                if record[0] == record_type:
+                    records.append((entry['id'], record))
+        records.sort(key = lambda x: x[0])
+        return records
+
+log_parse_caches = {}
+# If True, GetLogParseCache() returns the caches as they are, without
+# updating them; see FreezeLogParseCaches().
+log_parse_caches_frozen = False
+
+def UpdateLogParseCache(exp_dir):
+    """ Brings the LogParseCache of exp_dir, which is kept in memory across
+        calls, up to date and returns the set of kinds of log files which
+        changed since the last call. """
+    try:
+        cache = log_parse_caches[exp_dir]
+    except KeyError:
+        cache = LogParseCache(exp_dir)
+        log_parse_caches[exp_dir] = cache
+    updated_kinds = cache.Update()
+    cache.Save()
+    return updated_kinds
+
+def GetLogParseCache(exp_dir):
+    """ Returns the up-to-date LogParseCache of exp_dir; repeated parses
+        (e.g. one per plot) only need to stat the log files. While the
+        caches are frozen, the cache is returned as it was last updated. """
+    if not (log_parse_caches_frozen and exp_dir in log_parse_caches):
+        UpdateLogParseCache(exp_dir)
+    return log_parse_caches[exp_dir]
+
+def FreezeLogParseCaches(frozen = True):
+    """ Stops (or, with frozen = False, resumes) the updates of the caches
+        by the parsers, so that all the parses done in between (e.g. all
+        the plots rendered after one call to UpdateLogParseCache()) see the
+        same snapshot of the logs. """
+    global log_parse_caches_frozen
+    log_parse_caches_frozen = frozen
+
 #exp/nnet3/lstm_self_repair_ld5_sp/log/progress.9.log:component name=Lstm3_i type=SigmoidComponent, dim=1280, self-repair-scale=1e-05, count=1.96e+05, value-avg=[percentiles(0,1,2,5 10,20,50,80,90 95,98,99,100)=(0.05,0.09,0.11,0.15 0.19,0.27,0.50,0.72,0.83 0.88,0.92,0.94,0.99), mean=0.502, stddev=0.23], deriv-avg=[percentiles(0,1,2,5 10,20,50,80,90 95,98,99,100)=(0.009,0.04,0.05,0.06 0.08,0.10,0.14,0.17,0.18 0.19,0.20,0.20,0.21), mean=0.134, stddev=0.0397]
 def ParseProgressLogsForNonlinearityStats(exp_dir):
-    progress_log_files = "%s/log/progress.*.log" % (exp_dir)
     stats_per_component_per_iter = {}
 
-    progress_log_lines  = ntl.RunKaldiCommand('grep -e "value-avg.*deriv-avg" {0}'.format(progress_log_files))[0]
-
-    parse_regex = re.compile(".*progress.([0-9]+).log:component name=(.+) type=(.*)Component,.*value-avg=\[.*mean=([0-9\.\-e]+), stddev=([0-9\.e\-]+)\].*deriv-avg=\[.*mean=([0-9\.\-e]+), stddev=([0-9\.e\-]+)\]")
-    for line in progress_log_lines.split("\n") :
-        mat_obj = parse_regex.search(line)
-        if mat_obj is None:
-            continue
-        groups = mat_obj.groups()
-        # groups  = ('9', 'Lstm3_i', 'Sigmoid', '0.502', '0.23', '0.134', '0.0397')
-        iteration = int(groups[0])
-        component_name = groups[1]
-        component_type = groups[2]
-        value_mean = float(groups[3])
-        value_stddev = float(groups[4])
-        deriv_mean = float(groups[5])
-        deriv_stddev = float(groups[6])
+    for [id, record] in GetLogParseCache(exp_dir).GetRecords('progress', 'nonlin'):
+        # record = ('nonlin', 'Lstm3_i', 'Sigmoid', 0.502, 0.23, 0.134, 0.0397)
+        iteration = id[0]
+        component_name = record[1]
+        component_type = record[2]
+        [value_mean, value_stddev, deriv_mean, deriv_stddev] = record[3:]
         try:
             stats_per_component_per_iter[component_name]['stats'][iteration] = [value_mean, value_stddev, deriv_mean, deriv_stddev]
         except KeyError:
@@ -54,28 +272,24 @@ class MalformedClippedProportionLineException(Exception):
 
 def ParseProgressLogsForClippedProportion(exp_dir):
 
-    progress_log_files = "%s/log/progress.*.log" % (exp_dir)
-    component_names = set([])
-    progress_log_lines = ntl.RunKaldiCommand('grep -e "{0}" {1}'.format("clipped-proportion", progress_log_files))[0]
-    parse_regex = re.compile(".*progress\.([0-9]+)\.log:component name=(.*) type=.* clipped-proportion=([0-9\.e\-]+)")
+    cache = GetLogParseCache(exp_dir)
+    for [id, record] in cache.GetRecords('progress', 'clipped_malformed'):
+        raise MalformedClippedProportionLineException(record[1])
+    records = cache.GetRecords('progress', 'clipped')
+    if len(records) == 0:
+        raise MissingLogLinesException(exp_dir, "clipped-proportions")
 
     cp_per_component_per_iter = {}
 
     max_iteration = 0
     component_names = set([])
-    for line in progress_log_lines.split("\n") :
-        mat_obj = parse_regex.search(line)
-        if mat_obj is None:
-            if line.strip() == "":
-                continue
-            raise MalformedClippedProportionLineException(line)
-        groups = mat_obj.groups()
-        iteration = int(groups[0])
+    for [id, record] in records:
+        iteration = id[0]
         max_iteration = max(max_iteration, iteration)
-        name = groups[1]
-        clipped_proportion = float(groups[2])
+        name = record[1]
+        clipped_proportion = record[2]
         if clipped_proportion > 1:
-            raise MalformedClippedProportionLineException(line)
+            raise MalformedClippedProportionLineException(record[3])
         if not cp_per_component_per_iter.has_key(iteration):
             cp_per_component_per_iter[iteration] = {}
         cp_per_component_per_iter[iteration][name] = clipped_proportion
@@ -116,20 +330,15 @@ def ParseProgressLogsForParamDiff(exp_dir, pattern, logger = None):
     if pattern not in set(["Relative parameter differences", "Parameter differences"]):
         raise Exception("Unknown value for pattern : {0}".format(pattern))
 
-    progress_log_files = "%s/log/progress.*.log" % (exp_dir)
     progress_per_iter = {}
     component_names = set([])
-    progress_log_lines = ntl.RunKaldiCommand('grep -e "{0}" {1}'.format(pattern, progress_log_files))[0]
-    parse_regex = re.compile(".*progress\.([0-9]+)\.log:LOG.*{0}.*\[(.*)\]".format(pattern))
-    for line in progress_log_lines.split("\n") :
-        mat_obj = parse_regex.search(line)
-        if mat_obj is None:
+    for [id, record] in GetLogParseCache(exp_dir).GetRecords('progress', 'param_diff'):
+        if record[1] != pattern:
             continue
-        groups = mat_obj.groups()
-        iteration = groups[0]
-        differences = ParseDifferenceString(groups[1])
+        iteration = id[0]
+        differences = dict(record[2])
         component_names  = component_names.union(differences.keys())
-        progress_per_iter[int(iteration)] = differences
+        progress_per_iter[iteration] = differences
 
     component_names = list(component_names)
     component_names.sort()
@@ -164,20 +373,14 @@ def ParseProgressLogsForParamDiff(exp_dir, pattern, logger = None):
             'max_iter' : max_iter}
 
 def ParseTrainLogs(exp_dir):
-  train_log_files = "%s/log/train.*.log" % (exp_dir)
-  train_log_lines = ntl.RunKaldiCommand('grep -e Accounting {0}'.format(train_log_files))[0]
-  parse_regex = re.compile(".*train\.([0-9]+)\.([0-9]+)\.log:# Accounting: time=([0-9]+) thread.*")
-
   train_times = {}
-  for line in train_log_lines.split('\n'):
-    mat_obj = parse_regex.search(line)
-    if mat_obj is not None:
-        groups = mat_obj.groups()
-        try:
-            train_times[int(groups[0])][int(groups[1])] = float(groups[2])
-        except KeyError:
-            train_times[int(groups[0])] = {}
-            train_times[int(groups[0])][int(groups[1])] = float(groups[2])
+  for [id, record] in GetLogParseCache(exp_dir).GetRecords('train', 'accounting'):
+    [iteration, job] = id
+    try:
+        train_times[iteration][job] = record[1]
+    except KeyError:
+        train_times[iteration] = {}
+        train_times[iteration][job] = record[1]
   iters = train_times.keys()
   for iter in iters:
       values = train_times[iter].values()
@@ -185,30 +388,19 @@ def ParseTrainLogs(exp_dir):
   return train_times
 
 def ParseProbLogs(exp_dir, key = 'accuracy'):
-    train_prob_files = "%s/log/compute_prob_train.*.log" % (exp_dir)
-    valid_prob_files = "%s/log/compute_prob_valid.*.log" % (exp_dir)
-    train_prob_strings = ntl.RunKaldiCommand('grep -e {0} {1}'.format(key, train_prob_files), wait = True)[0]
-    valid_prob_strings = ntl.RunKaldiCommand('grep -e {0} {1}'.format(key, valid_prob_files))[0]
+    cache = GetLogParseCache(exp_dir)
 
     #LOG (nnet3-chain-compute-prob:PrintTotalStats():nnet-chain-diagnostics.cc:149) Overall log-probability for 'output' is -0.399395 + -0.013437 = -0.412832 per frame, over 20000 fra
     #LOG (nnet3-chain-compute-prob:PrintTotalStats():nnet-chain-diagnostics.cc:144) Overall log-probability for 'output' is -0.307255 per frame, over 20000 frames.
-    parse_regex = re.compile(".*compute_prob_.*\.([0-9]+).log:LOG .nnet3.*compute-prob:PrintTotalStats..:nnet.*diagnostics.cc:[0-9]+. Overall ([a-zA-Z\-]+) for 'output'.*is ([0-9.\-e]+) .*per frame")
     train_loss={}
     valid_loss={}
 
-
-    for line in train_prob_strings.split('\n'):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is not None:
-            groups = mat_obj.groups()
-            if groups[1] == key:
-                train_loss[int(groups[0])] = groups[2]
-    for line in valid_prob_strings.split('\n'):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is not None:
-            groups = mat_obj.groups()
-            if groups[1] == key:
-                valid_loss[int(groups[0])] = groups[2]
+    for [id, record] in cache.GetRecords('compute_prob_train', 'prob'):
+        if record[1] == key:
+            train_loss[id[0]] = record[2]
+    for [id, record] in cache.GetRecords('compute_prob_valid', 'prob'):
+        if record[1] == key:
+            valid_loss[id[0]] = record[2]
     iters = list(set(valid_loss.keys()).intersection(train_loss.keys()))
     iters.sort()
     return map(lambda x: (int(x), float(train_loss[x]), float(valid_loss[x])), iters)
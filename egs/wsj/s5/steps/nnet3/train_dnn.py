@@ -149,6 +149,26 @@ def GetArgs():
     parser.add_argument("--trainer.optimization.num-jobs-final", type=int, dest='num_jobs_final',
                         default = 8,
                         help="Number of neural net jobs to run in parallel at the end of training")
+    parser.add_argument("--trainer.optimization.max-concurrent-jobs", type=int, dest='max_concurrent_jobs',
+                        default = None,
+                        help="""Maximum number of training jobs of an iteration
+                        that are run at the same time; further jobs are
+                        launched as soon as any running job finishes.
+                        If not specified all the jobs are run at once.""")
+    parser.add_argument("--trainer.optimization.straggler-factor", type=float, dest='straggler_factor',
+                        default = None,
+                        help="""If specified, a training job which has been
+                        running for more than this many times the median
+                        duration of the finished jobs of the iteration gets a
+                        backup job on a different archive, and the output of
+                        whichever finishes first is used. e.g. 1.5""")
+    parser.add_argument("--trainer.optimization.pipelined-iterations", type=str, dest='pipelined_iterations',
+                        default = False, action = StrToBoolAction,
+                        choices = ["true", "false"],
+                        help="""If true, the diagnostics and clean-up of an
+                        iteration run in the background, concurrently with the
+                        training of the following iterations, instead of
+                        being interleaved with them.""")
     parser.add_argument("--trainer.optimization.max-models-combine", type=int, dest='max_models_combine',
                         default = 20,
                         help = """ The is the maximum number of models we give to the
@@ -262,6 +282,8 @@ def ProcessArgs(args):
     run_opts.realign_num_jobs = args.realign_num_jobs
 
     run_opts.command = args.command
+    run_opts.max_concurrent_jobs = args.max_concurrent_jobs
+    run_opts.straggler_factor = args.straggler_factor
     run_opts.num_jobs_compute_prior = args.num_jobs_compute_prior
 
     return [args, run_opts]
@@ -276,6 +298,8 @@ class RunOpts:
         self.prior_queue_opt = None
         self.parallel_train_opts = None
         self.realign_use_gpu = None
+        self.max_concurrent_jobs = None
+        self.straggler_factor = None
 
 # this is the main method which differs between RNN and DNN training
 def TrainNewModels(dir, iter, srand, num_jobs, num_archives_processed, num_archives,
@@ -292,41 +316,55 @@ def TrainNewModels(dir, iter, srand, num_jobs, num_archives_processed, num_archi
 
     context_opts="--left-context={0} --right-context={1}".format(
                   left_context, right_context)
-    processes = []
+    jobs = []
     for job in range(1,num_jobs+1):
         k = num_archives_processed + job - 1 # k is a zero-based index that we will derive
                                                # the other indexes from.
         archive_index = (k % num_archives) + 1 # work out the 1-based archive index.
         frame = (k / num_archives) % frames_per_eg
-        process_handle = RunKaldiCommand("""
-{command} {train_queue_opt} {dir}/log/train.{iter}.{job}.log \
+        # a backup of a straggling job is run on a different archive, the one
+        # which would have been used by this job on the next iteration.
+        backup_archive_index = ((k + num_jobs) % num_archives) + 1
+        commands = []
+        # in straggler mode, the job and its backup write their outputs under
+        # different names, and only those of the one which finishes first are
+        # moved into place.
+        if run_opts.straggler_factor is None:
+            # there is no backup, so the job writes its outputs under their
+            # final names, which can be watched while it runs.
+            variants = [["", archive_index]]
+        else:
+            variants = [[".main", archive_index], [".backup", backup_archive_index]]
+        for [suffix, cur_archive_index] in variants:
+            commands.append("""
+{command} {train_queue_opt} {dir}/log/train.{iter}.{job}{suffix}.log \
   nnet3-train {parallel_train_opts} \
   --print-interval=10 --momentum={momentum} \
   --max-param-change={max_param_change} \
   "{raw_model}" \
   "ark,bg:nnet3-copy-egs --frame={frame} {context_opts} ark:{egs_dir}/egs.{archive_index}.ark ark:- | nnet3-shuffle-egs --buffer-size={shuffle_buffer_size} --srand={srand} ark:- ark:-| nnet3-merge-egs --minibatch-size={minibatch_size} --measure-output-frames=false --discard-partial-minibatches=true ark:- ark:- |" \
-  {dir}/{next_iter}.{job}.raw
+  {dir}/{next_iter}.{job}{suffix}.raw
           """.format(command = run_opts.command,
                      train_queue_opt = run_opts.train_queue_opt,
                      dir = dir, iter = iter, srand = iter + srand, next_iter = iter + 1, job = job,
+                     suffix = suffix,
                      parallel_train_opts = run_opts.parallel_train_opts,
                      frame = frame,
                      momentum = momentum, max_param_change = max_param_change,
                      raw_model = raw_model_string, context_opts = context_opts,
-                     egs_dir = egs_dir, archive_index = archive_index,
+                     egs_dir = egs_dir, archive_index = cur_archive_index,
                      shuffle_buffer_size = shuffle_buffer_size,
-                     minibatch_size = minibatch_size),
-          wait = False)
+                     minibatch_size = minibatch_size))
 
-        processes.append(process_handle)
+        if run_opts.straggler_factor is None:
+            jobs.append(KaldiJob(job, commands[0]))
+        else:
+            jobs.append(KaldiJob(job, commands[0], commands[1],
+                                 GetTrainingJobRenames(dir, iter, job, ".backup"),
+                                 GetTrainingJobRenames(dir, iter, job, ".main")))
 
-    all_success = True
-    for process in processes:
-        process.wait()
-        [stdout_value, stderr_value] = process.communicate()
-        print(stderr_value)
-        if process.returncode != 0:
-            all_success = False
+    all_success = RunKaldiJobs(jobs, run_opts.max_concurrent_jobs,
+                               run_opts.straggler_factor)
 
     if not all_success:
         open('{0}/.error'.format(dir), 'w').close()
@@ -338,7 +376,7 @@ def TrainOneIteration(dir, iter, srand, egs_dir,
                       frames_per_eg, num_hidden_layers, add_layers_period,
                       left_context, right_context,
                       momentum, max_param_change, shuffle_buffer_size,
-                      run_opts):
+                      run_opts, task_graph = None):
 
 
 
@@ -359,10 +397,22 @@ def TrainOneIteration(dir, iter, srand, egs_dir,
         f.write(str(srand))
         f.close()
 
-    ComputeTrainCvProbabilities(dir, iter, egs_dir, run_opts)
+    if task_graph is None:
+        ComputeTrainCvProbabilities(dir, iter, egs_dir, run_opts)
 
-    if iter > 0:
-        ComputeProgress(dir, iter, egs_dir, run_opts)
+        if iter > 0:
+            ComputeProgress(dir, iter, egs_dir, run_opts)
+    else:
+        # in the pipelined mode the diagnostics are tracked, so that the models
+        # they read are not removed before they are done; like in the
+        # non-pipelined mode, a failed diagnostic does not stop the training.
+        task_graph.AddTask('compute_prob.{0}'.format(iter),
+                           lambda: ComputeTrainCvProbabilities(dir, iter, egs_dir, run_opts, wait = True),
+                           fatal = False)
+        if iter > 0:
+            task_graph.AddTask('progress.{0}'.format(iter),
+                               lambda: ComputeProgress(dir, iter, egs_dir, run_opts, wait = True),
+                               fatal = False)
 
     if iter > 0 and (iter <= (num_hidden_layers-1) * add_layers_period) and (iter % add_layers_period == 0):
 
@@ -426,11 +476,11 @@ nnet3-am-copy --set-raw-nnet=- {dir}/{iter}.mdl {dir}/{new_iter}.mdl
                    dir = dir, iter = iter, next_iter = iter + 1,
                    best_model_index =  best_model))
 
-    try:
-        for i in range(1, num_jobs + 1):
-            os.remove("{0}/{1}.{2}.raw".format(dir, iter + 1, i))
-    except OSError:
-        raise Exception("Error while trying to delete the raw models")
+    if task_graph is None:
+        RemoveTrainingJobModels(dir, iter, num_jobs)
+    else:
+        task_graph.AddTask('remove_raw.{0}'.format(iter), RemoveTrainingJobModels,
+                           (dir, iter, num_jobs))
 
     new_model = "{0}/{1}.mdl".format(dir, iter + 1)
 
@@ -439,6 +489,12 @@ nnet3-am-copy --set-raw-nnet=- {dir}/{iter}.mdl {dir}/{new_iter}.mdl
     elif os.stat(new_model).st_size == 0:
         raise Exception("{0} has size 0. Something went wrong in iteration {1}".format(new_model, iter))
 
+def SendProgressReport(dir, iter, email):
+    [report, times, data] = nnet3_log_parse.GenerateAccuracyReport(dir)
+    message = report
+    subject = "Update : Expt {dir} : Iter {iter}".format(dir = dir, iter = iter)
+    SendMail(message, subject, email)
+
 # args is a Namespace with the required parameters
 def Train(args, run_opts):
     arg_string = pprint.pformat(vars(args))
@@ -555,15 +611,21 @@ def Train(args, run_opts):
     # egs_dir will be updated if there is realignment
     cur_egs_dir=egs_dir
 
+    task_graph = KaldiTaskGraph() if args.pipelined_iterations else None
+
     logger.info("Training will run for {0} epochs = {1} iterations".format(args.num_epochs, num_iters))
     for iter in range(num_iters):
         if (args.exit_stage is not None) and (iter == args.exit_stage):
             logger.info("Exiting early due to --exit-stage {0}".format(iter))
+            if task_graph is not None:
+                task_graph.WaitAll()
             return
         current_num_jobs = int(0.5 + args.num_jobs_initial + (args.num_jobs_final - args.num_jobs_initial) * float(iter) / num_iters)
 
         if args.stage <= iter:
             if iter in realign_iters:
+                if task_graph is not None:
+                    task_graph.WaitAll()
                 logger.info("Re-aligning the data at iteration {0}".format(iter))
                 prev_egs_dir=cur_egs_dir
                 cur_egs_dir="{0}/egs_{1}".format(args.dir, "iter"+str(iter))
@@ -585,23 +647,38 @@ def Train(args, run_opts):
                               num_hidden_layers, args.add_layers_period,
                               left_context, right_context,
                               args.momentum, args.max_param_change,
-                              args.shuffle_buffer_size, run_opts)
+                              args.shuffle_buffer_size, run_opts, task_graph)
             if args.cleanup:
                 # do a clean up everythin but the last 2 models, under certain conditions
-                RemoveModel(args.dir, iter-2, num_iters, num_iters_combine,
-                            args.preserve_model_interval)
+                if task_graph is None:
+                    RemoveModel(args.dir, iter-2, num_iters, num_iters_combine,
+                                args.preserve_model_interval)
+                else:
+                    # model iter-2 is read by the diagnostics of iterations
+                    # iter-2 and iter-1
+                    task_graph.AddTask('remove_model.{0}'.format(iter - 2), RemoveModel,
+                                       (args.dir, iter-2, num_iters, num_iters_combine,
+                                        args.preserve_model_interval),
+                                       ['compute_prob.{0}'.format(iter - 2),
+                                        'progress.{0}'.format(iter - 2),
+                                        'progress.{0}'.format(iter - 1)])
 
             if args.email is not None:
                 reporting_iter_interval = num_iters * args.reporting_interval
                 if iter % reporting_iter_interval == 0:
                 # lets do some reporting
-                    [report, times, data] = nnet3_log_parse.GenerateAccuracyReport(args.dir)
-                    message = report
-                    subject = "Update : Expt {dir} : Iter {iter}".format(dir = args.dir, iter = iter)
-                    SendMail(message, subject, args.email)
+                    if task_graph is None:
+                        SendProgressReport(args.dir, iter, args.email)
+                    else:
+                        task_graph.AddTask('report.{0}'.format(iter), SendProgressReport,
+                                           (args.dir, iter, args.email),
+                                           ['compute_prob.{0}'.format(iter)], fatal = False)
 
         num_archives_processed = num_archives_processed + current_num_jobs
 
+    if task_graph is not None:
+        task_graph.WaitAll()
+
     if args.stage <= num_iters:
         logger.info("Doing final combination to produce final.mdl")
         CombineModels(args.dir, num_iters, num_iters_combine, egs_dir, run_opts)
@@ -166,6 +166,19 @@ def GetArgs():
     parser.add_argument("--trainer.optimization.num-jobs-final", type=int, dest='num_jobs_final',
                         default = 8,
                         help="Number of neural net jobs to run in parallel at the end of training")
+    parser.add_argument("--trainer.optimization.max-concurrent-jobs", type=int, dest='max_concurrent_jobs',
+                        default = None,
+                        help="""Maximum number of training jobs of an iteration
+                        that are run at the same time; further jobs are
+                        launched as soon as any running job finishes.
+                        If not specified all the jobs are run at once.""")
+    parser.add_argument("--trainer.optimization.straggler-factor", type=float, dest='straggler_factor',
+                        default = None,
+                        help="""If specified, a training job which has been
+                        running for more than this many times the median
+                        duration of the finished jobs of the iteration gets a
+                        backup job on a different archive, and the output of
+                        whichever finishes first is used. e.g. 1.5""")
     parser.add_argument("--trainer.optimization.max-models-combine", type=int, dest='max_models_combine',
                         default = 20,
                         help = """ The is the maximum number of models we give to the
@@ -305,6 +318,8 @@ def ProcessArgs(args):
     run_opts.realign_num_jobs = args.realign_num_jobs
 
     run_opts.command = args.command
+    run_opts.max_concurrent_jobs = args.max_concurrent_jobs
+    run_opts.straggler_factor = args.straggler_factor
     run_opts.num_jobs_compute_prior = args.num_jobs_compute_prior
 
     return [args, run_opts]
@@ -342,6 +357,8 @@ class RunOpts:
         self.prior_queue_opt = None
         self.parallel_train_opts = None
         self.realign_use_gpu = None
+        self.max_concurrent_jobs = None
+        self.straggler_factor = None
 
 
 def TrainNewModels(dir, iter, srand, num_jobs, num_archives_processed, num_archives,
@@ -358,48 +375,63 @@ def TrainNewModels(dir, iter, srand, num_jobs, num_archives_processed, num_archi
 
     context_opts="--left-context={0} --right-context={1}".format(
                   left_context, right_context)
-    processes = []
+    jobs = []
     for job in range(1,num_jobs+1):
         k = num_archives_processed + job - 1 # k is a zero-based index that we will derive
                                                # the other indexes from.
         archive_index = (k % num_archives) + 1 # work out the 1-based archive index.
-
-        cache_write_opt = ""
-        if job == 1:
-          # an option for writing cache (storing pairs of nnet-computations and
-          # computation-requests) during training.
-          cache_write_opt="--write-cache={dir}/cache.{iter}".format(dir=dir, iter=iter+1)
-
-        process_handle = RunKaldiCommand("""
-{command} {train_queue_opt} {dir}/log/train.{iter}.{job}.log \
+        # a backup of a straggling job is run on a different archive, the one
+        # which would have been used by this job on the next iteration.
+        backup_archive_index = ((k + num_jobs) % num_archives) + 1
+
+        commands = []
+        # in straggler mode, the job and its backup write their outputs
+        # (including the cache written by the first job) under different
+        # names, and only those of the one which finishes first are moved into
+        # place.
+        if run_opts.straggler_factor is None:
+            # there is no backup, so the job writes its outputs under their
+            # final names, which can be watched while it runs.
+            variants = [["", archive_index]]
+        else:
+            variants = [[".main", archive_index], [".backup", backup_archive_index]]
+        for [suffix, cur_archive_index] in variants:
+            cache_write_opt = ""
+            if job == 1:
+              # an option for writing cache (storing pairs of nnet-computations and
+              # computation-requests) during training.
+              cache_write_opt="--write-cache={dir}/cache.{iter}{suffix}".format(dir=dir, iter=iter+1, suffix=suffix)
+
+            commands.append("""
+{command} {train_queue_opt} {dir}/log/train.{iter}.{job}{suffix}.log \
   nnet3-train {parallel_train_opts} {cache_read_opt} {cache_write_opt} \
   --print-interval=10 --momentum={momentum} \
   --max-param-change={max_param_change} \
   --optimization.min-deriv-time={min_deriv_time} "{raw_model}" \
   "ark,bg:nnet3-copy-egs {context_opts} ark:{egs_dir}/egs.{archive_index}.ark ark:- | nnet3-shuffle-egs --buffer-size={shuffle_buffer_size} --srand={srand} ark:- ark:-| nnet3-merge-egs --minibatch-size={num_chunk_per_minibatch} --measure-output-frames=false --discard-partial-minibatches=true ark:- ark:- |" \
-  {dir}/{next_iter}.{job}.raw
+  {dir}/{next_iter}.{job}{suffix}.raw
           """.format(command = run_opts.command,
                      train_queue_opt = run_opts.train_queue_opt,
                      dir = dir, iter = iter, srand = iter + srand, next_iter = iter + 1, job = job,
+                     suffix = suffix,
                      parallel_train_opts = run_opts.parallel_train_opts,
                      cache_read_opt = cache_read_opt, cache_write_opt = cache_write_opt,
                      momentum = momentum, max_param_change = max_param_change,
                      min_deriv_time = min_deriv_time,
                      raw_model = raw_model_string, context_opts = context_opts,
-                     egs_dir = egs_dir, archive_index = archive_index,
+                     egs_dir = egs_dir, archive_index = cur_archive_index,
                      shuffle_buffer_size = shuffle_buffer_size,
-                     num_chunk_per_minibatch = num_chunk_per_minibatch),
-          wait = False)
-
-        processes.append(process_handle)
-
-    all_success = True
-    for process in processes:
-        process.wait()
-        [stdout_value, stderr_value] = process.communicate()
-        print(stderr_value)
-        if process.returncode != 0:
-            all_success = False
+                     num_chunk_per_minibatch = num_chunk_per_minibatch))
+
+        if run_opts.straggler_factor is None:
+            jobs.append(KaldiJob(job, commands[0]))
+        else:
+            jobs.append(KaldiJob(job, commands[0], commands[1],
+                                 GetTrainingJobRenames(dir, iter, job, ".backup", job == 1),
+                                 GetTrainingJobRenames(dir, iter, job, ".main", job == 1)))
+
+    all_success = RunKaldiJobs(jobs, run_opts.max_concurrent_jobs,
+                               run_opts.straggler_factor)
 
     if not all_success:
         open('{0}/.error'.format(dir), 'w').close()
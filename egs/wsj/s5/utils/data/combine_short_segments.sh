@@ -16,6 +16,7 @@
 
 # begin configuration section
 cleanup=true
+nj=1  # number of processes used to choose the utterances to combine
 # end configuration section
 
 . utils/parse_options.sh
@@ -26,6 +27,9 @@ if [ $# != 3 ]; then
   echo "e.g.:"
   echo " $0 data/train 1.55 data/train_comb"
   # options documentation here.
+  echo "Options:"
+  echo "  --nj <nj>      # number of processes used to choose the utterances"
+  echo "                 # to combine (default: 1)"
   exit 1;
 fi
 
@@ -71,7 +75,7 @@ set -o pipefail
 # make sure $srcdir/utt2dur exists.
 utils/data/get_utt2dur.sh $srcdir
 
-utils/data/internal/choose_utts_to_combine.py --min-duration=$min_seg_len \
+utils/data/internal/choose_utts_to_combine.py --min-duration=$min_seg_len --num-jobs=$nj \
   $srcdir/spk2utt $srcdir/utt2dur $dir/utt2utts $dir/utt2spk $dir/utt2dur
 
 utils/utt2spk_to_spk2utt.pl < $dir/utt2spk > $dir/spk2utt
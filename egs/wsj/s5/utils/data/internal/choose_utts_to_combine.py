@@ -9,6 +9,7 @@ import argparse
 from random import randint
 import sys
 import os
+import multiprocessing
 from collections import defaultdict
 
 
@@ -37,6 +38,9 @@ to the grouped utterance.
 
 parser.add_argument("--min-duration", type = float, default = 1.55,
                     help="Minimum utterance duration")
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help="Number of processes used to combine the utterances of "
+                    "the different speakers.")
 parser.add_argument("spk2utt_in", type = str, metavar = "<spk2utt-in>",
                     help="Filename of [input] speaker to utterance map needed "
                     "because this script tries to merge utterances from the "
@@ -86,10 +90,11 @@ def CombineList(min_duration, durations):
 
     num_utts = len(durations)
 
-    # for each utterance-index i, group_start[i] gives us the
-    # start-index of the group of utterances of which it's currently
-    # a member.
-    group_start = range(num_utts)
+    # The groups form a doubly linked list, indexed by their start-indexes, so
+    # that merging two groups takes constant time regardless of their sizes.
+    # is_group_start[i] is True if utterance-index i currently corresponds to the
+    # start of a group of utterances.
+    is_group_start = [ True ] * num_utts
     # if utterance-index i currently corresponds to the start of a group
     # of utterances, then group_durations[i] is the total duration of
     # that utterance-group, otherwise undefined.
@@ -98,18 +103,22 @@ def CombineList(min_duration, durations):
     # of utterances, then group_end[i] is the end-index (i.e. last index plus one
     # of that utterance-group, otherwise undefined.
     group_end = [ x + 1 for x in range(num_utts) ]
+    # if utterance-index i currently corresponds to the start of a group
+    # of utterances, then group_prev_start[i] is the start-index of the group
+    # to its left (or -1 if i == 0), otherwise undefined.
+    group_prev_start = [ x - 1 for x in range(num_utts) ]
 
     queue = [ i for i in range(num_utts) if LessThan(group_durations[i], min_duration) ]
 
     while len(queue) > 0:
         i = queue.pop()
-        if group_start[i] != i or not LessThan(group_durations[i], min_duration):
+        if not is_group_start[i] or not LessThan(group_durations[i], min_duration):
             # this group no longer exists or already has at least the minimum duration.
             continue
         this_dur = group_durations[i]
         # left_dur is the duration of the group to the left of this group,
         # or 0.0 if there is no such group.
-        left_dur = group_durations[group_start[i-1]] if i > 0 else 0.0
+        left_dur = group_durations[group_prev_start[i]] if i > 0 else 0.0
         # right_dur is the duration of the group to the right of this group,
         # or 0.0 if there is no such group.
         right_dur = group_durations[group_end[i]] if group_end[i] < num_utts else 0.0
@@ -117,7 +126,7 @@ def CombineList(min_duration, durations):
 
         if left_dur == 0.0 and right_dur == 0.0:
             # there is only one group.  Nothing more to merge; break
-            assert group_start[i] == 0 and group_end[i] == num_utts
+            assert i == 0 and group_end[i] == num_utts
             break
         # work out whether to combine left or right,
         # by means of the combine_left variable [ True or False ]
@@ -149,11 +158,12 @@ def CombineList(min_duration, durations):
 
         if combine_left:
             assert left_dur != 0.0
-            new_group_start = group_start[i-1]
+            new_group_start = group_prev_start[i]
             group_end[new_group_start] = group_end[i]
-            for j in range(group_start[i], group_end[i]):
-                group_start[j] = new_group_start
-                group_durations[new_group_start] += durations[j]
+            group_durations[new_group_start] += group_durations[i]
+            is_group_start[i] = False
+            if group_end[i] < num_utts:
+                group_prev_start[group_end[i]] = new_group_start
             # note: there is no need to add group_durations[new_group_start] to
             # the queue even if it is still below the minimum length, because it
             # would have previously had to have been below the minimum length,
@@ -164,9 +174,10 @@ def CombineList(min_duration, durations):
             old_group_end = group_end[i]
             new_group_end = group_end[old_group_end]
             group_end[i] = new_group_end
-            for j in range(old_group_end, new_group_end):
-                group_durations[i] += durations[j]
-                group_start[j] = i
+            group_durations[i] += group_durations[old_group_end]
+            is_group_start[old_group_end] = False
+            if new_group_end < num_utts:
+                group_prev_start[new_group_end] = i
             if LessThan(group_durations[i], min_duration):
                 # the group starting at i is still below the minimum length, so
                 # we need to put it back on the queue.
@@ -213,15 +224,21 @@ def SelfTest():
         ranges2 = CombineList(min_duration, durations2)
         assert ranges2 == ranges
 
+# This is a version of CombineList that takes its arguments as a pair
+# (min_duration, durations), for use with multiprocessing.Pool.map.
+def CombineListStar(args):
+    return CombineList(*args)
+
 # This function figures out the grouping of utterances.
 # The input is:
 # 'min_duration' which is the minimum utterance length in seconds.
 # 'spk2utt' which is a list of pairs (speaker-id, [list-of-utterances])
 # 'utt2dur' which is a dict from utterance-id to duration (as a float)
+# 'num_jobs' which is the number of processes used to process the speakers.
 # It returns a lists of lists of utterances; each list corresponds to
 # a group, e.g.
 # [ ['utt1'], ['utt2', 'utt3'] ]
-def GetUtteranceGroups(min_duration, spk2utt, utt2dur):
+def GetUtteranceGroups(min_duration, spk2utt, utt2dur, num_jobs = 1):
     # utt_groups will be a list of lists of utterance-ids formed from the
     # first pass of combination.
     utt_groups = []
@@ -229,8 +246,9 @@ def GetUtteranceGroups(min_duration, spk2utt, utt2dur):
     # 'utt_groups'.
     group_durations = []
 
-    # This block calls CombineList for the utterances of each speaker
-    # separately, in the 'first pass' of combination.
+    # spk_durations[i] is the list of durations of the utterances of
+    # the i'th speaker.
+    spk_durations = []
     for i in range(len(spk2utt)):
         (spk, utts) = spk2utt[i]
         durations = [] # durations for this group of utts.
@@ -241,7 +259,25 @@ def GetUtteranceGroups(min_duration, spk2utt, utt2dur):
                 sys.exit("choose_utts_to_combine.py: no duration available "
                          "in utt2dur file {0} for utterance {1}".format(
                         args.utt2dur_in, utt))
-        ranges = CombineList(min_duration, durations)
+        spk_durations.append(durations)
+
+    # This block calls CombineList for the utterances of each speaker
+    # separately, in the 'first pass' of combination.  The speakers are
+    # independent, so they can be processed in parallel.
+    if num_jobs > 1:
+        pool = multiprocessing.Pool(num_jobs)
+        spk_ranges = pool.map(CombineListStar,
+                              [ (min_duration, durations) for durations in spk_durations ],
+                              chunksize = 256)
+        pool.close()
+        pool.join()
+    else:
+        spk_ranges = [ CombineList(min_duration, durations) for durations in spk_durations ]
+
+    for i in range(len(spk2utt)):
+        (spk, utts) = spk2utt[i]
+        durations = spk_durations[i]
+        ranges = spk_ranges[i]
         for start, end in ranges:  # each element of 'ranges' is a 2-tuple (start, end)
             utt_groups.append( [ utts[i] for i in range(start, end) ])
             group_durations.append(sum([ durations[i] for i in range(start, end) ]))
@@ -280,6 +316,9 @@ if args.min_duration < 0.0:
     print("choose_utts_to_combine.py: bad minium duration {0}".format(
             args.min_duration))
 
+if args.num_jobs < 1:
+    sys.exit("choose_utts_to_combine.py: bad --num-jobs {0}".format(args.num_jobs))
+
 # spk2utt is a list of 2-tuples (speaker-id, [list-of-utterances])
 spk2utt = []
 # utt2spk is a dict from speaker-id to utternace-id.
@@ -324,7 +363,7 @@ while True:
                 args.utt2dur_in, line))
 
 
-utt_groups = GetUtteranceGroups(args.min_duration, spk2utt, utt2dur)
+utt_groups = GetUtteranceGroups(args.min_duration, spk2utt, utt2dur, args.num_jobs)
 
 # set utt_group names to an array like [ 'utt1', 'utt2-comb2', 'utt4', ... ]
 utt_group_names = [ group[0] if len(group)==1 else group[0] + "-comb" + str(len(group))
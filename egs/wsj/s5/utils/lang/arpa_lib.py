@@ -0,0 +1,398 @@
+# Apache 2.0.
+
+# This library reads ARPA-format language models into numpy arrays, for python
+# tools that need to look up n-gram probabilities (e.g.
+# utils/lang/internal/arpa2fst_constrained.py, utils/reverse_arpa.py and
+# steps/conf/parse_arpa_unigrams.py).
+#
+# The file is read in large chunks of lines, and the words are mapped to
+# integer ids.  The n-grams of each order are stored as a sorted array of keys
+# (the big-endian bytes of the word-ids, so that comparing keys compares the
+# word-id sequences), together with arrays of log-probs and backoff weights, and
+# are looked up by binary search.  This takes much less memory than dicts
+# indexed by tuples of words.  Optionally, the arrays are cached in a binary
+# file next to the ARPA file (see ReadArpa()), so the same language model can be
+# loaded quickly by later runs.
+#
+# Scripts are expected to be run from the egs directory (e.g. egs/wsj/s5), and
+# load this library with
+#   arpa_lib = imp.load_source('arpa_lib', 'utils/lang/arpa_lib.py')
+
+import gzip
+import io
+import os
+import struct
+import sys
+
+try:
+    import numpy as np
+    have_numpy = True
+except ImportError:
+    have_numpy = False
+
+
+class ArpaError(Exception):
+    pass
+
+
+def CheckNumpyIsAvailable():
+    if not have_numpy:
+        raise ArpaError("numpy is required to read ARPA language models with "
+                        "utils/lang/arpa_lib.py; please install it.")
+
+
+# Opens the ARPA file 'filename' ('-' or '' for the standard input) for
+# reading in binary mode; gzipped files are recognized by their first bytes and
+# decompressed.
+def OpenArpa(filename):
+    if filename == '' or filename == '-':
+        filename = '/dev/stdin'
+    try:
+        f = io.open(filename, 'rb')
+    except (IOError, OSError) as e:
+        raise ArpaError("error opening ARPA file {0}: {1}".format(filename, str(e)))
+    if f.peek(2)[:2] == b'\x1f\x8b':
+        f = gzip.GzipFile(fileobj = f)
+    return f
+
+
+# Returns the keys of the n-grams in the integer array 'ids' (with one row
+# per n-gram), as an array of byte strings.
+def MakeKeys(ids):
+    order = ids.shape[1]
+    return np.ascontiguousarray(ids, dtype = '>u4').view('S{0}'.format(4 * order)).ravel()
+
+
+# Returns the key of a single n-gram given as a sequence of word-ids.
+def MakeKey(ids):
+    return struct.pack('>{0}I'.format(len(ids)), *ids)
+
+
+# This class reads the n-grams from an ARPA file in batches, without keeping
+# them in memory, for tools that process large language models one batch at a
+# time; ReadArpa() uses it to read the whole model.
+#
+# The words are given integer ids in the order in which they are first seen;
+# they are in self.words (as byte strings) and self.word_to_id.  The counts in
+# the \data\ section are in self.ngram_counts (indexed by order - 1).
+class ArpaReader:
+    def __init__(self, filename, max_order = None, batch_size = 1000000,
+                 chunk_size = 1 << 24):
+        self.filename = filename
+        self.max_order = max_order
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.words = []
+        self.word_to_id = {}
+        self.f = OpenArpa(filename)
+        self.lines = self.Lines()
+        self.ngram_counts = self.ReadHeader()
+
+    # Yields the lines of the file (as byte strings), reading them in chunks of
+    # about self.chunk_size bytes.
+    def Lines(self):
+        while True:
+            lines = self.f.readlines(self.chunk_size)
+            if len(lines) == 0:
+                return
+            for line in lines:
+                yield line
+
+    def NextLine(self):
+        try:
+            return next(self.lines)
+        except StopIteration:
+            return None
+
+    # Reads up to and including the header lines like 'ngram 1=1264', and
+    # returns the list of counts.
+    def ReadHeader(self):
+        while True:
+            line = self.NextLine()
+            if line is None:
+                raise ArpaError("reading {0}, got EOF looking for \\data\\ marker.".format(
+                        self.filename))
+            if line[0:6] == b'\\data\\':
+                break
+        ngram_counts = []
+        while True:
+            line = self.NextLine()
+            if line is None:
+                raise ArpaError("reading {0}, got EOF in header.".format(self.filename))
+            if line.strip() == b'':
+                if len(ngram_counts) == 0:
+                    continue
+                break
+            a = line[5:].split(b'=')  # e.g. a = [ ' 1', '1264' ]
+            if line[0:5] != b'ngram' or len(a) != 2:
+                raise ArpaError("reading {0}, read something unexpected in header: {1}".format(
+                        self.filename, line.rstrip()))
+            try:
+                (order, count) = (int(a[0]), int(a[1]))
+            except ValueError:
+                raise ArpaError("reading {0}, read something unexpected in header: {1}".format(
+                        self.filename, line.rstrip()))
+            if order != len(ngram_counts) + 1:
+                raise ArpaError("reading {0}, n-gram orders in header are not in "
+                                "order: {1}".format(self.filename, line.rstrip()))
+            ngram_counts.append(count)
+        return ngram_counts
+
+    # Converts the lists of fields read for a batch of n-grams of order
+    # 'order' into arrays.
+    def MakeBatch(self, order, words, logprobs, backoffs):
+        word_to_id = self.word_to_id
+        for word in words:
+            if not word in word_to_id:
+                word_to_id[word] = len(self.words)
+                self.words.append(word)
+        ids = np.array([ word_to_id[word] for word in words ],
+                       dtype = np.int32).reshape(-1, order)
+        try:
+            return (order, ids, np.array(logprobs, dtype = np.float64),
+                    np.array(backoffs, dtype = np.float64))
+        except ValueError as e:
+            raise ArpaError("reading {0}: in {1}-grams section, got bad "
+                            "number ({2})".format(self.filename, order, str(e)))
+
+    # Yields the n-grams as tuples (order, ids, logprobs, backoffs), where
+    # 'ids' is an integer array with one row of word-ids for each n-gram, and
+    # logprobs and backoffs are the log10 probabilities and backoff weights.
+    # Backoff weights that are not given in the file are NaN.  Each tuple
+    # contains at most self.batch_size n-grams of a single order; the orders
+    # come in increasing order.
+    def Batches(self):
+        line = self.NextLine()
+        order = 0
+        while True:
+            while line is not None and line.strip() == b'':
+                line = self.NextLine()
+            if line is None:
+                raise ArpaError("reading {0}, found EOF while looking for \\end\\ "
+                                "marker.".format(self.filename))
+            if line[0:5] == b'\\end\\':
+                break
+            order += 1
+            if line.strip() != '\\{0}-grams:'.format(order).encode():
+                raise ArpaError("reading {0}, expected line \\{1}-grams:, got {2}".format(
+                        self.filename, order, line.rstrip()))
+            if self.max_order is not None and order > self.max_order:
+                return
+            (words, logprobs, backoffs) = ([], [], [])
+            # note: breaking out of this loop does not close the generator
+            # self.lines, so we go on reading from the next line after it.
+            for line in self.lines:
+                a = line.split()
+                l = len(a)
+                if l == order + 1:
+                    logprobs.append(a[0])
+                    words.extend(a[1:])
+                    backoffs.append(b'nan')
+                elif l == order + 2:
+                    logprobs.append(a[0])
+                    words.extend(a[1:order+1])
+                    backoffs.append(a[order+1])
+                elif l == 0 or a[0][0:1] == b'\\':
+                    # the section of n-grams is terminated by a blank line.
+                    break
+                else:
+                    raise ArpaError("reading {0}: in {1}-grams section, got bad "
+                                    "line: {2}".format(self.filename, order, line.rstrip()))
+                if len(logprobs) == self.batch_size:
+                    yield self.MakeBatch(order, words, logprobs, backoffs)
+                    (words, logprobs, backoffs) = ([], [], [])
+            else:
+                line = None
+            yield self.MakeBatch(order, words, logprobs, backoffs)
+        if order == 0:
+            raise ArpaError("reading {0}, read no n-grams.".format(self.filename))
+
+
+# This class holds an ARPA language model, as read by ReadArpa().
+#
+# self.words is the list of words (as str), sorted, so the word-ids are in the
+# same order as the words and the n-grams of each order are sorted
+# lexicographically by their words; self.word_to_id maps from word to id.
+# For the n-grams of order n (n = 1 ... self.Order()):
+#   self.keys[n-1] is the sorted array of the keys of the n-grams (see
+#                  MakeKeys()); self.WordIds(n) gives the word-ids.
+#   self.logprobs[n-1] is the array of the log10 probabilities.
+#   self.backoffs[n-1] is the array of the log10 backoff weights, with NaN for
+#                  n-grams that have no backoff weight in the ARPA file.
+class ArpaLm:
+    def __init__(self):
+        self.words = []
+        self.word_to_id = {}
+        self.ngram_counts = []
+        self.keys = []
+        self.logprobs = []
+        self.backoffs = []
+
+    def Order(self):
+        return len(self.keys)
+
+    def NumNgrams(self, order):
+        return len(self.keys[order-1])
+
+    def WordIds(self, order):
+        return self.keys[order-1].view('>u4').reshape(-1, order)
+
+    # Returns the words of the n-gram with index 'index' among the n-grams of
+    # order 'order', as a tuple of str.
+    def Ngram(self, order, index):
+        return tuple([ self.words[i] for i in struct.unpack(
+                    '>{0}I'.format(order), self.keys[order-1][index:index+1].tobytes()) ])
+
+    # Returns the word-ids of the words in 'words', or None if any of them is
+    # not in the vocabulary.
+    def GetIds(self, words):
+        try:
+            return [ self.word_to_id[word] for word in words ]
+        except KeyError:
+            return None
+
+    # Returns the index of the n-gram 'words' (a sequence of str) among the
+    # n-grams of its order, or -1 if it is not in the model.
+    def Find(self, words):
+        order = len(words)
+        ids = self.GetIds(words)
+        if ids is None or order == 0 or order > self.Order():
+            return -1
+        keys = self.keys[order-1]
+        key = MakeKey(ids)
+        index = np.searchsorted(keys, key, 'left')
+        if np.searchsorted(keys, key, 'right') > index:
+            return int(index)
+        return -1
+
+    # Vectorized version of Find(): 'ids' is an integer array with one row of
+    # word-ids per n-gram, and the array of indexes (or -1) is returned.
+    def FindIds(self, ids):
+        order = ids.shape[1]
+        keys = self.keys[order-1]
+        queries = MakeKeys(ids)
+        left = np.searchsorted(keys, queries, 'left')
+        right = np.searchsorted(keys, queries, 'right')
+        return np.where(right > left, left, -1)
+
+    # Returns the range [begin, end) of the indexes of the n-grams of order
+    # len(words) + 1 that start with 'words'.
+    def SuccessorRange(self, words):
+        order = len(words) + 1
+        ids = self.GetIds(words)
+        if ids is None or order > self.Order():
+            return (0, 0)
+        keys = self.keys[order-1]
+        prefix = MakeKey(ids)
+        return (int(np.searchsorted(keys, prefix + b'\x00' * 4, 'left')),
+                int(np.searchsorted(keys, prefix + b'\xff' * 4, 'right')))
+
+
+# Sets up 'lm' from the batches of n-grams read by 'reader': the word-ids are
+# changed to be in the sorted order of the words, and the n-grams are sorted.
+# If an n-gram appears more than once, the last one is kept.
+def FinalizeArpaLm(lm, reader):
+    batches = [ [] for n in range(len(reader.ngram_counts)) ]
+    for batch in reader.Batches():
+        if batch[0] > len(batches):
+            batches.append([])
+        batches[batch[0]-1].append(batch)
+    words = reader.words
+    sorted_ids = sorted(range(len(words)), key = lambda i: words[i])
+    new_id = np.zeros(len(words), dtype = np.int64)
+    new_id[sorted_ids] = np.arange(len(words))
+    lm.words = [ words[i] for i in sorted_ids ]
+    if sys.version_info[0] >= 3:
+        lm.words = [ word.decode('utf-8') for word in lm.words ]
+    lm.word_to_id = dict([ (word, i) for (i, word) in enumerate(lm.words) ])
+    lm.ngram_counts = reader.ngram_counts
+    for order_batches in batches:
+        if len(order_batches) == 0:
+            break
+        order = order_batches[0][0]
+        keys = MakeKeys(new_id[np.concatenate([ b[1] for b in order_batches ])])
+        logprobs = np.concatenate([ b[2] for b in order_batches ])
+        backoffs = np.concatenate([ b[3] for b in order_batches ])
+        del order_batches[:]
+        index = np.argsort(keys, kind = 'mergesort')
+        keys = keys[index]
+        keep = np.append(keys[1:] != keys[:-1], True)
+        lm.keys.append(keys[keep])
+        lm.logprobs.append(logprobs[index][keep])
+        lm.backoffs.append(backoffs[index][keep])
+
+
+def GetCacheFilename(filename):
+    return filename + '.cache.npz'
+
+
+# Writes the arrays of 'lm' into a binary cache file for the ARPA file
+# 'filename'; the cache is only used while the ARPA file is not modified.
+def WriteArpaCache(lm, filename):
+    stat = os.stat(filename)
+    arrays = { 'source': np.array([stat.st_mtime, stat.st_size], dtype = np.float64),
+               'ngram_counts': np.array(lm.ngram_counts, dtype = np.int64) }
+    words = [ word.encode('utf-8') if sys.version_info[0] >= 3 else word
+              for word in lm.words ]
+    arrays['words'] = np.frombuffer(b'\n'.join(words), dtype = np.uint8)
+    for n in range(lm.Order()):
+        arrays['keys{0}'.format(n+1)] = lm.keys[n]
+        arrays['logprobs{0}'.format(n+1)] = lm.logprobs[n]
+        arrays['backoffs{0}'.format(n+1)] = lm.backoffs[n]
+    cache_filename = GetCacheFilename(filename)
+    tmp_filename = cache_filename + '.tmp.{0}.npz'.format(os.getpid())
+    try:
+        np.savez(tmp_filename, **arrays)
+        os.rename(tmp_filename, cache_filename)
+    except (IOError, OSError) as e:
+        sys.stderr.write("{0}: warning: could not write cache {1} of ARPA file: "
+                         "{2}\n".format(sys.argv[0], cache_filename, str(e)))
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+# Returns the language model from the cache of the ARPA file 'filename', or
+# None if there is no cache or it is older than the ARPA file.
+def ReadArpaCache(filename, max_order = None):
+    cache_filename = GetCacheFilename(filename)
+    if not os.path.exists(cache_filename):
+        return None
+    stat = os.stat(filename)
+    arrays = np.load(cache_filename)
+    if list(arrays['source']) != [stat.st_mtime, stat.st_size]:
+        return None
+    lm = ArpaLm()
+    words = arrays['words'].tobytes()
+    lm.words = words.split(b'\n') if len(words) > 0 else []
+    if sys.version_info[0] >= 3:
+        lm.words = [ word.decode('utf-8') for word in lm.words ]
+    lm.word_to_id = dict([ (word, i) for (i, word) in enumerate(lm.words) ])
+    lm.ngram_counts = [ int(x) for x in arrays['ngram_counts'] ]
+    n = 1
+    while 'keys{0}'.format(n) in arrays.files and (max_order is None or n <= max_order):
+        lm.keys.append(arrays['keys{0}'.format(n)])
+        lm.logprobs.append(arrays['logprobs{0}'.format(n)])
+        lm.backoffs.append(arrays['backoffs{0}'.format(n)])
+        n += 1
+    arrays.close()
+    return lm
+
+
+# Reads the ARPA file 'filename' (which may be gzipped, or '-' for the
+# standard input) and returns it as an ArpaLm.  If 'max_order' is given, only
+# the n-grams up to that order are read.  If 'use_cache' is true, the model is
+# read from the cache file <filename>.cache.npz if it is up to date, and
+# otherwise the cache is written after reading the ARPA file.  Raises ArpaError
+# on errors.
+def ReadArpa(filename, max_order = None, use_cache = False):
+    CheckNumpyIsAvailable()
+    use_cache = use_cache and filename not in ['', '-'] and os.path.isfile(filename)
+    if use_cache:
+        lm = ReadArpaCache(filename, max_order)
+        if lm is not None:
+            return lm
+    lm = ArpaLm()
+    FinalizeArpaLm(lm, ArpaReader(filename, max_order))
+    if use_cache and max_order is None:
+        WriteArpaCache(lm, filename)
+    return lm
@@ -7,8 +7,11 @@ from __future__ import print_function
 import sys
 import argparse
 import math
+import imp
 from collections import defaultdict
 
+arpa_lib = imp.load_source('arpa_lib', 'utils/lang/arpa_lib.py')
+
 # note, this was originally based
 
 parser = argparse.ArgumentParser(description="""
@@ -37,6 +40,11 @@ parser.add_argument('allowed_bigrams_in', type = str,
                     "pairs like 'foo bar'.")
 parser.add_argument('--verbose', type = int, default = 0,
                     choices=[0,1,2,3,4,5], help = 'Verbose level')
+parser.add_argument('--use-arpa-cache', type = str, default = 'false',
+                    choices = ['true', 'false'],
+                    help = 'If true, cache the ARPA model in binary form in '
+                    '<arpa_in>.cache.npz, and read it from there while the ARPA '
+                    'file is unchanged (see utils/lang/arpa_lib.py)')
 
 args = parser.parse_args()
 
@@ -44,113 +52,25 @@ if args.verbose >= 1:
     print(' '.join(sys.argv), file = sys.stderr)
 
 
-class HistoryState:
-    def __init__(self):
-        # note: neither backoff_prob nor the floats
-        # in word_to_prob are in log space.
-        self.backoff_prob = 1.0
-        # will be a dict from string to float.  the prob is
-        # the actual probability of the word, including any probability
-        # mass from backoff (they get added together while writing out
-        # the arpa, and these probs are read in from the arpa).
-        self.word_to_prob = dict()
-
-
 class ArpaModel:
     def __init__(self):
-        # self.orders is indexed by history-length [i.e. 0 for unigram,
-        # 1 for bigram and so on], and is then a dict indexed
-        # by tuples of history-words.  E.g. for trigrams, we'd index
-        # it as self.orders[2][('a', 'b')].
-        # The value-type of the dict is HistoryState.  E.g. to set the
-        # probability of the trigram a b -> c to 0.2, we'd do
-        # self.orders[2][('a', 'b')].word_to_prob['c'] = 0.2
-        self.orders = []
+        # self.lm is the model as read by arpa_lib.ReadArpa(): for each order,
+        # the n-grams are in a sorted array, with arrays of their log10
+        # probabilities and backoff weights (see utils/lang/arpa_lib.py).
+        # Histories and words are passed to the functions below as tuples of
+        # strings and strings, e.g. the probability of the trigram a b -> c is
+        # self.GetProb(('a', 'b'), 'c').
+        self.lm = None
+        self.log10 = math.log(10.0)
 
     def Read(self, arpa_in):
-        assert len(self.orders) == 0
-        log10 = math.log(10.0)
-        if arpa_in == "" or arpa_in == "-":
-            arpa_in = "/dev/stdin"
+        assert self.lm is None
         try:
-            f = open(arpa_in, "r")
-        except:
-            sys.exit("{0}: error opening ARPA file {1}".format(
-                     sys.argv[0], arpa_in))
-        # first read till the \data\ marker.
-        while True:
-            line = f.readline()
-            if line == '':
-                sys.exit("{0}: reading {1}, got EOF looking for \\data\\ marker.".format(
-                    sys.argv[0], arpa_in))
-            if line[0:6] == '\\data\\':
-                break
-        while True:
-            # read, and ignore, the lines like 'ngram 1=1264'...
-            line = f.readline()
-            if line == '\n' or line == '\r\n':
-                break
-            if line[0:5] != 'ngram':
-                sys.exit("{0}: reading {1}, read something unexpected in header: {2}".format(
-                    sys.argv[0], arpa_in, line[:-1]))
-            rest=line[5:]
-            a = rest.split('=')  # e.g. a = [ '1', '1264] ]
-            if len(a) != 2:
-                sys.exit("{0}: reading {1}, read something unexpected in header: {2}".format(
-                    sys.argv[0], arpa_in, line[:-1]))
-            max_order = int(a[0])
-
-
-        for n in range(max_order):
-            # self.orders[n], indexed by history-length (length of the
-            # history-vector, == order-1), is a map from history as a tuple
-            # of strings, to class HistoryState.
-            self.orders.append(defaultdict(lambda: HistoryState()))
-
-        cur_order = 0
-        while True:
-            line = f.readline()
-            if line == '':
-                sys.exit("{0}: reading {1}, found EOF while looking for \\end\\ marker.".format(
-                    sys.argv[0], arpa_in))
-            elif line[0:5] == '\\end\\':
-                if len(self.orders) == 0:
-                    sys.exit("{0}: reading {1}, read no n-grams.".format(sys.argv[0], arpa_in))
-                break
-            else:
-                cur_order += 1
-                expected_line = '\\{0}-grams:'.format(cur_order)
-                if not expected_line in line:  # e.g. allow trailing whitespace and newline
-                    sys.exit("{0}: reading {1}, expected line {1}, got {2}".format(arpa_in, expected_line, line[:-1]))
-                if args.verbose >= 2:
-                    print("{0}: reading {1}-grams".format(
-                        sys.argv[0], cur_order), file = sys.stderr)
-
-                # now read all the n-grams from this order.
-                while True:
-                    line = f.readline()
-                    # the section of n-grams is terminated by a blank line.
-                    if line == '\n' or line == '\r\n':
-                        break
-                    a = line.split()
-                    l = len(a)
-                    if l != cur_order + 1 and l != cur_order + 2:
-                        sys.exit("{0}: reading {1}: in {2}-grams section, got bad line: {3}".format(
-                            sys.argv[0], arpa_in, cur_order, line[:-1]))
-                    try:
-                        prob = math.exp(float(a[0]) * log10)
-                        hist = tuple(a[1:cur_order])  # tuple of strings
-                        word = a[cur_order]  # a string
-                        backoff_prob = math.exp(float(a[cur_order+1]) * log10) if l == cur_order + 2 else None
-                    except Exception as e:
-                        sys.exit("{0}: reading {1}: in {2}-grams section, got bad "
-                                 "line (exception is: {3}): {4}".format(
-                                     sys.argv[0], arpa_in, cur_order,
-                                     str(type(e)) + ',' + str(e), line[:-1]))
-                    self.orders[cur_order-1][hist].word_to_prob[word] = prob
-                    if backoff_prob != None:
-                        self.orders[cur_order][hist + (word,)].backoff_prob = backoff_prob
-
+            self.lm = arpa_lib.ReadArpa(arpa_in,
+                                        use_cache = (args.use_arpa_cache == 'true'))
+        except arpa_lib.ArpaError as e:
+            sys.exit("{0}: {1}".format(sys.argv[0], str(e)))
+        cur_order = self.lm.Order()
         if args.verbose >= 2:
             print("{0}: read {1}-gram model from {2}".format(
                 sys.argv[0], cur_order, arpa_in), file = sys.stderr)
@@ -160,26 +80,56 @@ class ArpaModel:
             sys.exit("{0}: this script does not work when the ARPA language model "
                      "is unigram.".format(sys.argv[0]))
 
+    # Returns the number of history lengths (0 for unigram, 1 for bigram and so
+    # on), i.e. the order of the model.
+    def NumHistoryLengths(self):
+        return self.lm.Order()
+
+    # Converts a log10 value from the ARPA file to a probability.
+    def ToProb(self, log10_value):
+        return math.exp(float(log10_value) * self.log10)
+
+    # Returns the backoff probability of history-state 'hist', which is 1.0 if
+    # the ARPA file does not give a backoff weight for it.
+    def GetBackoffProb(self, hist):
+        index = self.lm.Find(hist)
+        if index < 0 or math.isnan(self.lm.backoffs[len(hist)-1][index]):
+            return 1.0
+        return self.ToProb(self.lm.backoffs[len(hist)-1][index])
+
+    # Returns the words predicted by history-state 'hist' (explicitly, not by
+    # backoff), as a list of (word, prob).
+    def GetWordProbs(self, hist):
+        order = len(hist) + 1
+        (begin, end) = self.lm.SuccessorRange(hist)
+        return [ (self.lm.Ngram(order, i)[-1], self.ToProb(self.lm.logprobs[order-1][i]))
+                 for i in range(begin, end) ]
+
+    # Returns the history-states of length hist_len as a list of tuples of
+    # strings, in sorted order.  These are the histories that predict some
+    # word, or that have a backoff weight.
+    def GetHistoryStates(self, hist_len):
+        np = arpa_lib.np
+        lm = self.lm
+        keys = lm.keys[hist_len-1][~np.isnan(lm.backoffs[hist_len-1])]
+        if hist_len < lm.Order():
+            keys = np.union1d(keys, arpa_lib.MakeKeys(lm.WordIds(hist_len+1)[:,0:hist_len]))
+        return [ tuple([ lm.words[i] for i in ids ])
+                 for ids in keys.view('>u4').reshape(-1, hist_len).tolist() ]
+
     # Returns the probability of word 'word' in history-state 'hist'.
     # Dies with error if this word is not predicted at all by the LM (not in vocab).
     # history-state does not exist.
     def GetProb(self, hist, word):
-        assert len(hist) < len(self.orders)
+        assert len(hist) < self.NumHistoryLengths()
+        index = self.lm.Find(hist + (word,))
+        if index >= 0:
+            return self.ToProb(self.lm.logprobs[len(hist)][index])
         if len(hist) == 0:
-            word_to_prob = self.orders[0][()].word_to_prob
-            if not word in word_to_prob:
-                sys.exit("{0}: no probability in unigram for word {1}".format(
-                    sys.argv[0], word))
-            return word_to_prob[word]
-        else:
-            if hist in self.orders[len(hist)]:
-                hist_state = self.orders[len(hist)][hist]
-                if word in hist_state.word_to_prob:
-                    return hist_state.word_to_prob[word]
-                else:
-                    return hist_state.backoff_prob * self.GetProb(hist[1:], word)
-            else:
-                return self.GetProb(hist[1:], word)
+            sys.exit("{0}: no probability in unigram for word {1}".format(
+                sys.argv[0], word))
+        # the backoff prob is 1.0 if this history-state does not exist.
+        return self.GetBackoffProb(hist) * self.GetProb(hist[1:], word)
 
     # This gets the state corresponding to 'hist' in 'hist_to_state', but backs
     # off for us if there is no such state.
@@ -214,8 +164,8 @@ class ArpaModel:
         # didn't naturally have such bigram states, we'll create them so that we
         # can enforce the bigram constraints supplied in 'bigrams_file' by the
         # user.
-        for word in self.orders[0][()].word_to_prob:
-            if word != '<s>' and word != '</s>':
+        for word in self.lm.words:
+            if self.lm.Find((word,)) >= 0 and word != '<s>' and word != '</s>':
                 hist = (word,)
                 hist_to_state[hist] = len(state_to_hist)
                 state_to_hist.append(hist)
@@ -224,8 +174,8 @@ class ArpaModel:
         # we don't have a unigram state in the output FST, only bigram states; and
         # we don't iterate over bigram histories because we covered them all above;
         # that's why we start 'n' from 2 below instead of from 0.
-        for n in range(2, len(self.orders)):
-            for hist in self.orders[n].keys():
+        for n in range(2, self.NumHistoryLengths()):
+            for hist in self.GetHistoryStates(n):
                 # note: hist is a tuple of strings.
                 assert not hist in hist_to_state
                 hist_to_state[hist] = len(state_to_hist)
@@ -244,7 +194,7 @@ class ArpaModel:
 
 
         # The following 3 things are just for diagnostics.
-        normalization_stats = [ [0, 0.0] for x in range(len(self.orders)) ]
+        normalization_stats = [ [0, 0.0] for x in range(self.NumHistoryLengths()) ]
         num_ngrams_allowed = 0
         num_ngrams_disallowed = 0
 
@@ -281,15 +231,14 @@ class ArpaModel:
                         print("%d %d %s %s %.3f" %
                               (state, next_state, word, word, cost))
             else:  # it's a higher-order than bigram state.
-                assert hist in self.orders[hist_len]
-                hist_state = self.orders[hist_len][hist]
+                word_probs = self.GetWordProbs(hist)
                 most_recent_word = hist[-1]
 
                 normalization_stats[hist_len][0] += 1
                 normalization_stats[hist_len][1] += \
                   sum([ self.GetProb(hist, word) for word in bigram_map[most_recent_word]])
 
-                for word, prob in hist_state.word_to_prob.items():
+                for word, prob in word_probs:
                     cost = -math.log(prob)
                     if word in bigram_map[most_recent_word]:
                         num_ngrams_allowed += 1
@@ -306,8 +255,7 @@ class ArpaModel:
                               (state, next_state, word, word, cost))
                 # Now deal with the backoff probability of this state (back off
                 # to the lower-order state).
-                assert hist in self.orders[hist_len]
-                backoff_prob = self.orders[hist_len][hist].backoff_prob
+                backoff_prob = self.GetBackoffProb(hist)
                 assert backoff_prob != 0.0
                 cost = -math.log(backoff_prob)
                 backoff_hist = hist[1:]
@@ -319,11 +267,11 @@ class ArpaModel:
 
                 # For hist-states that completely back off (they have no words coming out of them),
                 # there is no need to disambiguate, we can print an epsilon that will later be removed.
-                this_disambig_symbol = disambig_symbol if len(hist_state.word_to_prob) != 0 else '<eps>'
+                this_disambig_symbol = disambig_symbol if len(word_probs) != 0 else '<eps>'
                 print("%d %d %s <eps> %.3f" %
                       (state, backoff_state, this_disambig_symbol, cost))
         if args.verbose >= 1:
-            for hist_len in range(1, len(self.orders)):
+            for hist_len in range(1, self.NumHistoryLengths()):
                 num_states = normalization_stats[hist_len][0]
                 avg_prob_sum = normalization_stats[hist_len][1] / num_states if num_states > 0 else 0.0
                 print("{0}: for {1}-gram states, over {2} states the average sum of "
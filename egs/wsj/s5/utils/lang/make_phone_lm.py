@@ -7,6 +7,7 @@ from __future__ import print_function
 import sys
 import argparse
 import math
+import heapq
 from collections import defaultdict
 
 # note, this was originally based
@@ -65,11 +66,15 @@ if args.verbose >= 1:
 
 
 
-class CountsForHistory:
+class CountsForHistory(object):
     ## This class (which is more like a struct) stores the counts seen in a
     ## particular history-state.  It is used inside class NgramCounts.
     ## It really does the job of a dict from int to float, but it also
     ## keeps track of the total count.
+    ## There is one of these per history-state, so we use __slots__ to avoid
+    ## the memory overhead of a per-object __dict__.
+    __slots__ = [ 'word_to_count', 'total_count' ]
+
     def __init__(self):
         # The 'lambda: defaultdict(float)' is an anonymous function taking no
         # arguments that returns a new defaultdict(float).
@@ -374,35 +379,74 @@ class NgramCounts:
                         print(this_fst_state, backoff_fst_state,
                               word_disambig_symbol, 0, this_cost)
 
-    # This function returns a set of n-grams that cannot currently be pruned
-    # away, either because a higher-order form of the same n-gram already exists,
-    # or because the n-gram leads to an n-gram state that exists.
-    # [Note: as we prune, we remove any states that can be removed; see that
-    # PruneToIntermediateTarget() calls PruneEmptyStates().
-
-    def GetProtectedNgrams(self):
-        ans = set()
+    # This function sets up the bookkeeping used in PruneToFinalTarget() to
+    # know which n-grams cannot currently be pruned away, either because a
+    # higher-order form of the same n-gram exists, or because the n-gram leads
+    # to an n-gram state that exists.  Rather than a set, we keep a count of
+    # the reasons why each n-gram is protected (self.protect_count), so that
+    # when we prune an n-gram or remove a state we can tell which n-grams
+    # became prunable.  We also keep track of the number of higher-order
+    # states that back off to each state (self.num_child_states), so we know
+    # when an empty state can be removed.
+    def InitPruningState(self):
+        self.protect_count = defaultdict(int)
+        self.num_child_states = defaultdict(int)
         for n in range(args.no_backoff_ngram_order + 1, args.ngram_order):
             for hist, counts_for_hist in self.counts[n].items():
-                # If we have an n-gram (6, 7, 8) -> 9, the following loop will
-                # add the backed-off n-grams (7, 8) -> 9 and (8) -> 9 to
-                # 'protected-ngrams'.
-                reduced_hist = hist
-                for m in reversed(range(args.no_backoff_ngram_order, n)):
-                    reduced_hist = reduced_hist[1:]  # shift an element off
-                                                     # the history.
+                for word in counts_for_hist.word_to_count.keys():
+                    if word != self.backoff_symbol:
+                        self.ChangeBackoffNgramProtection(hist, word, 1)
+                self.ChangeStateProtection(hist, 1)
+                self.num_child_states[hist[1:]] += 1
+
+    # If we have an n-gram (6, 7, 8) -> 9, the backed-off n-grams (7, 8) -> 9
+    # and (8) -> 9 are protected.  This function adds 'change' (1 or -1) to
+    # their protect-count, and returns a list of the n-grams that became
+    # prunable.
+    def ChangeBackoffNgramProtection(self, hist, word, change):
+        ans = []
+        reduced_hist = hist
+        for m in reversed(range(args.no_backoff_ngram_order, len(hist))):
+            reduced_hist = reduced_hist[1:]  # shift an element off the history.
+            ngram = reduced_hist + (word,)
+            self.protect_count[ngram] += change
+            if self.protect_count[ngram] == 0:
+                ans.append(ngram)
+        return ans
 
-                    for word in counts_for_hist.word_to_count.keys():
-                        if word != self.backoff_symbol:
-                            ans.add(reduced_hist + (word,))
-                # The following statement ensures that if we are in a
-                # history-state (6, 7, 8), then n-grams (6, 7, 8) and (6, 7) are
-                # protected.  This assures that the FST states are accessible.
-                reduced_hist = hist
-                for m in reversed(range(args.no_backoff_ngram_order, n)):
-                    ans.add(reduced_hist)
-                    reduced_hist = reduced_hist[:-1]  # pop an element off the
-                                                      # history
+    # If we are in a history-state (6, 7, 8), then n-grams (6, 7) -> 8 and
+    # (6) -> 7 are protected.  This assures that the FST states are accessible.
+    # Like ChangeBackoffNgramProtection(), returns a list of the n-grams that
+    # became prunable.
+    def ChangeStateProtection(self, hist, change):
+        ans = []
+        reduced_hist = hist
+        for m in reversed(range(args.no_backoff_ngram_order, len(hist))):
+            self.protect_count[reduced_hist] += change
+            if self.protect_count[reduced_hist] == 0:
+                ans.append(reduced_hist)
+            reduced_hist = reduced_hist[:-1]  # pop an element off the history.
+        return ans
+
+    def NgramExists(self, hist, word):
+        return (hist in self.counts[len(hist)] and
+                word in self.counts[len(hist)][hist].word_to_count)
+
+    # Removes the history-state 'hist' if it has no counts except backoff and
+    # no higher-order state backs off to it, and then does the same for the
+    # state it backs off to.  This does the same as PruneEmptyStates(), but
+    # incrementally as we prune.  Returns a list of n-grams that became prunable.
+    def MaybeRemoveState(self, hist):
+        ans = []
+        while (len(hist) >= args.no_backoff_ngram_order and
+               hist in self.counts[len(hist)] and
+               len(self.counts[len(hist)][hist].word_to_count) == 1 and
+               self.num_child_states[hist] == 0):
+            del self.counts[len(hist)][hist]
+            if len(hist) > args.no_backoff_ngram_order:
+                ans += self.ChangeStateProtection(hist, -1)
+                self.num_child_states[hist[1:]] -= 1
+            hist = hist[1:]
         return ans
 
     def PruneNgram(self, hist, word):
@@ -412,8 +456,11 @@ class NgramCounts:
         del counts_for_hist.word_to_count[word]
         counts_for_hist.word_to_count[self.backoff_symbol] += count
         # the next call adds the count to the symbol 'word' in the backoff
-        # history-state, and also updates its 'total_count'.
-        self.counts[len(hist) - 1][hist[1:]].AddCount(word, count)
+        # history-state, and also updates its 'total_count'.  (We don't call it
+        # for zero counts, as it would remove a zero count there that may be
+        # structurally needed).
+        if count != 0:
+            self.counts[len(hist) - 1][hist[1:]].AddCount(word, count)
 
     # The function PruningLogprobChange is the same as the same-named
     # function in float-counts-prune.cc in pocolm.  Note, it doesn't access
@@ -548,6 +595,8 @@ class NgramCounts:
         counts_for_backoff_hist = self.counts[len(hist) - 1][hist[1:]]
         assert word != self.backoff_symbol and word in counts_for_hist.word_to_count
         count = counts_for_hist.word_to_count[word]
+        if count == 0:
+            return 0.0  # no need to look at the backoff state.
         discount = counts_for_hist.word_to_count[self.backoff_symbol]
         backoff_total = counts_for_backoff_hist.total_count
         # backoff_count is a pseudo-count: it's like the count of 'word' in the
@@ -563,129 +612,140 @@ class NgramCounts:
         return self.PruningLogprobChange(float(count), float(discount),
                                          backoff_count, float(backoff_total))
 
-    # note: returns loglike change per word.
-    def PruneToIntermediateTarget(self, num_extra_ngrams):
-        protected_ngrams = self.GetProtectedNgrams()
+    # Returns the quantities that the likelihood change from pruning an n-gram
+    # in history-state 'hist' depends on, apart from its own count: the
+    # discount (backoff count) of 'hist', and the total count of the state it
+    # backs off to.  Pruning can only increase these.
+    def GetPruningStateCounts(self, hist):
+        return (self.counts[len(hist)][hist].word_to_count[self.backoff_symbol],
+                self.counts[len(hist) - 1][hist[1:]].total_count)
+
+    # Computes the likelihood change from pruning the n-gram hist -> word and
+    # returns an entry for the priority queue used in PruneToFinalTarget().
+    # heapq gives us the smallest element first, so the likelihood change is
+    # negated so that we get the n-gram with the least-negative likelihood
+    # change first.  The state counts the likelihood change was computed from
+    # are stored with it, so we can tell if it is out of date when we get to
+    # it, and they are also stored in self.queued_state_counts so we can tell
+    # if a newer entry for the same n-gram was added.
+    def GetPruningCandidate(self, hist, word):
+        like_change = self.GetLikeChangeFromPruningNgram(hist, word)
+        state_counts = self.GetPruningStateCounts(hist)
+        self.queued_state_counts[hist + (word,)] = state_counts
+        return (-like_change, hist + (word,)) + state_counts
+
+    def AddPruningCandidate(self, queue, hist, word):
+        heapq.heappush(queue, self.GetPruningCandidate(hist, word))
+
+    # Returns true if 'new_counts' (as returned by GetPruningStateCounts())
+    # differ enough from 'old_counts' that we should recompute the likelihood
+    # changes computed from 'old_counts'.
+    def StateCountsChanged(self, old_counts, new_counts):
+        return (new_counts[0] > old_counts[0] * self.recompute_threshold or
+                new_counts[1] > old_counts[1] * self.recompute_threshold)
+
+    def PruneToFinalTarget(self, num_extra_ngrams):
+        # prunes to a specified num_extra_ngrams.  The 'extra_ngrams' refers to
+        # the count of n-grams of order higher than args.no_backoff_ngram_order.
+        # We keep the prunable n-grams in a priority queue and repeatedly prune
+        # the one whose pruning gives the least-negative likelihood change.
+        # Pruning an n-gram only changes the counts of its own history-state
+        # and of the state that it backs off to, so rather than recomputing
+        # all the likelihood changes after each prune, we recompute them
+        # lazily: when an n-gram gets to the top of the queue, if the counts of
+        # its state or backoff state have changed by more than a few percent
+        # since its likelihood change was computed (similar to the factors
+        # between successive targets that we used when pruning in several
+        # passes), we recompute it and put it back in the queue.
+        # Sometimes we can't prune a certain n-gram before certain other
+        # n-grams are pruned (because they lead to a state that must be kept,
+        # or an n-gram exists that backs off to this n-gram); such n-grams are
+        # added to the queue when they become prunable.
+
         initial_num_extra_ngrams = self.GetNumExtraNgrams()
+
+        if num_extra_ngrams >= initial_num_extra_ngrams:
+            print('make_phone_lm.py: not pruning since target num-extra-ngrams={0} is >= '
+                  'current num-extra-ngrams={1}'.format(num_extra_ngrams, initial_num_extra_ngrams),
+                  file=sys.stderr)
+            return
+
         num_ngrams_to_prune = initial_num_extra_ngrams - num_extra_ngrams
-        assert num_ngrams_to_prune > 0
+        print('make_phone_lm.py: current num-extra-ngrams={0}, pruning to {1}'.format(
+                initial_num_extra_ngrams, num_extra_ngrams), file = sys.stderr)
 
+        self.InitPruningState()
         num_candidates_per_order = [ 0 ] * args.ngram_order
         num_pruned_per_order = [ 0 ] * args.ngram_order
 
-
-        # like_change_and_ngrams this will be a list of tuples consisting
-        # of the likelihood change as a float and then the words of the n-gram
-        # that we're considering pruning,
-        # e.g. (-0.164, 7, 8, 9)
-        # meaning that pruning the n-gram (7, 8) -> 9 leads to
-        # a likelihood change of -0.164.  We'll later sort this list
-        # so we can prune the n-grams that made the least-negative
-        # likelihood change.
-        like_change_and_ngrams = []
+        queue = []
+        self.queued_state_counts = dict()
+        self.recompute_threshold = 1.1
         for n in range(args.no_backoff_ngram_order, args.ngram_order):
             for hist, counts_for_hist in self.counts[n].items():
-                for word, count in counts_for_hist.word_to_count.items():
-                    if word != self.backoff_symbol:
-                        if not hist + (word,) in protected_ngrams:
-                            like_change = self.GetLikeChangeFromPruningNgram(hist, word)
-                            like_change_and_ngrams.append((like_change,) + hist + (word,))
-                            num_candidates_per_order[len(hist)] += 1
-
-        like_change_and_ngrams.sort(reverse = True)
-
-        if num_ngrams_to_prune > len(like_change_and_ngrams):
-            print('make_phone_lm.py: aimed to prune {0} n-grams but could only '
-                  'prune {1}'.format(num_ngrams_to_prune, len(like_change_and_ngrams)),
-                  file = sys.stderr)
-            num_ngrams_to_prune = len(like_change_and_ngrams)
+                for word in counts_for_hist.word_to_count.keys():
+                    if word != self.backoff_symbol and self.protect_count[hist + (word,)] == 0:
+                        queue.append(self.GetPruningCandidate(hist, word))
+                        num_candidates_per_order[n] += 1
+        heapq.heapify(queue)
 
         total_loglike_change = 0.0
-
-        for i in range(num_ngrams_to_prune):
-            total_loglike_change += like_change_and_ngrams[i][0]
-            hist = like_change_and_ngrams[i][1:-1]  # all but 1st and last elements
-            word = like_change_and_ngrams[i][-1]  # last element
+        num_pruned = 0
+        num_recomputed = 0
+        like_change = 0.0
+        while num_pruned < num_ngrams_to_prune and len(queue) > 0:
+            entry = heapq.heappop(queue)
+            ngram = entry[1]
+            hist = ngram[:-1]
+            word = ngram[-1]
+            if not self.NgramExists(hist, word) or entry[2:] != self.queued_state_counts[ngram]:
+                continue  # already pruned, or there is a newer entry.
+            if (entry[0] != 0.0 and
+                self.StateCountsChanged(entry[2:], self.GetPruningStateCounts(hist))):
+                # recompute the likelihood change and put it back in the queue.
+                # (zero counts always have zero likelihood change, so they
+                # never need recomputing).
+                self.AddPruningCandidate(queue, hist, word)
+                num_recomputed += 1
+                continue
+            like_change = -entry[0]
+            if args.verbose >= 3:
+                print("Pruning: " + str((like_change,) + ngram), file = sys.stderr)
+            total_loglike_change += like_change
+            num_pruned += 1
             num_pruned_per_order[len(hist)] += 1
             self.PruneNgram(hist, word)
 
+            newly_prunable = (self.ChangeBackoffNgramProtection(hist, word, -1) +
+                              self.MaybeRemoveState(hist))
+            for new_ngram in newly_prunable:
+                if self.NgramExists(new_ngram[:-1], new_ngram[-1]):
+                    self.AddPruningCandidate(queue, new_ngram[:-1], new_ngram[-1])
+                    num_candidates_per_order[len(new_ngram) - 1] += 1
+
+        if num_pruned < num_ngrams_to_prune:
+            print('make_phone_lm.py: aimed to prune {0} n-grams but could only '
+                  'prune {1}'.format(num_ngrams_to_prune, num_pruned),
+                  file = sys.stderr)
+
         like_change_per_word = total_loglike_change / self.total_num_words
 
         if args.verbose >= 1:
-            effective_threshold = (like_change_and_ngrams[num_ngrams_to_prune - 1][0]
-                                   if num_ngrams_to_prune >= 0 else 0.0)
             print("Pruned from {0} ngrams to {1}, with threshold {2}.  Candidates per order were {3}, "
-                  "num-ngrams pruned per order were {4}.  Like-change per word was {5}".format(
+                  "num-ngrams pruned per order were {4}.  Recomputed {5} out-of-date "
+                  "likelihood changes.".format(
                     initial_num_extra_ngrams,
-                    initial_num_extra_ngrams - num_ngrams_to_prune,
-                    '%.4f' % effective_threshold,
+                    initial_num_extra_ngrams - num_pruned,
+                    '%.4f' % like_change,
                     num_candidates_per_order,
                     num_pruned_per_order,
-                    like_change_per_word), file = sys.stderr)
+                    num_recomputed), file = sys.stderr)
+            print('make_phone_lm.py: K-L divergence from pruning (upper bound) is '
+                  '%.4f' % like_change_per_word, file = sys.stderr)
 
         if args.verbose >= 3:
-            print("Pruning: like_change_and_ngrams is:\n" +
-                  '\n'.join([str(x) for x in like_change_and_ngrams[:num_ngrams_to_prune]]) +
-                  "\n-------- stop pruning here: ----------\n" +
-                  '\n'.join([str(x) for x in like_change_and_ngrams[num_ngrams_to_prune:]]),
-                  file = sys.stderr)
             self.Print("Counts after pruning to num-extra-ngrams={0}".format(
-                    initial_num_extra_ngrams - num_ngrams_to_prune))
-
-        self.PruneEmptyStates()
-        if args.verbose >= 3:
-            ngram_counts.Print("Counts after removing empty states [inside pruning algorithm]:")
-        return like_change_per_word
-
-
-
-    def PruneToFinalTarget(self, num_extra_ngrams):
-        # prunes to a specified num_extra_ngrams.  The 'extra_ngrams' refers to
-        # the count of n-grams of order higher than args.no_backoff_ngram_order.
-        # We construct a sequence of targets that gradually approaches
-        # this value.  Doing it iteratively like this is a good way
-        # to deal with the fact that sometimes we can't prune a certain
-        # n-gram before certain other n-grams are pruned (because
-        # they lead to a state that must be kept, or an n-gram exists
-        # that backs off to this n-gram).
-
-        current_num_extra_ngrams = self.GetNumExtraNgrams()
-
-        if num_extra_ngrams >= current_num_extra_ngrams:
-            print('make_phone_lm.py: not pruning since target num-extra-ngrams={0} is >= '
-                  'current num-extra-ngrams={1}'.format(num_extra_ngrams, current_num_extra_ngrams),
-                  file=sys.stderr)
-            return
-
-        target_sequence = [num_extra_ngrams]
-        # two final iterations where the targets differ by factors of 1.1,
-        # preceded by two iterations where the targets differ by factors of 1.2.
-        for this_factor in [ 1.1, 1.2 ]:
-            for n in range(0,2):
-                if int((target_sequence[-1]+1) * this_factor) < current_num_extra_ngrams:
-                    target_sequence.append(int((target_sequence[-1]+1) * this_factor))
-        # then change in factors of 1.3
-        while True:
-            this_factor = 1.3
-            if int((target_sequence[-1]+1) * this_factor) < current_num_extra_ngrams:
-                target_sequence.append(int((target_sequence[-1]+1) * this_factor))
-            else:
-                break
-
-        target_sequence = list(set(target_sequence))  # only keep unique targets.
-        target_sequence.sort(reverse = True)
-
-        print('make_phone_lm.py: current num-extra-ngrams={0}, pruning with '
-              'following sequence of targets: {1}'.format(current_num_extra_ngrams,
-                                                          target_sequence),
-              file = sys.stderr)
-        total_like_change_per_word = 0.0
-        for target in target_sequence:
-            total_like_change_per_word += self.PruneToIntermediateTarget(target)
-
-        if args.verbose >= 1:
-            print('make_phone_lm.py: K-L divergence from pruning (upper bound) is '
-                  '%.4f' % total_like_change_per_word, file = sys.stderr)
+                    initial_num_extra_ngrams - num_pruned))
 
 
     # returns the number of n-grams on top of those that can't be pruned away
@@ -2,8 +2,24 @@
 # -*- coding: utf-8 -*-
 # Copyright 2012 Mirko Hannemann BUT, mirko.hannemann@gmail.com
 
+# To keep the memory bounded for large language models, the n-grams are not
+# all kept in memory.  They are read in batches, with the words as integer ids
+# (see utils/lang/arpa_lib.py); each batch is sorted and written as a run to a
+# temporary directory (in $TMPDIR), and the runs of each order are merged into
+# a sorted table on disk.  The reversed model is then computed one order at a
+# time from the tables, which are memory-mapped, so only the vocabulary and
+# about batch_size n-grams need to be in memory.
+
 import sys
-import codecs # for UTF-8/unicode
+import os
+import imp
+import shutil
+import tempfile
+
+arpa_lib = imp.load_source('arpa_lib', 'utils/lang/arpa_lib.py')
+
+# The number of n-grams that are sorted in memory at a time.
+batch_size = 1000000
 
 if len(sys.argv) != 2:
     print 'usage: reverse_arpa arpa.in'
@@ -30,95 +46,136 @@ arpaname = sys.argv[1]
 #-0.23940	a b </s>
 #\end\
 
-# read language model in ARPA format
 try:
-  file = codecs.open(arpaname, "r", "utf-8")
-except IOError:
-  print 'file not found: ' + arpaname
-  sys.exit()
-
-text=file.readline()
-while (text and text[:6] != "\\data\\"): text=file.readline()
-if not text:
-  print "invalid ARPA file"
-  sys.exit()
-#print text,
-while (text and text[:5] != "ngram"): text=file.readline()
-
-# get ngram counts
-cngrams=[]
-n=0
-while (text and text[:5] == "ngram"):
-  ind = text.split("=")
-  counts = int(ind[1].strip())
-  r = ind[0].split()
-  read_n = int(r[1].strip())
-  if read_n != n+1:
-    print "invalid ARPA file:", text
-    sys.exit()
-  n = read_n
-  cngrams.append(counts)
-  #print text,
-  text=file.readline()
-
-# read all n-grams order by order
-sentprob = 0.0 # sentence begin unigram
-ngrams=[]
+  import numpy as np
+except ImportError:
+  sys.exit("reverse_arpa.py: numpy is required; please install it.")
 inf=float("inf")
-for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
-  while (text and "-grams:" not in text): text=file.readline()
-  if n != int(text[1]):
-    print "invalid ARPA file:", text
-    sys.exit()
-  #print text,cngrams[n-1]
-  this_ngrams={} # stores all read ngrams
-  for ng in range(cngrams[n-1]):
-    while (text and len(text.split())<2):
-      text=file.readline()
-      if (not text) or ((len(text.split())==1) and (("-grams:" in text) or (text[:5] == "\\end\\"))): break
-    if (not text) or ((len(text.split())==1) and (("-grams:" in text) or (text[:5] == "\\end\\"))):
-      break # to deal with incorrect ARPA files
-    entry = text.split()
-    prob = float(entry[0])
-    if len(entry)>n+1:
-      back = float(entry[-1])
-      words = entry[1:n+1]
+
+# A table (or a sorted run) of n-grams of order n is stored in 3 files:
+# <name>.keys with the keys of the n-grams (see arpa_lib.MakeKeys()),
+# <name>.probs with their log10 probs and <name>.backs with their backoff
+# weights: 0.0 for the n-grams that have no backoff weight, and inf for the
+# n-grams we create because they are needed for backoff.
+def write_table(name, keys, probs, backs, mode='wb'):
+  for (suffix, array) in [ ('.keys', keys), ('.probs', probs), ('.backs', backs) ]:
+    f = open(name + suffix, mode)
+    array.tofile(f)
+    f.close()
+
+def read_table(name, order, mode='r'):
+  ans = []
+  for (suffix, dtype) in [ ('.keys', 'S%d' % (4*order)), ('.probs', np.float64),
+                           ('.backs', np.float64) ]:
+    if os.path.getsize(name + suffix) == 0:
+      ans.append(np.zeros(0, dtype=dtype))
     else:
-      back = 0.0
-      words = entry[1:]
-    ngram = " ".join(words)
-    if (n==1) and words[0]=="<s>":
-      sentprob = prob
-      prob = 0.0
-    this_ngrams[ngram] = (prob,back)
-    #print prob,ngram.encode("utf-8"),back
-
-    for x in range(n-1,0,-1):
-      # add all missing backoff ngrams for reversed lm
-      l_ngram = " ".join(words[:x]) # shortened ngram
-      r_ngram = " ".join(words[1:1+x]) # shortened ngram with offset one
-      if l_ngram not in ngrams[x-1]: # create missing ngram
-        ngrams[x-1][l_ngram] = (0.0,inf)
-        #print ngram, "create 0.0", l_ngram, "inf"
-      if r_ngram not in ngrams[x-1]: # create missing ngram
-        ngrams[x-1][r_ngram] = (0.0,inf)
-        #print ngram, "create 0.0", r_ngram, "inf",x,n,h_ngram
-
-      # add all missing backoff ngrams for forward lm
-      h_ngram = " ".join(words[n-x:]) # shortened history
-      if h_ngram not in ngrams[x-1]: # create missing ngram
-        ngrams[x-1][h_ngram] = (0.0,inf)
-        #print "create inf", h_ngram, "0.0"
-    text=file.readline()
-    if (not text) or ((len(text.split())==1) and (("-grams:" in text) or (text[:5] == "\\end\\"))): break
-  ngrams.append(this_ngrams)
-
-while (text and text[:5] != "\\end\\"): text=file.readline()
-if not text:
-  print "invalid ARPA file"
-  sys.exit()
-file.close()
-#print text,
+      ans.append(np.memmap(name + suffix, dtype=dtype, mode=mode))
+  return ans
+
+def remove_table(name):
+  for suffix in [ '.keys', '.probs', '.backs' ]:
+    os.remove(name + suffix)
+
+# Sorts the keys and removes duplicates, keeping the last one
+# (like the dict of n-grams in the original version of this script).
+# Returns the indexes of the keys that are kept, in sorted order.
+def sort_unique(keys):
+  index = np.argsort(keys, kind='mergesort')
+  keys = keys[index]
+  return index[np.append(keys[1:] != keys[:-1], True)]
+
+# Reads the ARPA file in batches, and writes each batch as a sorted run.
+# The word-ids are changed to be in sorted order of the words, so the order
+# of the keys is the same as the (string) order of the n-grams.
+# Returns (words, runs), where runs[n-1] is the list of the names of the runs
+# for order n.  The first runs of each order contain the missing backoff
+# n-grams, i.e. the shortened ngrams words[:x] and the shortened ngrams with
+# offset one words[1:1+x] for the reversed lm, and the shortened histories
+# words[n-x:] for the forward lm, of the ngrams of higher order n; the others
+# are the n-grams read from the ARPA file, in order.
+def make_sorted_runs(arpaname, tmpdir):
+  reader = arpa_lib.ArpaReader(arpaname, batch_size=batch_size)
+  batches = []
+  for (n, ids, probs, backs) in reader.Batches():
+    # note: the .keys file of the batch contains the word-ids, as the keys
+    # can only be made once we have all the words.
+    name = os.path.join(tmpdir, 'batch%d' % len(batches))
+    write_table(name, ids.astype(np.int32), probs, backs)
+    batches.append((n, name))
+  num_orders = max([ 0 ] + [ n for (n, name) in batches ])
+
+  words = reader.words
+  sorted_ids = sorted(range(len(words)), key=lambda i: words[i])
+  new_id = np.zeros(len(words), dtype=np.int64)
+  new_id[sorted_ids] = np.arange(len(words))
+  words = [ words[i] for i in sorted_ids ]
+
+  read_runs = [ [] for n in range(num_orders) ]
+  created_runs = [ [] for n in range(num_orders) ]
+  for (n, name) in batches:
+    ids = np.fromfile(name + '.keys', dtype=np.int32).reshape(-1, n)
+    ids = new_id[ids]
+    probs = np.fromfile(name + '.probs', dtype=np.float64)
+    backs = np.fromfile(name + '.backs', dtype=np.float64)
+    remove_table(name)
+    backs[np.isnan(backs)] = 0.0
+    keys = arpa_lib.MakeKeys(ids)
+    index = sort_unique(keys)
+    write_table(name + '.read', keys[index], probs[index], backs[index])
+    read_runs[n-1].append(name + '.read')
+    for x in range(1,n):
+      keys = np.unique(np.concatenate((arpa_lib.MakeKeys(ids[:,0:x]),
+                                       arpa_lib.MakeKeys(ids[:,1:1+x]),
+                                       arpa_lib.MakeKeys(ids[:,n-x:]))))
+      write_table(name + '.created%d' % x, keys, np.zeros(len(keys)),
+                  np.repeat(inf, len(keys)))
+      created_runs[x-1].append(name + '.created%d' % x)
+  return (words, [ created_runs[n] + read_runs[n] for n in range(num_orders) ])
+
+# Merges the sorted runs 'run_names' of n-grams of order n into the table
+# 'table_name'.  For n-grams that are in more than one run, the one in the
+# last run is kept; so the n-grams that we create are only kept if they are
+# not in the ARPA file.  Returns the number of n-grams.
+def merge_runs(run_names, n, table_name):
+  runs = [ read_table(name, n) for name in run_names ]
+  positions = [ 0 ] * len(runs)
+  chunk_size = max(batch_size / max(len(runs), 1), 1000)
+  write_table(table_name, np.zeros(0), np.zeros(0), np.zeros(0))
+  count = 0
+  while True:
+    active = [ i for i in range(len(runs)) if positions[i] < len(runs[i][0]) ]
+    if len(active) == 0:
+      break
+    # all the n-grams up to 'bound' in all the runs are in the next chunks
+    # of the runs.
+    bound = min([ runs[i][0][min(positions[i] + chunk_size, len(runs[i][0])) - 1]
+                  for i in active ])
+    parts = []
+    for i in active:
+      begin = positions[i]
+      end = begin + np.searchsorted(runs[i][0][begin:begin+chunk_size], bound, 'right')
+      parts.append([ np.asarray(array[begin:end]) for array in runs[i] ])
+      positions[i] = end
+    (keys, probs, backs) = [ np.concatenate([ part[j] for part in parts ])
+                             for j in range(3) ]
+    index = sort_unique(keys)
+    write_table(table_name, keys[index], probs[index], backs[index], mode='ab')
+    count += len(index)
+  del runs
+  for name in run_names:
+    remove_table(name)
+  return count
+
+# Returns the log10 probs of the n-grams with word-ids 'ids' (one row per
+# n-gram) in the table 'table'.
+def lookup_probs(table, ids):
+  (keys, probs, backs) = table
+  queries = arpa_lib.MakeKeys(ids)
+  index = np.searchsorted(keys, queries, 'left')
+  if not np.all(np.searchsorted(keys, queries, 'right') > index):
+    sys.exit("reverse_arpa.py: n-gram not found")
+  return probs[index]
 
 #fourgram "maxent" model (b(ABCD)=0):
 #p(A)+b(A) A 0
@@ -132,57 +189,77 @@ file.close()
 #p(ABC)+b(ABC)-p(BC)+p(AB)-p(B)+p(A) CBA 0
 #p(ABCD)+b(ABCD)-p(BCD)+p(ABC)-p(BC)+p(AB)-p(B)+p(A) DCBA 0
 
-# compute new reversed ARPA model
-print "\\data\\"
-for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
-  print "ngram "+str(n)+"="+str(len(ngrams[n-1].keys()))
-offset = 0.0
-for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
-  print "\\"+str(n)+"-grams:"
-  keys = ngrams[n-1].keys()
-  keys.sort()
-  for ngram in keys:
-    prob = ngrams[n-1][ngram]
-    # reverse word order
-    words = ngram.split()
-    rstr = " ".join(reversed(words))
-    # swap <s> and </s>
-    rev_ngram = rstr.replace("<s>","<temp>").replace("</s>","<s>").replace("<temp>","</s>")
-
-    revprob = prob[0]
-    if (prob[1] != inf): # only backoff weights from not newly created ngrams
-      revprob = revprob + prob[1]
-    #print prob[0],prob[1]
-    # sum all missing terms in decreasing ngram order
-    for x in range(n-1,0,-1): 
-      l_ngram = " ".join(words[:x]) # shortened ngram
-      if l_ngram not in ngrams[x-1]:
-        sys.stderr.write(rev_ngram+": not found "+l_ngram+"\n")
-      p_l = ngrams[x-1][l_ngram][0]
-      #print p_l,l_ngram
-      revprob = revprob + p_l
-
-      r_ngram = " ".join(words[1:1+x]) # shortened ngram with offset one
-      if r_ngram not in ngrams[x-1]:
-        sys.stderr.write(rev_ngram+": not found "+r_ngram+"\n")
-      p_r = ngrams[x-1][r_ngram][0]
-      #print -p_r,r_ngram
-      revprob = revprob - p_r
-
-    if n != len(cngrams): #not highest order
-      back = 0.0
-      if rev_ngram[:3] == "<s>": # special handling since arpa2fst ignores <s> weight
-        if n == 1:
-          offset = revprob # remember <s> weight
-          revprob = sentprob # apply <s> weight from forward model
-          back = offset
-        elif n == 2:
-          revprob = revprob + offset # add <s> weight to bigrams starting with <s>
-      if (prob[1] != inf): # only backoff weights from not newly created ngrams
-        print revprob,rev_ngram.encode("utf-8"),back
-      else:
-        print revprob,rev_ngram.encode("utf-8"),"-100000.0"
-    else: # highest order - no backoff weights
-      if (n==2) and (rev_ngram[:3] == "<s>"): revprob = revprob + offset
-      print revprob,rev_ngram.encode("utf-8")
-print "\\end\\"
+def reverse_arpa(arpaname, tmpdir):
+  # read language model in ARPA format
+  (words, runs) = make_sorted_runs(arpaname, tmpdir)
+  num_orders = len(runs)
+  counts = []
+  for n in range(1,num_orders+1):
+    counts.append(merge_runs(runs[n-1], n, os.path.join(tmpdir, 'table%d' % n)))
+
+  # sentence begin unigram
+  sentprob = 0.0
+  if "<s>" in words:
+    (keys, probs, backs) = read_table(os.path.join(tmpdir, 'table1'), 1, mode='r+')
+    key = arpa_lib.MakeKey([ words.index("<s>") ])
+    i = np.searchsorted(keys, key, 'left')
+    if np.searchsorted(keys, key, 'right') > i:
+      sentprob = float(probs[i])
+      probs[i] = 0.0
+    del keys, probs, backs
+  tables = [ read_table(os.path.join(tmpdir, 'table%d' % n), n)
+             for n in range(1,num_orders+1) ]
+
+  # compute new reversed ARPA model
+  # the words with <s> and </s> swapped
+  swapped_words = [ w.replace("<s>","<temp>").replace("</s>","<s>").replace("<temp>","</s>")
+                    for w in words ]
+  print "\\data\\"
+  for n in range(1,num_orders+1): # unigrams, bigrams, trigrams
+    print "ngram "+str(n)+"="+str(counts[n-1])
+  offset = 0.0
+  for n in range(1,num_orders+1): # unigrams, bigrams, trigrams
+    print "\\"+str(n)+"-grams:"
+    (keys, probs, backs) = tables[n-1]
+    for begin in range(0, len(keys), batch_size):
+      ids = np.asarray(keys[begin:begin+batch_size]).view('>u4').reshape(-1, n)
+      these_probs = np.asarray(probs[begin:begin+batch_size])
+      these_backs = np.asarray(backs[begin:begin+batch_size])
+      created = np.isinf(these_backs)
+      # only backoff weights from not newly created ngrams
+      revprobs = np.where(created, these_probs, these_probs + these_backs)
+      # sum all missing terms in decreasing ngram order
+      for x in range(n-1,0,-1):
+        revprobs = revprobs + lookup_probs(tables[x-1], ids[:,0:x]) # shortened ngram
+        revprobs = revprobs - lookup_probs(tables[x-1], ids[:,1:1+x]) # shortened ngram with offset one
+
+      lines = []
+      for ngram, revprob, was_created in zip(ids.tolist(), revprobs.tolist(), created.tolist()):
+        # reverse word order, and swap <s> and </s>
+        rev_ngram = " ".join([ swapped_words[w] for w in reversed(ngram) ])
+        if n != num_orders: #not highest order
+          back = 0.0
+          if rev_ngram[:3] == "<s>": # special handling since arpa2fst ignores <s> weight
+            if n == 1:
+              offset = revprob # remember <s> weight
+              revprob = sentprob # apply <s> weight from forward model
+              back = offset
+            elif n == 2:
+              revprob = revprob + offset # add <s> weight to bigrams starting with <s>
+          if not was_created: # only backoff weights from not newly created ngrams
+            lines.append("%s %s %s\n" % (revprob, rev_ngram, back))
+          else:
+            lines.append("%s %s -100000.0\n" % (revprob, rev_ngram))
+        else: # highest order - no backoff weights
+          if (n==2) and (rev_ngram[:3] == "<s>"): revprob = revprob + offset
+          lines.append("%s %s\n" % (revprob, rev_ngram))
+      sys.stdout.write("".join(lines))
+  print "\\end\\"
+
+tmpdir = tempfile.mkdtemp(prefix='reverse_arpa.')
+try:
+  reverse_arpa(arpaname, tmpdir)
+except arpa_lib.ArpaError as e:
+  print "invalid ARPA file:", str(e)
+finally:
+  shutil.rmtree(tmpdir)